@@ -0,0 +1,578 @@
+"""
+API Assíncrona (ASGI) - Endpoints de alto volume dos ESP32 e do dashboard
+Mesmos contratos de simple_location_api, simple_image_api, simple_integrated_api
+e dashboard_api, com handlers async sobre os repositórios assíncronos
+
+E/S (banco) é aguardada no event loop; trabalho de CPU bloqueante (inferência
+YOLO/OpenCV, leitura de métricas do sistema) roda em executores, para que um
+único processo mantenha muitas conexões abertas ao mesmo tempo.
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from config_simple import ASGI_CONFIG, IDEMPOTENCY_CONFIG
+from ml.occupancy_predictor import predict_bus_occupancy
+from database.async_connection import (
+    get_async_database_manager, get_async_bus_repository,
+    get_async_occupancy_repository, get_async_eta_repository,
+    get_async_interval_repository
+)
+from api.utils import (
+    validate_gps_coordinates, validate_bus_line, validate_device_id, validate_json_payload,
+    parse_request_timestamp, decode_image_base64, get_traffic_factor_by_hour,
+    get_nearest_destination, log_api_request
+)
+from api.simple_location_api import (
+    resolve_location_eta, location_adaptive_interval, location_response_body
+)
+from api.simple_image_api import validate_image_data, spool_image_analysis, image_analysis_body
+from database.spool import get_write_spool
+from api.idempotency import ingest_key_for, get_response_cache, REPLAY_HEADER
+from api.trajectory import get_trajectory_compressor, bus_key_for, device_id_for, merge_latest_positions
+from api.simple_integrated_api import (
+    calculate_eta_with_occupancy_impact, generate_simple_recommendations,
+    occupancy_adaptive_interval, replayed_reading_body, integrated_response_body
+)
+from api.dashboard_api import (
+    fallback_buses_for_line, latest_buses_by_line, format_occupancy_summary,
+    get_fallback_occupancy_summary, get_system_metrics, database_metrics_from_info,
+    health_body, dashboard_body, dashboard_fallback_body, buses_body, occupancy_body,
+    metrics_body, metrics_error_body
+)
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Executor dedicado à inferência: limita quantas imagens são processadas ao
+# mesmo tempo sem ocupar as threads usadas pelas demais chamadas bloqueantes.
+# Criado no startup do servidor (depois de um eventual fork), não na importação.
+inference_executor: Optional[ThreadPoolExecutor] = None
+
+def start_inference_executor():
+    global inference_executor
+    if inference_executor is None:
+        inference_executor = ThreadPoolExecutor(
+            max_workers=ASGI_CONFIG['inference_workers'],
+            thread_name_prefix='inference'
+        )
+
+def shutdown_inference_executor():
+    global inference_executor
+    if inference_executor is not None:
+        inference_executor.shutdown(wait=False)
+        inference_executor = None
+
+async def read_json(request: Request) -> Tuple[Optional[Dict], Optional[JSONResponse]]:
+    """Lê o corpo JSON, com a mesma validação de Content-Type das APIs Flask."""
+    if 'application/json' not in request.headers.get('content-type', ''):
+        return None, JSONResponse({'error': 'Content-Type deve ser application/json'}, 400)
+    try:
+        return await request.json(), None
+    except ValueError:
+        return None, JSONResponse({'error': 'JSON inválido'}, 400)
+
+async def analyze_image(image_base64: str) -> Dict:
+    """Executa a inferência de ocupação no executor de inferência."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, predict_bus_occupancy, image_base64)
+
+def idempotent(endpoint: str):
+    """
+    Contraparte assíncrona de api.idempotency.idempotent
+
+    A ingest_key fica em request.state.ingest_key. A espera por uma
+    requisição igual em andamento roda no threadpool, fora do event loop.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request: Request):
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            ingest_key = ingest_key_for(endpoint, data if isinstance(data, dict) else {}, request.headers)
+            request.state.ingest_key = ingest_key
+            if not ingest_key:
+                return await handler(request)
+
+            cache = get_response_cache()
+            cached, owner = cache.acquire(ingest_key)
+            if not cached and not owner:
+                cached, owner = await run_in_threadpool(
+                    cache.acquire, ingest_key, IDEMPOTENCY_CONFIG['inflight_wait_seconds']
+                )
+            if cached:
+                logger.info(f"Requisição repetida em {endpoint}: resposta guardada ({ingest_key})")
+                status, body = cached
+                return Response(body, status, headers={REPLAY_HEADER: 'true'},
+                                media_type='application/json')
+
+            status, body = None, None
+            try:
+                response = await handler(request)
+                if response.status_code == 200:
+                    status, body = response.status_code, bytes(response.body)
+                return response
+            finally:
+                if owner:
+                    cache.release(ingest_key, status, body)
+                elif body is not None:
+                    cache.put(ingest_key, status, body)
+        return wrapper
+    return decorator
+
+def int_param(request: Request, name: str, default: int) -> int:
+    """Parâmetro inteiro da query string (inválido: valor padrão, como type=int no Flask)"""
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+# ============================================================
+#                       LOCALIZAÇÃO
+# ============================================================
+
+@idempotent('/api/location')
+async def receive_location(request: Request):
+    """Contraparte assíncrona de POST /api/location"""
+    try:
+        data, error = await read_json(request)
+        if error:
+            return error
+
+        # Valida campos obrigatórios
+        for field in ['bus_line', 'latitude', 'longitude']:
+            if field not in data:
+                return JSONResponse({'error': f'Campo obrigatório ausente: {field}'}, 400)
+
+        bus_line = data['bus_line'].strip().upper()
+        latitude = float(data['latitude'])
+        longitude = float(data['longitude'])
+        timestamp = parse_request_timestamp(data)
+
+        if not validate_gps_coordinates(latitude, longitude):
+            return JSONResponse({'error': 'Coordenadas GPS inválidas'}, 400)
+
+        if not validate_bus_line(bus_line):
+            return JSONResponse({'error': 'Linha de ônibus inválida'}, 400)
+
+        device_id = device_id_for(data)
+        if not validate_device_id(device_id):
+            return JSONResponse({'error': 'device_id inválido'}, 400)
+
+        bus_repo = get_async_bus_repository()
+        eta_repo = get_async_eta_repository()
+        interval_repo = get_async_interval_repository()
+
+        # Compressão de trajetória: ponto sem informação nova não é gravado
+        # (só com device_id: sem ele os ônibus da linha não se distinguem)
+        bus_key = bus_key_for(data)
+        compressor = get_trajectory_compressor() if bus_key else None
+        persist = compressor.offer(bus_key, bus_line, latitude, longitude) if compressor else True
+
+        ingest_key = request.state.ingest_key
+        location_id = None
+        created = True
+        if persist and get_async_database_manager() and bus_repo:
+            if ingest_key:
+                location_id, created = await bus_repo.save_location_once(
+                    bus_line, latitude, longitude, ingest_key, device_id
+                )
+            else:
+                location_id = await bus_repo.save_location(bus_line, latitude, longitude, device_id)
+            if location_id and compressor:
+                compressor.set_location_id(bus_key, location_id)
+
+        # Cálculo de ETA é aritmética de microssegundos (itinerário em NumPy
+        # incluído): roda no próprio loop
+        resolved = resolve_location_eta(bus_key, bus_line, latitude, longitude, timestamp, observe=created)
+        if not resolved:
+            return JSONResponse({'error': 'Nenhum destino encontrado'}, 500)
+        nearest_dest, eta_data, route_eta = resolved
+        adaptive_interval = location_adaptive_interval()
+
+        # ETA e intervalo são independentes: gravados em paralelo no pool
+        if location_id and created:
+            writes = []
+            if eta_repo and eta_data.get('estimated_arrival'):
+                writes.append(eta_repo.save_eta_prediction(
+                    location_id, datetime.fromisoformat(eta_data['estimated_arrival']),
+                    eta_data['confidence_percent']
+                ))
+            if interval_repo:
+                writes.append(interval_repo.save_interval(location_id, adaptive_interval))
+            for result in await asyncio.gather(*writes, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.warning(f"Erro ao salvar ETA/intervalo: {result}")
+
+        # Banco indisponível: guarda no spool local (escrita em arquivo, sem fsync no loop)
+        spool = get_write_spool()
+        spooled = False
+        if persist and not location_id and spool:
+            spool.append_location(
+                bus_line, latitude, longitude,
+                predicted_arrival=eta_data.get('estimated_arrival'),
+                confidence_percent=eta_data.get('confidence_percent'),
+                interval_seconds=adaptive_interval,
+                ingest_key=ingest_key,
+                device_id=device_id
+            )
+            spooled = True
+
+        anchor_id = compressor.anchor_location_id(bus_key) if not persist else None
+
+        log_api_request('/api/location', 'POST', {
+            'bus_line': bus_line,
+            'eta_minutes': eta_data['eta_minutes'],
+            'confidence': eta_data['confidence_percent']
+        }, 200)
+
+        body = location_response_body(
+            bus_line, timestamp, location_id or anchor_id, nearest_dest, eta_data, route_eta,
+            adaptive_interval,
+            database_connected=location_id is not None or (
+                not persist and get_async_database_manager() is not None
+            ),
+            spooled=spooled, compressed=not persist
+        )
+        return JSONResponse(body, headers={REPLAY_HEADER: 'true'} if location_id and not created else None)
+
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/location: {e}")
+        return JSONResponse({'error': 'Erro interno do servidor', 'details': str(e)}, 500)
+
+# ============================================================
+#                     ANÁLISE DE IMAGEM
+# ============================================================
+
+async def analyze_bus_image(request: Request):
+    """Contraparte assíncrona de POST /api/image/analyze"""
+    try:
+        data, error = await read_json(request)
+        if error:
+            return error
+
+        is_valid, error_msg = validate_json_payload(['bus_line', 'image_data'], data)
+        if not is_valid:
+            return JSONResponse({'error': error_msg}, 400)
+
+        bus_line = data['bus_line'].strip().upper()
+        image_base64 = data['image_data']
+        location_id = data.get('location_id')
+        timestamp = parse_request_timestamp(data)
+
+        is_valid, error_msg = validate_image_data(image_base64)
+        if not is_valid:
+            return JSONResponse({'error': error_msg}, 400)
+
+        analysis_result = await analyze_image(image_base64)
+
+        if analysis_result['status'] != 'success':
+            return JSONResponse({
+                'error': 'Erro na análise de imagem',
+                'details': analysis_result.get('error', 'Erro desconhecido')
+            }, 500)
+
+        occupancy_repo = get_async_occupancy_repository()
+        person_count = analysis_result.get('occupancy', {}).get('person_count', 0)
+
+        image_data = decode_image_base64(image_base64)
+        spooled = None
+
+        if get_async_database_manager() and occupancy_repo:
+            image_id = await occupancy_repo.save_image_analysis(location_id, image_data, person_count)
+            saved = image_id is not None
+            # Conexão caiu: guarda no spool (localização inexistente não é reenviada)
+            if not saved and not await database_connected():
+                spooled = spool_image_analysis(location_id, image_data, person_count)
+        else:
+            spooled = spool_image_analysis(location_id, image_data, person_count)
+            # Modo fallback - simula salvamento
+            image_id = None if spooled else f"img_{int(datetime.now().timestamp())}"
+            saved = not spooled
+
+        log_api_request('/api/image/analyze', 'POST', {
+            'bus_line': bus_line,
+            'image_size': len(image_base64),
+            'occupancy_level': analysis_result['occupancy']['level']
+        }, 200)
+
+        return JSONResponse(image_analysis_body(
+            bus_line, timestamp, analysis_result, image_id,
+            database_connected=saved, spooled=spooled is not None
+        ))
+
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/image/analyze: {e}")
+        return JSONResponse({'error': 'Erro interno do servidor', 'details': str(e)}, 500)
+
+# ============================================================
+#                  LOCALIZAÇÃO + IMAGEM
+# ============================================================
+
+@idempotent('/api/location-image')
+async def receive_location_and_image(request: Request):
+    """Contraparte assíncrona de POST /api/location-image"""
+    try:
+        data, error = await read_json(request)
+        if error:
+            return error
+
+        for field in ['bus_line', 'latitude', 'longitude', 'image_data']:
+            if field not in data:
+                return JSONResponse({'error': f'Campo obrigatório ausente: {field}'}, 400)
+
+        bus_line = data['bus_line'].strip().upper()
+        latitude = float(data['latitude'])
+        longitude = float(data['longitude'])
+        image_base64 = data['image_data']
+        location_id = data.get('location_id')
+        timestamp = parse_request_timestamp(data)
+
+        if not validate_gps_coordinates(latitude, longitude):
+            return JSONResponse({'error': 'Coordenadas GPS inválidas'}, 400)
+
+        if not validate_bus_line(bus_line):
+            return JSONResponse({'error': 'Linha de ônibus inválida'}, 400)
+
+        device_id = device_id_for(data)
+        if not validate_device_id(device_id):
+            return JSONResponse({'error': 'device_id inválido'}, 400)
+
+        bus_repo = get_async_bus_repository()
+        db_available = get_async_database_manager() is not None and bus_repo is not None
+
+        # Repetição já gravada (outro worker ou depois do TTL do cache): responde sem o detector
+        ingest_key = request.state.ingest_key
+        if ingest_key and db_available:
+            existing_location_id = await get_async_occupancy_repository().find_location_by_ingest_key(ingest_key)
+            if existing_location_id:
+                return JSONResponse(replayed_reading_body(existing_location_id, timestamp, bus_line),
+                                    headers={REPLAY_HEADER: 'true'})
+
+        # 1. Inferência (executor) e gravação da localização (banco) em paralelo
+        save_location = None
+        if db_available and not location_id:
+            if ingest_key:
+                save_location = bus_repo.save_location_once(bus_line, latitude, longitude, ingest_key, device_id)
+            else:
+                save_location = bus_repo.save_location(bus_line, latitude, longitude, device_id)
+
+        created = True
+        if save_location:
+            occupancy_analysis, saved = await asyncio.gather(
+                analyze_image(image_base64), save_location
+            )
+            saved_location_id, created = saved if ingest_key else (saved, True)
+        else:
+            occupancy_analysis = await analyze_image(image_base64)
+            saved_location_id = location_id
+
+        # Ponto com imagem é sempre gravado; vira a âncora da compressão de trajetória
+        compressor = get_trajectory_compressor()
+        bus_key = bus_key_for(data)
+        if compressor and bus_key and not location_id:
+            compressor.offer(bus_key, bus_line, latitude, longitude, force=True)
+            if saved_location_id:
+                compressor.set_location_id(bus_key, saved_location_id)
+
+        if occupancy_analysis['status'] != 'success':
+            return JSONResponse({
+                'error': 'Erro na análise de ocupação',
+                'details': occupancy_analysis.get('error', 'Erro desconhecido')
+            }, 500)
+
+        occupancy_info = occupancy_analysis['occupancy']
+        occupancy_level = occupancy_info['level']
+
+        # 2. Destino, tráfego e ETA
+        nearest_dest = get_nearest_destination(latitude, longitude)
+        if not nearest_dest:
+            return JSONResponse({'error': 'Nenhum destino encontrado'}, 500)
+
+        traffic_factor = get_traffic_factor_by_hour(datetime.now().hour)
+        eta_data = calculate_eta_with_occupancy_impact(
+            latitude, longitude,
+            nearest_dest['latitude'], nearest_dest['longitude'],
+            occupancy_level, traffic_factor
+        )
+
+        # 3. Intervalo adaptativo baseado na ocupação
+        adaptive_interval = occupancy_adaptive_interval(occupancy_level)
+
+        # 4. Imagem, ETA e intervalo gravados em paralelo
+        image_data = decode_image_base64(image_base64)
+        image_id = None
+        if saved_location_id and db_available:
+            writes = [
+                get_async_occupancy_repository().save_image_analysis(
+                    saved_location_id, image_data, occupancy_info['person_count'], ingest_key
+                )
+            ]
+            if created:
+                writes.append(get_async_interval_repository().save_interval(
+                    saved_location_id, adaptive_interval
+                ))
+            if created and eta_data.get('estimated_arrival'):
+                writes.append(get_async_eta_repository().save_eta_prediction(
+                    saved_location_id, datetime.fromisoformat(eta_data['estimated_arrival']),
+                    eta_data['confidence_percent']
+                ))
+            results = await asyncio.gather(*writes, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.warning(f"Erro ao salvar dados integrados: {result}")
+            image_id = results[0] if not isinstance(results[0], Exception) else None
+
+        # 5. Banco indisponível: guarda no spool local para reenvio
+        spooled = False
+        spool = get_write_spool()
+        if not saved_location_id and spool:
+            spool.append_location(
+                bus_line, latitude, longitude,
+                predicted_arrival=eta_data.get('estimated_arrival'),
+                confidence_percent=eta_data.get('confidence_percent'),
+                interval_seconds=adaptive_interval,
+                image_data=image_data,
+                occupancy_count=occupancy_info['person_count'],
+                ingest_key=ingest_key,
+                device_id=device_id
+            )
+            spooled = True
+        elif location_id and not image_id and not await database_connected():
+            spooled = spool_image_analysis(
+                location_id, image_data, occupancy_info['person_count'], ingest_key
+            ) is not None
+
+        recommendations = generate_simple_recommendations(
+            occupancy_info, eta_data, traffic_factor, adaptive_interval
+        )
+
+        log_api_request('/api/location-image', 'POST', {
+            'bus_line': bus_line,
+            'occupancy_level': occupancy_level,
+            'eta_minutes': eta_data['eta_minutes'],
+            'confidence': eta_data['confidence_percent']
+        }, 200)
+
+        return JSONResponse(integrated_response_body(
+            bus_line, timestamp, saved_location_id, latitude, longitude, nearest_dest,
+            occupancy_analysis, eta_data, traffic_factor, adaptive_interval, recommendations,
+            spooled
+        ), headers={REPLAY_HEADER: 'true'} if saved_location_id and not created else None)
+
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/location-image: {e}")
+        return JSONResponse({'error': 'Erro interno do servidor', 'details': str(e)}, 500)
+
+# ============================================================
+#                        DASHBOARD
+# ============================================================
+
+async def database_connected() -> bool:
+    db_manager = get_async_database_manager()
+    return db_manager is not None and await db_manager.test_connection()
+
+async def get_database_metrics() -> Dict:
+    db_manager = get_async_database_manager()
+    db_info = await db_manager.get_database_info() if await database_connected() else None
+    return database_metrics_from_info(db_info)
+
+async def get_occupancy_summary(line_code: Optional[str] = None, hours: int = 24) -> Dict:
+    occupancy_repo = get_async_occupancy_repository()
+    if occupancy_repo and await database_connected():
+        stats = await occupancy_repo.get_occupancy_statistics(bus_line=line_code, hours=hours)
+        return format_occupancy_summary(stats)
+    return get_fallback_occupancy_summary()
+
+async def get_buses(line_code: Optional[str] = None, minutes: int = 5):
+    bus_repo = get_async_bus_repository()
+    if bus_repo and await database_connected():
+        locations = await bus_repo.get_current_locations(bus_line=line_code, minutes=minutes)
+        return latest_buses_by_line(merge_latest_positions(locations, line_code, minutes)), True
+    return fallback_buses_for_line(line_code), False
+
+async def dashboard_health(request: Request):
+    return JSONResponse(health_body())
+
+async def get_dashboard_data(request: Request):
+    """Contraparte assíncrona de GET /api/dashboard/data"""
+    try:
+        # psutil.cpu_percent bloqueia ~100ms: roda em thread enquanto o banco responde
+        (buses, db_connected), occupancy_summary, database_metrics, system_metrics = await asyncio.gather(
+            get_buses(minutes=5),
+            get_occupancy_summary(),
+            get_database_metrics(),
+            run_in_threadpool(get_system_metrics)
+        )
+
+        return JSONResponse(dashboard_body(buses, db_connected, occupancy_summary, system_metrics, {
+            'tables_count': database_metrics['tables_count'] or 4,
+            'total_records': database_metrics['total_records'],
+            'connection_pool_size': get_async_database_manager().get_pool_stats()
+                .get('pool_size', 0) if db_connected else 1
+        }))
+
+    except Exception as e:
+        logger.error(f"Erro ao obter dados do dashboard: {e}")
+        return JSONResponse(dashboard_fallback_body(
+            get_fallback_occupancy_summary(), await run_in_threadpool(get_system_metrics)
+        ))
+
+async def get_current_buses(request: Request):
+    """Contraparte assíncrona de GET /api/dashboard/buses"""
+    line_code = request.query_params.get('line')
+    minutes = int_param(request, 'minutes', 5)
+    try:
+        buses, _ = await get_buses(line_code, minutes)
+    except Exception as e:
+        logger.error(f"Erro ao obter ônibus: {e}")
+        buses = []
+
+    return JSONResponse(buses_body(buses, line_code, minutes))
+
+async def get_occupancy_data(request: Request):
+    """Contraparte assíncrona de GET /api/dashboard/occupancy"""
+    line_code = request.query_params.get('line')
+    hours = int_param(request, 'hours', 24)
+    try:
+        occupancy_data = await get_occupancy_summary(line_code, hours)
+    except Exception as e:
+        logger.error(f"Erro ao obter dados de ocupação: {e}")
+        occupancy_data = get_fallback_occupancy_summary()
+
+    return JSONResponse(occupancy_body(occupancy_data, line_code, hours))
+
+async def get_metrics(request: Request):
+    """Contraparte assíncrona de GET /api/dashboard/metrics"""
+    try:
+        system_metrics, database_metrics = await asyncio.gather(
+            run_in_threadpool(get_system_metrics),
+            get_database_metrics()
+        )
+        return JSONResponse(metrics_body(system_metrics, database_metrics))
+    except Exception as e:
+        logger.error(f"Erro ao obter métricas: {e}")
+        return JSONResponse(metrics_error_body(await run_in_threadpool(get_system_metrics)))
+
+# Rotas nativas assíncronas (demais rotas são atendidas pela aplicação Flask montada)
+async_routes = [
+    Route('/api/location', receive_location, methods=['POST']),
+    Route('/api/image/analyze', analyze_bus_image, methods=['POST']),
+    Route('/api/location-image', receive_location_and_image, methods=['POST']),
+    Route('/api/dashboard/health', dashboard_health, methods=['GET']),
+    Route('/api/dashboard/data', get_dashboard_data, methods=['GET']),
+    Route('/api/dashboard/buses', get_current_buses, methods=['GET']),
+    Route('/api/dashboard/occupancy', get_occupancy_data, methods=['GET']),
+    Route('/api/dashboard/metrics', get_metrics, methods=['GET']),
+]
@@ -0,0 +1,202 @@
+"""
+Disjuntor (circuit breaker) para dependências externas
+Usado pelo cliente do OSRM (api/osrm_client.py)
+
+Com o OSRM lento ou fora do ar, cada leitura GPS esperava o timeout inteiro
+antes do cálculo manual. O disjuntor acompanha o resultado e a latência das
+últimas chamadas, em uma janela de window_seconds:
+
+- fechado: chamadas passam; com ao menos min_calls na janela, taxa de erro
+  >= error_rate_threshold ou taxa de chamadas lentas (> slow_call_ms)
+  >= slow_rate_threshold abre o disjuntor;
+- aberto: chamadas falham na hora (o chamador usa o fallback). Uma thread em
+  segundo plano testa a dependência (probe) a cada open_seconds; sem probe,
+  o disjuntor passa sozinho a meio-aberto depois de open_seconds;
+- meio-aberto: até half_open_max_calls chamadas de teste passam; todas com
+  sucesso fecham o disjuntor, uma falha o abre de novo.
+
+O estado aparece nos health checks e em osrm_client_metrics. Por processo.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Disjuntor com janelas móveis de erro e de latência."""
+
+    def __init__(self, name: str, window_seconds: float = 30, min_calls: int = 10,
+                 error_rate_threshold: float = 0.5, slow_call_ms: float = 2000,
+                 slow_rate_threshold: float = 0.8, open_seconds: float = 15,
+                 half_open_max_calls: int = 3, probe: Callable[[], bool] = None):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_ms = slow_call_ms
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.probe = probe
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # (instante, sucesso, lenta) das chamadas na janela
+        self._window: deque = deque()
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        self._probe_thread: Optional[threading.Thread] = None
+        self.rejected = 0
+        self.times_opened = 0
+        self.probes = 0
+        self.probe_failures = 0
+        self.last_change = time.time()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        # Sem probe, o tempo aberto basta para voltar a testar
+        if self._state == OPEN and self.probe is None and \
+                time.monotonic() - self._opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+
+    def _set_state(self, state: str):
+        if state == self._state:
+            return
+        logger.warning(f"Disjuntor {self.name}: {self._state} -> {state}")
+        self._state = state
+        self.last_change = time.time()
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+        elif state == HALF_OPEN:
+            self._half_open_calls = 0
+            self._half_open_successes = 0
+        elif state == CLOSED:
+            self._window.clear()
+
+    def allow(self) -> bool:
+        """Se a chamada pode ir à dependência (False: usar o fallback já)."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: bool, seconds: float):
+        """Resultado de uma chamada que foi à dependência."""
+        start_probe = False
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if not success:
+                    self._set_state(OPEN)
+                    start_probe = True
+                else:
+                    self._half_open_successes += 1
+                    if self._half_open_successes >= self.half_open_max_calls:
+                        self._set_state(CLOSED)
+            elif self._state == CLOSED:
+                now = time.monotonic()
+                self._window.append((now, success, seconds * 1000 > self.slow_call_ms))
+                self._trim(now)
+                if self._should_open():
+                    self._set_state(OPEN)
+                    start_probe = True
+        if start_probe:
+            self._start_probe()
+
+    def _trim(self, now: float):
+        while self._window and self._window[0][0] < now - self.window_seconds:
+            self._window.popleft()
+
+    def _rates(self):
+        calls = len(self._window)
+        if not calls:
+            return 0, None, None
+        errors = sum(1 for _, success, _ in self._window if not success)
+        slow = sum(1 for _, _, is_slow in self._window if is_slow)
+        return calls, errors / calls, slow / calls
+
+    def _should_open(self) -> bool:
+        calls, error_rate, slow_rate = self._rates()
+        if calls < self.min_calls:
+            return False
+        return error_rate >= self.error_rate_threshold or slow_rate >= self.slow_rate_threshold
+
+    # ============================================================
+    #                TESTE EM SEGUNDO PLANO
+    # ============================================================
+
+    def _start_probe(self):
+        if self.probe is None:
+            return
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True,
+                                                  name=f"probe-{self.name}")
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """Testa a dependência a cada open_seconds enquanto o disjuntor estiver aberto."""
+        while True:
+            time.sleep(self.open_seconds)
+            with self._lock:
+                if self._state != OPEN:
+                    return
+            try:
+                healthy = bool(self.probe())
+            except Exception as e:
+                logger.debug(f"Disjuntor {self.name}: teste falhou: {e}")
+                healthy = False
+            with self._lock:
+                self.probes += 1
+                if self._state != OPEN:
+                    return
+                if healthy:
+                    self._set_state(HALF_OPEN)
+                    return
+                self.probe_failures += 1
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._set_state(CLOSED)
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_half_open()
+            self._trim(time.monotonic())
+            calls, error_rate, slow_rate = self._rates()
+            status = {
+                'state': self._state,
+                'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.last_change)),
+                'window_calls': calls,
+                'error_rate': round(error_rate, 3) if error_rate is not None else None,
+                'slow_rate': round(slow_rate, 3) if slow_rate is not None else None,
+                'rejected': self.rejected,
+                'times_opened': self.times_opened,
+                'probes': self.probes,
+                'probe_failures': self.probe_failures
+            }
+            if self._state == OPEN:
+                status['open_for_seconds'] = round(time.monotonic() - self._opened_at, 1)
+            return status
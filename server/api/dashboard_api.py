@@ -8,17 +8,27 @@ import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from flask import request, jsonify, Blueprint
+import numpy as np
 import os
 import sys
 
 # Adiciona o diretório server ao path para imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config_simple import DATABASE_CONFIG, ML_CONFIG
+from config_simple import DATABASE_CONFIG, ML_CONFIG, ETA_CONFIG, QUERY_STATS_CONFIG
 from database.simple_connection import (
     get_simple_database_manager, get_simple_bus_repository,
     get_simple_occupancy_repository, get_simple_eta_repository
 )
+from database.spool import get_spool_status
+from database.query_stats import get_query_stats, get_query_stats_status
+from api.idempotency import get_idempotency_status
+from api.trajectory import get_trajectory_status, merge_latest_positions
+from api.stop_index import get_stop_index
+from api.route_cache import get_route_cache_status
+from api.osrm_client import get_osrm_client_status, get_osrm_circuit_status
+from api.utils import get_traffic_factor_by_hour
+from ml.segment_speeds import get_segment_speeds_status
 
 # Configuração de logging
 logger = logging.getLogger(__name__)
@@ -115,14 +125,169 @@ def format_bus_location(location: Dict, occupancy: Optional[Dict] = None, eta: O
         'eta': eta
     }
 
+def latest_buses_by_line(locations: List[Dict]) -> List[Dict]:
+    """Agrupa por linha (pega a mais recente de cada linha) e formata para o front-end"""
+    buses_by_line = {}
+    for loc in locations:
+        line = loc.get('bus_line', '')
+        if line not in buses_by_line:
+            buses_by_line[line] = loc
+        else:
+            if loc.get('timestamp_location', datetime.min) > buses_by_line[line].get('timestamp_location', datetime.min):
+                buses_by_line[line] = loc
+    
+    latest = list(buses_by_line.values())
+    etas = estimate_fleet_etas(latest)
+    return [format_bus_location(loc, eta=eta) for loc, eta in zip(latest, etas)]
+
+# Fator de velocidade da ocupação média (nível 2), o padrão de calculate_simple_eta
+FLEET_OCCUPANCY_SPEED_FACTOR = 0.90
+
+def estimate_fleet_etas(locations: List[Dict]) -> List[Optional[Dict]]:
+    """
+    ETA de cada ônibus até a parada mais próxima, para a frota inteira de uma vez
+
+    Mesma estimativa de calculate_simple_eta (velocidade padrão, fator de tráfego
+    da hora, ocupação média), com as distâncias calculadas em lote (api/geo.py).
+    """
+    if not locations:
+        return []
+    try:
+        lats = np.array([float(loc.get('latitude', 0)) for loc in locations])
+        lons = np.array([float(loc.get('longitude', 0)) for loc in locations])
+        stops = get_stop_index().nearest_many(lats, lons)
+        distances = np.array([stop['distance_km'] if stop else np.nan for stop in stops])
+
+        traffic_factor = get_traffic_factor_by_hour(datetime.now().hour)
+        speed_kmh = ETA_CONFIG['default_speed_kmh'] * traffic_factor * FLEET_OCCUPANCY_SPEED_FACTOR
+        minutes = distances / speed_kmh * 60
+        confidence = max(50.0, min(95.0, 80.0 * FLEET_OCCUPANCY_SPEED_FACTOR * traffic_factor))
+    except Exception as e:
+        logger.warning(f"Erro ao calcular ETA da frota: {e}")
+        return [None] * len(locations)
+
+    return [None if stop is None else {
+        'minutes': round(float(eta_minutes), 1),
+        'confidence': round(confidence, 1),
+        'destination': stop['id'],
+        'distance_km': round(stop['distance_km'], 2)
+    } for stop, eta_minutes in zip(stops, minutes)]
+
+# ============================================================
+#        CORPOS DAS RESPOSTAS (servidores Flask e ASGI)
+# ============================================================
+# As rotas Flask abaixo e as de api/async_api.py só buscam os dados (síncrona
+# ou assincronamente); o formato das respostas é montado aqui, uma vez.
+
+def fallback_buses_for_line(line_code: Optional[str] = None) -> List[Dict]:
+    """Ônibus simulados (modo fallback), filtrados pela linha se informada"""
+    buses = get_fallback_buses()
+    if line_code:
+        buses = [b for b in buses if b['line_code'] == line_code]
+    return buses
+
+def database_metrics_from_info(db_info: Optional[Dict]) -> Dict:
+    """Métricas do banco a partir de get_database_info (None: desconectado)"""
+    if db_info is None:
+        return {
+            'tables_count': 0,
+            'total_records': 0,
+            'connection_status': 'disconnected'
+        }
+    return {
+        'tables_count': len(db_info.get('tables', [])),
+        'total_records': db_info.get('total_records', 0),
+        'connection_status': 'connected'
+    }
+
+def health_body() -> Dict:
+    return {
+        'status': 'healthy',
+        'service': 'dashboard-api',
+        'timestamp': datetime.now().isoformat(),
+        'osrm_circuit': get_osrm_circuit_status()
+    }
+
+def dashboard_body(buses: List[Dict], db_connected: bool, occupancy_summary: Dict,
+                   system_metrics: Dict, database_info: Dict) -> Dict:
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'system_status': {
+            'database_connected': db_connected,
+            'total_active_buses': len(buses),
+            'last_update': datetime.now().isoformat(),
+            'mode': 'database' if db_connected else 'fallback'
+        },
+        'current_buses': buses,
+        'occupancy_summary': occupancy_summary,
+        'eta_summary': get_eta_summary(),
+        'system_metrics': system_metrics,
+        'database_info': database_info
+    }
+
+def dashboard_fallback_body(occupancy_summary: Dict, system_metrics: Dict) -> Dict:
+    """Dados simulados quando a montagem do dashboard falha"""
+    return dashboard_body(get_fallback_buses(), False, occupancy_summary, system_metrics, {
+        'tables_count': 0,
+        'total_records': 0,
+        'connection_pool_size': 0
+    })
+
+def buses_body(buses: List[Dict], line_code: Optional[str], minutes: int) -> Dict:
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'count': len(buses),
+        'buses': buses,
+        'filters': {
+            'line_code': line_code,
+            'minutes': minutes
+        }
+    }
+
+def occupancy_body(occupancy_data: Dict, line_code: Optional[str], hours: int) -> Dict:
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'occupancy_data': occupancy_data,
+        'filters': {
+            'line_code': line_code,
+            'hours': hours
+        }
+    }
+
+def metrics_body(system_metrics: Dict, database_metrics: Dict) -> Dict:
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'system_metrics': system_metrics,
+        'database_metrics': database_metrics,
+        'spool_metrics': get_spool_status(),
+        'idempotency_metrics': get_idempotency_status(),
+        'trajectory_metrics': get_trajectory_status(),
+        'query_metrics': get_query_stats_status(),
+        'route_cache_metrics': get_route_cache_status(),
+        'osrm_client_metrics': get_osrm_client_status(),
+        'segment_speed_metrics': get_segment_speeds_status(),
+        'api_metrics': {
+            'requests_today': 0,
+            'avg_response_time': 0.15
+        }
+    }
+
+def metrics_error_body(system_metrics: Dict) -> Dict:
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'system_metrics': system_metrics,
+        'database_metrics': {},
+        'api_metrics': {}
+    }
+
+# ============================================================
+#                        ROTAS
+# ============================================================
+
 @dashboard_bp.route('/health', methods=['GET'])
 def dashboard_health():
     """Health check da API de dashboard"""
-    return jsonify({
-        'status': 'healthy',
-        'service': 'dashboard-api',
-        'timestamp': datetime.now().isoformat()
-    }), 200
+    return jsonify(health_body()), 200
 
 @dashboard_bp.route('/data', methods=['GET'])
 def get_dashboard_data():
@@ -138,32 +303,12 @@ def get_dashboard_data():
             # Apenas se o banco estiver indisponível é que caímos em modo fallback.
             bus_repo = get_simple_bus_repository()
             if bus_repo:
-                locations = bus_repo.get_current_locations(minutes=5)
-                # Agrupa por linha (pega a mais recente de cada linha)
-                buses_by_line = {}
-                for loc in locations:
-                    line = loc.get('bus_line', '')
-                    if line not in buses_by_line:
-                        buses_by_line[line] = loc
-                    else:
-                        if loc.get('timestamp_location', datetime.min) > buses_by_line[line].get('timestamp_location', datetime.min):
-                            buses_by_line[line] = loc
-                
-                for loc in buses_by_line.values():
-                    buses.append(format_bus_location(loc))
+                locations = merge_latest_positions(bus_repo.get_current_locations(minutes=5))
+                buses = latest_buses_by_line(locations)
         else:
             # Sem conexão com banco → dados simulados (modo fallback)
             buses = get_fallback_buses()
         
-        # Obtém estatísticas de ocupação
-        occupancy_summary = get_occupancy_summary()
-        
-        # Obtém estatísticas de ETA
-        eta_summary = get_eta_summary()
-        
-        # Obtém métricas do sistema
-        system_metrics = get_system_metrics()
-        
         # Informações do banco
         database_info = {
             'tables_count': 4,
@@ -176,50 +321,21 @@ def get_dashboard_data():
             database_info['tables_count'] = len(db_info.get('tables', []))
             database_info['total_records'] = db_info.get('total_records', 0)
         
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'system_status': {
-                'database_connected': db_connected,
-                'total_active_buses': len(buses),
-                'last_update': datetime.now().isoformat(),
-                'mode': 'database' if db_connected else 'fallback'
-            },
-            'current_buses': buses,
-            'occupancy_summary': occupancy_summary,
-            'eta_summary': eta_summary,
-            'system_metrics': system_metrics,
-            'database_info': database_info
-        }), 200
+        return jsonify(dashboard_body(
+            buses, db_connected, get_occupancy_summary(), get_system_metrics(), database_info
+        )), 200
         
     except Exception as e:
         logger.error(f"Erro ao obter dados do dashboard: {e}")
         # Retorna dados fallback em caso de erro
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'system_status': {
-                'database_connected': False,
-                'total_active_buses': 3,
-                'last_update': datetime.now().isoformat(),
-                'mode': 'fallback'
-            },
-            'current_buses': get_fallback_buses(),
-            'occupancy_summary': get_occupancy_summary(),
-            'eta_summary': get_eta_summary(),
-            'system_metrics': get_system_metrics(),
-            'database_info': {
-                'tables_count': 0,
-                'total_records': 0,
-                'connection_pool_size': 0
-            }
-        }), 200
+        return jsonify(dashboard_fallback_body(get_occupancy_summary(), get_system_metrics())), 200
 
 @dashboard_bp.route('/buses', methods=['GET'])
 def get_current_buses():
     """Retorna ônibus ativos"""
+    line_code = request.args.get('line')
+    minutes = request.args.get('minutes', 5, type=int)
     try:
-        line_code = request.args.get('line')
-        minutes = int(request.args.get('minutes', 5))
-        
         db_manager = get_simple_database_manager()
         buses = []
         db_connected = db_manager is not None and db_manager.test_connection()
@@ -227,116 +343,91 @@ def get_current_buses():
         if db_connected:
             bus_repo = get_simple_bus_repository()
             if bus_repo:
-                locations = bus_repo.get_current_locations(bus_line=line_code, minutes=minutes)
-                # Agrupa por linha
-                buses_by_line = {}
-                for loc in locations:
-                    line = loc.get('bus_line', '')
-                    if line not in buses_by_line:
-                        buses_by_line[line] = loc
-                    else:
-                        if loc.get('timestamp_location', datetime.min) > buses_by_line[line].get('timestamp_location', datetime.min):
-                            buses_by_line[line] = loc
-                
-                for loc in buses_by_line.values():
-                    buses.append(format_bus_location(loc))
+                locations = merge_latest_positions(
+                    bus_repo.get_current_locations(bus_line=line_code, minutes=minutes),
+                    line_code, minutes
+                )
+                buses = latest_buses_by_line(locations)
         else:
-            buses = get_fallback_buses()
-            if line_code:
-                buses = [b for b in buses if b['line_code'] == line_code]
-        
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'count': len(buses),
-            'buses': buses,
-            'filters': {
-                'line_code': line_code,
-                'minutes': minutes
-            }
-        }), 200
+            buses = fallback_buses_for_line(line_code)
         
     except Exception as e:
         logger.error(f"Erro ao obter ônibus: {e}")
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'count': 0,
-            'buses': [],
-            'filters': {
-                'line_code': line_code,
-                'minutes': minutes
-            }
-        }), 200
+        buses = []
+    
+    return jsonify(buses_body(buses, line_code, minutes)), 200
 
 @dashboard_bp.route('/occupancy', methods=['GET'])
 def get_occupancy_data():
     """Retorna dados de ocupação"""
+    line_code = request.args.get('line')
+    hours = request.args.get('hours', 24, type=int)
     try:
-        line_code = request.args.get('line')
-        hours = int(request.args.get('hours', 24))
-        
         occupancy_data = get_occupancy_summary(line_code, hours)
-        
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'occupancy_data': occupancy_data,
-            'filters': {
-                'line_code': line_code,
-                'hours': hours
-            }
-        }), 200
-        
     except Exception as e:
         logger.error(f"Erro ao obter dados de ocupação: {e}")
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'occupancy_data': get_occupancy_summary(),
-            'filters': {
-                'line_code': line_code,
-                'hours': hours
-            }
-        }), 200
+        occupancy_data = get_occupancy_summary()
+    
+    return jsonify(occupancy_body(occupancy_data, line_code, hours)), 200
 
 @dashboard_bp.route('/metrics', methods=['GET'])
 def get_metrics():
     """Retorna métricas do sistema"""
     try:
-        system_metrics = get_system_metrics()
-        
         db_manager = get_simple_database_manager()
-        database_metrics = {}
+        db_info = None
         if db_manager and db_manager.test_connection():
             db_info = db_manager.get_database_info()
-            database_metrics = {
-                'tables_count': len(db_info.get('tables', [])),
-                'total_records': db_info.get('total_records', 0),
-                'connection_status': 'connected'
-            }
-        else:
-            database_metrics = {
-                'tables_count': 0,
-                'total_records': 0,
-                'connection_status': 'disconnected'
-            }
         
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'system_metrics': system_metrics,
-            'database_metrics': database_metrics,
-            'api_metrics': {
-                'requests_today': 0,
-                'avg_response_time': 0.15
-            }
-        }), 200
+        return jsonify(metrics_body(get_system_metrics(), database_metrics_from_info(db_info))), 200
         
     except Exception as e:
         logger.error(f"Erro ao obter métricas: {e}")
+        return jsonify(metrics_error_body(get_system_metrics())), 200
+
+@dashboard_bp.route('/spool', methods=['GET'])
+def get_spool():
+    """Tamanho do spool local de gravações e progresso do reenvio (deste processo)"""
+    return jsonify({
+        'timestamp': datetime.now().isoformat(),
+        'spool': get_spool_status()
+    }), 200
+
+@dashboard_bp.route('/queries', methods=['GET'])
+def get_slow_queries():
+    """
+    Consultas mais lentas deste processo e planos das execuções lentas
+
+    Parâmetros: top (padrão QUERY_STATS_CONFIG['top_n']), order (total_ms,
+    mean_ms, max_ms, p95_ms, p99_ms, calls ou slow_calls; padrão total_ms)
+    """
+    stats = get_query_stats()
+    if stats is None:
         return jsonify({
             'timestamp': datetime.now().isoformat(),
-            'system_metrics': get_system_metrics(),
-            'database_metrics': {},
-            'api_metrics': {}
+            'status': get_query_stats_status(),
+            'queries': [],
+            'slow_captures': []
         }), 200
 
+    try:
+        top_n = max(1, min(int(request.args.get('top', QUERY_STATS_CONFIG['top_n'])), 100))
+        order = request.args.get('order', 'total_ms')
+        queries = stats.top(top_n, order)
+    except ValueError:
+        return jsonify({
+            'error': "Parâmetros inválidos: top deve ser inteiro e order um de "
+                     + ", ".join(stats.ORDERS)
+        }), 400
+
+    return jsonify({
+        'timestamp': datetime.now().isoformat(),
+        'status': stats.get_status(),
+        'order': order,
+        'queries': queries,
+        'slow_captures': stats.recent_captures(top_n)
+    }), 200
+
 def get_occupancy_summary(line_code: Optional[str] = None, hours: int = 24) -> Dict:
     """Obtém resumo de ocupação"""
     try:
@@ -345,67 +436,9 @@ def get_occupancy_summary(line_code: Optional[str] = None, hours: int = 24) -> D
         
         if db_manager and db_manager.test_connection() and occupancy_repo:
             stats = occupancy_repo.get_occupancy_statistics(bus_line=line_code, hours=hours)
-            
-            # Formata para o formato esperado
-            distribution = {}
-            total = stats.get('total_analyses', 0)
-            
-            for level in range(5):
-                level_name = ML_CONFIG['occupancy_levels'].get(level, 'desconhecido')
-                count = stats.get('by_occupancy', {}).get(level, {}).get('count', 0)
-                avg_count = stats.get('by_occupancy', {}).get(level, {}).get('avg_occupancy', 0)
-                avg_conf = 85.0  # Confiança padrão
-                
-                distribution[level_name.lower()] = {
-                    'count': count,
-                    'percentage': (count / total * 100) if total > 0 else 0,
-                    'avg_person_count': float(avg_count) if avg_count else 0,
-                    'avg_confidence': avg_conf
-                }
-            
-            return {
-                'total_analyses': total,
-                'overall_confidence': 85.0,
-                'distribution': distribution
-            }
+            return format_occupancy_summary(stats)
         else:
-            # Dados fallback
-            return {
-                'total_analyses': 150,
-                'overall_confidence': 85.5,
-                'distribution': {
-                    'vazio': {
-                        'count': 20,
-                        'percentage': 13.3,
-                        'avg_person_count': 0,
-                        'avg_confidence': 90.0
-                    },
-                    'baixa': {
-                        'count': 45,
-                        'percentage': 30.0,
-                        'avg_person_count': 8,
-                        'avg_confidence': 88.0
-                    },
-                    'média': {
-                        'count': 60,
-                        'percentage': 40.0,
-                        'avg_person_count': 18,
-                        'avg_confidence': 85.0
-                    },
-                    'alta': {
-                        'count': 20,
-                        'percentage': 13.3,
-                        'avg_person_count': 35,
-                        'avg_confidence': 82.0
-                    },
-                    'lotado': {
-                        'count': 5,
-                        'percentage': 3.3,
-                        'avg_person_count': 48,
-                        'avg_confidence': 80.0
-                    }
-                }
-            }
+            return get_fallback_occupancy_summary()
             
     except Exception as e:
         logger.error(f"Erro ao obter resumo de ocupação: {e}")
@@ -415,6 +448,69 @@ def get_occupancy_summary(line_code: Optional[str] = None, hours: int = 24) -> D
             'distribution': {}
         }
 
+def format_occupancy_summary(stats: Dict) -> Dict:
+    """Formata estatísticas de ocupação para o formato esperado pelo front-end"""
+    distribution = {}
+    total = stats.get('total_analyses', 0)
+    
+    for level in range(5):
+        level_name = ML_CONFIG['occupancy_levels'].get(level, 'desconhecido')
+        count = stats.get('by_occupancy', {}).get(level, {}).get('count', 0)
+        avg_count = stats.get('by_occupancy', {}).get(level, {}).get('avg_occupancy', 0)
+        avg_conf = 85.0  # Confiança padrão
+        
+        distribution[level_name.lower()] = {
+            'count': count,
+            'percentage': (count / total * 100) if total > 0 else 0,
+            'avg_person_count': float(avg_count) if avg_count else 0,
+            'avg_confidence': avg_conf
+        }
+    
+    return {
+        'total_analyses': total,
+        'overall_confidence': 85.0,
+        'distribution': distribution
+    }
+
+def get_fallback_occupancy_summary() -> Dict:
+    """Resumo de ocupação simulado (modo fallback)"""
+    return {
+        'total_analyses': 150,
+        'overall_confidence': 85.5,
+        'distribution': {
+            'vazio': {
+                'count': 20,
+                'percentage': 13.3,
+                'avg_person_count': 0,
+                'avg_confidence': 90.0
+            },
+            'baixa': {
+                'count': 45,
+                'percentage': 30.0,
+                'avg_person_count': 8,
+                'avg_confidence': 88.0
+            },
+            'média': {
+                'count': 60,
+                'percentage': 40.0,
+                'avg_person_count': 18,
+                'avg_confidence': 85.0
+            },
+            'alta': {
+                'count': 20,
+                'percentage': 13.3,
+                'avg_person_count': 35,
+                'avg_confidence': 82.0
+            },
+            'lotado': {
+                'count': 5,
+                'percentage': 3.3,
+                'avg_person_count': 48,
+                'avg_confidence': 80.0
+            }
+        }
+    }
+
 def get_eta_summary() -> Dict:
     """Obtém resumo de ETA"""
     try:
@@ -427,29 +523,7 @@ def get_eta_summary() -> Dict:
             pass
         
         # Dados fallback
-        return {
-            'total_predictions': 200,
-            'avg_accuracy_minutes': 2.5,
-            'avg_confidence_percent': 78.5,
-            'by_method': {
-                'osrm': {
-                    'count': 150,
-                    'avg_accuracy': 1.8,
-                    'avg_confidence': 90.0
-                },
-                'fallback': {
-                    'count': 50,
-                    'avg_accuracy': 4.2,
-                    'avg_confidence': 60.0
-                }
-            },
-            'performance': {
-                'excellent': 120,
-                'good': 60,
-                'fair': 15,
-                'poor': 5
-            }
-        }
+        return get_fallback_eta_summary()
         
     except Exception as e:
         logger.error(f"Erro ao obter resumo de ETA: {e}")
@@ -466,6 +540,32 @@ def get_eta_summary() -> Dict:
             }
         }
 
+def get_fallback_eta_summary() -> Dict:
+    """Resumo de ETA simulado (modo fallback)"""
+    return {
+        'total_predictions': 200,
+        'avg_accuracy_minutes': 2.5,
+        'avg_confidence_percent': 78.5,
+        'by_method': {
+            'osrm': {
+                'count': 150,
+                'avg_accuracy': 1.8,
+                'avg_confidence': 90.0
+            },
+            'fallback': {
+                'count': 50,
+                'avg_accuracy': 4.2,
+                'avg_confidence': 60.0
+            }
+        },
+        'performance': {
+            'excellent': 120,
+            'good': 60,
+            'fair': 15,
+            'poor': 5
+        }
+    }
+
 def get_system_metrics() -> Dict:
     """Obtém métricas do sistema"""
     try:
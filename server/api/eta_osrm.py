@@ -3,70 +3,84 @@ Módulo para cálculo de ETA usando OSRM (Open Source Routing Machine)
 Muito mais preciso que cálculos manuais baseados em distância
 """
 
-import requests
 import json
 import logging
-from typing import Dict, Optional, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 
 # Importa configurações centralizadas
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import OSRM_CONFIG
+from config_simple import OSRM_CONFIG, ETA_CONFIG
+from api.geo import haversine_km
+from api.route_cache import RouteCache, get_route_cache
+from api.osrm_client import OSRMClient, OSRMError, ROUTE_PARAMS, get_osrm_client, route_path
 
 logger = logging.getLogger(__name__)
 
 class OSRMETA:
     """Classe para cálculo de ETA usando OSRM"""
     
-    def __init__(self, osrm_server: str = None, profile: str = None):
+    def __init__(self, osrm_server: str = None, profile: str = None, cache: RouteCache = None,
+                 client: OSRMClient = None):
         self.osrm_server = osrm_server or OSRM_CONFIG['server_url']
         self.profile = profile or OSRM_CONFIG['profile']
-        self.timeout = OSRM_CONFIG['timeout_seconds']
-        self.max_retries = OSRM_CONFIG['max_retries']
+        # Cache de rotas do processo (None com OSRM_ROUTE_CACHE=false)
+        self.cache = cache if cache is not None else get_route_cache()
+        # Cliente com pool e novas tentativas (api/osrm_client.py): o do
+        # processo, ou um próprio para outro servidor
+        if client is None:
+            client = get_osrm_client()
+            if client.server_url != self.osrm_server.rstrip('/'):
+                client = OSRMClient(self.osrm_server)
+        self.client = client
         
     def get_route_info(self, start_lat: float, start_lon: float, 
-                      end_lat: float, end_lon: float) -> Dict:
+                      end_lat: float, end_lon: float, destination_id: str = None) -> Dict:
         """
         Obtém informações de rota do OSRM
         Retorna: distância, duração, instruções
+        
+        Consulta antes o cache de rotas (api/route_cache.py), pela célula da
+        origem e pelo destino (destination_id, ou as coordenadas do destino).
         """
+        destination_id = destination_id or f"{end_lat:.5f},{end_lon:.5f}"
+        if self.cache:
+            cached = self.cache.get(start_lat, start_lon, destination_id, self.profile)
+            if cached:
+                return {
+                    'distance_meters': cached['distance_meters'],
+                    'duration_seconds': cached['duration_seconds'],
+                    'duration_minutes': round(cached['duration_seconds'] / 60, 1),
+                    'cache': cached['cache'],
+                    'status': 'success'
+                }
+        
         try:
-            # Formato: longitude,latitude;longitude,latitude
-            coordinates = f"{start_lon},{start_lat};{end_lon},{end_lat}"
+            started = time.perf_counter()
+            data = self.client.route([(start_lat, start_lon), (end_lat, end_lon)], self.profile)
+            if not data.get('routes'):
+                return {'status': 'error', 'message': 'OSRM sem rotas'}
+            route = data['routes'][0]
             
-            url = f"{self.osrm_server}/route/v1/{self.profile}/{coordinates}"
+            if self.cache:
+                self.cache.put(start_lat, start_lon, (end_lat, end_lon), destination_id, self.profile,
+                               route['distance'], route['duration'], time.perf_counter() - started)
             
-            params = {
-                'overview': 'false',  # Não retorna geometria da rota
-                'steps': 'false',     # Não retorna instruções detalhadas
-                'alternatives': 'false'  # Apenas a rota mais rápida
+            return {
+                'distance_meters': route['distance'],
+                'duration_seconds': route['duration'],
+                'duration_minutes': round(route['duration'] / 60, 1),
+                'status': 'success'
             }
-            
-            response = requests.get(url, params=params, timeout=self.timeout)
-            
-            if response.status_code == 200:
-                data = response.json()
                 
-                if data.get('code') == 'Ok' and data.get('routes'):
-                    route = data['routes'][0]
-                    
-                    return {
-                        'distance_meters': route['distance'],
-                        'duration_seconds': route['duration'],
-                        'duration_minutes': round(route['duration'] / 60, 1),
-                        'status': 'success'
-                    }
-                else:
-                    logger.error(f"OSRM error: {data.get('message', 'Unknown error')}")
-                    return {'status': 'error', 'message': data.get('message', 'OSRM error')}
-            else:
-                logger.error(f"OSRM HTTP error: {response.status_code}")
-                return {'status': 'error', 'message': f'HTTP {response.status_code}'}
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"OSRM request error: {e}")
+        except OSRMError as e:
+            if e.circuit_open:
+                # Disjuntor aberto: falha imediata, o chamador usa o cálculo manual
+                return {'status': 'error', 'message': str(e), 'circuit_open': True}
+            logger.error(f"OSRM error: {e}")
             return {'status': 'error', 'message': str(e)}
         except Exception as e:
             logger.error(f"OSRM unexpected error: {e}")
@@ -74,11 +88,11 @@ class OSRMETA:
     
     def get_eta_with_traffic_factor(self, start_lat: float, start_lon: float,
                                    end_lat: float, end_lon: float,
-                                   traffic_factor: float = 1.0) -> Dict:
+                                   traffic_factor: float = 1.0, destination_id: str = None) -> Dict:
         """
         Calcula ETA considerando fator de tráfego
         """
-        route_info = self.get_route_info(start_lat, start_lon, end_lat, end_lon)
+        route_info = self.get_route_info(start_lat, start_lon, end_lat, end_lon, destination_id)
         
         if route_info['status'] != 'success':
             return route_info
@@ -98,7 +112,8 @@ class OSRMETA:
             'distance_km': round(route_info['distance_meters'] / 1000, 2),
             'traffic_factor': traffic_factor,
             'confidence_percent': OSRM_CONFIG['confidence_osrm'],  # OSRM é muito confiável
-            'source': 'OSRM'
+            'source': 'OSRM',
+            'route_cache': route_info.get('cache', 'miss') if self.cache else None
         }
     
     def get_multiple_routes(self, coordinates: list) -> Dict:
@@ -107,53 +122,166 @@ class OSRMETA:
         Útil para rotas de ônibus com várias paradas
         """
         try:
-            # Formato: lon1,lat1;lon2,lat2;lon3,lat3
-            coord_string = ';'.join([f"{lon},{lat}" for lat, lon in coordinates])
-            
-            url = f"{self.osrm_server}/route/v1/{self.profile}/{coord_string}"
+            data = self.client.get(route_path(self.profile, coordinates), ROUTE_PARAMS,
+                                   timeout_seconds=15, deadline_seconds=15)
+            if not data.get('routes'):
+                return {'status': 'error', 'message': 'OSRM sem rotas'}
+            route = data['routes'][0]
             
-            params = {
-                'overview': 'false',
-                'steps': 'false',
-                'alternatives': 'false'
+            return {
+                'status': 'success',
+                'total_distance_km': round(route['distance'] / 1000, 2),
+                'total_duration_minutes': round(route['duration'] / 60, 1),
+                'waypoints': data.get('waypoints', [])
             }
-            
-            response = requests.get(url, params=params, timeout=15)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data.get('code') == 'Ok' and data.get('routes'):
-                    route = data['routes'][0]
-                    
-                    return {
-                        'status': 'success',
-                        'total_distance_km': round(route['distance'] / 1000, 2),
-                        'total_duration_minutes': round(route['duration'] / 60, 1),
-                        'waypoints': data.get('waypoints', [])
-                    }
-                else:
-                    return {'status': 'error', 'message': data.get('message', 'OSRM error')}
-            else:
-                return {'status': 'error', 'message': f'HTTP {response.status_code}'}
                 
+        except OSRMError as e:
+            return {'status': 'error', 'message': str(e)}
         except Exception as e:
             logger.error(f"OSRM multiple routes error: {e}")
             return {'status': 'error', 'message': str(e)}
 
+    def get_duration_table(self, sources: List[Tuple[float, float]],
+                           destinations: List[Tuple[float, float]]) -> Dict:
+        """
+        Durações (s) e distâncias (m) de cada origem até cada destino (/table)
+        
+        Uma requisição cobre até table_max_coordinates coordenadas (origens +
+        destinos); frotas maiores são divididas em blocos de origens (e de
+        destinos, se necessário), e os blocos são juntados na matriz final.
+        Células de blocos que falharam (ou sem rota) ficam None.
+        
+        Args:
+            sources: (latitude, longitude) de cada ônibus
+            destinations: (latitude, longitude) de cada parada
+        """
+        max_coordinates = OSRM_CONFIG['table_max_coordinates']
+        if len(destinations) < max_coordinates:
+            dest_chunk = max(1, len(destinations))
+        else:
+            dest_chunk = max_coordinates // 2
+        source_chunk = max(1, max_coordinates - dest_chunk)
+        
+        durations = [[None] * len(destinations) for _ in sources]
+        distances = [[None] * len(destinations) for _ in sources]
+        requests_made = failed = 0
+        
+        for s0 in range(0, len(sources), source_chunk):
+            block_sources = sources[s0:s0 + source_chunk]
+            for d0 in range(0, len(destinations), dest_chunk):
+                block_destinations = destinations[d0:d0 + dest_chunk]
+                requests_made += 1
+                block = self._table_request(block_sources, block_destinations)
+                if block is None:
+                    failed += 1
+                    continue
+                for i, row in enumerate(block['durations']):
+                    durations[s0 + i][d0:d0 + len(row)] = row
+                for i, row in enumerate(block.get('distances') or []):
+                    distances[s0 + i][d0:d0 + len(row)] = row
+        
+        if failed == requests_made and requests_made:
+            status = 'error'
+        else:
+            status = 'partial' if failed else 'success'
+        return {
+            'status': status,
+            'durations': durations,
+            'distances': distances,
+            'requests': requests_made,
+            'failed_requests': failed
+        }
+    
+    def _table_request(self, sources: List[Tuple[float, float]],
+                       destinations: List[Tuple[float, float]]) -> Optional[Dict]:
+        """Uma requisição /table (origens primeiro, depois destinos); None se falhar."""
+        coordinates = ';'.join(f"{lon},{lat}" for lat, lon in sources + destinations)
+        params = {
+            'sources': ';'.join(str(i) for i in range(len(sources))),
+            'destinations': ';'.join(str(len(sources) + j) for j in range(len(destinations))),
+            'annotations': 'duration,distance'
+        }
+        try:
+            return self.client.get(f"/table/v1/{self.profile}/{coordinates}", params,
+                                   timeout_seconds=OSRM_CONFIG['table_timeout_seconds'],
+                                   deadline_seconds=OSRM_CONFIG['table_deadline_seconds'])
+        except OSRMError as e:
+            if not e.circuit_open:
+                logger.error(f"OSRM table error: {e}")
+            return None
+
 # Instância global do OSRM
 osrm_eta = OSRMETA()
 
 def calculate_eta_with_osrm(current_lat: float, current_lon: float,
                            target_lat: float, target_lon: float,
-                           traffic_factor: float = 1.0) -> Dict:
+                           traffic_factor: float = 1.0, destination_id: str = None) -> Dict:
     """
     Função helper para calcular ETA usando OSRM
     """
     return osrm_eta.get_eta_with_traffic_factor(
-        current_lat, current_lon, target_lat, target_lon, traffic_factor
+        current_lat, current_lon, target_lat, target_lon, traffic_factor, destination_id
     )
 
+def calculate_batch_etas(buses: List[Dict], stops_by_bus: List[List[Dict]],
+                         traffic_factor: float = 1.0) -> List[List[Dict]]:
+    """
+    ETA de cada ônibus até cada uma das suas paradas, com uma matriz /table
+    
+    As paradas de todos os ônibus entram juntas como destinos (cada parada uma
+    vez). Pares sem duração do OSRM (bloco que falhou, sem rota) usam a
+    distância em linha reta e a velocidade padrão, como o fallback manual.
+    
+    Args:
+        buses: dicionários com latitude e longitude
+        stops_by_bus: paradas relevantes de cada ônibus (id, latitude, longitude)
+        traffic_factor: multiplicador da duração
+        
+    Returns:
+        Para cada ônibus, as ETAs até as suas paradas, da menor para a maior
+    """
+    unique_stops: Dict[str, Dict] = {}
+    for stops in stops_by_bus:
+        for stop in stops:
+            unique_stops.setdefault(stop['id'], stop)
+    stop_ids = list(unique_stops)
+    column = {stop_id: j for j, stop_id in enumerate(stop_ids)}
+    
+    table = osrm_eta.get_duration_table(
+        [(float(b['latitude']), float(b['longitude'])) for b in buses],
+        [(unique_stops[s]['latitude'], unique_stops[s]['longitude']) for s in stop_ids]
+    )
+    fallback_speed_kmh = ETA_CONFIG['default_speed_kmh'] * traffic_factor
+    now = datetime.now()
+    
+    results = []
+    for i, (bus, stops) in enumerate(zip(buses, stops_by_bus)):
+        etas = []
+        for stop in stops:
+            j = column[stop['id']]
+            duration = table['durations'][i][j]
+            if duration is not None:
+                seconds = duration * traffic_factor
+                distance_km = (table['distances'][i][j] or 0) / 1000
+                source, confidence = 'OSRM', OSRM_CONFIG['confidence_osrm']
+            else:
+                distance_km = float(haversine_km(bus['latitude'], bus['longitude'],
+                                                 stop['latitude'], stop['longitude']))
+                seconds = distance_km / fallback_speed_kmh * 3600
+                source, confidence = 'manual_fallback', OSRM_CONFIG['confidence_fallback']
+            etas.append({
+                'stop_id': stop['id'],
+                'stop_name': stop.get('name'),
+                'eta_minutes': round(seconds / 60, 1),
+                'estimated_arrival': (now + timedelta(seconds=seconds)).isoformat(),
+                'distance_km': round(distance_km, 2),
+                'confidence_percent': confidence,
+                'source': source
+            })
+        etas.sort(key=lambda eta: eta['eta_minutes'])
+        results.append(etas)
+    return results
+
 def get_traffic_factor_by_hour_osrm(hour: int) -> float:
     """
     Fator de tráfego baseado no horário (para usar com OSRM)
@@ -0,0 +1,73 @@
+"""
+Distâncias Haversine vetorizadas (NumPy)
+Muitos pontos de uma vez, para os cálculos em lote da frota e das análises
+
+calculate_distance_km (api/utils.py) continua sendo o caminho de um ponto só:
+para uma distância, a chamada escalar é mais rápida que montar arrays. As
+funções daqui valem a partir de dezenas de pontos (tools/benchmark_distance.py).
+
+FixedPoints guarda, para um conjunto fixo (paradas do catálogo), as
+latitudes/longitudes em radianos e o cosseno da latitude, calculados uma vez.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+# Raio médio da Terra em km (o mesmo de calculate_distance_km)
+EARTH_RADIUS_KM = 6371.0
+
+# Elementos da matriz de distâncias calculados por vez em FixedPoints.nearest
+# (cada bloco ocupa alguns arrays temporários desse tamanho)
+NEAREST_CHUNK_CELLS = 1_000_000
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Distância elemento a elemento (com broadcasting) entre pontos em graus."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def distance_matrix_km(lats_a, lons_a, lats_b, lons_b) -> np.ndarray:
+    """Matriz (len(a), len(b)) das distâncias de cada ponto de a até cada ponto de b."""
+    return FixedPoints(lats_b, lons_b).distances_km(lats_a, lons_a)
+
+def path_length_km(lats, lons) -> float:
+    """Comprimento da trajetória que liga os pontos na ordem dada."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size < 2:
+        return 0.0
+    return float(haversine_km(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum())
+
+class FixedPoints:
+    """Pontos fixos (ex.: paradas) com os termos trigonométricos pré-calculados."""
+
+    def __init__(self, lats, lons):
+        self._lat = np.radians(np.asarray(lats, dtype=np.float64))
+        self._lon = np.radians(np.asarray(lons, dtype=np.float64))
+        self._cos_lat = np.cos(self._lat)
+
+    def __len__(self) -> int:
+        return self._lat.size
+
+    def distances_km(self, lats, lons) -> np.ndarray:
+        """Matriz (pontos consultados, pontos fixos) das distâncias."""
+        lat = np.radians(np.asarray(lats, dtype=np.float64)).reshape(-1, 1)
+        lon = np.radians(np.asarray(lons, dtype=np.float64)).reshape(-1, 1)
+        a = (np.sin((self._lat - lat) / 2) ** 2
+             + np.cos(lat) * self._cos_lat * np.sin((self._lon - lon) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, lats, lons) -> Tuple[np.ndarray, np.ndarray]:
+        """Índice do ponto fixo mais próximo de cada ponto consultado e a distância até ele."""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        chunk_rows = max(1, NEAREST_CHUNK_CELLS // max(1, len(self)))
+        indices = np.empty(lats.size, dtype=np.int64)
+        distances = np.empty(lats.size, dtype=np.float64)
+        for start in range(0, lats.size, chunk_rows):
+            block = self.distances_km(lats[start:start + chunk_rows], lons[start:start + chunk_rows])
+            best = block.argmin(axis=1)
+            indices[start:start + chunk_rows] = best
+            distances[start:start + chunk_rows] = block[np.arange(best.size), best]
+        return indices, distances
@@ -0,0 +1,430 @@
+"""
+Importação do GTFS estático (paradas, linhas e traçados)
+Catálogo em arrays NumPy, com snapshot binário mapeado em memória
+
+DESTINATIONS em config_simple é uma lista escrita à mão. Com
+GTFS_CONFIG['feed_zip'] (um .zip do GTFS), stops.txt, routes.txt, trips.txt,
+shapes.txt e stop_times.txt viram arrays compactos:
+
+- paradas: ids, nomes, coordenadas (n x 2) e location_type;
+- traçados: pontos de todos os shapes em um array só (m x 2), com o início
+  de cada shape em shape_offsets (shape i = points[offsets[i]:offsets[i+1]]);
+- padrões de parada: para cada linha e sentido (route_id, direction_id), a
+  viagem com mais paradas, com a sequência de paradas e os horários de
+  chegada e saída em segundos desde a saída da primeira parada (-1 sem
+  horário), no mesmo formato de offsets.
+
+stop_times.txt é lido duas vezes: a primeira conta as paradas de cada
+viagem, a segunda guarda só as viagens escolhidas.
+
+O resultado é gravado em <snapshot_dir>/<nome do zip>/ como um .npy por
+array e um manifest.json com o tamanho e o mtime do zip. Na próxima
+inicialização, com o zip igual, os arrays são abertos com np.load(mmap_mode='r')
+em milissegundos (as páginas são compartilhadas entre os workers) em vez de
+reprocessar os CSVs. O snapshot novo é escrito em um diretório temporário e
+trocado de uma vez.
+
+O catálogo alimenta o índice de paradas (api/stop_index.py) e o ETA pelo
+itinerário (api/route_engine.py).
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config_simple import GTFS_CONFIG
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Muda quando o formato do snapshot muda (snapshots antigos são refeitos)
+SNAPSHOT_VERSION = 1
+
+ARRAY_NAMES = (
+    'stop_ids', 'stop_names', 'stop_coords', 'stop_types',
+    'route_ids', 'route_short_names', 'route_long_names',
+    'shape_ids', 'shape_offsets', 'shape_points',
+    'pattern_routes', 'pattern_directions', 'pattern_shapes', 'pattern_trips',
+    'pattern_offsets', 'pattern_stops', 'pattern_arrivals', 'pattern_departures'
+)
+
+# location_type acima disso (entradas, nós, áreas de embarque) não entra no catálogo
+MAX_CATALOGUE_LOCATION_TYPE = 1
+
+def parse_gtfs_time(value: str) -> int:
+    """HH:MM:SS do GTFS em segundos (pode passar de 24h); -1 se vazio."""
+    if not value:
+        return -1
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def _text_array(values: List[str]) -> np.ndarray:
+    # Unicode de largura fixa: mapeável sem pickle
+    return np.array(values, dtype=f"U{max((len(v) for v in values), default=1) or 1}")
+
+class GTFSFeed:
+    """Arrays do GTFS (somente leitura; podem estar mapeados do snapshot)."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], source: str = None,
+                 loaded_from: str = 'feed', load_ms: float = None):
+        missing = [name for name in ARRAY_NAMES if name not in arrays]
+        if missing:
+            raise ValueError(f"GTFS sem os arrays {missing}")
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.source = source
+        self.loaded_from = loaded_from
+        self.load_ms = load_ms
+        self.loaded_at = datetime.now()
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            'stops': len(self.stop_ids),
+            'routes': len(self.route_ids),
+            'shapes': len(self.shape_ids),
+            'shape_points': len(self.shape_points),
+            'patterns': len(self.pattern_routes)
+        }
+
+    def shape(self, index: int) -> np.ndarray:
+        """Pontos (latitude, longitude) do shape."""
+        return self.shape_points[self.shape_offsets[index]:self.shape_offsets[index + 1]]
+
+    def line_code(self, route_index: int) -> str:
+        """Código da linha como os ônibus enviam: route_short_name ou route_id."""
+        return str(self.route_short_names[route_index]) or str(self.route_ids[route_index])
+
+    def stops_catalogue(self) -> Dict[str, Dict[str, Any]]:
+        """Paradas e estações no formato de DESTINATIONS; location_type 1 vira terminal."""
+        catalogue = {}
+        coords = np.asarray(self.stop_coords).tolist()
+        for stop_id, name, (lat, lon), location_type in zip(
+                self.stop_ids.tolist(), self.stop_names.tolist(), coords, self.stop_types.tolist()):
+            if location_type > MAX_CATALOGUE_LOCATION_TYPE:
+                continue
+            catalogue[stop_id] = {
+                'name': name or stop_id,
+                'latitude': lat,
+                'longitude': lon,
+                'type': 'terminal' if location_type == 1 else 'parada'
+            }
+        return catalogue
+
+    def patterns(self) -> Iterator[Dict[str, Any]]:
+        """Padrões de parada: linha, sentido, traçado e paradas com horários relativos."""
+        for p in range(len(self.pattern_routes)):
+            start, end = int(self.pattern_offsets[p]), int(self.pattern_offsets[p + 1])
+            indexes = self.pattern_stops[start:end].tolist()
+            arrivals = self.pattern_arrivals[start:end].tolist()
+            departures = self.pattern_departures[start:end].tolist()
+            stops = []
+            for k, i in enumerate(indexes):
+                lat, lon = self.stop_coords[i].tolist()
+                stop = {'id': str(self.stop_ids[i]), 'name': str(self.stop_names[i]) or str(self.stop_ids[i]),
+                        'latitude': lat, 'longitude': lon}
+                if k > 0 and arrivals[k] >= 0 and departures[k - 1] >= 0:
+                    stop['travel_seconds'] = arrivals[k] - departures[k - 1]
+                stops.append(stop)
+            route = int(self.pattern_routes[p])
+            shape = int(self.pattern_shapes[p])
+            yield {
+                'route_id': str(self.route_ids[route]),
+                'line': self.line_code(route),
+                'name': str(self.route_long_names[route]) or None,
+                'direction': int(self.pattern_directions[p]),
+                'trip_id': str(self.pattern_trips[p]),
+                'shape': self.shape(shape) if shape >= 0 else None,
+                'stops': stops
+            }
+
+# ============================================================
+#                     LEITURA DO ZIP
+# ============================================================
+
+def _columns(feed: zipfile.ZipFile, name: str, columns: Tuple[str, ...],
+             required: bool = True) -> Iterator[List[str]]:
+    """Valores das colunas pedidas em cada linha do CSV ('' para coluna ausente)."""
+    try:
+        raw = feed.open(name)
+    except KeyError:
+        if required:
+            raise ValueError(f"GTFS sem {name}")
+        return
+    with io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader, [])]
+        # csv.reader em vez de DictReader: stop_times.txt tem milhões de linhas
+        positions = [header.index(column) if column in header else None for column in columns]
+        for row in reader:
+            if not row:
+                continue
+            yield [row[i].strip() if i is not None and i < len(row) else '' for i in positions]
+
+def parse_gtfs_zip(path: str) -> GTFSFeed:
+    """Lê os CSVs do zip e monta os arrays (linhas inválidas são ignoradas com aviso)."""
+    started = time.perf_counter()
+    with zipfile.ZipFile(path) as feed:
+        # Paradas
+        stop_ids, stop_names, stop_coords, stop_types = [], [], [], []
+        for row in _columns(feed, 'stops.txt', ('stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'location_type')):
+            stop_id, stop_name, lat, lon, location_type = row
+            try:
+                coords = (float(lat), float(lon))
+                location_type = int(location_type or 0)
+            except ValueError:
+                logger.warning(f"Parada ignorada no GTFS: {row}")
+                continue
+            stop_ids.append(stop_id)
+            stop_names.append(stop_name)
+            stop_coords.append(coords)
+            stop_types.append(location_type)
+        stop_position = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+
+        # Linhas
+        route_ids, short_names, long_names = [], [], []
+        for route_id, short_name, long_name in _columns(
+                feed, 'routes.txt', ('route_id', 'route_short_name', 'route_long_name')):
+            route_ids.append(route_id)
+            short_names.append(short_name)
+            long_names.append(long_name)
+        route_position = {route_id: i for i, route_id in enumerate(route_ids)}
+
+        # Traçados, ordenados por shape_pt_sequence
+        shape_rows = defaultdict(list)
+        for row in _columns(feed, 'shapes.txt', ('shape_id', 'shape_pt_sequence', 'shape_pt_lat', 'shape_pt_lon'),
+                            required=False):
+            try:
+                shape_rows[row[0]].append((int(row[1]), float(row[2]), float(row[3])))
+            except ValueError:
+                logger.warning(f"Ponto de traçado ignorado no GTFS: {row}")
+        shape_ids = sorted(shape_rows)
+        shape_position = {shape_id: i for i, shape_id in enumerate(shape_ids)}
+        shape_offsets = [0]
+        shape_points = []
+        for shape_id in shape_ids:
+            points = sorted(shape_rows.pop(shape_id))
+            shape_points.extend((lat, lon) for _, lat, lon in points)
+            shape_offsets.append(len(shape_points))
+
+        # Viagens: linha, sentido e traçado
+        trips = {}
+        for trip_id, route_id, direction, shape_id in _columns(
+                feed, 'trips.txt', ('trip_id', 'route_id', 'direction_id', 'shape_id')):
+            route = route_position.get(route_id)
+            if route is None:
+                continue
+            trips[trip_id] = (route, int(direction or 0), shape_position.get(shape_id, -1))
+
+        # 1ª passada em stop_times: a viagem com mais paradas de cada linha e sentido
+        stop_counts = defaultdict(int)
+        for (trip_id,) in _columns(feed, 'stop_times.txt', ('trip_id',)):
+            stop_counts[trip_id] += 1
+        chosen: Dict[Tuple[int, int], str] = {}
+        for trip_id in sorted(stop_counts):
+            if trip_id not in trips:
+                continue
+            route, direction, _ = trips[trip_id]
+            current = chosen.get((route, direction))
+            if current is None or stop_counts[trip_id] > stop_counts[current]:
+                chosen[(route, direction)] = trip_id
+
+        # 2ª passada: só as viagens escolhidas
+        chosen_trips = set(chosen.values())
+        trip_rows = defaultdict(list)
+        for row in _columns(feed, 'stop_times.txt',
+                            ('trip_id', 'stop_sequence', 'stop_id', 'arrival_time', 'departure_time')):
+            if row[0] not in chosen_trips:
+                continue
+            stop = stop_position.get(row[2])
+            try:
+                if stop is None:
+                    raise ValueError('parada desconhecida')
+                trip_rows[row[0]].append((int(row[1]), stop, parse_gtfs_time(row[3]), parse_gtfs_time(row[4])))
+            except ValueError:
+                logger.warning(f"Horário ignorado no GTFS: {row}")
+
+    pattern_routes, pattern_directions, pattern_shapes, pattern_trips = [], [], [], []
+    pattern_offsets, pattern_stops, pattern_arrivals, pattern_departures = [0], [], [], []
+    for (route, direction), trip_id in sorted(chosen.items()):
+        rows = sorted(trip_rows.get(trip_id, []))
+        if len(rows) < 2:
+            continue
+        # Horários relativos à saída da primeira parada
+        origin = rows[0][3] if rows[0][3] >= 0 else rows[0][2]
+        for _, stop, arrival, departure in rows:
+            pattern_stops.append(stop)
+            pattern_arrivals.append(arrival - origin if arrival >= 0 and origin >= 0 else -1)
+            pattern_departures.append(departure - origin if departure >= 0 and origin >= 0 else -1)
+        pattern_offsets.append(len(pattern_stops))
+        pattern_routes.append(route)
+        pattern_directions.append(direction)
+        pattern_shapes.append(trips[trip_id][2])
+        pattern_trips.append(trip_id)
+
+    arrays = {
+        'stop_ids': _text_array(stop_ids),
+        'stop_names': _text_array(stop_names),
+        'stop_coords': np.asarray(stop_coords, dtype=np.float64).reshape(-1, 2),
+        'stop_types': np.asarray(stop_types, dtype=np.int8),
+        'route_ids': _text_array(route_ids),
+        'route_short_names': _text_array(short_names),
+        'route_long_names': _text_array(long_names),
+        'shape_ids': _text_array(shape_ids),
+        'shape_offsets': np.asarray(shape_offsets, dtype=np.int64),
+        'shape_points': np.asarray(shape_points, dtype=np.float64).reshape(-1, 2),
+        'pattern_routes': np.asarray(pattern_routes, dtype=np.int32),
+        'pattern_directions': np.asarray(pattern_directions, dtype=np.int8),
+        'pattern_shapes': np.asarray(pattern_shapes, dtype=np.int32),
+        'pattern_trips': _text_array(pattern_trips),
+        'pattern_offsets': np.asarray(pattern_offsets, dtype=np.int64),
+        'pattern_stops': np.asarray(pattern_stops, dtype=np.int32),
+        'pattern_arrivals': np.asarray(pattern_arrivals, dtype=np.int32),
+        'pattern_departures': np.asarray(pattern_departures, dtype=np.int32)
+    }
+    load_ms = (time.perf_counter() - started) * 1000
+    return GTFSFeed(arrays, source=path, loaded_from='feed', load_ms=load_ms)
+
+# ============================================================
+#                    SNAPSHOT BINÁRIO
+# ============================================================
+
+def _source_stat(path: str) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def snapshot_path(feed_zip: str, snapshot_dir: str = None) -> str:
+    snapshot_dir = snapshot_dir or GTFS_CONFIG['snapshot_dir']
+    return os.path.join(snapshot_dir, os.path.splitext(os.path.basename(feed_zip))[0])
+
+def save_snapshot(feed: GTFSFeed, directory: str, source_stat: Dict[str, Any]):
+    """Grava os arrays (.npy) e o manifesto em um diretório temporário e troca de uma vez."""
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        for name, array in feed.arrays().items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+        manifest = dict(source_stat, version=SNAPSHOT_VERSION, built_at=datetime.now().isoformat(),
+                        counts=feed.counts())
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+        # Arquivos já mapeados do snapshot antigo continuam válidos depois da remoção
+        old_dir = f"{directory}.old-{os.getpid()}"
+        if os.path.exists(directory):
+            os.rename(directory, old_dir)
+        os.rename(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+def load_snapshot(directory: str, source_stat: Dict[str, Any] = None,
+                  mmap: bool = True) -> Optional[GTFSFeed]:
+    """Snapshot do diretório; None se não existe, é de outra versão ou de outro zip."""
+    started = time.perf_counter()
+    try:
+        with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return None
+    if source_stat and any(manifest.get(key) != value for key, value in source_stat.items()):
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"),
+                                mmap_mode='r' if mmap else None, allow_pickle=False)
+                  for name in ARRAY_NAMES}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Snapshot do GTFS inválido ({directory}): {e}")
+        return None
+    load_ms = (time.perf_counter() - started) * 1000
+    return GTFSFeed(arrays, source=manifest.get('source'), loaded_from='snapshot', load_ms=load_ms)
+
+def load_gtfs(feed_zip: str, snapshot_dir: str = None, mmap: bool = None) -> GTFSFeed:
+    """
+    Catálogo do zip, pelo snapshot quando está em dia
+
+    Sem snapshot válido, lê os CSVs e grava o snapshot; se a gravação falhar
+    (diretório sem permissão), segue com os arrays em memória.
+    """
+    mmap = GTFS_CONFIG['mmap'] if mmap is None else mmap
+    source_stat = _source_stat(feed_zip)
+    directory = snapshot_path(feed_zip, snapshot_dir)
+    feed = load_snapshot(directory, source_stat, mmap)
+    if feed is not None:
+        logger.info(f"GTFS mapeado do snapshot em {feed.load_ms:.1f} ms: {feed.counts()}")
+        return feed
+
+    feed = parse_gtfs_zip(feed_zip)
+    logger.info(f"GTFS lido de {feed_zip} em {feed.load_ms:.0f} ms: {feed.counts()}")
+    try:
+        save_snapshot(feed, directory, source_stat)
+    except OSError as e:
+        logger.warning(f"Snapshot do GTFS não gravado em {directory}: {e}")
+    return feed
+
+# ============================================================
+#                     CATÁLOGO GLOBAL
+# ============================================================
+
+_gtfs_feed: Optional[GTFSFeed] = None
+_feed_stat: Optional[Dict[str, Any]] = None
+_load_lock = threading.Lock()
+
+def gtfs_feed_signature() -> Optional[Tuple[int, int]]:
+    """(tamanho, mtime) do zip configurado; None sem GTFS ou sem arquivo."""
+    feed_zip = GTFS_CONFIG['feed_zip']
+    try:
+        stat = os.stat(feed_zip) if feed_zip else None
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns) if stat else None
+
+def get_gtfs_feed() -> Optional[GTFSFeed]:
+    """Catálogo do zip configurado (recarregado quando o zip muda); None sem GTFS."""
+    global _gtfs_feed, _feed_stat
+    feed_zip = GTFS_CONFIG['feed_zip']
+    if not feed_zip:
+        return None
+    with _load_lock:
+        try:
+            stat = _source_stat(feed_zip)
+        except OSError:
+            logger.warning(f"GTFS não encontrado: {feed_zip}")
+            return None
+        if _gtfs_feed is None or stat != _feed_stat:
+            try:
+                _gtfs_feed, _feed_stat = load_gtfs(feed_zip), stat
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                logger.error(f"Erro ao importar o GTFS {feed_zip}: {e}")
+                return _gtfs_feed
+        return _gtfs_feed
+
+def get_gtfs_feed_status() -> Dict[str, Any]:
+    feed = _gtfs_feed
+    return {
+        'feed_zip': GTFS_CONFIG['feed_zip'] or None,
+        'snapshot_dir': GTFS_CONFIG['snapshot_dir'],
+        'loaded_from': feed.loaded_from if feed else None,
+        'load_ms': round(feed.load_ms, 1) if feed and feed.load_ms is not None else None,
+        'loaded_at': feed.loaded_at.isoformat() if feed else None,
+        **(feed.counts() if feed else {})
+    }
@@ -0,0 +1,379 @@
+"""
+Feeds GTFS-Realtime (posições dos veículos e previsões de chegada)
+Codificados uma vez por tick e servidos de um buffer pronto, com ETag
+
+Aplicativos de passageiros e portais de dados abertos consultariam os
+endpoints JSON a todo momento. Os feeds /gtfs-rt/vehicle_positions e
+/gtfs-rt/trip_updates (api/gtfs_rt_api.py) são montados a cada
+GTFS_RT_CONFIG['tick_seconds'] a partir do estado mais recente da frota:
+
+- posição mais recente de cada ônibus identificado (device_id) nos últimos
+  max_age_minutes (banco, quando disponível, mais as posições em memória da
+  compressão de trajetória); leituras sem device_id não dizem qual ônibus
+  as enviou e ficam fora dos feeds;
+- ETA de cada parada adiante pelo itinerário (api/route_engine.py) ou, para
+  linhas sem itinerário, até a parada mais próxima (estimate_fleet_etas).
+
+Cada feed é codificado em protobuf (FeedMessage do gtfs-realtime.proto) e
+guardado com uma ETag calculada sobre as entidades; se nada mudou desde o
+tick anterior, o buffer e a ETag anteriores continuam valendo (respostas 304
+para quem manda If-None-Match). Qualquer número de consultas custa uma
+codificação por tick.
+
+A codificação escreve direto o formato binário do protobuf (varint, fixed32
+e mensagens aninhadas) só para os campos usados, sem depender dos bindings
+gerados (gtfs-realtime-bindings). A viagem (TripDescriptor) vai sem trip_id,
+como route_id, direction_id, start_time e start_date: a route_id do GTFS
+importado, o sentido escolhido pelo itinerário (api/route_engine.py) e o
+início estimado pela leitura menos o tempo desde a primeira parada nos
+horários do padrão. Sem sentido conhecido (linha fora do GTFS ou sentido
+ambíguo), a posição sai sem viagem e o veículo não tem TripUpdate. As
+paradas vão pelo stop_id.
+
+Por processo: cada worker tem seu buffer, atualizado por uma thread
+(iniciada em main.initialize_services) ou, sem ela, na primeira consulta
+depois do tick.
+"""
+
+import hashlib
+import logging
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from config_simple import GTFS_RT_CONFIG
+from database.simple_connection import get_simple_bus_repository
+from api.dashboard_api import estimate_fleet_etas
+from api.gtfs_feed import get_gtfs_feed
+from api.route_engine import ROUTE_ENGINE_CONFIG, get_route_engine
+from api.trajectory import bus_key_for, merge_latest_positions
+from api.utils import get_traffic_factor_by_hour
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+GTFS_RT_VERSION = '2.0'
+VEHICLE_POSITIONS = 'vehicle_positions'
+TRIP_UPDATES = 'trip_updates'
+FEEDS = (VEHICLE_POSITIONS, TRIP_UPDATES)
+
+# Enums do gtfs-realtime.proto
+FULL_DATASET = 0
+IN_TRANSIT_TO = 2
+
+# ============================================================
+#                 CODIFICAÇÃO PROTOBUF
+# ============================================================
+
+def _varint(value: int) -> bytes:
+    # int64 negativo: complemento de dois em 64 bits
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def pb_varint(field: int, value: int) -> bytes:
+    """uint32/uint64/int32/int64/enum (tipo 0)."""
+    return _varint(field << 3) + _varint(int(value))
+
+def pb_float(field: int, value: float) -> bytes:
+    """float (tipo 5, fixed32)."""
+    return _varint((field << 3) | 5) + struct.pack('<f', value)
+
+def pb_bytes(field: int, payload: bytes) -> bytes:
+    """string ou mensagem aninhada (tipo 2, com o tamanho antes)."""
+    return _varint((field << 3) | 2) + _varint(len(payload)) + payload
+
+def pb_string(field: int, text: str) -> bytes:
+    return pb_bytes(field, str(text).encode('utf-8'))
+
+def encode_trip(trip: Dict[str, Any]) -> bytes:
+    """TripDescriptor: start_time (2), start_date (3), route_id (5), direction_id (6)."""
+    return (pb_string(2, trip['start_time']) + pb_string(3, trip['start_date'])
+            + pb_string(5, trip['route_id']) + pb_varint(6, trip['direction_id']))
+
+def encode_vehicle_descriptor(vehicle_id: str, label: str) -> bytes:
+    """VehicleDescriptor: id (1), label (2)."""
+    return pb_string(1, vehicle_id) + pb_string(2, label)
+
+def encode_vehicle_position(vehicle: Dict[str, Any]) -> bytes:
+    """VehiclePosition: trip (1), position (2), current_status (4), timestamp (5), stop_id (7), vehicle (8)."""
+    position = pb_float(1, vehicle['latitude']) + pb_float(2, vehicle['longitude'])
+    payload = pb_bytes(1, encode_trip(vehicle['trip'])) if vehicle['trip'] else b''
+    payload += pb_bytes(2, position)
+    if vehicle['stops']:
+        payload += pb_varint(4, IN_TRANSIT_TO)
+    payload += pb_varint(5, vehicle['timestamp'])
+    if vehicle['stops']:
+        payload += pb_string(7, vehicle['stops'][0]['stop_id'])
+    return payload + pb_bytes(8, encode_vehicle_descriptor(vehicle['vehicle_id'], vehicle['label']))
+
+def encode_trip_update(vehicle: Dict[str, Any]) -> bytes:
+    """TripUpdate: trip (1), stop_time_update (2), vehicle (3), timestamp (4)."""
+    payload = pb_bytes(1, encode_trip(vehicle['trip']))
+    for stop in vehicle['stops']:
+        # StopTimeUpdate: arrival (2) = StopTimeEvent time (2), uncertainty (3); stop_id (4)
+        arrival = pb_varint(2, stop['arrival_time'])
+        if stop.get('uncertainty') is not None:
+            arrival += pb_varint(3, stop['uncertainty'])
+        payload += pb_bytes(2, pb_bytes(2, arrival) + pb_string(4, stop['stop_id']))
+    payload += pb_bytes(3, encode_vehicle_descriptor(vehicle['vehicle_id'], vehicle['label']))
+    return payload + pb_varint(4, vehicle['timestamp'])
+
+def encode_feed(entities: List[bytes], timestamp: int) -> bytes:
+    """FeedMessage: header (1) com versão, incrementality e timestamp; entity (2) repetido."""
+    header = pb_string(1, GTFS_RT_VERSION) + pb_varint(2, FULL_DATASET) + pb_varint(3, timestamp)
+    return pb_bytes(1, header) + b''.join(pb_bytes(2, entity) for entity in entities)
+
+def encode_entity(entity_id: str, field: int, payload: bytes) -> bytes:
+    """FeedEntity: id (1) e trip_update (3) ou vehicle (4)."""
+    return pb_string(1, entity_id) + pb_bytes(field, payload)
+
+# ============================================================
+#                     ESTADO DA FROTA
+# ============================================================
+
+def latest_locations(minutes: int) -> List[Dict[str, Any]]:
+    """Leitura mais recente de cada dispositivo no banco (se disponível) mais as posições em memória."""
+    bus_repo = get_simple_bus_repository()
+    locations = []
+    if bus_repo:
+        try:
+            locations = bus_repo.get_latest_device_locations(minutes=minutes)
+        except Exception as e:
+            logger.warning(f"Erro ao consultar localizações para o GTFS-RT: {e}")
+    return merge_latest_positions(locations, minutes=minutes)
+
+def _route_ids() -> Dict[str, str]:
+    """Código da linha -> route_id do GTFS importado."""
+    feed = get_gtfs_feed()
+    if feed is None:
+        return {}
+    return {feed.line_code(i): str(route_id) for i, route_id in enumerate(feed.route_ids.tolist())}
+
+def trip_descriptor(route_id: str, direction: Optional[int], fix_time: datetime,
+                    elapsed_seconds: float) -> Optional[Dict[str, Any]]:
+    """
+    Viagem em andamento sem trip_id: route_id, direction_id e início estimado
+    (start_time HH:MM:SS e start_date AAAAMMDD) pelos horários do padrão
+
+    Returns:
+        None sem sentido conhecido (a viagem não pode ser identificada)
+    """
+    if direction is None:
+        return None
+    start = fix_time - timedelta(seconds=max(float(elapsed_seconds), 0.0))
+    return {
+        'route_id': route_id,
+        'direction_id': int(direction),
+        'start_time': start.strftime('%H:%M:%S'),
+        'start_date': start.strftime('%Y%m%d')
+    }
+
+def build_vehicle_states(locations: List[Dict[str, Any]], now: float = None) -> List[Dict[str, Any]]:
+    """
+    Um veículo por dispositivo (posição mais recente) com as previsões das paradas adiante
+
+    Returns:
+        vehicle_id (device_id), label (linha), route_id, trip (trip_descriptor
+        ou None), latitude, longitude, timestamp (epoch) e stops (stop_id,
+        arrival_time em epoch, uncertainty em segundos); a chegada conta a
+        partir da leitura GPS, então o feed só muda com leituras novas
+    """
+    now = now if now is not None else time.time()
+    latest = {}
+    for location in locations:
+        device_id = location.get('device_id')
+        if not device_id or not location.get('bus_line'):
+            continue
+        if device_id not in latest or location['timestamp_location'] > latest[device_id]['timestamp_location']:
+            latest[device_id] = location
+    if not latest:
+        return []
+
+    route_ids = _route_ids()
+    traffic_factor = get_traffic_factor_by_hour(datetime.now().hour)
+    engine = get_route_engine() if ROUTE_ENGINE_CONFIG['enabled'] else None
+
+    vehicles = []
+    nearest_pending = []
+    for device_id in sorted(latest):
+        location = latest[device_id]
+        line = location['bus_line']
+        latitude, longitude = float(location['latitude']), float(location['longitude'])
+        timestamp = location['timestamp_location']
+        vehicle = {
+            'vehicle_id': str(device_id),
+            'label': line,
+            'route_id': route_ids.get(line, line),
+            'trip': None,
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': int(timestamp.timestamp() if isinstance(timestamp, datetime) else now),
+            'stops': []
+        }
+        result = engine.etas(line, latitude, longitude, traffic_factor, bus_key_for(location)) if engine else None
+        if result:
+            vehicle['trip'] = trip_descriptor(vehicle['route_id'], result['direction'],
+                                              datetime.fromtimestamp(vehicle['timestamp']),
+                                              result['elapsed_seconds'])
+            vehicle['stops'] = [{
+                'stop_id': stop['id'],
+                'arrival_time': int(vehicle['timestamp'] + stop['eta_minutes'] * 60),
+                'uncertainty': None
+            } for stop in result['stops']]
+        else:
+            nearest_pending.append((vehicle, location))
+        vehicles.append(vehicle)
+
+    # Ônibus de linhas sem itinerário: parada mais próxima, em lote
+    if nearest_pending:
+        etas = estimate_fleet_etas([location for _, location in nearest_pending])
+        for (vehicle, _), eta in zip(nearest_pending, etas):
+            if eta:
+                vehicle['stops'] = [{
+                    'stop_id': eta['destination'],
+                    'arrival_time': int(vehicle['timestamp'] + eta['minutes'] * 60),
+                    # Incerteza proporcional à confiança (100% -> 0 s)
+                    'uncertainty': int(eta['minutes'] * 60 * (100 - eta['confidence']) / 100)
+                }]
+    return vehicles
+
+# ============================================================
+#                  PUBLICAÇÃO POR TICK
+# ============================================================
+
+class FeedBuffer:
+    """Feed codificado pronto para servir."""
+
+    __slots__ = ('payload', 'etag', 'entities', 'timestamp')
+
+    def __init__(self, payload: bytes, etag: str, entities: int, timestamp: int):
+        self.payload = payload
+        self.etag = etag
+        self.entities = entities
+        self.timestamp = timestamp
+
+class GTFSRealtimePublisher:
+    """Monta e codifica os feeds a cada tick; as consultas só leem o buffer."""
+
+    def __init__(self, tick_seconds: float, max_age_minutes: int,
+                 source: Callable[[int], List[Dict[str, Any]]] = None):
+        self.tick_seconds = tick_seconds
+        self.max_age_minutes = max_age_minutes
+        self.source = source or latest_locations
+        self._buffers: Dict[str, FeedBuffer] = {}
+        self._refreshed_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.ticks = 0
+        self.encodes = 0
+        self.errors = 0
+        self.last_tick_ms: Optional[float] = None
+        self.last_refresh: Optional[datetime] = None
+
+    def refresh(self):
+        """Um tick: lê o estado da frota e recodifica os feeds que mudaram."""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        started = time.perf_counter()
+        now = time.time()
+        try:
+            vehicles = build_vehicle_states(self.source(self.max_age_minutes), now)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Erro ao montar os feeds GTFS-RT: {e}")
+            vehicles = None
+        if vehicles is None:
+            # Mantém o último feed; sem nenhum, serve um feed vazio
+            entities = {name: [] for name in FEEDS if name not in self._buffers}
+        else:
+            entities = {
+                VEHICLE_POSITIONS: [encode_entity(f"vehicle-{v['vehicle_id']}", 4, encode_vehicle_position(v))
+                                    for v in vehicles],
+                # TripUpdate só para viagens identificáveis (trip_descriptor)
+                TRIP_UPDATES: [encode_entity(f"trip-{v['vehicle_id']}", 3, encode_trip_update(v))
+                               for v in vehicles if v['stops'] and v['trip']]
+            }
+        for name, feed_entities in entities.items():
+            digest = hashlib.sha1(b''.join(feed_entities)).hexdigest()[:16]
+            current = self._buffers.get(name)
+            if current is not None and current.etag == digest:
+                continue
+            self._buffers[name] = FeedBuffer(encode_feed(feed_entities, int(now)), digest,
+                                             len(feed_entities), int(now))
+            self.encodes += 1
+        self.ticks += 1
+        self._refreshed_at = time.monotonic()
+        self.last_tick_ms = (time.perf_counter() - started) * 1000
+        self.last_refresh = datetime.now()
+
+    def _stale(self, name: str) -> bool:
+        return name not in self._buffers or time.monotonic() - self._refreshed_at >= self.tick_seconds
+
+    def get(self, name: str) -> FeedBuffer:
+        """Buffer do feed; sem a thread, refaz na primeira consulta depois do tick."""
+        if name not in FEEDS:
+            raise KeyError(name)
+        running = self._thread is not None and self._thread.is_alive()
+        if name not in self._buffers or (not running and self._stale(name)):
+            with self._refresh_lock:
+                # Com várias consultas ao mesmo tempo, só a primeira recodifica
+                if self._stale(name):
+                    self._refresh()
+        return self._buffers[name]
+
+    def start(self):
+        """Inicia a thread de ticks (daemon)."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _run():
+            while True:
+                self.refresh()
+                if self._stop_event.wait(self.tick_seconds):
+                    break
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=_run, name='gtfs-rt-tick', daemon=True)
+        self._thread.start()
+        logger.info(f"Feeds GTFS-RT atualizados a cada {self.tick_seconds}s")
+
+    def stop(self):
+        """Interrompe a thread de ticks."""
+        self._stop_event.set()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'enabled': GTFS_RT_CONFIG['enabled'],
+            'tick_seconds': self.tick_seconds,
+            'ticker_running': self._thread is not None and self._thread.is_alive(),
+            'ticks': self.ticks,
+            'encodes': self.encodes,
+            'errors': self.errors,
+            'last_tick_ms': round(self.last_tick_ms, 2) if self.last_tick_ms is not None else None,
+            'last_refresh': self.last_refresh.isoformat() if self.last_refresh else None,
+            'feeds': {
+                name: {'entities': buffer.entities, 'bytes': len(buffer.payload), 'etag': buffer.etag}
+                for name, buffer in self._buffers.items()
+            }
+        }
+
+# Instância global do publicador
+gtfs_realtime_publisher = GTFSRealtimePublisher(GTFS_RT_CONFIG['tick_seconds'],
+                                                GTFS_RT_CONFIG['max_age_minutes'])
+
+def get_gtfs_realtime_publisher() -> GTFSRealtimePublisher:
+    """Retorna a instância global do publicador dos feeds GTFS-RT."""
+    return gtfs_realtime_publisher
+
+def get_gtfs_realtime_status() -> Dict[str, Any]:
+    return gtfs_realtime_publisher.get_status()
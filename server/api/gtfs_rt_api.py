@@ -0,0 +1,60 @@
+"""
+API dos feeds GTFS-Realtime
+Posições dos veículos e previsões de chegada em protobuf (api/gtfs_realtime.py)
+
+As respostas vêm do buffer codificado no último tick, com ETag: consultas
+com If-None-Match igual recebem 304 sem corpo.
+"""
+
+import logging
+from datetime import datetime, timezone
+from flask import request, jsonify, Blueprint, Response
+import os
+import sys
+
+# Adiciona o diretório server ao path para imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_simple import GTFS_RT_CONFIG
+from api.gtfs_feed import get_gtfs_feed_status
+from api.gtfs_realtime import (
+    TRIP_UPDATES, VEHICLE_POSITIONS, get_gtfs_realtime_publisher, get_gtfs_realtime_status
+)
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Cria blueprint para os feeds GTFS-RT
+gtfs_rt_bp = Blueprint('gtfs_rt', __name__)
+
+PROTOBUF_MIMETYPE = 'application/x-protobuf'
+
+def _feed_response(name: str):
+    if not GTFS_RT_CONFIG['enabled']:
+        return jsonify({'error': 'Feeds GTFS-RT desativados'}), 404
+    buffer = get_gtfs_realtime_publisher().get(name)
+    response = Response(buffer.payload, mimetype=PROTOBUF_MIMETYPE)
+    response.set_etag(buffer.etag)
+    response.last_modified = datetime.fromtimestamp(buffer.timestamp, timezone.utc)
+    response.cache_control.public = True
+    response.cache_control.max_age = int(GTFS_RT_CONFIG['tick_seconds'])
+    return response.make_conditional(request)
+
+@gtfs_rt_bp.route('/vehicle_positions', methods=['GET'])
+def vehicle_positions():
+    """Feed VehiclePosition: posição mais recente de cada linha."""
+    return _feed_response(VEHICLE_POSITIONS)
+
+@gtfs_rt_bp.route('/trip_updates', methods=['GET'])
+def trip_updates():
+    """Feed TripUpdate: previsão de chegada nas paradas adiante."""
+    return _feed_response(TRIP_UPDATES)
+
+@gtfs_rt_bp.route('/status', methods=['GET'])
+def gtfs_rt_status():
+    """Ticks, codificações e tamanho dos feeds, e o GTFS estático importado."""
+    return jsonify({
+        'timestamp': datetime.now().isoformat(),
+        'gtfs_realtime': get_gtfs_realtime_status(),
+        'gtfs_static': get_gtfs_feed_status()
+    }), 200
@@ -0,0 +1,229 @@
+"""
+Deduplicação de requisições repetidas pelos dispositivos (ESP32)
+
+O firmware repete o POST quando a resposta demora, e sem deduplicação cada
+repetição gravaria outra localização com ETA e intervalo. O dispositivo pode
+mandar uma chave de idempotência (cabeçalho Idempotency-Key ou campo
+'idempotency_key') ou um número de sequência ('device_id' + 'seq'). A chave
+vira a ingest_key da leitura, um UUID determinístico:
+
+- a resposta de sucesso fica em um cache LRU com TTL neste processo, e uma
+  repetição recebe a mesma resposta sem tocar no banco nem no detector;
+- uma repetição que chega enquanto a original ainda está em andamento espera
+  por ela em vez de processar de novo;
+- o índice único de ingest_key (migração 005) cobre repetições que caem em
+  outro worker ou chegam depois do TTL, e o reenvio do spool local usa a
+  mesma chave.
+
+Requisições sem chave seguem exatamente como antes.
+"""
+
+import functools
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from flask import request, g, make_response, Response
+
+from config_simple import IDEMPOTENCY_CONFIG
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Namespace fixo: a mesma chave gera sempre a mesma ingest_key, em qualquer processo
+INGEST_KEY_NAMESPACE = uuid.UUID('6f1c2a52-8d1e-4c3b-9a57-2f0e4b8d7c31')
+
+# Cabeçalho das respostas a uma leitura já recebida
+REPLAY_HEADER = 'Idempotent-Replay'
+
+def ingest_key_for(endpoint: str, data: Mapping[str, Any], headers: Mapping[str, str]) -> Optional[str]:
+    """
+    ingest_key (UUID) da requisição, ou None se o dispositivo não enviou chave
+
+    O endpoint entra no cálculo: a mesma sequência em /location e em
+    /location-image são leituras diferentes.
+    """
+    key = headers.get(IDEMPOTENCY_CONFIG['header']) or data.get('idempotency_key')
+    if key:
+        source = f"key:{key}"
+    elif data.get('device_id') is not None and data.get('seq') is not None:
+        source = f"seq:{data['device_id']}:{data['seq']}"
+    else:
+        return None
+    return str(uuid.uuid5(INGEST_KEY_NAMESPACE, f"{endpoint}|{source}"))
+
+# ============================================================
+#                 CACHE DE RESPOSTAS (LRU + TTL)
+# ============================================================
+
+class ResponseCache:
+    """
+    Respostas já enviadas, por ingest_key (corpo JSON já serializado)
+
+    LRU limitado por número de entradas e por bytes; entradas vencidas são
+    descartadas na leitura ou empurradas para fora pelas novas.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 600,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, Tuple[float, int, bytes]]' = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+
+    def _get(self, key: str) -> Optional[Tuple[int, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, status, body = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return status, body
+
+    def _remove(self, key: str):
+        _, _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def get(self, key: str) -> Optional[Tuple[int, bytes]]:
+        """(status, corpo) guardados para a chave, ou None."""
+        with self._lock:
+            cached = self._get(key)
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return cached
+
+    def put(self, key: str, status: int, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, status, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def acquire(self, key: str, wait_seconds: float = 0) -> Tuple[Optional[Tuple[int, bytes]], bool]:
+        """
+        Resposta guardada para a chave, ou a posse da chave para processá-la
+
+        Se outra requisição com a mesma chave está em andamento, espera por
+        ela (até wait_seconds) e usa a resposta dela.
+
+        Returns:
+            (resposta, dono): resposta guardada ou None; dono=True quando esta
+            requisição deve processar a chave e chamar release() ao final
+        """
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            with self._lock:
+                cached = self._get(key)
+                if cached:
+                    self.hits += 1
+                    return cached, False
+                event = self._inflight.get(key)
+                if event is None:
+                    self.misses += 1
+                    self._inflight[key] = threading.Event()
+                    return None, True
+
+            # Sem espera (ou a original demorou demais): processa sem a posse;
+            # o índice único no banco evita a gravação dupla
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, False
+            self.waits += 1
+            if not event.wait(remaining):
+                return None, False
+
+    def release(self, key: str, status: int = None, body: bytes = None):
+        """Guarda a resposta (se houver) e libera quem espera pela chave."""
+        if body is not None:
+            self.put(key, status, body)
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'in_flight': len(self._inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'evictions': self.evictions,
+                'ttl_seconds': self.ttl_seconds
+            }
+
+# ============================================================
+#                 INSTÂNCIA GLOBAL E DECORADOR
+# ============================================================
+
+# Um cache por processo (cada worker do gunicorn tem o seu)
+response_cache = ResponseCache(
+    IDEMPOTENCY_CONFIG['max_entries'],
+    IDEMPOTENCY_CONFIG['ttl_seconds'],
+    IDEMPOTENCY_CONFIG['max_bytes']
+)
+
+def get_response_cache() -> ResponseCache:
+    return response_cache
+
+def get_idempotency_status() -> Dict[str, Any]:
+    return response_cache.get_status()
+
+def idempotent(endpoint: str):
+    """
+    Decorador das rotas Flask de ingestão
+
+    Calcula a ingest_key (disponível na rota como g.ingest_key), responde às
+    repetições com a resposta guardada e guarda as respostas 200.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            ingest_key = ingest_key_for(endpoint, data if isinstance(data, dict) else {}, request.headers)
+            g.ingest_key = ingest_key
+            if not ingest_key:
+                return view(*args, **kwargs)
+
+            cached, owner = response_cache.acquire(ingest_key, IDEMPOTENCY_CONFIG['inflight_wait_seconds'])
+            if cached:
+                logger.info(f"Requisição repetida em {endpoint}: resposta guardada ({ingest_key})")
+                status, body = cached
+                return Response(body, status, mimetype='application/json',
+                                headers={REPLAY_HEADER: 'true'})
+
+            status, body = None, None
+            try:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    status, body = response.status_code, response.get_data()
+                return response
+            finally:
+                if owner:
+                    response_cache.release(ingest_key, status, body)
+                elif body is not None:
+                    response_cache.put(ingest_key, status, body)
+        return wrapper
+    return decorator
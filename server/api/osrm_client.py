@@ -0,0 +1,431 @@
+"""
+Cliente HTTP do OSRM
+Conexões reaproveitadas, novas tentativas com espera aleatória e prazo por chamada
+
+Cada requests.get abria uma conexão TCP nova por rota, e max_retries do
+OSRM_CONFIG não era usado. OSRMClient mantém uma requests.Session com pool
+de conexões keep-alive (pool_maxsize) e repete as falhas transitórias
+(conexão recusada, timeout, HTTP 429 e 5xx) até max_retries vezes, com
+espera aleatória entre 0 e min(backoff_max, backoff_base * 2^tentativa)
+("full jitter", para os clientes não repetirem todos juntos). Respostas do
+OSRM como NoRoute ou TooBig não são repetidas.
+
+Toda chamada tem um prazo (deadline_seconds): o timeout de cada tentativa é
+limitado ao tempo que resta, e não há nova tentativa se a espera não couber
+no prazo.
+
+AsyncOSRMClient faz o mesmo sobre httpx.AsyncClient (opcional) e dispara
+muitas rotas ao mesmo tempo (routes), limitadas por async_concurrency.
+
+Os dois passam pelo disjuntor do OSRM (api/circuit_breaker.py,
+OSRM_CIRCUIT_CONFIG): com o disjuntor aberto, get() levanta OSRMError na hora
+(circuit_open) e o chamador usa o cálculo manual.
+
+Os dois contam conexões abertas por requisição (taxa de reaproveitamento) e
+a latência de cada tentativa: osrm_client_metrics de /api/dashboard/metrics.
+Por processo.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config_simple import OSRM_CONFIG, OSRM_CIRCUIT_CONFIG, DESTINATIONS
+from api.circuit_breaker import CircuitBreaker
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Status HTTP que valem nova tentativa
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Só a rota mais rápida, sem geometria nem instruções
+ROUTE_PARAMS = {'overview': 'false', 'steps': 'false', 'alternatives': 'false'}
+
+# Latências guardadas para os percentis
+LATENCY_SAMPLES = 1000
+
+class OSRMError(Exception):
+    """Falha de uma chamada ao OSRM (depois das tentativas)."""
+
+    def __init__(self, message: str, retryable: bool = False, circuit_open: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.circuit_open = circuit_open
+
+def backoff_seconds(attempt: int, base: float, maximum: float) -> float:
+    """Espera antes da tentativa attempt + 1 ("full jitter")."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+def route_path(profile: str, coordinates: List[Tuple[float, float]]) -> str:
+    """Caminho /route do OSRM para (latitude, longitude); o OSRM recebe longitude,latitude."""
+    return f"/route/v1/{profile}/" + ';'.join(f"{lon},{lat}" for lat, lon in coordinates)
+
+def make_breaker(server_url: str, probe=None) -> Optional[CircuitBreaker]:
+    """Disjuntor de um servidor OSRM com OSRM_CIRCUIT_CONFIG (None se desativado)."""
+    if not OSRM_CIRCUIT_CONFIG['enabled']:
+        return None
+    return CircuitBreaker(
+        f"osrm:{server_url}",
+        OSRM_CIRCUIT_CONFIG['window_seconds'],
+        OSRM_CIRCUIT_CONFIG['min_calls'],
+        OSRM_CIRCUIT_CONFIG['error_rate_threshold'],
+        OSRM_CIRCUIT_CONFIG['slow_call_ms'],
+        OSRM_CIRCUIT_CONFIG['slow_rate_threshold'],
+        OSRM_CIRCUIT_CONFIG['open_seconds'],
+        OSRM_CIRCUIT_CONFIG['half_open_max_calls'],
+        probe
+    )
+
+def _admit(breaker: Optional[CircuitBreaker], stats: 'ClientStats', server_url: str):
+    """Levanta OSRMError (circuit_open) se o disjuntor não deixar a tentativa passar."""
+    if breaker is not None and not breaker.allow():
+        stats.record_call(False, short_circuited=True)
+        raise OSRMError(f"Disjuntor do OSRM aberto ({server_url})", circuit_open=True)
+
+def _interrupted() -> OSRMError:
+    """
+    Resultado de uma tentativa até ela terminar: se for cancelada (cliente
+    ASGI desconectou) ou levantar outra exceção, conta como falha no disjuntor,
+    senão a vaga de teste do meio-aberto nunca volta
+    """
+    return OSRMError("Tentativa interrompida", retryable=True)
+
+def _record(breaker: Optional[CircuitBreaker], error: Optional[OSRMError], seconds: float):
+    # Erros do OSRM (NoRoute, TooBig) mostram um servidor que responde
+    if breaker is not None:
+        breaker.record(error is None or not error.retryable, seconds)
+
+# ============================================================
+#                        MÉTRICAS
+# ============================================================
+
+class ClientStats:
+    """Requisições, tentativas, conexões abertas e latência por tentativa."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.attempts = 0
+        self.retries = 0
+        self.connections_opened = 0
+        self.deadline_exceeded = 0
+        self.short_circuited = 0
+        self._by_attempt: Dict[int, List[float]] = {}
+        self._latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+
+    def record_attempt(self, attempt: int, seconds: float, new_connections: int = 0):
+        with self._lock:
+            self.attempts += 1
+            if attempt > 1:
+                self.retries += 1
+            self.connections_opened += new_connections
+            count_total = self._by_attempt.setdefault(attempt, [0, 0.0])
+            count_total[0] += 1
+            count_total[1] += seconds
+            self._latencies.append(seconds)
+
+    def record_call(self, ok: bool, deadline_exceeded: bool = False, short_circuited: bool = False):
+        with self._lock:
+            self.calls += 1
+            if not ok:
+                self.failures += 1
+            if deadline_exceeded:
+                self.deadline_exceeded += 1
+            if short_circuited:
+                self.short_circuited += 1
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+            def percentile(q: float) -> Optional[float]:
+                if not latencies:
+                    return None
+                return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+
+            return {
+                'calls': self.calls,
+                'failures': self.failures,
+                'attempts': self.attempts,
+                'retries': self.retries,
+                'deadline_exceeded': self.deadline_exceeded,
+                'short_circuited': self.short_circuited,
+                'connections_opened': self.connections_opened,
+                'connection_reuse_ratio': (round(1 - self.connections_opened / self.attempts, 3)
+                                           if self.attempts else None),
+                'attempt_latency_ms': {
+                    'p50': percentile(0.50),
+                    'p95': percentile(0.95),
+                    'max': round(latencies[-1] * 1000, 1) if latencies else None
+                },
+                'by_attempt': {
+                    str(attempt): {'count': count, 'avg_ms': round(total / count * 1000, 1)}
+                    for attempt, (count, total) in sorted(self._by_attempt.items())
+                }
+            }
+
+# ============================================================
+#                    CLIENTE (SÍNCRONO)
+# ============================================================
+
+class OSRMClient:
+    """Chamadas GET ao OSRM por uma Session com pool keep-alive."""
+
+    def __init__(self, server_url: str = None, timeout_seconds: float = None,
+                 deadline_seconds: float = None, max_retries: int = None,
+                 pool_maxsize: int = None, circuit: bool = True):
+        self.server_url = (server_url or OSRM_CONFIG['server_url']).rstrip('/')
+        self.timeout_seconds = timeout_seconds or OSRM_CONFIG['timeout_seconds']
+        self.deadline_seconds = deadline_seconds or OSRM_CONFIG['deadline_seconds']
+        self.max_retries = OSRM_CONFIG['max_retries'] if max_retries is None else max_retries
+        self.backoff_base = OSRM_CONFIG['backoff_base_seconds']
+        self.backoff_max = OSRM_CONFIG['backoff_max_seconds']
+        self.stats = ClientStats()
+
+        # Novas tentativas ficam aqui, não no urllib3 (max_retries=0), para
+        # respeitar o prazo e contar cada tentativa
+        self._adapter = HTTPAdapter(pool_connections=1,
+                                    pool_maxsize=pool_maxsize or OSRM_CONFIG['pool_maxsize'],
+                                    max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        # Testado em segundo plano pelo _probe enquanto estiver aberto
+        self.breaker = make_breaker(self.server_url, self._probe) if circuit else None
+
+    def _probe(self) -> bool:
+        """Uma rota curta entre dois destinos, fora do disjuntor e das métricas."""
+        points = [(d['latitude'], d['longitude']) for d in list(DESTINATIONS.values())[:2]]
+        response = self.session.get(self.server_url + route_path(OSRM_CONFIG['profile'], points),
+                                    params=ROUTE_PARAMS, timeout=self.timeout_seconds)
+        return response.status_code == 200 and response.json().get('code') == 'Ok'
+
+    def _connections_opened(self) -> int:
+        """Conexões abertas até agora pelos pools do urllib3."""
+        pools = self._adapter.poolmanager.pools
+        return sum(getattr(pools.get(key), 'num_connections', 0) for key in pools.keys())
+
+    def get(self, path: str, params: Dict[str, Any] = None, timeout_seconds: float = None,
+            deadline_seconds: float = None) -> Dict[str, Any]:
+        """
+        GET em server_url + path com novas tentativas
+
+        Returns:
+            JSON da resposta (code == 'Ok')
+
+        Raises:
+            OSRMError: resposta de erro do OSRM, ou falhas até esgotar tentativas/prazo
+        """
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        url = self.server_url + path
+        attempt = 0
+        while True:
+            attempt += 1
+            _admit(self.breaker, self.stats, self.server_url)
+            remaining = deadline - time.monotonic()
+            opened_before = self._connections_opened()
+            started = time.perf_counter()
+            error = _interrupted()
+            try:
+                response = self.session.get(url, params=params, timeout=min(timeout_seconds, remaining))
+                data = _check_response(response.status_code, response.json)
+                error = None
+            except requests.exceptions.RequestException as e:
+                error = OSRMError(str(e), retryable=True)
+            except OSRMError as e:
+                error = e
+            finally:
+                seconds = time.perf_counter() - started
+                self.stats.record_attempt(attempt, seconds, self._connections_opened() - opened_before)
+                _record(self.breaker, error, seconds)
+
+            if error is None:
+                self.stats.record_call(True)
+                return data
+            if not error.retryable or attempt > self.max_retries:
+                self.stats.record_call(False)
+                raise error
+            wait = backoff_seconds(attempt - 1, self.backoff_base, self.backoff_max)
+            if time.monotonic() + wait >= deadline:
+                self.stats.record_call(False, deadline_exceeded=True)
+                raise OSRMError(f"Prazo esgotado após {attempt} tentativa(s): {error}")
+            logger.warning(f"OSRM: tentativa {attempt} falhou ({error}), nova tentativa em {wait:.2f}s")
+            time.sleep(wait)
+
+    def route(self, coordinates: List[Tuple[float, float]], profile: str = None,
+              params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Rota pelos pontos (latitude, longitude); levanta OSRMError."""
+        return self.get(route_path(profile or OSRM_CONFIG['profile'], coordinates),
+                        params or ROUTE_PARAMS)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'server_url': self.server_url,
+            **self.stats.get_status(),
+            'circuit': self.breaker.get_status() if self.breaker else {'enabled': False}
+        }
+
+    def close(self):
+        self.session.close()
+
+def _check_response(status_code: int, read_json) -> Dict[str, Any]:
+    """JSON de uma resposta do OSRM, ou OSRMError (repetível para 429 e 5xx)."""
+    if status_code in RETRY_STATUS:
+        raise OSRMError(f"HTTP {status_code}", retryable=True)
+    try:
+        data = read_json()
+    except ValueError:
+        raise OSRMError(f"HTTP {status_code}: resposta não é JSON")
+    if status_code != 200 or data.get('code') != 'Ok':
+        raise OSRMError(data.get('message') or data.get('code') or f"HTTP {status_code}")
+    return data
+
+# ============================================================
+#                   CLIENTE (ASSÍNCRONO)
+# ============================================================
+
+class AsyncOSRMClient:
+    """
+    Contraparte assíncrona de OSRMClient (httpx.AsyncClient)
+
+    Mesmas tentativas e prazo; routes() dispara várias rotas ao mesmo tempo,
+    no máximo concurrency em andamento.
+    """
+
+    def __init__(self, server_url: str = None, timeout_seconds: float = None,
+                 deadline_seconds: float = None, max_retries: int = None,
+                 max_connections: int = None, breaker: CircuitBreaker = None, circuit: bool = True):
+        if not HTTPX_AVAILABLE:
+            raise ImportError("httpx não instalado: pip install httpx")
+        self.server_url = (server_url or OSRM_CONFIG['server_url']).rstrip('/')
+        self.timeout_seconds = timeout_seconds or OSRM_CONFIG['timeout_seconds']
+        self.deadline_seconds = deadline_seconds or OSRM_CONFIG['deadline_seconds']
+        self.max_retries = OSRM_CONFIG['max_retries'] if max_retries is None else max_retries
+        self.backoff_base = OSRM_CONFIG['backoff_base_seconds']
+        self.backoff_max = OSRM_CONFIG['backoff_max_seconds']
+        self.stats = ClientStats()
+        max_connections = max_connections or OSRM_CONFIG['pool_maxsize']
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections))
+        # breaker: o de um OSRMClient do mesmo servidor (com o teste em segundo
+        # plano); senão um próprio, que volta a testar depois de open_seconds
+        if breaker is None and circuit:
+            breaker = make_breaker(self.server_url)
+        self.breaker = breaker
+
+    async def get(self, path: str, params: Dict[str, Any] = None, timeout_seconds: float = None,
+                  deadline_seconds: float = None) -> Dict[str, Any]:
+        """Como OSRMClient.get; levanta OSRMError."""
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        url = self.server_url + path
+        attempt = 0
+        while True:
+            attempt += 1
+            _admit(self.breaker, self.stats, self.server_url)
+            remaining = deadline - time.monotonic()
+            opened = []
+
+            async def trace(event: str, info: Dict[str, Any]):
+                # Evento do httpcore a cada conexão TCP nova
+                if event == 'connection.connect_tcp.complete':
+                    opened.append(event)
+
+            started = time.perf_counter()
+            error = _interrupted()
+            try:
+                response = await self.client.get(url, params=params, timeout=min(timeout_seconds, remaining),
+                                                 extensions={'trace': trace})
+                data = _check_response(response.status_code, response.json)
+                error = None
+            except httpx.HTTPError as e:
+                error = OSRMError(str(e) or type(e).__name__, retryable=True)
+            except OSRMError as e:
+                error = e
+            finally:
+                seconds = time.perf_counter() - started
+                self.stats.record_attempt(attempt, seconds, len(opened))
+                _record(self.breaker, error, seconds)
+
+            if error is None:
+                self.stats.record_call(True)
+                return data
+            if not error.retryable or attempt > self.max_retries:
+                self.stats.record_call(False)
+                raise error
+            wait = backoff_seconds(attempt - 1, self.backoff_base, self.backoff_max)
+            if time.monotonic() + wait >= deadline:
+                self.stats.record_call(False, deadline_exceeded=True)
+                raise OSRMError(f"Prazo esgotado após {attempt} tentativa(s): {error}")
+            logger.warning(f"OSRM: tentativa {attempt} falhou ({error}), nova tentativa em {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    async def route(self, coordinates: List[Tuple[float, float]], profile: str = None,
+                    params: Dict[str, Any] = None) -> Dict[str, Any]:
+        return await self.get(route_path(profile or OSRM_CONFIG['profile'], coordinates),
+                              params or ROUTE_PARAMS)
+
+    async def routes(self, pairs: List[Tuple[Tuple[float, float], Tuple[float, float]]],
+                     profile: str = None, concurrency: int = None) -> List[Dict[str, Any]]:
+        """
+        Rotas (origem, destino) em paralelo, na ordem de pairs
+
+        Returns:
+            Para cada par, distance_meters/duration_seconds com status 'success',
+            ou status 'error' e message
+        """
+        semaphore = asyncio.Semaphore(concurrency or OSRM_CONFIG['async_concurrency'])
+
+        async def one(start, end):
+            async with semaphore:
+                try:
+                    route = (await self.route([start, end], profile))['routes'][0]
+                    return {'status': 'success', 'distance_meters': route['distance'],
+                            'duration_seconds': route['duration']}
+                except OSRMError as e:
+                    return {'status': 'error', 'message': str(e)}
+
+        return await asyncio.gather(*(one(start, end) for start, end in pairs))
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'server_url': self.server_url,
+            **self.stats.get_status(),
+            'circuit': self.breaker.get_status() if self.breaker else {'enabled': False}
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+# ============================================================
+#                  INSTÂNCIA GLOBAL (POR PROCESSO)
+# ============================================================
+
+osrm_client = OSRMClient()
+
+def get_osrm_client() -> OSRMClient:
+    return osrm_client
+
+def get_osrm_client_status() -> Dict[str, Any]:
+    return osrm_client.get_status()
+
+def get_osrm_circuit_status() -> Dict[str, Any]:
+    if osrm_client.breaker is None:
+        return {'enabled': False}
+    return osrm_client.breaker.get_status()
@@ -17,7 +17,7 @@ import logging
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DATABASE_CONFIG, ETA_CONFIG, DESTINATIONS, INTERVAL_CONFIG, OSRM_CONFIG
+from config_simple import DATABASE_CONFIG, ETA_CONFIG, DESTINATIONS, INTERVAL_CONFIG, OSRM_CONFIG
 from api.utils import (
     validate_gps_coordinates, validate_bus_line, parse_timestamp,
     create_db_connection, log_api_request,
@@ -26,6 +26,9 @@ from api.utils import (
 from api.eta_osrm import (
     calculate_eta_with_osrm, get_traffic_factor_by_hour_osrm
 )
+from ml.delay_profile import get_delay_profile_cache
+from api.osrm_client import get_osrm_circuit_status
+from database import queries
 
 # Configuração de logging
 logger = logging.getLogger(__name__)
@@ -58,16 +61,17 @@ def save_location_data(bus_line: str, latitude: float, longitude: float,
         return None
 
 def save_eta_prediction(location_id: int, eta_data: Dict, db_connection):
-    """Salva previsão de ETA no banco"""
+    """
+    Salva previsão de ETA no banco (mesmo SQL do repositório: localização
+    inexistente é rejeitada pela chave estrangeira, não ignorada)
+    """
     try:
         cursor = db_connection.cursor()
-        query = """
-            INSERT INTO prediction_confidence 
-            (location_id, predicted_arrival, confidence_percent, timestamp_prediction)
-            VALUES (%s, %s, %s, %s)
-        """
         predicted_arrival = datetime.fromisoformat(eta_data['estimated_arrival']) if eta_data['estimated_arrival'] else None
-        cursor.execute(query, (location_id, predicted_arrival, eta_data['confidence_percent'], datetime.now()))
+        query, params = queries.save_eta_prediction_query(
+            location_id, predicted_arrival, eta_data['confidence_percent']
+        )
+        cursor.execute(query, params)
         db_connection.commit()
         logger.info(f"Previsão ETA salva para localização {location_id}")
     except Exception as e:
@@ -94,7 +98,7 @@ def save_adaptive_interval(location_id: int, interval_seconds: int, db_connectio
 
 def calculate_eta_with_osrm_and_history(current_lat: float, current_lon: float,
                                        target_lat: float, target_lon: float,
-                                       bus_line: str, db_connection) -> Dict:
+                                       bus_line: str, db_connection, destination_id: str = None) -> Dict:
     """
     Calcula ETA usando OSRM + histórico da linha para ajustes
     """
@@ -104,12 +108,14 @@ def calculate_eta_with_osrm_and_history(current_lat: float, current_lon: float,
         traffic_factor = get_traffic_factor_by_hour_osrm(current_hour)
         
         osrm_result = calculate_eta_with_osrm(
-            current_lat, current_lon, target_lat, target_lon, traffic_factor
+            current_lat, current_lon, target_lat, target_lon, traffic_factor, destination_id
         )
         
         if osrm_result['status'] != 'success':
-            # Fallback para cálculo manual se OSRM falhar
-            logger.warning("OSRM falhou, usando cálculo manual")
+            # Fallback para cálculo manual se OSRM falhar (ou se o disjuntor
+            # estiver aberto: nesse caso sem esperar o timeout)
+            if not osrm_result.get('circuit_open'):
+                logger.warning("OSRM falhou, usando cálculo manual")
             return calculate_eta_manual_fallback(current_lat, current_lon, target_lat, target_lon, bus_line, db_connection)
         
         # 2. Ajusta baseado no histórico da linha (opcional)
@@ -136,41 +142,16 @@ def calculate_eta_with_osrm_and_history(current_lat: float, current_lon: float,
         logger.error(f"Erro ao calcular ETA com OSRM: {e}")
         return calculate_eta_manual_fallback(current_lat, current_lon, target_lat, target_lon, bus_line, db_connection)
 
-def get_history_adjustment(bus_line: str, hour: int, db_connection) -> float:
+def get_history_adjustment(bus_line: str, hour: int, db_connection=None) -> float:
     """
     Obtém ajuste baseado no histórico da linha
+
+    Consulta o perfil de atraso em memória (linha x dia da semana x hora),
+    atualizado em background por ml.delay_profile; não acessa o banco.
     """
     try:
-        cursor = db_connection.cursor()
-        query = """
-            SELECT 
-                AVG(EXTRACT(EPOCH FROM (pc.actual_arrival - pc.predicted_arrival))/60) as avg_delay
-            FROM prediction_confidence pc
-            JOIN bus_location bl ON pc.location_id = bl.id
-            WHERE bl.bus_line = %s
-            AND pc.actual_arrival IS NOT NULL
-            AND EXTRACT(HOUR FROM bl.timestamp_location) = %s
-            AND pc.timestamp_prediction >= %s
-        """
-        
-        since = datetime.now() - timedelta(days=7)
-        cursor.execute(query, (bus_line, hour, since))
-        result = cursor.fetchone()
-        
-        if result and result[0] is not None:
-            avg_delay = result[0]
-            # Converte atraso em fator de ajuste
-            if avg_delay > 0:
-                # Atraso médio de 5 minutos = fator 1.1 (10% mais tempo)
-                adjustment = max(0.8, 1.0 + (avg_delay / 50))
-            else:
-                # Adiantamento médio = fator < 1.0 (menos tempo)
-                adjustment = min(1.2, 1.0 + (avg_delay / 50))
-            
-            return adjustment
-        
-        return 1.0  # Sem histórico, usa fator neutro
-        
+        weekday = datetime.now().weekday()
+        return get_delay_profile_cache().get_adjustment(bus_line, weekday, hour)
     except Exception as e:
         logger.error(f"Erro ao obter ajuste histórico: {e}")
         return 1.0
@@ -266,7 +247,7 @@ def receive_location():
             return jsonify({'error': 'Erro ao salvar localização'}), 500
         
         # Encontra destino mais próximo
-        nearest_dest = get_nearest_destination(latitude, longitude, DESTINATIONS)
+        nearest_dest = get_nearest_destination(latitude, longitude)
         if not nearest_dest:
             return jsonify({'error': 'Nenhum destino encontrado'}), 500
         
@@ -274,7 +255,7 @@ def receive_location():
         eta_data = calculate_eta_with_osrm_and_history(
             latitude, longitude, 
             nearest_dest['latitude'], nearest_dest['longitude'], 
-            bus_line, db_connection
+            bus_line, db_connection, nearest_dest['id']
         )
         
         # Salva previsão no banco
@@ -361,7 +342,12 @@ def get_destinations():
 @location_bp.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de health check"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()}), 200
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'delay_profile': get_delay_profile_cache().get_status(),
+        'osrm_circuit': get_osrm_circuit_status()
+    }), 200
 
 # Exporta o blueprint para uso no main.py
 app = location_bp
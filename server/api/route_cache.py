@@ -0,0 +1,180 @@
+"""
+Cache das rotas calculadas pelo OSRM
+Evita uma requisição HTTP bloqueante por leitura GPS
+
+Leituras seguidas de um ônibus indo para a mesma parada diferem por poucos
+metros. A origem é quantizada em células de cell_meters, e a rota (distância
+e duração pelo OSRM) fica guardada por (célula, destino, perfil), com
+validade ttl_seconds e descarte LRU acima de max_entries.
+
+Com interpolate, a rota guardada é ajustada à posição exata: distância e
+duração são escaladas pela razão entre as distâncias em linha reta da
+posição nova e da origem guardada até a parada (o trajeto restante encurta
+na mesma proporção). Uma célula sem rota usa a de uma célula vizinha, com o
+mesmo ajuste; a rota interpolada não é guardada.
+
+Acertos, interpolações e o tempo de requisição economizado aparecem em
+route_cache_metrics de /api/dashboard/metrics. Por processo.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config_simple import ROUTE_CACHE_CONFIG
+from api.trajectory import METERS_PER_DEGREE
+from api.utils import calculate_distance_km
+
+# Células vizinhas consultadas quando a célula da origem não tem rota
+_NEIGHBORS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+class _Route:
+    """Rota guardada: origem e destino exatos, valores do OSRM e o custo da requisição."""
+    __slots__ = ('expires_at', 'origin', 'destination', 'distance_meters', 'duration_seconds',
+                 'request_seconds')
+
+    def __init__(self, expires_at, origin, destination, distance_meters, duration_seconds, request_seconds):
+        self.expires_at = expires_at
+        self.origin = origin
+        self.destination = destination
+        self.distance_meters = distance_meters
+        self.duration_seconds = duration_seconds
+        self.request_seconds = request_seconds
+
+class RouteCache:
+    """Rotas por (célula da origem, destino, perfil), LRU com validade."""
+
+    def __init__(self, cell_meters: float = 100.0, ttl_seconds: float = 300,
+                 max_entries: int = 20000, interpolate: bool = True,
+                 min_interpolation_meters: float = 50.0):
+        self.cell_meters = cell_meters
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.interpolate = interpolate
+        self.min_interpolation_meters = min_interpolation_meters
+        self._entries: 'OrderedDict[Tuple, _Route]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.interpolated = 0
+        self.misses = 0
+        self.evictions = 0
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        """Célula da grade (x leste, y norte) que contém o ponto."""
+        y = math.floor(latitude * METERS_PER_DEGREE / self.cell_meters)
+        # Largura em graus de longitude pela latitude do centro da faixa: a
+        # mesma para todos os pontos da faixa
+        center_lat = (y + 0.5) * self.cell_meters / METERS_PER_DEGREE
+        x = math.floor(longitude * METERS_PER_DEGREE * math.cos(math.radians(center_lat)) / self.cell_meters)
+        return x, y
+
+    def _get(self, key: Tuple) -> Optional[_Route]:
+        route = self._entries.get(key)
+        if route is None:
+            return None
+        if route.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return route
+
+    def _adjusted(self, route: _Route, latitude: float, longitude: float) -> Tuple[float, float]:
+        """(distância, duração) da rota guardada escaladas para a posição exata."""
+        if not self.interpolate:
+            return route.distance_meters, route.duration_seconds
+        cached_straight = calculate_distance_km(*route.origin, *route.destination) * 1000
+        if cached_straight < self.min_interpolation_meters:
+            return route.distance_meters, route.duration_seconds
+        ratio = calculate_distance_km(latitude, longitude, *route.destination) * 1000 / cached_straight
+        return route.distance_meters * ratio, route.duration_seconds * ratio
+
+    def get(self, latitude: float, longitude: float, destination_id: str,
+            profile: str) -> Optional[Dict[str, Any]]:
+        """
+        Rota guardada da posição até o destino, ou None
+
+        Returns:
+            distance_meters, duration_seconds e cache ('hit' ou 'interpolated')
+        """
+        x, y = self.cell(latitude, longitude)
+        with self._lock:
+            route = self._get((x, y, destination_id, profile))
+            kind = 'hit'
+            if route is None and self.interpolate:
+                kind = 'interpolated'
+                route = next((r for r in (self._get((x + dx, y + dy, destination_id, profile))
+                                          for dx, dy in _NEIGHBORS) if r), None)
+            if route is None:
+                self.misses += 1
+                return None
+            if kind == 'hit':
+                self.hits += 1
+            else:
+                self.interpolated += 1
+            self.saved_seconds += route.request_seconds
+
+        distance, duration = self._adjusted(route, latitude, longitude)
+        return {'distance_meters': distance, 'duration_seconds': duration, 'cache': kind}
+
+    def put(self, latitude: float, longitude: float, destination: Tuple[float, float],
+            destination_id: str, profile: str, distance_meters: float, duration_seconds: float,
+            request_seconds: float):
+        """Guarda a rota obtida do OSRM e o tempo que a requisição levou."""
+        key = (*self.cell(latitude, longitude), destination_id, profile)
+        with self._lock:
+            self.requests += 1
+            self.request_seconds += request_seconds
+            self._entries.pop(key, None)
+            self._entries[key] = _Route(time.monotonic() + self.ttl_seconds, (latitude, longitude),
+                                        destination, distance_meters, duration_seconds, request_seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.interpolated + self.misses
+            return {
+                'enabled': True,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'interpolated': self.interpolated,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round((self.hits + self.interpolated) / lookups, 3) if lookups else None,
+                'avg_request_ms': round(self.request_seconds / self.requests * 1000, 1) if self.requests else None,
+                'saved_seconds': round(self.saved_seconds, 3),
+                'cell_meters': self.cell_meters,
+                'ttl_seconds': self.ttl_seconds
+            }
+
+# ============================================================
+#                  INSTÂNCIA GLOBAL (POR PROCESSO)
+# ============================================================
+
+route_cache: Optional[RouteCache] = None
+if ROUTE_CACHE_CONFIG['enabled']:
+    route_cache = RouteCache(
+        ROUTE_CACHE_CONFIG['cell_meters'],
+        ROUTE_CACHE_CONFIG['ttl_seconds'],
+        ROUTE_CACHE_CONFIG['max_entries'],
+        ROUTE_CACHE_CONFIG['interpolate'],
+        ROUTE_CACHE_CONFIG['min_interpolation_meters']
+    )
+
+def get_route_cache() -> Optional[RouteCache]:
+    return route_cache
+
+def get_route_cache_status() -> Dict[str, Any]:
+    if route_cache is None:
+        return {'enabled': False}
+    return route_cache.get_status()
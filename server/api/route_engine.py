@@ -0,0 +1,546 @@
+"""
+ETA pelo itinerário da linha (sem HTTP por leitura)
+Projeção da posição no traçado e tempos acumulados entre paradas
+
+O ônibus segue um itinerário fixo, mas o ETA era a linha reta a velocidade
+constante (calculate_simple_eta) ou uma rota genérica de carro do OSRM. Cada
+linha com arquivo em ROUTE_ENGINE_CONFIG['routes_dir'] (<linha>.json) tem o
+traçado (shape, lista de [latitude, longitude]) e as paradas em ordem:
+
+    {
+      "line": "L1", "name": "...", "speed_kmh": 22, "dwell_seconds": 20,
+      "shape": [[-8.0630, -34.8710], ...],
+      "stops": [{"id": "terminal_central", "name": "...", "latitude": ...,
+                 "longitude": ..., "travel_seconds": 420}, ...]
+    }
+
+travel_seconds é o tempo de viagem desde a parada anterior (tabela horária);
+sem ele, a distância pelo traçado a speed_kmh. dwell_seconds é o tempo parado
+em cada parada intermediária.
+
+O traçado é projetado em metros (equiretangular na latitude média da linha)
+e guardado em arrays NumPy. Uma posição GPS é projetada no segmento mais
+próximo do traçado (todas as distâncias de uma vez); a distância percorrida
+ao longo da linha e a interpolação dos tempos acumulados das paradas dão o
+ETA de cada parada adiante. Linhas que passam duas vezes pela mesma rua
+(ida e volta) devem ter um arquivo por sentido.
+
+Com o GTFS importado (api/gtfs_feed.py), cada linha ganha também o padrão
+de paradas de cada sentido (direction_id), com o traçado do shapes.txt (sem
+shape, a poligonal das paradas) e travel_seconds dos horários de
+stop_times.txt; como os horários já incluem o tempo parado, dwell_seconds é
+zero. Um arquivo .json da mesma linha tem prioridade.
+
+Linha com mais de um sentido: vale o sentido cujo traçado passa a até
+max_offset_meters da posição. Perto dos dois (mesma rua na ida e na volta),
+vale o sentido em que o ônibus avançou desde a leitura anterior
+(DirectionTracker, por bus_key); sem leitura anterior ou sem avanço
+conclusivo, o sentido é ambíguo e a linha fica sem ETA pelo itinerário.
+
+Os arquivos são relidos quando mudam (verificação a cada
+reload_check_seconds); o motor é imutável e trocado de uma vez, como o
+índice de paradas.
+
+Com velocidades aprendidas (ml/segment_speeds.py), o tempo de cada trecho
+entre paradas com observações suficientes no dia da semana e faixa horária
+é o comprimento dividido pela velocidade aprendida, sem o fator de tráfego
+(que já está na média); os outros trechos seguem a tabela vezes o fator.
+"""
+
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from config_simple import GTFS_CONFIG, ROUTE_ENGINE_CONFIG, SEGMENT_SPEED_CONFIG
+from api.gtfs_feed import GTFSFeed, get_gtfs_feed, gtfs_feed_signature
+from api.trajectory import METERS_PER_DEGREE
+from ml.segment_speeds import get_segment_speed_estimator
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+class LineRoute:
+    """Traçado e paradas de uma linha, com tempos acumulados (somente leitura)."""
+
+    def __init__(self, line: str, shape: List[Tuple[float, float]], stops: List[Dict[str, Any]],
+                 speed_kmh: float = None, dwell_seconds: float = None, name: str = None,
+                 direction: int = None):
+        if len(shape) < 2:
+            raise ValueError(f"Linha {line}: traçado com menos de 2 pontos")
+        if not stops:
+            raise ValueError(f"Linha {line}: sem paradas")
+        self.line = line
+        self.name = name or line
+        # Sentido do GTFS (direction_id); None para itinerário de arquivo .json
+        self.direction = direction
+        # Chave das velocidades aprendidas: um conjunto por sentido
+        self.key = line if direction is None else f"{line}:{direction}"
+        self.speed_kmh = speed_kmh or ROUTE_ENGINE_CONFIG['default_speed_kmh']
+        self.dwell_seconds = ROUTE_ENGINE_CONFIG['dwell_seconds'] if dwell_seconds is None else dwell_seconds
+        self.stops = stops
+        self.stop_ids = tuple(stop['id'] for stop in stops)
+
+        shape = np.asarray(shape, dtype=float)
+        self._ref_lat = float(shape[:, 0].mean())
+        self._x_scale = METERS_PER_DEGREE * math.cos(math.radians(self._ref_lat))
+        x, y = self._project(shape[:, 0], shape[:, 1])
+        self._x0, self._y0 = x[:-1], y[:-1]
+        self._dx, self._dy = np.diff(x), np.diff(y)
+        lengths = np.hypot(self._dx, self._dy)
+        # Segmentos de comprimento zero (pontos repetidos) não atrapalham a divisão
+        self._len2 = np.maximum(lengths ** 2, 1e-12)
+        self._cum = np.concatenate(([0.0], np.cumsum(lengths)))
+        self.length_m = float(self._cum[-1])
+
+        # Paradas em ordem: cada uma projetada a partir da anterior
+        along = []
+        for stop in stops:
+            position, offset = self.locate(stop['latitude'], stop['longitude'],
+                                           min_along_m=along[-1] if along else None)
+            if offset > ROUTE_ENGINE_CONFIG['max_offset_meters']:
+                logger.warning(f"Linha {line}: parada {stop['id']} a {offset:.0f} m do traçado")
+            along.append(position)
+        self.stop_along = np.asarray(along)
+
+        # Chegada (s desde a partida da primeira parada) e saída de cada parada
+        speed_mps = self.speed_kmh / 3.6
+        arrival = [0.0]
+        for j in range(1, len(stops)):
+            travel = stops[j].get('travel_seconds')
+            if travel is None:
+                travel = (along[j] - along[j - 1]) / speed_mps
+            departure = arrival[-1] + (self.dwell_seconds if j > 1 else 0.0)
+            arrival.append(departure + float(travel))
+        self.arrival = np.asarray(arrival)
+        self.departure = self.arrival + np.where(np.arange(len(stops)) > 0, self.dwell_seconds, 0.0)
+        self._speed_mps = speed_mps
+
+    def _project(self, lats, lons):
+        return (np.asarray(lons) * self._x_scale,
+                (np.asarray(lats) - self._ref_lat) * METERS_PER_DEGREE)
+
+    def locate(self, latitude: float, longitude: float,
+               min_along_m: float = None) -> Tuple[float, float]:
+        """
+        Projeção da posição no traçado
+
+        Args:
+            min_along_m: só considera o traçado a partir desta distância
+
+        Returns:
+            (distância ao longo da linha em metros, distância até o traçado em metros)
+        """
+        px, py = self._project(latitude, longitude)
+        t = np.clip(((px - self._x0) * self._dx + (py - self._y0) * self._dy) / self._len2, 0.0, 1.0)
+        offset2 = (self._x0 + t * self._dx - px) ** 2 + (self._y0 + t * self._dy - py) ** 2
+        along = self._cum[:-1] + t * np.sqrt(self._len2)
+        if min_along_m is not None:
+            offset2 = np.where(self._cum[1:] >= min_along_m, offset2, np.inf)
+        i = int(np.argmin(offset2))
+        return float(along[i]), float(math.sqrt(offset2[i]))
+
+    def time_at(self, along_m: float, arrival: np.ndarray = None, departure: np.ndarray = None,
+                speed_mps: float = None) -> float:
+        """Segundos desde a partida da primeira parada ao passar por along_m."""
+        arrival = self.arrival if arrival is None else arrival
+        departure = self.departure if departure is None else departure
+        if along_m <= self.stop_along[0]:
+            return -(self.stop_along[0] - along_m) / (speed_mps or self._speed_mps)
+        k = int(np.searchsorted(self.stop_along, along_m, side='right')) - 1
+        if k >= len(self.stops) - 1:
+            return float(arrival[-1])
+        span = self.stop_along[k + 1] - self.stop_along[k]
+        fraction = (along_m - self.stop_along[k]) / span if span > 0 else 1.0
+        return float(departure[k] + fraction * (arrival[k + 1] - departure[k]))
+
+    def timeline(self, traffic_factor: float = 1.0,
+                 segment_speeds_kmh: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Chegada e saída de cada parada com o fator de tráfego e as velocidades aprendidas
+
+        Args:
+            segment_speeds_kmh: velocidade de cada trecho entre paradas (NaN = sem dado)
+
+        Returns:
+            (arrival, departure, trechos com velocidade aprendida)
+        """
+        travel = (self.arrival[1:] - self.departure[:-1]) * traffic_factor
+        learned = 0
+        if segment_speeds_kmh is not None:
+            known = np.isfinite(segment_speeds_kmh) & (segment_speeds_kmh > 0)
+            learned = int(known.sum())
+            if learned:
+                lengths = np.diff(self.stop_along)
+                travel = np.where(known, lengths / np.where(known, segment_speeds_kmh, 1.0) * 3.6, travel)
+        dwell = (self.departure - self.arrival) * traffic_factor
+        arrival = np.concatenate(([0.0], np.cumsum(travel + dwell[:-1])))
+        return arrival, arrival + dwell, learned
+
+    def etas(self, latitude: float, longitude: float, traffic_factor: float = 1.0,
+             now: datetime = None, segment_speeds_kmh: np.ndarray = None) -> Optional[Dict[str, Any]]:
+        """
+        ETA de cada parada adiante da posição
+
+        Args:
+            segment_speeds_kmh: velocidades aprendidas por trecho (timeline)
+
+        Returns:
+            along_m, offset_m, elapsed_seconds (tempo estimado desde a saída
+            da primeira parada), learned_segments e stops (id, name,
+            distance_km pelo traçado, eta_minutes, estimated_arrival), ou None
+            fora do traçado
+        """
+        along, offset = self.locate(latitude, longitude)
+        if offset > ROUTE_ENGINE_CONFIG['max_offset_meters']:
+            return None
+        now = now or datetime.now()
+        arrival, scale, learned = self.arrival, traffic_factor, 0
+        if segment_speeds_kmh is not None:
+            learned_arrival, departure, learned = self.timeline(traffic_factor, segment_speeds_kmh)
+        if learned:
+            # Tempos já com o fator de tráfego nos trechos sem velocidade aprendida
+            arrival, scale = learned_arrival, 1.0
+            elapsed = self.time_at(along, arrival, departure, self._speed_mps / traffic_factor)
+        else:
+            elapsed = self.time_at(along)
+        downstream = []
+        for j in np.nonzero(self.stop_along > along)[0]:
+            seconds = (arrival[j] - elapsed) * scale
+            stop = self.stops[j]
+            downstream.append({
+                'id': stop['id'],
+                'name': stop.get('name', stop['id']),
+                'latitude': stop['latitude'],
+                'longitude': stop['longitude'],
+                'sequence': int(j),
+                'distance_km': round(float(self.stop_along[j] - along) / 1000, 3),
+                'eta_minutes': round(float(seconds) / 60, 1),
+                'estimated_arrival': (now + timedelta(seconds=float(seconds))).isoformat()
+            })
+        return {
+            'line': self.line,
+            'along_m': round(along, 1),
+            'offset_m': round(offset, 1),
+            'progress': round(along / self.length_m, 3) if self.length_m else None,
+            'elapsed_seconds': round(float(elapsed) * scale, 1),
+            'learned_segments': learned,
+            'stops': downstream
+        }
+
+class DirectionTracker:
+    """
+    Última posição de cada ônibus ao longo de cada sentido da linha (escolha do sentido)
+
+    Estado do processo: exige as leituras de um dispositivo sempre no mesmo
+    worker (per_device_state_enabled em config_simple.py).
+    """
+
+    def __init__(self, min_move_meters: float = None, memory_seconds: float = None):
+        self.min_move_meters = (ROUTE_ENGINE_CONFIG['direction_min_move_meters']
+                                if min_move_meters is None else min_move_meters)
+        self.memory_seconds = (ROUTE_ENGINE_CONFIG['direction_memory_seconds']
+                               if memory_seconds is None else memory_seconds)
+        # bus_key -> (linha, {sentido: distância ao longo do traçado}, sentido escolhido, instante)
+        self._buses: 'OrderedDict[str, Tuple[str, Dict[int, float], Optional[int], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buses)
+
+    def choose(self, bus_key: str, bus_line: str, alongs: Dict[int, float],
+               now: float = None) -> Optional[int]:
+        """
+        Sentido do ônibus a partir da posição em cada sentido candidato
+
+        Um candidato só: ele. Vários: o único em que o ônibus avançou
+        min_move_meters desde a referência anterior; parado, mantém o sentido já
+        escolhido. A referência só muda quando o ônibus anda (como a âncora das
+        velocidades por trecho), para que avanços lentos se acumulem.
+
+        Args:
+            alongs: distância ao longo do traçado em cada sentido perto da posição
+
+        Returns:
+            direction_id escolhido, ou None se ambíguo
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            # Ônibus sem leitura há mais de memory_seconds saem (os mais antigos vêm primeiro)
+            while self._buses:
+                oldest = next(iter(self._buses.values()))
+                if now - oldest[3] <= self.memory_seconds:
+                    break
+                self._buses.popitem(last=False)
+
+            previous = self._buses.pop(bus_key, None)
+            if previous is not None and previous[0] != bus_line:
+                previous = None
+            anchor, chosen = dict(alongs), None
+            if len(alongs) == 1:
+                chosen = next(iter(alongs))
+            elif previous is not None:
+                forward = [direction for direction, along in alongs.items()
+                           if direction in previous[1] and along - previous[1][direction] >= self.min_move_meters]
+                if len(forward) == 1:
+                    chosen = forward[0]
+                elif not forward:
+                    # Sem avanço: mantém a referência e o sentido anteriores
+                    anchor.update(previous[1])
+                    chosen = previous[2] if previous[2] in alongs else None
+            self._buses[bus_key] = (bus_line, anchor, chosen, now)
+            return chosen
+
+class RouteEngine:
+    """Linhas carregadas, por código da linha (um LineRoute por sentido)."""
+
+    def __init__(self, lines: Dict[str, Union[LineRoute, Sequence[LineRoute]]],
+                 tracker: DirectionTracker = None):
+        self.directions: Dict[str, Tuple[LineRoute, ...]] = {
+            code: (routes,) if isinstance(routes, LineRoute) else tuple(routes)
+            for code, routes in lines.items() if routes
+        }
+        # Primeiro sentido de cada linha (status e consultas sem posição)
+        self.lines = {code: routes[0] for code, routes in self.directions.items()}
+        self.tracker = tracker if tracker is not None else direction_tracker
+        self.built_at = datetime.now()
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def get(self, bus_line: str, direction: int = None) -> Optional[LineRoute]:
+        """Itinerário da linha no sentido pedido (sem sentido: o primeiro)."""
+        if direction is None:
+            return self.lines.get(bus_line)
+        for route in self.directions.get(bus_line, ()):
+            if route.direction == direction:
+                return route
+        return None
+
+    def resolve(self, bus_line: str, latitude: float, longitude: float,
+                bus_key: str = None) -> Optional[LineRoute]:
+        """
+        Sentido da linha em que a posição está
+
+        Returns:
+            O itinerário da linha com um sentido só; com vários, o escolhido
+            pelo traçado próximo e pelo avanço do ônibus (DirectionTracker);
+            None sem itinerário, fora de todos os sentidos ou sentido ambíguo
+        """
+        routes = self.directions.get(bus_line)
+        if not routes:
+            return None
+        if len(routes) == 1:
+            return routes[0]
+        alongs, by_direction = {}, {}
+        for route in routes:
+            along, offset = route.locate(latitude, longitude)
+            if offset <= ROUTE_ENGINE_CONFIG['max_offset_meters']:
+                alongs[route.direction] = along
+                by_direction[route.direction] = route
+        if not alongs:
+            return None
+        if bus_key is None:
+            return next(iter(by_direction.values())) if len(alongs) == 1 else None
+        direction = self.tracker.choose(bus_key, bus_line, alongs)
+        return by_direction.get(direction)
+
+    def etas(self, bus_line: str, latitude: float, longitude: float,
+             traffic_factor: float = 1.0, bus_key: str = None) -> Optional[Dict[str, Any]]:
+        """
+        ETA das paradas adiante; None para linha sem itinerário, posição fora
+        dele ou sentido ambíguo (resolve)
+        """
+        route = self.resolve(bus_line, latitude, longitude, bus_key)
+        if route is None:
+            return None
+        speeds = None
+        if SEGMENT_SPEED_CONFIG['enabled']:
+            now = datetime.now()
+            speeds = get_segment_speed_estimator().line_speeds(route.key, route.stop_ids, now.weekday(), now.hour)
+        result = route.etas(latitude, longitude, traffic_factor, segment_speeds_kmh=speeds)
+        if result is not None:
+            result['direction'] = route.direction
+        return result
+
+# ============================================================
+#                  ARQUIVOS E MOTOR GLOBAL
+# ============================================================
+
+def load_route_file(path: str) -> LineRoute:
+    """Linha de um arquivo <linha>.json (formato no início do módulo)."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    line = data.get('line') or os.path.splitext(os.path.basename(path))[0]
+    return LineRoute(line, [tuple(p) for p in data['shape']], data['stops'],
+                     data.get('speed_kmh'), data.get('dwell_seconds'), data.get('name'))
+
+def load_routes_dir(directory: str) -> Dict[str, LineRoute]:
+    """Todas as linhas do diretório; arquivos inválidos são ignorados com aviso."""
+    lines = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            route = load_route_file(path)
+            lines[route.line] = route
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning(f"Itinerário ignorado ({path}): {e}")
+    return lines
+
+def load_gtfs_lines(feed: GTFSFeed) -> Dict[str, List[LineRoute]]:
+    """Um itinerário por route e sentido do GTFS, do padrão de paradas de cada sentido."""
+    lines: Dict[str, List[LineRoute]] = {}
+    for pattern in sorted(feed.patterns(), key=lambda p: (p['line'], p['direction'])):
+        line = pattern['line']
+        stops = pattern['stops']
+        shape = pattern['shape']
+        if shape is None or len(shape) < 2:
+            shape = [(stop['latitude'], stop['longitude']) for stop in stops]
+        timetabled = any('travel_seconds' in stop for stop in stops)
+        try:
+            route = LineRoute(line, shape, stops, dwell_seconds=0 if timetabled else None,
+                              name=pattern['name'], direction=pattern['direction'])
+        except ValueError as e:
+            logger.warning(f"Linha do GTFS ignorada ({line}, sentido {pattern['direction']}): {e}")
+            continue
+        lines.setdefault(line, []).append(route)
+    return lines
+
+def load_all_lines() -> Dict[str, Union[LineRoute, List[LineRoute]]]:
+    """Linhas do GTFS (quando configurado) e dos arquivos .json, que têm prioridade."""
+    lines = {}
+    if GTFS_CONFIG['route_lines']:
+        feed = get_gtfs_feed()
+        if feed is not None:
+            lines.update(load_gtfs_lines(feed))
+    lines.update(load_routes_dir(ROUTE_ENGINE_CONFIG['routes_dir']))
+    return lines
+
+# Sentido escolhido de cada ônibus; sobrevive à troca do motor
+direction_tracker = DirectionTracker()
+
+_route_engine: Optional[RouteEngine] = None
+_routes_signature: Optional[Tuple] = None
+_last_check = 0.0
+_rebuild_lock = threading.Lock()
+
+def _routes_dir_signature() -> Tuple:
+    """(arquivo, mtime) dos itinerários e do GTFS: muda quando algum é criado, alterado ou removido."""
+    directory = ROUTE_ENGINE_CONFIG['routes_dir']
+    signature = [('gtfs', gtfs_feed_signature())]
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            signature.append((path, os.path.getmtime(path)))
+        except OSError:
+            pass
+    return tuple(signature)
+
+def rebuild_route_engine(lines: Dict[str, LineRoute] = None) -> RouteEngine:
+    """Carrega os itinerários e publica o motor novo no lugar do atual."""
+    global _route_engine, _routes_signature
+    with _rebuild_lock:
+        signature = _routes_dir_signature()
+        engine = RouteEngine(lines if lines is not None else load_all_lines())
+        _route_engine, _routes_signature = engine, signature
+    logger.info(f"Itinerários carregados: {len(engine)} linha(s)")
+    return engine
+
+def get_route_engine() -> RouteEngine:
+    """Motor atual, recarregado quando os arquivos de itinerário mudam."""
+    global _last_check
+    engine = _route_engine
+    if engine is None:
+        return rebuild_route_engine()
+    now = time.monotonic()
+    if now - _last_check >= ROUTE_ENGINE_CONFIG['reload_check_seconds']:
+        _last_check = now
+        if _routes_dir_signature() != _routes_signature:
+            return rebuild_route_engine()
+    return engine
+
+def get_route_engine_status() -> Dict[str, Any]:
+    engine = _route_engine
+    return {
+        'enabled': ROUTE_ENGINE_CONFIG['enabled'],
+        'routes_dir': ROUTE_ENGINE_CONFIG['routes_dir'],
+        'lines': {
+            code: {'stops': len(route.stops), 'length_km': round(route.length_m / 1000, 2),
+                   'directions': len(engine.directions[code])}
+            for code, route in engine.lines.items()
+        } if engine else {},
+        'tracked_buses': len(direction_tracker),
+        'built_at': engine.built_at.isoformat() if engine else None
+    }
+
+def estimate_route_eta(bus_line: str, latitude: float, longitude: float,
+                       traffic_factor: float = 1.0, bus_key: str = None) -> Optional[Dict[str, Any]]:
+    """
+    ETA pelo itinerário para a recepção de localização
+
+    Args:
+        bus_key: identificador do ônibus (bus_key_for), para escolher o sentido
+            de linhas com ida e volta
+
+    Returns:
+        destination (próxima parada, no formato de get_nearest_destination),
+        eta (no formato de calculate_simple_eta, com direction_id) e
+        downstream_stops; None sem itinerário, fora do traçado, com sentido
+        ambíguo ou depois da última parada
+    """
+    if not ROUTE_ENGINE_CONFIG['enabled']:
+        return None
+    result = get_route_engine().etas(bus_line, latitude, longitude, traffic_factor, bus_key)
+    if not result or not result['stops']:
+        return None
+    next_stop = result['stops'][0]
+    return {
+        'destination': {
+            'id': next_stop['id'],
+            'name': next_stop['name'],
+            'latitude': next_stop['latitude'],
+            'longitude': next_stop['longitude'],
+            'type': 'parada',
+            'distance_km': next_stop['distance_km']
+        },
+        'eta': {
+            'status': 'success',
+            'eta_minutes': next_stop['eta_minutes'],
+            'estimated_arrival': next_stop['estimated_arrival'],
+            'distance_km': round(next_stop['distance_km'], 2),
+            'confidence_percent': ROUTE_ENGINE_CONFIG['confidence_percent'],
+            'traffic_factor': round(traffic_factor, 2),
+            'along_route_m': result['along_m'],
+            'off_route_m': result['offset_m'],
+            'learned_segments': result['learned_segments'],
+            'direction_id': result['direction'],
+            'source': 'route_engine'
+        },
+        'downstream_stops': result['stops']
+    }
+
+def observe_route_fix(bus_key: Optional[str], bus_line: str, along_m: float, timestamp: datetime,
+                      direction: int = None) -> bool:
+    """
+    Leitura já projetada no itinerário (along_route_m e direction_id de
+    estimate_route_eta) para as velocidades aprendidas por trecho
+
+    Args:
+        bus_key: identificador do ônibus (bus_key_for); sem device_id (None)
+            a leitura é ignorada
+
+    Returns:
+        True se a leitura gerou uma observação de velocidade
+    """
+    if bus_key is None or not SEGMENT_SPEED_CONFIG['enabled']:
+        return False
+    route = get_route_engine().get(bus_line, direction)
+    if route is None:
+        return False
+    return get_segment_speed_estimator().observe(bus_key, route, along_m, timestamp)
@@ -6,7 +6,7 @@ Baseado nos requisitos do projeto IoT de monitoramento de ônibus
 
 import json
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 from flask import request, jsonify, Blueprint
 import os
@@ -15,12 +15,16 @@ import sys
 # Adiciona o diretório server ao path para imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config_simple import ML_CONFIG, VALIDATION_CONFIG
+from config_simple import ML_CONFIG, VALIDATION_CONFIG, PAGINATION_CONFIG
 from ml.occupancy_predictor import predict_bus_occupancy
 from database.simple_connection import (
     get_simple_database_manager, get_simple_occupancy_repository
 )
-from api.utils import validate_json_payload, log_api_request
+from database.spool import get_write_spool
+from api.utils import (
+    validate_json_payload, log_api_request, decode_cursor, paginate_rows, validate_page_limit,
+    parse_request_timestamp, decode_image_base64
+)
 
 # Configuração de logging
 logger = logging.getLogger(__name__)
@@ -54,6 +58,31 @@ def validate_image_data(image_base64: str) -> tuple[bool, str]:
     
     return True, ""
 
+def spool_image_analysis(location_id, image_data: bytes, occupancy_count: int,
+                         ingest_key: str = None) -> Optional[Dict]:
+    """
+    Guarda a análise no spool local quando o banco está indisponível
+    
+    Só localizações já gravadas (id numérico) podem ser reenviadas depois;
+    ids simulados do modo fallback ('simple_...') são ignorados.
+    
+    Returns:
+        Resultado do salvamento, ou None se não foi possível usar o spool
+    """
+    spool = get_write_spool()
+    if not spool or not str(location_id).isdigit():
+        return None
+    
+    ingest_key = spool.append_image(int(location_id), image_data, occupancy_count, ingest_key)
+    logger.info(f"Análise de imagem guardada no spool: {ingest_key}")
+    return {
+        'status': 'spooled',
+        'image_id': None,
+        'ingest_key': ingest_key,
+        'saved_at': datetime.now().isoformat(),
+        'message': 'Banco indisponível: análise guardada para reenvio'
+    }
+
 def save_simple_image_analysis(location_id: int, image_base64: str, 
                               analysis_result: Dict) -> Dict:
     """
@@ -70,15 +99,23 @@ def save_simple_image_analysis(location_id: int, image_base64: str,
     try:
         db_manager = get_simple_database_manager()
         occupancy_repo = get_simple_occupancy_repository()
+        occupancy_count = analysis_result.get('occupancy', {}).get('person_count', 0)
+        
+        # Decodifica imagem para bytes
+        image_data = decode_image_base64(image_base64)
         
         if not all([db_manager, occupancy_repo]):
+            spooled = spool_image_analysis(location_id, image_data, occupancy_count)
+            if spooled:
+                return spooled
+            
             # Modo fallback - simula salvamento
             timestamp = datetime.now()
             image_record = {
                 'id': f"img_{int(timestamp.timestamp())}",
                 'location_id': location_id,
                 'timestamp': timestamp.isoformat(),
-                'occupancy_count': analysis_result.get('occupancy', {}).get('person_count', 0),
+                'occupancy_count': occupancy_count,
                 'status': 'analyzed_fallback'
             }
             
@@ -91,19 +128,11 @@ def save_simple_image_analysis(location_id: int, image_base64: str,
                 'message': 'Análise salva com sucesso (modo fallback)'
             }
         
-        # Salva no banco real
-        import base64
-        
-        # Decodifica imagem para bytes
-        if ',' in image_base64:
-            image_base64 = image_base64.split(',')[1]
-        image_data = base64.b64decode(image_base64)
-        
         # Salva imagem
         image_id = occupancy_repo.save_image_analysis(
             location_id, 
             image_data, 
-            analysis_result.get('occupancy', {}).get('person_count', 0)
+            occupancy_count
         )
         
         if image_id:
@@ -113,11 +142,17 @@ def save_simple_image_analysis(location_id: int, image_base64: str,
                 'saved_at': datetime.now().isoformat(),
                 'message': 'Análise salva com sucesso no banco'
             }
-        else:
-            return {
-                'status': 'error',
-                'error': 'Falha ao salvar no banco'
-            }
+        
+        # Conexão caiu: guarda no spool (localização inexistente não é reenviada)
+        if not db_manager.test_connection():
+            spooled = spool_image_analysis(location_id, image_data, occupancy_count)
+            if spooled:
+                return spooled
+        
+        return {
+            'status': 'error',
+            'error': 'Falha ao salvar no banco'
+        }
         
     except Exception as e:
         logger.error(f"Erro ao salvar análise de imagem: {e}")
@@ -126,6 +161,43 @@ def save_simple_image_analysis(location_id: int, image_base64: str,
             'error': str(e)
         }
 
+def image_analysis_body(bus_line: str, timestamp: datetime, analysis_result: Dict, image_id,
+                        database_connected: bool, spooled: bool) -> Dict:
+    """Resposta de POST /api/image/analyze (servidores Flask e ASGI)"""
+    return {
+        'status': 'success',
+        'bus_line': bus_line,
+        'timestamp': timestamp.isoformat(),
+        'image_id': image_id,
+        'occupancy': analysis_result['occupancy'],
+        'detections': {
+            'count': len(analysis_result['detections']),
+            'confidence_avg': analysis_result['image_analysis']['confidence_avg']
+        },
+        'recommendations': analysis_result['recommendations'],
+        'annotated_image': analysis_result['annotated_image'],
+        'message': 'Análise de ocupação concluída (modo simplificado)',
+        'database_connected': database_connected,
+        'spooled': spooled
+    }
+
+def calculate_avg_occupancy_level(stats: Dict) -> float:
+    """
+    Calcula o nível médio de ocupação ponderado pela quantidade de análises
+    
+    Args:
+        stats: Resultado de get_occupancy_statistics
+        
+    Returns:
+        Nível médio (0-4), ou 0.0 sem análises
+    """
+    total = stats.get('total_analyses', 0)
+    if not total:
+        return 0.0
+    
+    level_sum = sum(level * data['count'] for level, data in stats['by_occupancy'].items())
+    return round(level_sum / total, 2)
+
 @simple_image_bp.route('/image/analyze', methods=['POST'])
 def analyze_bus_image():
     """
@@ -149,16 +221,7 @@ def analyze_bus_image():
         
         # Campos opcionais
         location_id = data.get('location_id')
-        timestamp_str = data.get('timestamp')
-        
-        # Valida timestamp se fornecido
-        if timestamp_str:
-            try:
-                timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-            except:
-                timestamp = datetime.now()
-        else:
-            timestamp = datetime.now()
+        timestamp = parse_request_timestamp(data)
         
         # Valida dados da imagem
         is_valid, error_msg = validate_image_data(image_base64)
@@ -180,21 +243,11 @@ def analyze_bus_image():
         save_result = save_simple_image_analysis(location_id, image_base64, analysis_result)
         
         # Resposta para o ESP32
-        response = {
-            'status': 'success',
-            'bus_line': bus_line,
-            'timestamp': timestamp.isoformat(),
-            'image_id': save_result.get('image_id'),
-            'occupancy': analysis_result['occupancy'],
-            'detections': {
-                'count': len(analysis_result['detections']),
-                'confidence_avg': analysis_result['image_analysis']['confidence_avg']
-            },
-            'recommendations': analysis_result['recommendations'],
-            'annotated_image': analysis_result['annotated_image'],
-            'message': 'Análise de ocupação concluída (modo simplificado)',
-            'database_connected': save_result.get('status') == 'success'
-        }
+        response = image_analysis_body(
+            bus_line, timestamp, analysis_result, save_result.get('image_id'),
+            database_connected=save_result.get('status') == 'success',
+            spooled=save_result.get('status') == 'spooled'
+        )
         
         # Log da requisição
         log_api_request('/api/image/analyze', 'POST', {
@@ -271,7 +324,9 @@ def get_occupancy_history(bus_line: str):
                     'occupancy_level': level,
                     'occupancy_name': ML_CONFIG['occupancy_levels'].get(level, f'Nível {level}'),
                     'count': data['count'],
-                    'avg_occupancy_count': data['avg_occupancy']
+                    'avg_occupancy_count': data['avg_occupancy'],
+                    'min_occupancy_count': data['min_occupancy'],
+                    'max_occupancy_count': data['max_occupancy']
                 })
         
         response = {
@@ -280,8 +335,8 @@ def get_occupancy_history(bus_line: str):
             'occupancy_history': occupancy_history,
             'summary': {
                 'total_analyses': stats['total_analyses'],
-                'avg_occupancy_level': 2.0,  # Calculado se necessário
-                'max_occupancy_level': 4
+                'avg_occupancy_level': calculate_avg_occupancy_level(stats),
+                'max_occupancy_level': max(stats['by_occupancy'], default=0)
             },
             'mode': 'database'
         }
@@ -292,6 +347,55 @@ def get_occupancy_history(bus_line: str):
         logger.error(f"Erro ao buscar histórico de ocupação: {e}")
         return jsonify({'error': 'Erro interno do servidor'}), 500
 
+@simple_image_bp.route('/image/occupancy/<bus_line>/history', methods=['GET'])
+def get_occupancy_analyses(bus_line: str):
+    """
+    Endpoint para listar análises de ocupação de uma linha (paginado por cursor)
+    
+    Paginação: envie o 'next_cursor' da resposta anterior no parâmetro 'cursor'.
+    """
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        hours = request.args.get('hours', 24, type=int)
+        cursor = request.args.get('cursor')
+        
+        valid, message = validate_page_limit(limit, PAGINATION_CONFIG['max_limit'])
+        if not valid:
+            return jsonify({'error': message}), 400
+        
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        db_manager = get_simple_database_manager()
+        occupancy_repo = get_simple_occupancy_repository()
+        
+        if not all([db_manager, occupancy_repo]):
+            return jsonify({
+                'bus_line': bus_line,
+                'count': 0,
+                'analyses': [],
+                'next_cursor': None,
+                'message': 'Histórico indisponível sem banco de dados',
+                'mode': 'fallback'
+            }), 200
+        
+        rows = occupancy_repo.get_occupancy_history(bus_line, hours, limit + 1, after)
+        analyses, next_cursor = paginate_rows(rows, limit, 'timestamp_image')
+        
+        return jsonify({
+            'bus_line': bus_line,
+            'count': len(analyses),
+            'analyses': analyses,
+            'next_cursor': next_cursor,
+            'mode': 'database'
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Erro ao listar análises de ocupação: {e}")
+        return jsonify({'error': 'Erro interno do servidor'}), 500
+
 @simple_image_bp.route('/image/statistics', methods=['GET'])
 def get_occupancy_statistics():
     """
@@ -324,7 +428,7 @@ def get_occupancy_statistics():
             # Converte para formato esperado
             stats.update({
                 'bus_lines_active': len(stats.get('by_line', {})),
-                'avg_occupancy_level': 2.0,  # Calculado se necessário
+                'avg_occupancy_level': calculate_avg_occupancy_level(stats),
                 'last_updated': datetime.now().isoformat(),
                 'mode': 'database'
             })
@@ -9,24 +9,28 @@ import math
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-from flask import request, jsonify, Blueprint
+from flask import request, jsonify, Blueprint, g
 import os
 import sys
 
 # Adiciona o diretório server ao path para imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config_simple import ETA_CONFIG, DESTINATIONS, INTERVAL_CONFIG, ML_CONFIG
+from config_simple import ETA_CONFIG, INTERVAL_CONFIG, ML_CONFIG
 from ml.occupancy_predictor import predict_bus_occupancy
 from database.simple_connection import (
     get_simple_database_manager, get_simple_bus_repository,
     get_simple_occupancy_repository, get_simple_eta_repository,
     get_simple_interval_repository
 )
+from database.spool import get_write_spool
+from api.simple_image_api import spool_image_analysis
+from api.idempotency import idempotent, REPLAY_HEADER
+from api.trajectory import get_trajectory_compressor, bus_key_for, device_id_for, merge_latest_positions
 from api.utils import (
-    validate_gps_coordinates, validate_bus_line, parse_timestamp,
+    validate_gps_coordinates, validate_bus_line, validate_device_id, parse_request_timestamp,
     calculate_distance_km, get_traffic_factor_by_hour, calculate_adaptive_interval,
-    get_nearest_destination, log_api_request
+    get_nearest_destination, log_api_request, decode_image_base64
 )
 
 # Configuração de logging
@@ -110,10 +114,75 @@ def calculate_eta_with_occupancy_impact(current_lat: float, current_lon: float,
             'error': str(e)
         }
 
+def occupancy_adaptive_interval(occupancy_level: int) -> int:
+    """Intervalo de envio sugerido ao ESP32 pelo nível de ocupação"""
+    occupancy_interval_factors = {
+        0: 1.2,  # Vazio - intervalo maior
+        1: 1.1,  # Baixa - intervalo ligeiramente maior
+        2: 1.0,  # Média - intervalo normal
+        3: 0.8,  # Alta - intervalo menor
+        4: 0.6   # Lotado - intervalo muito menor
+    }
+    
+    occupancy_interval_factor = occupancy_interval_factors.get(occupancy_level, 1.0)
+    adaptive_interval = int(INTERVAL_CONFIG['default_interval_seconds'] * occupancy_interval_factor)
+    
+    # Garante limites
+    return max(
+        INTERVAL_CONFIG['min_interval_seconds'],
+        min(adaptive_interval, INTERVAL_CONFIG['max_interval_seconds'])
+    )
+
+def replayed_reading_body(location_id, timestamp: datetime, bus_line: str) -> Dict:
+    """Resposta a uma leitura com imagem já gravada (servidores Flask e ASGI)"""
+    return {
+        'status': 'success',
+        'location_id': location_id,
+        'timestamp': timestamp.isoformat(),
+        'bus_line': bus_line,
+        'message': 'Leitura já recebida anteriormente',
+        'database_connected': True,
+        'spooled': False
+    }
+
+def integrated_response_body(bus_line: str, timestamp: datetime, location_id,
+                             latitude: float, longitude: float, nearest_dest: Dict,
+                             occupancy_analysis: Dict, eta_data: Dict, traffic_factor: float,
+                             adaptive_interval: int, recommendations: List[str],
+                             spooled: bool) -> Dict:
+    """Resposta de POST /api/location-image (servidores Flask e ASGI)"""
+    return {
+        'status': 'success',
+        'location_id': location_id or f"simple_{int(timestamp.timestamp())}",
+        'timestamp': timestamp.isoformat(),
+        'bus_line': bus_line,
+        'location': {
+            'latitude': latitude,
+            'longitude': longitude,
+            'destination': nearest_dest
+        },
+        'occupancy': occupancy_analysis['occupancy'],
+        'eta': eta_data,
+        'adaptive_interval_seconds': adaptive_interval,
+        'traffic': {
+            'factor': traffic_factor,
+            'level': 'high' if traffic_factor < 0.7 else 'medium' if traffic_factor < 0.9 else 'low'
+        },
+        'recommendations': recommendations,
+        'annotated_image': occupancy_analysis['annotated_image'],
+        'message': 'Análise integrada concluída (modo simplificado)',
+        'database_connected': location_id is not None,
+        'spooled': spooled
+    }
+
 @simple_integrated_bp.route('/location-image', methods=['POST'])
+@idempotent('/api/location-image')
 def receive_location_and_image():
     """
     Endpoint integrado simplificado para receber localização GPS e imagem do ESP32
+    
+    Com chave de idempotência, uma leitura já gravada não passa de novo pelo
+    detector nem grava outra localização.
     """
     try:
         if not request.is_json:
@@ -135,16 +204,7 @@ def receive_location_and_image():
         
         # Campos opcionais
         location_id = data.get('location_id')
-        timestamp_str = data.get('timestamp')
-        
-        # Valida timestamp se fornecido
-        if timestamp_str:
-            try:
-                timestamp = parse_timestamp(timestamp_str)
-            except:
-                timestamp = datetime.now()
-        else:
-            timestamp = datetime.now()
+        timestamp = parse_request_timestamp(data)
         
         # Validações
         if not validate_gps_coordinates(latitude, longitude):
@@ -153,6 +213,26 @@ def receive_location_and_image():
         if not validate_bus_line(bus_line):
             return jsonify({'error': 'Linha de ônibus inválida'}), 400
         
+        device_id = device_id_for(data)
+        if not validate_device_id(device_id):
+            return jsonify({'error': 'device_id inválido'}), 400
+        
+        # Conecta ao banco (se disponível)
+        db_manager = get_simple_database_manager()
+        bus_repo = get_simple_bus_repository()
+        occupancy_repo = get_simple_occupancy_repository()
+        eta_repo = get_simple_eta_repository()
+        interval_repo = get_simple_interval_repository()
+        
+        # Repetição já gravada (outro worker ou depois do TTL do cache): responde sem o detector
+        ingest_key = g.ingest_key
+        if ingest_key and occupancy_repo:
+            existing_location_id = occupancy_repo.find_location_by_ingest_key(ingest_key)
+            if existing_location_id:
+                logger.info(f"Leitura repetida: imagem da localização {existing_location_id} já gravada")
+                return jsonify(replayed_reading_body(existing_location_id, timestamp, bus_line)), \
+                    200, {REPLAY_HEADER: 'true'}
+        
         logger.info(f"Processando localização e imagem para linha {bus_line}")
         
         # 1. Analisa ocupação da imagem
@@ -168,7 +248,7 @@ def receive_location_and_image():
         occupancy_level = occupancy_info['level']
         
         # 2. Encontra destino mais próximo
-        nearest_dest = get_nearest_destination(latitude, longitude, DESTINATIONS)
+        nearest_dest = get_nearest_destination(latitude, longitude)
         if not nearest_dest:
             return jsonify({'error': 'Nenhum destino encontrado'}), 500
         
@@ -183,38 +263,41 @@ def receive_location_and_image():
             occupancy_level, traffic_factor
         )
         
-        # 5. Conecta ao banco (se disponível)
-        db_manager = get_simple_database_manager()
-        bus_repo = get_simple_bus_repository()
-        occupancy_repo = get_simple_occupancy_repository()
-        eta_repo = get_simple_eta_repository()
-        interval_repo = get_simple_interval_repository()
-        
+        # 5. Salva localização no banco (se disponível)
         saved_location_id = location_id
+        created = True
         if all([db_manager, bus_repo]) and not location_id:
-            # Salva localização no banco
-            saved_location_id = bus_repo.save_location(bus_line, latitude, longitude)
-            if saved_location_id:
+            if ingest_key:
+                saved_location_id, created = bus_repo.save_location_once(
+                    bus_line, latitude, longitude, ingest_key, device_id
+                )
+            else:
+                saved_location_id = bus_repo.save_location(bus_line, latitude, longitude, device_id)
+            if saved_location_id and created:
                 logger.info(f"Localização salva: ID {saved_location_id}")
         
+        # Ponto com imagem é sempre gravado; vira a âncora da compressão de trajetória
+        compressor = get_trajectory_compressor()
+        bus_key = bus_key_for(data)
+        if compressor and bus_key and not location_id:
+            compressor.offer(bus_key, bus_line, latitude, longitude, force=True)
+            if saved_location_id:
+                compressor.set_location_id(bus_key, saved_location_id)
+        
         # 6. Salva análise de imagem (se banco disponível)
+        image_data = decode_image_base64(image_base64)
+        
+        image_id = None
         if saved_location_id and occupancy_repo:
             try:
-                import base64
-                if ',' in image_base64:
-                    image_base64_clean = image_base64.split(',')[1]
-                else:
-                    image_base64_clean = image_base64
-                image_data = base64.b64decode(image_base64_clean)
-                
-                occupancy_repo.save_image_analysis(
-                    saved_location_id, image_data, occupancy_info['person_count']
+                image_id = occupancy_repo.save_image_analysis(
+                    saved_location_id, image_data, occupancy_info['person_count'], ingest_key
                 )
             except Exception as e:
                 logger.warning(f"Erro ao salvar análise de imagem: {e}")
         
         # 7. Salva previsão de ETA (se banco disponível)
-        if saved_location_id and eta_repo:
+        if saved_location_id and created and eta_repo:
             try:
                 predicted_arrival = datetime.fromisoformat(eta_data['estimated_arrival'])
                 eta_repo.save_eta_prediction(
@@ -224,59 +307,46 @@ def receive_location_and_image():
                 logger.warning(f"Erro ao salvar ETA: {e}")
         
         # 8. Calcula intervalo adaptativo baseado na ocupação
-        occupancy_interval_factors = {
-            0: 1.2,  # Vazio - intervalo maior
-            1: 1.1,  # Baixa - intervalo ligeiramente maior
-            2: 1.0,  # Média - intervalo normal
-            3: 0.8,  # Alta - intervalo menor
-            4: 0.6   # Lotado - intervalo muito menor
-        }
-        
-        occupancy_interval_factor = occupancy_interval_factors.get(occupancy_level, 1.0)
-        base_interval = INTERVAL_CONFIG['default_interval_seconds']
-        adaptive_interval = int(base_interval * occupancy_interval_factor)
-        
-        # Garante limites
-        adaptive_interval = max(
-            INTERVAL_CONFIG['min_interval_seconds'],
-            min(adaptive_interval, INTERVAL_CONFIG['max_interval_seconds'])
-        )
+        adaptive_interval = occupancy_adaptive_interval(occupancy_level)
         
         # 9. Salva intervalo adaptativo (se banco disponível)
-        if saved_location_id and interval_repo:
+        if saved_location_id and created and interval_repo:
             try:
                 interval_repo.save_interval(saved_location_id, adaptive_interval)
             except Exception as e:
                 logger.warning(f"Erro ao salvar intervalo: {e}")
         
-        # 10. Gera recomendações integradas
+        # 10. Banco indisponível: guarda no spool local para reenvio quando ele voltar
+        spooled = False
+        spool = get_write_spool()
+        if not saved_location_id and spool:
+            spool.append_location(
+                bus_line, latitude, longitude,
+                predicted_arrival=eta_data.get('estimated_arrival'),
+                confidence_percent=eta_data.get('confidence_percent'),
+                interval_seconds=adaptive_interval,
+                image_data=image_data,
+                occupancy_count=occupancy_info['person_count'],
+                ingest_key=ingest_key,
+                device_id=device_id
+            )
+            spooled = True
+        elif location_id and not image_id and not (db_manager and db_manager.test_connection()):
+            spooled = spool_image_analysis(
+                location_id, image_data, occupancy_info['person_count'], ingest_key
+            ) is not None
+        
+        # 11. Gera recomendações integradas
         recommendations = generate_simple_recommendations(
             occupancy_info, eta_data, traffic_factor, adaptive_interval
         )
         
-        # 11. Resposta integrada para o ESP32
-        response = {
-            'status': 'success',
-            'location_id': saved_location_id or f"simple_{int(timestamp.timestamp())}",
-            'timestamp': timestamp.isoformat(),
-            'bus_line': bus_line,
-            'location': {
-                'latitude': latitude,
-                'longitude': longitude,
-                'destination': nearest_dest
-            },
-            'occupancy': occupancy_info,
-            'eta': eta_data,
-            'adaptive_interval_seconds': adaptive_interval,
-            'traffic': {
-                'factor': traffic_factor,
-                'level': 'high' if traffic_factor < 0.7 else 'medium' if traffic_factor < 0.9 else 'low'
-            },
-            'recommendations': recommendations,
-            'annotated_image': occupancy_analysis['annotated_image'],
-            'message': 'Análise integrada concluída (modo simplificado)',
-            'database_connected': saved_location_id is not None
-        }
+        # 12. Resposta integrada para o ESP32
+        response = integrated_response_body(
+            bus_line, timestamp, saved_location_id, latitude, longitude, nearest_dest,
+            occupancy_analysis, eta_data, traffic_factor, adaptive_interval, recommendations,
+            spooled
+        )
         
         # Log da requisição
         log_api_request('/api/location-image', 'POST', {
@@ -288,7 +358,8 @@ def receive_location_and_image():
         
         logger.info(f"Análise integrada concluída: {occupancy_level} pessoas, ETA {eta_data['eta_minutes']}min")
         
-        return jsonify(response), 200
+        headers = {REPLAY_HEADER: 'true'} if saved_location_id and not created else {}
+        return jsonify(response), 200, headers
         
     except Exception as e:
         logger.error(f"Erro no endpoint /api/location-image: {e}")
@@ -389,7 +460,7 @@ def get_integrated_status(bus_line: str):
             }
         else:
             # Dados reais do banco
-            locations = bus_repo.get_current_locations(bus_line, minutes=5)
+            locations = merge_latest_positions(bus_repo.get_current_locations(bus_line, minutes=5), bus_line)
             
             if locations:
                 latest_location = locations[0]
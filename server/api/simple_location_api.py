@@ -8,24 +8,37 @@ import json
 import math
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from flask import request, jsonify, Blueprint
+from typing import Dict, List, Optional, Tuple
+from flask import request, jsonify, Blueprint, Response, stream_with_context, g
 import os
 import sys
 
 # Adiciona o diretório server ao path para imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config_simple import ETA_CONFIG, DESTINATIONS, INTERVAL_CONFIG, ML_CONFIG
+from config_simple import (
+    ETA_CONFIG, DESTINATIONS, INTERVAL_CONFIG, ML_CONFIG, EXPORT_CONFIG, ARCHIVE_CONFIG,
+    STOP_INDEX_CONFIG, OSRM_CONFIG, PAGINATION_CONFIG
+)
 from database.simple_connection import (
     get_simple_database_manager, get_simple_bus_repository,
     get_simple_occupancy_repository, get_simple_eta_repository,
     get_simple_interval_repository
 )
+from database.spool import get_write_spool
+from database.archive import downsampled_history, read_archived_locations
+from api.idempotency import idempotent, REPLAY_HEADER
+from api.trajectory import get_trajectory_compressor, bus_key_for, device_id_for, merge_latest_positions
+from api.stop_index import get_stop_index
+from api.geo import path_length_km
+from api.eta_osrm import calculate_batch_etas, get_traffic_factor_by_hour_osrm
+from api.osrm_client import get_osrm_circuit_status
+from api.route_engine import estimate_route_eta, get_route_engine, observe_route_fix
 from api.utils import (
-    validate_gps_coordinates, validate_bus_line, parse_timestamp,
+    validate_gps_coordinates, validate_bus_line, validate_device_id, parse_request_timestamp,
     calculate_distance_km, get_traffic_factor_by_hour, calculate_adaptive_interval,
-    get_nearest_destination, log_api_request
+    get_nearest_destination, log_api_request, iter_ndjson, iter_csv, prefetch_first_batch,
+    decode_cursor, paginate_rows, validate_page_limit
 )
 
 # Configuração de logging
@@ -112,10 +125,74 @@ def calculate_simple_eta(current_lat: float, current_lon: float,
             'error': str(e)
         }
 
+def resolve_location_eta(bus_key: Optional[str], bus_line: str, latitude: float, longitude: float,
+                         timestamp: datetime, observe: bool = True) -> Optional[Tuple[Dict, Dict, Optional[Dict]]]:
+    """
+    Destino e ETA de uma leitura de localização (servidores Flask e ASGI)
+    
+    Linha com itinerário: próxima parada e ETA pelo traçado; leitura nova
+    (observe=True) de um ônibus identificado (bus_key, do device_id) alimenta
+    as velocidades aprendidas por trecho. Sem
+    itinerário: destino mais próximo e ETA simplificado.
+    
+    Returns:
+        (destino, eta, route_eta) ou None se nenhum destino foi encontrado
+    """
+    route_eta = estimate_route_eta(bus_line, latitude, longitude,
+                                   get_traffic_factor_by_hour(datetime.now().hour), bus_key)
+    if route_eta:
+        if observe and bus_key is not None:
+            observe_route_fix(bus_key, bus_line, route_eta['eta']['along_route_m'], timestamp,
+                              route_eta['eta']['direction_id'])
+        return route_eta['destination'], route_eta['eta'], route_eta
+    
+    nearest_dest = get_nearest_destination(latitude, longitude)
+    if not nearest_dest:
+        return None
+    eta_data = calculate_simple_eta(
+        latitude, longitude,
+        nearest_dest['latitude'], nearest_dest['longitude']
+    )
+    return nearest_dest, eta_data, None
+
+def location_adaptive_interval() -> int:
+    """Intervalo de envio sugerido ao ESP32 pelo fator de tráfego da hora"""
+    return calculate_adaptive_interval(
+        INTERVAL_CONFIG['default_interval_seconds'],
+        get_traffic_factor_by_hour(datetime.now().hour),
+        INTERVAL_CONFIG['min_interval_seconds'],
+        INTERVAL_CONFIG['max_interval_seconds']
+    )
+
+def location_response_body(bus_line: str, timestamp: datetime, location_id, nearest_dest: Dict,
+                           eta_data: Dict, route_eta: Optional[Dict], adaptive_interval: int,
+                           database_connected: bool, spooled: bool, compressed: bool) -> Dict:
+    """Resposta de POST /api/location (servidores Flask e ASGI)"""
+    response = {
+        'status': 'success',
+        'location_id': location_id or f"simple_{int(timestamp.timestamp())}",
+        'timestamp': timestamp.isoformat(),
+        'bus_line': bus_line,
+        'destination': nearest_dest,
+        'eta': eta_data,
+        'adaptive_interval_seconds': adaptive_interval,
+        'message': 'Localização recebida e ETA calculado (modo simplificado)',
+        'database_connected': database_connected,
+        'spooled': spooled,
+        'compressed': compressed
+    }
+    if route_eta:
+        response['downstream_stops'] = route_eta['downstream_stops']
+    return response
+
 @simple_location_bp.route('/location', methods=['POST'])
+@idempotent('/api/location')
 def receive_location():
     """
     Endpoint simplificado para receber dados de localização do ESP32
+    
+    Com chave de idempotência (Idempotency-Key, idempotency_key ou
+    device_id + seq), repetições da mesma leitura não gravam de novo.
     """
     try:
         if not request.is_json:
@@ -135,13 +212,7 @@ def receive_location():
         longitude = float(data['longitude'])
         
         # Usa timestamp do ESP32 se fornecido
-        if 'timestamp' in data:
-            try:
-                timestamp = parse_timestamp(data['timestamp'])
-            except:
-                timestamp = datetime.now()
-        else:
-            timestamp = datetime.now()
+        timestamp = parse_request_timestamp(data)
         
         # Validações
         if not validate_gps_coordinates(latitude, longitude):
@@ -150,32 +221,50 @@ def receive_location():
         if not validate_bus_line(bus_line):
             return jsonify({'error': 'Linha de ônibus inválida'}), 400
         
+        device_id = device_id_for(data)
+        if not validate_device_id(device_id):
+            return jsonify({'error': 'device_id inválido'}), 400
+        
         # Conecta ao banco (se disponível)
         db_manager = get_simple_database_manager()
         bus_repo = get_simple_bus_repository()
         eta_repo = get_simple_eta_repository()
         interval_repo = get_simple_interval_repository()
         
+        # Compressão de trajetória: ponto sem informação nova não é gravado
+        # (só atualiza a posição mais recente do ônibus em memória)
+        # (só com device_id: sem ele os ônibus da linha não se distinguem)
+        bus_key = bus_key_for(data)
+        compressor = get_trajectory_compressor() if bus_key else None
+        persist = compressor.offer(bus_key, bus_line, latitude, longitude) if compressor else True
+        
+        ingest_key = g.ingest_key
         location_id = None
-        if all([db_manager, bus_repo]):
+        created = True
+        if persist and all([db_manager, bus_repo]):
             # Salva localização no banco
-            location_id = bus_repo.save_location(bus_line, latitude, longitude)
-            if location_id:
+            if ingest_key:
+                # Repetição que escapou do cache (outro worker, TTL vencido): o índice único barra
+                location_id, created = bus_repo.save_location_once(
+                    bus_line, latitude, longitude, ingest_key, device_id
+                )
+            else:
+                location_id = bus_repo.save_location(bus_line, latitude, longitude, device_id)
+            if location_id and created:
                 logger.info(f"Localização salva: ID {location_id}, Linha {bus_line}")
-        
-        # Encontra destino mais próximo
-        nearest_dest = get_nearest_destination(latitude, longitude, DESTINATIONS)
-        if not nearest_dest:
+            elif location_id:
+                logger.info(f"Leitura repetida: localização {location_id} já gravada")
+            if location_id and compressor:
+                compressor.set_location_id(bus_key, location_id)
+        
+        # Destino e ETA; só leitura nova (não repetição) alimenta as velocidades por trecho
+        resolved = resolve_location_eta(bus_key, bus_line, latitude, longitude, timestamp, observe=created)
+        if not resolved:
             return jsonify({'error': 'Nenhum destino encontrado'}), 500
-        
-        # Calcula ETA simplificado
-        eta_data = calculate_simple_eta(
-            latitude, longitude,
-            nearest_dest['latitude'], nearest_dest['longitude']
-        )
+        nearest_dest, eta_data, route_eta = resolved
         
         # Salva previsão de ETA (se banco disponível)
-        if location_id and eta_repo:
+        if location_id and created and eta_repo:
             try:
                 predicted_arrival = datetime.fromisoformat(eta_data['estimated_arrival'])
                 eta_repo.save_eta_prediction(
@@ -185,34 +274,39 @@ def receive_location():
                 logger.warning(f"Erro ao salvar ETA: {e}")
         
         # Calcula intervalo adaptativo
-        current_hour = datetime.now().hour
-        traffic_factor = get_traffic_factor_by_hour(current_hour)
-        adaptive_interval = calculate_adaptive_interval(
-            INTERVAL_CONFIG['default_interval_seconds'],
-            traffic_factor,
-            INTERVAL_CONFIG['min_interval_seconds'],
-            INTERVAL_CONFIG['max_interval_seconds']
-        )
+        adaptive_interval = location_adaptive_interval()
         
         # Salva intervalo adaptativo (se banco disponível)
-        if location_id and interval_repo:
+        if location_id and created and interval_repo:
             try:
                 interval_repo.save_interval(location_id, adaptive_interval)
             except Exception as e:
                 logger.warning(f"Erro ao salvar intervalo: {e}")
         
+        # Banco indisponível: guarda no spool local para reenvio quando ele voltar
+        spool = get_write_spool()
+        spooled = False
+        if persist and not location_id and spool:
+            spool.append_location(
+                bus_line, latitude, longitude,
+                predicted_arrival=eta_data.get('estimated_arrival'),
+                confidence_percent=eta_data.get('confidence_percent'),
+                interval_seconds=adaptive_interval,
+                ingest_key=ingest_key,
+                device_id=device_id
+            )
+            spooled = True
+        
+        # Ponto descartado pela compressão: responde com o último ponto gravado do ônibus
+        anchor_id = compressor.anchor_location_id(bus_key) if not persist else None
+        
         # Resposta para o ESP32
-        response = {
-            'status': 'success',
-            'location_id': location_id or f"simple_{int(timestamp.timestamp())}",
-            'timestamp': timestamp.isoformat(),
-            'bus_line': bus_line,
-            'destination': nearest_dest,
-            'eta': eta_data,
-            'adaptive_interval_seconds': adaptive_interval,
-            'message': 'Localização recebida e ETA calculado (modo simplificado)',
-            'database_connected': location_id is not None
-        }
+        response = location_response_body(
+            bus_line, timestamp, location_id or anchor_id, nearest_dest, eta_data, route_eta,
+            adaptive_interval,
+            database_connected=location_id is not None or (not persist and db_manager is not None),
+            spooled=spooled, compressed=not persist
+        )
         
         # Log da requisição
         log_api_request('/api/location', 'POST', {
@@ -223,7 +317,8 @@ def receive_location():
         
         logger.info(f"Localização processada: Linha {bus_line}, ETA {eta_data['eta_minutes']} min")
         
-        return jsonify(response), 200
+        headers = {REPLAY_HEADER: 'true'} if location_id and not created else {}
+        return jsonify(response), 200, headers
         
     except Exception as e:
         logger.error(f"Erro no endpoint /api/location: {e}")
@@ -236,10 +331,22 @@ def receive_location():
 def get_location_history(bus_line: str):
     """
     Endpoint para consultar histórico de localizações de uma linha
+    
+    Paginação: envie o 'next_cursor' da resposta anterior no parâmetro 'cursor'.
     """
     try:
         limit = request.args.get('limit', 50, type=int)
         hours = request.args.get('hours', 24, type=int)
+        cursor = request.args.get('cursor')
+        
+        valid, message = validate_page_limit(limit, PAGINATION_CONFIG['max_limit'])
+        if not valid:
+            return jsonify({'error': message}), 400
+        
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         db_manager = get_simple_database_manager()
         bus_repo = get_simple_bus_repository()
@@ -267,13 +374,15 @@ def get_location_history(bus_line: str):
                 'mode': 'fallback'
             }), 200
         
-        # Dados reais do banco
-        locations = bus_repo.get_location_history(bus_line, hours, limit)
+        # Dados reais do banco (limit + 1 para saber se há próxima página)
+        rows = bus_repo.get_location_history(bus_line, hours, limit + 1, after)
+        locations, next_cursor = paginate_rows(rows, limit, 'timestamp_location')
         
         return jsonify({
             'bus_line': bus_line,
             'count': len(locations),
             'locations': locations,
+            'next_cursor': next_cursor,
             'mode': 'database'
         }), 200
         
@@ -281,6 +390,159 @@ def get_location_history(bus_line: str):
         logger.error(f"Erro ao buscar histórico: {e}")
         return jsonify({'error': 'Erro interno do servidor'}), 500
 
+@simple_location_bp.route('/location/history/<bus_line>/export', methods=['GET'])
+def export_location_history(bus_line: str):
+    """
+    Endpoint para exportar histórico de localizações em streaming (NDJSON ou CSV)
+    
+    Lê o banco com cursor do lado do servidor e envia a resposta em blocos,
+    então exportações longas usam memória constante.
+    """
+    try:
+        export_format = request.args.get('format', 'ndjson').lower()
+        hours = request.args.get('hours', 24, type=int)
+        limit = request.args.get('limit', type=int)
+        
+        if export_format not in EXPORT_CONFIG['formats']:
+            return jsonify({'error': f'Formato inválido: {export_format}'}), 400
+        
+        db_manager = get_simple_database_manager()
+        bus_repo = get_simple_bus_repository()
+        
+        if not all([db_manager, bus_repo]):
+            return jsonify({
+                'error': 'Exportação indisponível sem banco de dados',
+                'mode': 'fallback'
+            }), 503
+        
+        # Consulta aberta e primeiro lote lido aqui: erro do banco ainda vira 500
+        batches = prefetch_first_batch(bus_repo.stream_location_history(
+            bus_line, hours, limit, EXPORT_CONFIG['batch_size']
+        ))
+        
+        if export_format == 'csv':
+            columns = ['id', 'bus_line', 'latitude', 'longitude', 'timestamp_location']
+            body = iter_csv(batches, columns)
+            mimetype = 'text/csv'
+        else:
+            body = iter_ndjson(batches)
+            mimetype = 'application/x-ndjson'
+        
+        filename = f"history_{bus_line}.{export_format}"
+        return Response(
+            stream_with_context(body),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+        
+    except Exception as e:
+        logger.error(f"Erro ao exportar histórico: {e}")
+        return jsonify({'error': 'Erro interno do servidor'}), 500
+
+@simple_location_bp.route('/location/history/<bus_line>/archive', methods=['GET'])
+def get_archived_history(bus_line: str):
+    """
+    Endpoint para consultar o histórico já arquivado de uma linha (database/archive.py)
+    
+    Parâmetros: start e end (ISO 8601, obrigatórios), resolution ('downsampled',
+    um ponto por bucket; ou 'raw', lido dos arquivos do manifesto) e limit.
+    """
+    try:
+        resolution = request.args.get('resolution', 'downsampled')
+        limit = min(request.args.get('limit', 1000, type=int), ARCHIVE_CONFIG['max_query_rows'])
+        
+        if resolution not in ('downsampled', 'raw'):
+            return jsonify({'error': f'Resolução inválida: {resolution}'}), 400
+        
+        try:
+            start = _parse_archive_time(request.args.get('start'))
+            end = _parse_archive_time(request.args.get('end'))
+        except ValueError:
+            return jsonify({'error': 'start e end são obrigatórios (ISO 8601)'}), 400
+        
+        db_manager = get_simple_database_manager()
+        if not db_manager:
+            return jsonify({
+                'error': 'Histórico arquivado indisponível sem banco de dados',
+                'mode': 'fallback'
+            }), 503
+        
+        if resolution == 'raw':
+            locations = read_archived_locations(db_manager, bus_line, start, end, limit)
+        else:
+            locations = downsampled_history(db_manager, bus_line, start, end, limit)
+        
+        return jsonify({
+            'bus_line': bus_line,
+            'resolution': resolution,
+            'count': len(locations),
+            # Distância percorrida ligando os pontos devolvidos, em ordem
+            'distance_km': round(path_length_km([loc['latitude'] for loc in locations],
+                                                [loc['longitude'] for loc in locations]), 3),
+            'locations': locations,
+            'mode': 'database'
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Erro ao consultar histórico arquivado: {e}")
+        return jsonify({'error': 'Erro interno do servidor'}), 500
+
+def _parse_archive_time(value: Optional[str]) -> datetime:
+    """Instante ISO 8601 em horário local sem fuso, como timestamp_location."""
+    if not value:
+        raise ValueError(value)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+@simple_location_bp.route('/location/eta/<bus_line>', methods=['GET'])
+def get_eta_predictions(bus_line: str):
+    """
+    Endpoint para consultar previsões de ETA de uma linha (paginado por cursor)
+    """
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        hours = request.args.get('hours', 24, type=int)
+        cursor = request.args.get('cursor')
+        
+        valid, message = validate_page_limit(limit, PAGINATION_CONFIG['max_limit'])
+        if not valid:
+            return jsonify({'error': message}), 400
+        
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        db_manager = get_simple_database_manager()
+        eta_repo = get_simple_eta_repository()
+        
+        if not all([db_manager, eta_repo]):
+            return jsonify({
+                'bus_line': bus_line,
+                'count': 0,
+                'predictions': [],
+                'next_cursor': None,
+                'message': 'Previsões indisponíveis sem banco de dados',
+                'mode': 'fallback'
+            }), 200
+        
+        rows = eta_repo.get_eta_predictions(bus_line, hours, limit + 1, after)
+        predictions, next_cursor = paginate_rows(rows, limit, 'timestamp_prediction')
+        
+        return jsonify({
+            'bus_line': bus_line,
+            'count': len(predictions),
+            'predictions': predictions,
+            'next_cursor': next_cursor,
+            'mode': 'database'
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Erro ao buscar previsões de ETA: {e}")
+        return jsonify({'error': 'Erro interno do servidor'}), 500
+
 @simple_location_bp.route('/location/destinations', methods=['GET'])
 def get_destinations():
     """
@@ -291,6 +553,121 @@ def get_destinations():
         'count': len(DESTINATIONS)
     }), 200
 
+@simple_location_bp.route('/location/stops/nearby', methods=['GET'])
+def get_nearby_stops():
+    """
+    Endpoint para buscar paradas próximas a um ponto (api/stop_index.py)
+    
+    Parâmetros: latitude e longitude (obrigatórios), radius_m (todas as paradas
+    até essa distância) ou k (as k mais próximas, padrão 5).
+    """
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    radius_m = request.args.get('radius_m', type=float)
+    k = request.args.get('k', 5, type=int)
+    
+    if latitude is None or longitude is None or not validate_gps_coordinates(latitude, longitude):
+        return jsonify({'error': 'latitude e longitude válidas são obrigatórias'}), 400
+    if (radius_m is not None and radius_m <= 0) or k < 1:
+        return jsonify({'error': 'radius_m e k devem ser positivos'}), 400
+    
+    limit = min(k, STOP_INDEX_CONFIG['max_results'])
+    index = get_stop_index()
+    if radius_m is not None:
+        stops = index.within(latitude, longitude, radius_m, limit=STOP_INDEX_CONFIG['max_results'])
+    else:
+        stops = index.nearest(latitude, longitude, k=limit)
+    
+    return jsonify({
+        'stops': stops,
+        'count': len(stops)
+    }), 200
+
+@simple_location_bp.route('/location/route/<bus_line>/eta', methods=['GET'])
+def get_route_eta(bus_line: str):
+    """
+    Endpoint para o ETA pelo itinerário da linha até cada parada adiante
+    
+    Parâmetros: latitude e longitude do ônibus e direction (direction_id do
+    GTFS, opcional). 404 para linha ou sentido sem itinerário; fora do
+    traçado, ou sem direction em trecho comum à ida e à volta, stops vazio
+    e on_route false.
+    """
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    direction = request.args.get('direction', type=int)
+    if latitude is None or longitude is None or not validate_gps_coordinates(latitude, longitude):
+        return jsonify({'error': 'latitude e longitude válidas são obrigatórias'}), 400
+    
+    engine = get_route_engine()
+    route = engine.get(bus_line, direction)
+    if route is None:
+        return jsonify({'error': f'Linha {bus_line} sem itinerário'}), 404
+    # Sem direction: o sentido cujo traçado passa pela posição (None se ambíguo)
+    resolved = engine.resolve(bus_line, latitude, longitude) if direction is None else route
+    route = resolved or route
+    
+    traffic_factor = get_traffic_factor_by_hour(datetime.now().hour)
+    result = resolved.etas(latitude, longitude, traffic_factor) if resolved else None
+    return jsonify({
+        'bus_line': bus_line,
+        'name': route.name,
+        'direction_id': route.direction,
+        'on_route': result is not None,
+        'along_m': result['along_m'] if result else None,
+        'offset_m': result['offset_m'] if result else None,
+        'progress': result['progress'] if result else None,
+        'traffic_factor': traffic_factor,
+        'stops': result['stops'] if result else [],
+        'source': 'route_engine'
+    }), 200
+
+@simple_location_bp.route('/location/fleet/eta', methods=['GET'])
+def get_fleet_eta():
+    """
+    Endpoint para o ETA de todos os ônibus ativos até as paradas mais próximas
+    
+    Uma matriz do OSRM (/table, em blocos para frotas grandes) no lugar de uma
+    rota por ônibus. Parâmetros: minutes (posição nos últimos N minutos, padrão
+    5), line e stops (paradas por ônibus, padrão OSRM_CONFIG['batch_stops_per_bus']).
+    """
+    try:
+        minutes = request.args.get('minutes', 5, type=int)
+        line = request.args.get('line')
+        stops_per_bus = request.args.get('stops', OSRM_CONFIG['batch_stops_per_bus'], type=int)
+        if minutes < 1 or not 1 <= stops_per_bus <= 10:
+            return jsonify({'error': 'minutes deve ser positivo e stops entre 1 e 10'}), 400
+        
+        bus_repo = get_simple_bus_repository()
+        locations = bus_repo.get_current_locations(bus_line=line, minutes=minutes) if bus_repo else []
+        # Mais recente primeiro: a primeira posição de cada linha é a atual
+        buses = {}
+        for location in merge_latest_positions(locations, line, minutes):
+            buses.setdefault(location['bus_line'], location)
+        buses = list(buses.values())
+        
+        index = get_stop_index()
+        stops_by_bus = [index.nearest(float(b['latitude']), float(b['longitude']), k=stops_per_bus)
+                        for b in buses]
+        traffic_factor = get_traffic_factor_by_hour_osrm(datetime.now().hour)
+        etas = calculate_batch_etas(buses, stops_by_bus, traffic_factor) if buses else []
+        
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'count': len(buses),
+            'traffic_factor': traffic_factor,
+            'buses': [{
+                'bus_line': bus['bus_line'],
+                'latitude': float(bus['latitude']),
+                'longitude': float(bus['longitude']),
+                'etas': bus_etas
+            } for bus, bus_etas in zip(buses, etas)]
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Erro ao calcular ETA da frota: {e}")
+        return jsonify({'error': 'Erro interno do servidor'}), 500
+
 @simple_location_bp.route('/location/current', methods=['GET'])
 def get_current_locations():
     """
@@ -327,8 +704,10 @@ def get_current_locations():
                 'mode': 'fallback'
             }), 200
         
-        # Dados reais do banco
-        locations = bus_repo.get_current_locations(bus_line, minutes)
+        # Dados reais do banco, mais as posições recentes não gravadas (compressão)
+        locations = merge_latest_positions(
+            bus_repo.get_current_locations(bus_line, minutes), bus_line, minutes
+        )
         
         return jsonify({
             'timestamp': datetime.now().isoformat(),
@@ -353,6 +732,7 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'database_connected': db_connected,
+        'osrm_circuit': get_osrm_circuit_status(),
         'mode': 'simple',
         'features': [
             'Localização GPS',
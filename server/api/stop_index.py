@@ -0,0 +1,270 @@
+"""
+Índice espacial das paradas e destinos
+Busca dos k mais próximos e por raio sem percorrer o catálogo inteiro
+
+O catálogo são os DESTINATIONS de config_simple, as paradas do GTFS importado
+(api/gtfs_feed.py, GTFS_CONFIG['feed_zip']) e as de um arquivo no formato
+stops.txt do GTFS (STOP_INDEX_CONFIG['stops_file']: stop_id, stop_name,
+stop_lat, stop_lon e, opcional, location_type). As coordenadas são
+projetadas em metros (equiretangular na latitude média do catálogo) e
+distribuídas em uma grade de células de cell_meters. A busca visita só a
+célula do ponto e os anéis de células em volta, até que nenhuma célula ainda
+não visitada possa ter parada mais próxima que as já encontradas. As
+distâncias devolvidas são Haversine.
+
+O índice é imutável: uma mudança no catálogo (arquivo ou zip com mtime novo) gera
+um índice novo, que substitui o anterior de uma vez só; buscas em andamento
+terminam no índice antigo.
+"""
+
+import csv
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config_simple import DESTINATIONS, GTFS_CONFIG, STOP_INDEX_CONFIG
+from api.geo import FixedPoints
+from api.gtfs_feed import get_gtfs_feed, gtfs_feed_signature
+from api.trajectory import METERS_PER_DEGREE
+from api.utils import calculate_distance_km
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Candidatos a mais na busca dos k mais próximos: a distância projetada difere
+# da Haversine em frações de metro, o que troca a ordem de paradas quase
+# equidistantes na borda dos k
+NEAREST_MARGIN = 4
+
+# Até este tamanho (pontos x paradas), nearest_many calcula a matriz inteira de
+# distâncias com NumPy; acima disso, cada ponto usa a grade
+MATRIX_MAX_CELLS = 2_000_000
+
+class StopIndex:
+    """Grade uniforme sobre as coordenadas projetadas das paradas (somente leitura)."""
+
+    def __init__(self, stops: Dict[str, Dict[str, Any]], cell_meters: float = 500.0):
+        self.cell_meters = cell_meters
+        self.built_at = datetime.now()
+        self._ids = list(stops)
+        self._info = [stops[stop_id] for stop_id in self._ids]
+        self._ref_lat = (sum(s['latitude'] for s in self._info) / len(self._info)) if self._info else 0.0
+        self._x_scale = METERS_PER_DEGREE * math.cos(math.radians(self._ref_lat))
+
+        self._points: List[Tuple[float, float]] = []
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, info in enumerate(self._info):
+            x, y = self._project(info['latitude'], info['longitude'])
+            self._points.append((x, y))
+            self._cells.setdefault(self._cell(x, y), []).append(i)
+
+        self._fixed = FixedPoints([s['latitude'] for s in self._info], [s['longitude'] for s in self._info])
+
+        if self._cells:
+            self._bounds = (min(c[0] for c in self._cells), max(c[0] for c in self._cells),
+                            min(c[1] for c in self._cells), max(c[1] for c in self._cells))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _project(self, latitude: float, longitude: float) -> Tuple[float, float]:
+        return longitude * self._x_scale, latitude * METERS_PER_DEGREE
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(math.floor(x / self.cell_meters)), int(math.floor(y / self.cell_meters))
+
+    def _ring(self, cx: int, cy: int, r: int) -> Iterator[int]:
+        """Paradas das células a exatamente r células (Chebyshev) de (cx, cy)."""
+        if r == 0:
+            yield from self._cells.get((cx, cy), ())
+            return
+        for dx in range(-r, r + 1):
+            yield from self._cells.get((cx + dx, cy - r), ())
+            yield from self._cells.get((cx + dx, cy + r), ())
+        for dy in range(-r + 1, r):
+            yield from self._cells.get((cx - r, cy + dy), ())
+            yield from self._cells.get((cx + r, cy + dy), ())
+
+    def _max_ring(self, cx: int, cy: int) -> int:
+        min_x, max_x, min_y, max_y = self._bounds
+        return max(abs(cx - min_x), abs(cx - max_x), abs(cy - min_y), abs(cy - max_y))
+
+    def _results(self, indices: Iterator[int], latitude: float, longitude: float) -> List[Dict[str, Any]]:
+        """Paradas ordenadas pela distância Haversine (a projeção só seleciona os candidatos)."""
+        ranked = sorted(
+            (calculate_distance_km(latitude, longitude, self._info[i]['latitude'], self._info[i]['longitude']), i)
+            for i in indices
+        )
+        return [self._entry(i, distance) for distance, i in ranked]
+
+    def _entry(self, i: int, distance_km: float) -> Dict[str, Any]:
+        info = self._info[i]
+        return {
+            'id': self._ids[i],
+            'name': info['name'],
+            'latitude': info['latitude'],
+            'longitude': info['longitude'],
+            'type': info['type'],
+            'distance_km': round(float(distance_km), 3)
+        }
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1,
+                max_distance_m: float = None) -> List[Dict[str, Any]]:
+        """As k paradas mais próximas (opcionalmente até max_distance_m), da mais próxima à mais distante."""
+        if not self._cells or k < 1:
+            return []
+        wanted, k = k, k + NEAREST_MARGIN
+        qx, qy = self._project(latitude, longitude)
+        cx, cy = self._cell(qx, qy)
+        limit = max_distance_m ** 2 if max_distance_m is not None else float('inf')
+        best: List[Tuple[float, int]] = []     # heap de máximo: (-distância², índice)
+
+        max_ring = self._max_ring(cx, cy)
+        for r in range(max_ring + 1):
+            # Longe do catálogo, um anel tem mais células que a grade inteira:
+            # as células restantes são percorridas direto
+            exhaustive = 8 * r > len(self._cells)
+            candidates = self._remaining(cx, cy, r) if exhaustive else self._ring(cx, cy, r)
+            for i in candidates:
+                x, y = self._points[i]
+                d2 = (x - qx) ** 2 + (y - qy) ** 2
+                if d2 > limit:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, i))
+                elif d2 < -best[0][0]:
+                    heapq.heapreplace(best, (-d2, i))
+            if exhaustive:
+                break
+            # Células fora do anel r estão a pelo menos r * cell_meters do ponto
+            reach = (r * self.cell_meters) ** 2
+            if (len(best) == k and -best[0][0] <= reach) or reach > limit:
+                break
+
+        return self._results((i for _, i in best), latitude, longitude)[:wanted]
+
+    def nearest_many(self, lats, lons) -> List[Optional[Dict[str, Any]]]:
+        """A parada mais próxima de cada ponto (ex.: todos os ônibus ativos de uma vez)."""
+        if not self._cells:
+            return [None] * len(lats)
+        if len(lats) * len(self) > MATRIX_MAX_CELLS:
+            return [self.nearest(lat, lon)[0] for lat, lon in zip(lats, lons)]
+        indices, distances = self._fixed.nearest(lats, lons)
+        return [self._entry(i, distance) for i, distance in zip(indices.tolist(), distances)]
+
+    def _remaining(self, cx: int, cy: int, r: int) -> Iterator[int]:
+        """Paradas das células a r ou mais células de (cx, cy)."""
+        for (x, y), members in self._cells.items():
+            if max(abs(x - cx), abs(y - cy)) >= r:
+                yield from members
+
+    def within(self, latitude: float, longitude: float, radius_m: float,
+               limit: int = None) -> List[Dict[str, Any]]:
+        """Paradas até radius_m do ponto, da mais próxima à mais distante."""
+        if not self._cells:
+            return []
+        qx, qy = self._project(latitude, longitude)
+        x0, y0 = self._cell(qx - radius_m, qy - radius_m)
+        x1, y1 = self._cell(qx + radius_m, qy + radius_m)
+        radius2 = radius_m ** 2
+
+        found = []
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            cells = self._cells.values()
+        else:
+            cells = (self._cells.get((x, y), ()) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+        for members in cells:
+            for i in members:
+                x, y = self._points[i]
+                d2 = (x - qx) ** 2 + (y - qy) ** 2
+                if d2 <= radius2:
+                    found.append((d2, i))
+
+        found.sort()
+        return self._results((i for _, i in found[:limit]), latitude, longitude)
+
+# ============================================================
+#                   CATÁLOGO E ÍNDICE GLOBAL
+# ============================================================
+
+def load_stops_file(path: str) -> Dict[str, Dict[str, Any]]:
+    """Paradas de um arquivo stops.txt (GTFS); location_type 1 (estação) vira terminal."""
+    stops = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            try:
+                stops[row['stop_id']] = {
+                    'name': row.get('stop_name') or row['stop_id'],
+                    'latitude': float(row['stop_lat']),
+                    'longitude': float(row['stop_lon']),
+                    'type': 'terminal' if row.get('location_type') == '1' else 'parada'
+                }
+            except (KeyError, ValueError):
+                logger.warning(f"Parada ignorada em {path}: {row}")
+    return stops
+
+def build_catalogue(stops_file: str = None) -> Dict[str, Dict[str, Any]]:
+    """DESTINATIONS mais as paradas do GTFS e do arquivo (quando existem)."""
+    catalogue = dict(DESTINATIONS)
+    feed = get_gtfs_feed()
+    if feed is not None:
+        catalogue.update(feed.stops_catalogue())
+    stops_file = stops_file if stops_file is not None else STOP_INDEX_CONFIG['stops_file']
+    if stops_file and os.path.exists(stops_file):
+        catalogue.update(load_stops_file(stops_file))
+    return catalogue
+
+_stop_index: Optional[StopIndex] = None
+_catalogue_signature: Optional[Tuple] = None
+_last_check = 0.0
+_rebuild_lock = threading.Lock()
+
+def _stops_file_mtime() -> Optional[float]:
+    stops_file = STOP_INDEX_CONFIG['stops_file']
+    try:
+        return os.path.getmtime(stops_file) if stops_file else None
+    except OSError:
+        return None
+
+def _catalogue_files_signature() -> Tuple:
+    """Muda quando o stops.txt ou o zip do GTFS mudam."""
+    return (_stops_file_mtime(), gtfs_feed_signature())
+
+def rebuild_stop_index(catalogue: Dict[str, Dict[str, Any]] = None) -> StopIndex:
+    """Constrói um índice novo e o publica no lugar do atual."""
+    global _stop_index, _catalogue_signature
+    with _rebuild_lock:
+        signature = _catalogue_files_signature()
+        index = StopIndex(catalogue if catalogue is not None else build_catalogue(),
+                          STOP_INDEX_CONFIG['cell_meters'])
+        _stop_index, _catalogue_signature = index, signature
+    logger.info(f"Índice de paradas construído: {len(index)} paradas")
+    return index
+
+def get_stop_index() -> StopIndex:
+    """Índice atual, reconstruído quando o arquivo de paradas muda."""
+    global _last_check
+    index = _stop_index
+    if index is None:
+        return rebuild_stop_index()
+    now = time.monotonic()
+    if now - _last_check >= STOP_INDEX_CONFIG['reload_check_seconds']:
+        _last_check = now
+        if _catalogue_files_signature() != _catalogue_signature:
+            return rebuild_stop_index()
+    return index
+
+def get_stop_index_status() -> Dict[str, Any]:
+    index = _stop_index
+    return {
+        'stops': len(index) if index else 0,
+        'cell_meters': STOP_INDEX_CONFIG['cell_meters'],
+        'stops_file': STOP_INDEX_CONFIG['stops_file'] or None,
+        'gtfs_feed': GTFS_CONFIG['feed_zip'] or None,
+        'built_at': index.built_at.isoformat() if index else None
+    }
@@ -0,0 +1,281 @@
+"""
+Compressão de trajetória na ingestão de localizações
+Descarta pontos GPS que não acrescentam informação antes de gravá-los
+
+Ônibus parados ou em trecho reto a velocidade constante mandam uma sequência
+de posições quase idênticas. Para cada ônibus, o compressor guarda o último
+ponto gravado (âncora) e o anterior a ele, e decide na chegada de cada ponto:
+
+- dead-band: deslocamento em relação à âncora menor que deadband_meters é
+  ruído do GPS (ônibus parado) e não é gravado;
+- desvio sincronizado: a posição esperada no instante do ponto é extrapolada
+  da âncora com a velocidade entre os dois últimos pontos gravados (a mesma
+  distância usada pelo Douglas-Peucker com tempo); até tolerance_meters de
+  diferença, o ponto não traz geometria nova e não é gravado;
+- limite de tempo: passados max_interval_seconds desde a âncora, o ponto é
+  gravado de qualquer forma, então cada ônibus ativo tem ao menos um registro
+  nessa janela (consultas de "localizações atuais" continuam vendo o ônibus).
+
+A decisão é tomada na chegada, sem guardar pontos pendentes em memória: um
+worker reciclado (max_requests) ou encerrado não perde nada que seria gravado.
+Pontos descartados atualizam a posição mais recente do ônibus, que
+merge_latest_positions acrescenta às consultas de localizações atuais.
+
+Só leituras com device_id são comprimidas: sem ele, os ônibus de uma linha
+não se distinguem e o estado de um descartaria os pontos dos outros.
+
+O estado fica na memória do processo: as leituras de um dispositivo precisam
+chegar sempre ao mesmo worker (per_device_state_enabled em config_simple.py;
+gunicorn.conf.py roda com um worker só enquanto ele estiver ativo).
+
+Tolerâncias por linha em TRAJECTORY_CONFIG['lines'].
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config_simple import TRAJECTORY_CONFIG
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Metros por grau de latitude (aproximação equiretangular, suficiente para
+# distâncias de dezenas de metros)
+METERS_PER_DEGREE = 111_320.0
+
+# Prefixo de bus_key_for (o restante é o device_id)
+DEVICE_KEY_PREFIX = 'device:'
+
+def _offset_meters(lat0: float, lon0: float, lat: float, lon: float):
+    """Deslocamento (x leste, y norte) em metros de (lat0, lon0) até (lat, lon)."""
+    x = (lon - lon0) * METERS_PER_DEGREE * math.cos(math.radians(lat0))
+    y = (lat - lat0) * METERS_PER_DEGREE
+    return x, y
+
+class _BusTrack:
+    """Estado de um ônibus: âncora, ponto gravado anterior e posição mais recente."""
+    __slots__ = ('bus_line', 'anchor', 'previous', 'latest', 'location_id')
+
+    def __init__(self, bus_line: str):
+        self.bus_line = bus_line
+        self.anchor = None          # (lat, lon, t) do último ponto gravado
+        self.previous = None        # (lat, lon, t) do ponto gravado antes da âncora
+        self.latest = None          # (lat, lon, t) do último ponto recebido
+        self.location_id = None     # id da âncora no banco, quando conhecido
+
+class TrajectoryCompressor:
+    """
+    Compressão por ônibus (bus_key_for: só leituras com device_id)
+
+    Estado limitado a max_tracked_buses (o ônibus há mais tempo sem dados sai primeiro).
+    """
+
+    def __init__(self, deadband_meters: float = 10.0, tolerance_meters: float = 25.0,
+                 max_interval_seconds: float = 120, max_tracked_buses: int = 10000,
+                 lines: Dict[str, Dict[str, float]] = None):
+        self.deadband_meters = deadband_meters
+        self.tolerance_meters = tolerance_meters
+        self.max_interval_seconds = max_interval_seconds
+        self.max_tracked_buses = max_tracked_buses
+        self.lines = lines or {}
+        self._tracks: 'OrderedDict[str, _BusTrack]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def tolerances(self, bus_line: str) -> Dict[str, float]:
+        """Dead-band, tolerância e limite de tempo da linha (com os padrões)."""
+        line = self.lines.get(bus_line, {})
+        return {
+            'deadband_meters': line.get('deadband_meters', self.deadband_meters),
+            'tolerance_meters': line.get('tolerance_meters', self.tolerance_meters),
+            'max_interval_seconds': line.get('max_interval_seconds', self.max_interval_seconds)
+        }
+
+    def _decide(self, track: _BusTrack, lat: float, lon: float, t: float) -> str:
+        """Motivo para gravar ('first', 'interval', 'deviation') ou descartar ('deadband', 'tolerance')."""
+        if track.anchor is None:
+            return 'first'
+        limits = self.tolerances(track.bus_line)
+        a_lat, a_lon, a_t = track.anchor
+        elapsed = t - a_t
+        if elapsed >= limits['max_interval_seconds'] or elapsed < 0:
+            return 'interval'
+
+        x, y = _offset_meters(a_lat, a_lon, lat, lon)
+        if math.hypot(x, y) < limits['deadband_meters']:
+            return 'deadband'
+
+        # Posição esperada: âncora + velocidade dos dois últimos pontos gravados
+        ex, ey = 0.0, 0.0
+        if track.previous is not None:
+            p_lat, p_lon, p_t = track.previous
+            span = a_t - p_t
+            if span > 0:
+                px, py = _offset_meters(a_lat, a_lon, p_lat, p_lon)
+                ex, ey = -px / span * elapsed, -py / span * elapsed
+        if math.hypot(x - ex, y - ey) <= limits['tolerance_meters']:
+            return 'tolerance'
+        return 'deviation'
+
+    def offer(self, bus_key: str, bus_line: str, latitude: float, longitude: float,
+              force: bool = False, now: float = None) -> bool:
+        """
+        Registra um ponto recebido e decide se ele deve ser gravado
+
+        Em ambos os casos a posição mais recente do ônibus é atualizada.
+
+        Args:
+            bus_key: Identificador do ônibus (bus_key_for)
+            bus_line: Linha (tolerâncias e métricas)
+            force: Grava sempre (ex.: ponto com imagem), mantendo a âncora em dia
+            now: Instante do ponto em segundos (padrão: agora)
+
+        Returns:
+            True se o ponto deve ser gravado (vira a nova âncora)
+        """
+        t = time.time() if now is None else now
+        with self._lock:
+            track = self._tracks.get(bus_key)
+            if track is None or track.bus_line != bus_line:
+                track = _BusTrack(bus_line)
+                self._tracks[bus_key] = track
+                while len(self._tracks) > self.max_tracked_buses:
+                    self._tracks.popitem(last=False)
+            self._tracks.move_to_end(bus_key)
+
+            reason = 'forced' if force else self._decide(track, latitude, longitude, t)
+            persist = reason not in ('deadband', 'tolerance')
+            track.latest = (latitude, longitude, t)
+            if persist:
+                track.previous = track.anchor
+                track.anchor = (latitude, longitude, t)
+                track.location_id = None
+
+            stats = self._stats.setdefault(bus_line, {
+                'received': 0, 'persisted': 0, 'deadband': 0, 'tolerance': 0
+            })
+            stats['received'] += 1
+            if persist:
+                stats['persisted'] += 1
+            else:
+                stats[reason] += 1
+        return persist
+
+    def set_location_id(self, bus_key: str, location_id: int):
+        """Associa o id gravado à âncora atual do ônibus."""
+        with self._lock:
+            track = self._tracks.get(bus_key)
+            if track is not None:
+                track.location_id = location_id
+
+    def anchor_location_id(self, bus_key: str) -> Optional[int]:
+        """id do último ponto gravado do ônibus (resposta de pontos descartados)."""
+        track = self._tracks.get(bus_key)
+        return track.location_id if track else None
+
+    def latest_positions(self, bus_line: str = None, minutes: int = 5) -> List[Dict[str, Any]]:
+        """Posições mais recentes que não foram gravadas (mais novas que a âncora)."""
+        cutoff = time.time() - minutes * 60
+        positions = []
+        with self._lock:
+            for key, track in self._tracks.items():
+                if bus_line and track.bus_line != bus_line:
+                    continue
+                if track.latest is None or track.latest == track.anchor or track.latest[2] < cutoff:
+                    continue
+                lat, lon, t = track.latest
+                positions.append({
+                    'id': track.location_id,
+                    'bus_line': track.bus_line,
+                    'device_id': device_id_from_key(key),
+                    'latitude': lat,
+                    'longitude': lon,
+                    'timestamp_location': datetime.fromtimestamp(t),
+                    'compressed': True
+                })
+        return positions
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            by_line = {}
+            received = persisted = 0
+            for line, stats in self._stats.items():
+                received += stats['received']
+                persisted += stats['persisted']
+                by_line[line] = dict(stats, compression_ratio=_ratio(stats['received'], stats['persisted']))
+            return {
+                'enabled': True,
+                'tracked_buses': len(self._tracks),
+                'points_received': received,
+                'points_persisted': persisted,
+                'points_dropped': received - persisted,
+                'compression_ratio': _ratio(received, persisted),
+                'by_line': by_line
+            }
+
+def _ratio(received: int, persisted: int) -> Optional[float]:
+    """Pontos recebidos por ponto gravado (1.0 = sem compressão)."""
+    return round(received / persisted, 2) if persisted else None
+
+# ============================================================
+#                  INSTÂNCIA GLOBAL (POR PROCESSO)
+# ============================================================
+
+trajectory_compressor: Optional[TrajectoryCompressor] = None
+if TRAJECTORY_CONFIG['enabled']:
+    trajectory_compressor = TrajectoryCompressor(
+        TRAJECTORY_CONFIG['deadband_meters'],
+        TRAJECTORY_CONFIG['tolerance_meters'],
+        TRAJECTORY_CONFIG['max_interval_seconds'],
+        TRAJECTORY_CONFIG['max_tracked_buses'],
+        TRAJECTORY_CONFIG['lines']
+    )
+
+def get_trajectory_compressor() -> Optional[TrajectoryCompressor]:
+    return trajectory_compressor
+
+def get_trajectory_status() -> Dict[str, Any]:
+    if trajectory_compressor is None:
+        return {'enabled': False}
+    return trajectory_compressor.get_status()
+
+def device_id_for(data: Dict[str, Any]) -> Optional[str]:
+    """device_id da leitura (sem espaços nas pontas), ou None se o dispositivo não se identifica."""
+    device_id = data.get('device_id')
+    if device_id is None or not str(device_id).strip():
+        return None
+    return str(device_id).strip()
+
+def bus_key_for(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Identificador do ônibus (device_id da leitura), ou None se o dispositivo
+    não se identifica. Estado por ônibus (compressão, velocidades por trecho,
+    sentido da linha, veículo no GTFS-RT) só é mantido com identificador: a
+    linha sozinha mistura os ônibus dela.
+    """
+    device_id = device_id_for(data)
+    return DEVICE_KEY_PREFIX + device_id if device_id else None
+
+def device_id_from_key(bus_key: str) -> Optional[str]:
+    """device_id de um bus_key_for (None para outra chave)."""
+    return bus_key[len(DEVICE_KEY_PREFIX):] if bus_key.startswith(DEVICE_KEY_PREFIX) else None
+
+def merge_latest_positions(locations: List[Dict[str, Any]], bus_line: str = None,
+                           minutes: int = 5) -> List[Dict[str, Any]]:
+    """
+    Acrescenta às localizações do banco as posições recentes não gravadas
+
+    Mantém a ordem por timestamp_location decrescente das consultas de
+    localizações atuais.
+    """
+    if trajectory_compressor is None:
+        return locations
+    latest = trajectory_compressor.latest_positions(bus_line, minutes)
+    if not latest:
+        return locations
+    return sorted(locations + latest, key=lambda loc: loc['timestamp_location'], reverse=True)
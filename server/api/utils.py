@@ -3,14 +3,21 @@ Utilitários compartilhados para as APIs
 Baseado nos requisitos do projeto IoT de monitoramento de ônibus
 """
 
+import base64
+import csv
+import io
+import itertools
 import json
 import logging
 import math
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# Nível de ocupação: regra compartilhada com a camada de banco
+from ml.occupancy_levels import determine_occupancy_level
+
 logger = logging.getLogger(__name__)
 
 def validate_gps_coordinates(latitude: float, longitude: float) -> bool:
@@ -35,6 +42,12 @@ def validate_bus_line(bus_line: str) -> bool:
     
     return True
 
+def validate_device_id(device_id: Optional[str]) -> bool:
+    """
+    Valida o device_id opcional da leitura (cabe em bus_location.device_id)
+    """
+    return device_id is None or len(device_id) <= 64
+
 def parse_timestamp(timestamp_str: Optional[str]) -> datetime:
     """
     Converte string de timestamp para datetime
@@ -58,6 +71,23 @@ def parse_timestamp(timestamp_str: Optional[str]) -> datetime:
             logger.warning(f"Timestamp inválido: {timestamp_str}, usando timestamp atual")
             return datetime.now()
 
+def parse_request_timestamp(data: Dict) -> datetime:
+    """
+    Timestamp enviado pelo ESP32 (campo 'timestamp') ou o horário atual
+    """
+    try:
+        return parse_timestamp(data.get('timestamp'))
+    except Exception:
+        return datetime.now()
+
+def decode_image_base64(image_base64: str) -> bytes:
+    """
+    Remove o prefixo data:image/...;base64, (se houver) e decodifica a imagem
+    """
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]
+    return base64.b64decode(image_base64)
+
 def create_db_connection(config: Dict[str, Any]):
     """
     Cria conexão com banco PostgreSQL
@@ -197,21 +227,6 @@ def calculate_adaptive_interval(current_interval: int, traffic_factor: float,
     
     return new_interval
 
-def determine_occupancy_level(passenger_count: int, max_capacity: int = 50) -> int:
-    """
-    Determina nível de ocupação (0-4) baseado na contagem de passageiros
-    """
-    if passenger_count == 0:
-        return 0  # Vazio
-    elif passenger_count <= max_capacity * 0.25:
-        return 1  # Baixa
-    elif passenger_count <= max_capacity * 0.5:
-        return 2  # Média
-    elif passenger_count <= max_capacity * 0.75:
-        return 3  # Alta
-    else:
-        return 4  # Lotado
-
 def validate_image_data(image_base64: str, max_size_mb: int = 5) -> Tuple[bool, str]:
     """
     Valida dados de imagem em Base64
@@ -228,28 +243,103 @@ def validate_image_data(image_base64: str, max_size_mb: int = 5) -> Tuple[bool,
     
     return True, ""
 
-def get_nearest_destination(latitude: float, longitude: float, destinations: Dict) -> Dict:
+def get_nearest_destination(latitude: float, longitude: float, destinations: Dict = None) -> Optional[Dict]:
     """
     Encontra o destino mais próximo baseado nas coordenadas GPS
+
+    Sem destinations, usa o índice espacial do catálogo de paradas
+    (api/stop_index.py); com um dicionário próprio, monta um índice só para ele.
     """
-    min_distance = float('inf')
-    nearest_dest = None
+    from api.stop_index import StopIndex, get_stop_index
+
+    index = get_stop_index() if destinations is None else StopIndex(destinations)
+    found = index.nearest(latitude, longitude, k=1)
+    if not found:
+        return None
+    nearest_dest = found[0]
+    nearest_dest['distance_km'] = round(nearest_dest['distance_km'], 2)
+    return nearest_dest
+
+def _json_default(value: Any) -> Any:
+    """Serializa tipos do banco (datetime, Decimal) para JSON."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def prefetch_first_batch(batches: Iterator[List[Dict]]) -> Iterator[List[Dict]]:
+    """
+    Lê o primeiro lote antes de a resposta começar
+    Falha ao abrir o cursor ou na primeira leitura sobe aqui (e vira um erro
+    com status próprio), em vez de cortar um 200 já enviado
+    """
+    first = next(batches, None)
+    if first is None:
+        return iter(())
+    return itertools.chain([first], batches)
+
+def iter_ndjson(batches: Iterator[List[Dict]]) -> Iterator[str]:
+    """
+    Converte lotes de linhas em NDJSON (um objeto JSON por linha)
+    Cada lote vira um único bloco de texto enviado ao cliente
+    """
+    for batch in batches:
+        yield ''.join(json.dumps(row, default=_json_default) + '\n' for row in batch)
+
+def iter_csv(batches: Iterator[List[Dict]], columns: List[str]) -> Iterator[str]:
+    """
+    Converte lotes de linhas em CSV com cabeçalho
+    Cada lote vira um único bloco de texto enviado ao cliente
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in batch:
+            writer.writerow([
+                row[col].isoformat() if isinstance(row[col], datetime) else row[col]
+                for col in columns
+            ])
+        yield buffer.getvalue()
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """
+    Gera token opaco de continuação para paginação por keyset (timestamp, id)
+    """
+    payload = json.dumps({'t': timestamp.isoformat(), 'id': row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    """
+    Decodifica token gerado por encode_cursor
+    Levanta ValueError se o token for inválido
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload['t']), int(payload['id'])
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {token}") from e
+
+def validate_page_limit(limit: int, max_limit: int) -> Tuple[bool, str]:
+    """
+    Valida o tamanho de página pedido (1 <= limit <= max_limit)
+    """
+    if limit is None or not 1 <= limit <= max_limit:
+        return False, f"Parâmetro 'limit' deve estar entre 1 e {max_limit}"
+    return True, ""
+
+def paginate_rows(rows: List[Dict], limit: int, timestamp_field: str) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Separa a página do excedente (consultas pedem limit + 1 linhas)
+    Retorna (linhas da página, cursor da próxima página ou None)
+    """
+    if len(rows) <= limit:
+        return rows, None
     
-    for dest_id, dest_info in destinations.items():
-        distance = calculate_distance_km(
-            latitude, longitude,
-            dest_info['latitude'], dest_info['longitude']
-        )
-        
-        if distance < min_distance:
-            min_distance = distance
-            nearest_dest = {
-                'id': dest_id,
-                'name': dest_info['name'],
-                'latitude': dest_info['latitude'],
-                'longitude': dest_info['longitude'],
-                'type': dest_info['type'],
-                'distance_km': round(distance, 2)
-            }
-    
-    return nearest_dest
\ No newline at end of file
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(last[timestamp_field], last['id'])
@@ -0,0 +1,98 @@
+"""
+Servidor ASGI alternativo para APIs de monitoramento de ônibus IoT
+Mesmos contratos do servidor Flask (main.py), com handlers assíncronos
+
+Os endpoints de alto volume (/api/location, /api/image/analyze,
+/api/location-image e /api/dashboard/*) são atendidos por api/async_api.py
+sobre o pool assíncrono de conexões. Qualquer outra rota é repassada à
+aplicação Flask, montada como WSGI, então a API completa continua disponível.
+
+Para executar:
+    python asgi_app.py
+    # ou
+    uvicorn asgi_app:app --host 0.0.0.0 --port 3000
+
+Requer: pip install starlette uvicorn "psycopg[binary,pool]"
+"""
+
+import os
+import sys
+import logging
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Mount
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+# Adiciona o diretório server ao path para imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config_simple import ASGI_CONFIG, CORS_CONFIG, DATABASE_CONFIG, LOGGING_CONFIG
+from main import create_app, initialize_services, shutdown_services
+from database.async_connection import initialize_async_database, close_async_database
+from api.async_api import async_routes, start_inference_executor, shutdown_inference_executor
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Cria pools e executores no startup (por processo) e os libera no shutdown."""
+    if await initialize_async_database(DATABASE_CONFIG):
+        logger.info("Servidor ASGI usando banco de dados (pool assíncrono)")
+    else:
+        logger.warning("Servidor ASGI em modo fallback (sem banco de dados)")
+
+    # Recursos síncronos usados pelas rotas Flask montadas
+    await run_in_threadpool(initialize_services)
+    start_inference_executor()
+
+    yield
+
+    shutdown_inference_executor()
+    await run_in_threadpool(shutdown_services)
+    await close_async_database()
+
+def create_asgi_app() -> Starlette:
+    """
+    Cria a aplicação ASGI
+
+    CORS é aplicado aqui, para todas as rotas; por isso o Flask montado
+    é criado sem Flask-CORS (evita cabeçalhos duplicados).
+    """
+    flask_app = create_app(enable_cors=False)
+
+    return Starlette(
+        routes=async_routes + [Mount('/', app=WSGIMiddleware(flask_app))],
+        middleware=[
+            Middleware(
+                CORSMiddleware,
+                allow_origins=CORS_CONFIG['origins'],
+                allow_methods=CORS_CONFIG['methods'],
+                allow_headers=CORS_CONFIG['allow_headers']
+            )
+        ],
+        lifespan=lifespan
+    )
+
+app = create_asgi_app()
+
+if __name__ == '__main__':
+    import uvicorn
+
+    logger.info("Iniciando servidor ASGI de monitoramento de ônibus IoT...")
+
+    uvicorn.run(
+        app,
+        host=ASGI_CONFIG['host'],
+        port=ASGI_CONFIG['port'],
+        limit_concurrency=ASGI_CONFIG['limit_concurrency'],
+        backlog=ASGI_CONFIG['backlog'],
+        log_level=LOGGING_CONFIG['level'].lower()
+    )
@@ -22,6 +22,13 @@ DATABASE_CONFIG: Dict[str, Any] = {
     'port': int(os.getenv('DB_PORT', '5432')),
 }
 
+# Pool de conexões da camada assíncrona (database/async_connection.py, psycopg 3)
+ASYNC_DB_CONFIG: Dict[str, Any] = {
+    'pool_min_size': int(os.getenv('DB_POOL_MIN', '2')),    # Conexões mantidas abertas
+    'pool_max_size': int(os.getenv('DB_POOL_MAX', '20')),   # Limite de consultas simultâneas
+    'pool_timeout_seconds': 10.0                            # Espera máxima por uma conexão livre
+}
+
 # Configurações da API
 # Padrão: Flask em http://0.0.0.0:3000
 # O frontend Next.js, em desenvolvimento, roda em http://localhost:3001.
@@ -31,6 +38,24 @@ API_CONFIG: Dict[str, Any] = {
     'host': os.getenv('API_HOST', '0.0.0.0'),
     'port': int(os.getenv('API_PORT', '3000')),
     'debug': os.getenv('API_DEBUG', 'True').lower() == 'true',
+    # Produção (gunicorn.conf.py)
+    'workers': int(os.getenv('API_WORKERS', '1')),                  # Processos; 1 com estado por ônibus em memória (per_device_state_enabled)
+    'threads': int(os.getenv('API_THREADS', '4')),                  # Threads por processo; também o tamanho do pool de conexões
+    'timeout': int(os.getenv('API_TIMEOUT', '60')),                 # Worker sem resposta por mais que isso é reiniciado
+    'graceful_timeout': int(os.getenv('API_GRACEFUL_TIMEOUT', '90')), # Tempo para concluir requisições em andamento no reload
+    'keepalive': int(os.getenv('API_KEEPALIVE', '5')),              # Segundos mantendo conexões keep-alive
+    'max_requests': int(os.getenv('API_MAX_REQUESTS', '5000')),     # Recicla o worker após N requisições (0 = nunca)
+    'max_requests_jitter': 500,                                     # Evita reciclar todos os workers juntos
+    'inference_threads': int(os.getenv('INFERENCE_THREADS', '1'))  # Threads de torch/OpenCV por worker
+}
+
+# Servidor ASGI alternativo (asgi_app.py, uvicorn)
+ASGI_CONFIG: Dict[str, Any] = {
+    'host': os.getenv('API_HOST', '0.0.0.0'),
+    'port': int(os.getenv('API_PORT', '3000')),
+    'inference_workers': int(os.getenv('INFERENCE_WORKERS', '2')),          # Threads de inferência (YOLO/OpenCV)
+    'limit_concurrency': int(os.getenv('ASGI_LIMIT_CONCURRENCY', '10000')), # Conexões simultâneas antes de 503
+    'backlog': 4096                                                         # Fila de conexões do socket
 }
 
 # Configurações de ETA simplificado
@@ -41,6 +66,55 @@ ETA_CONFIG: Dict[str, Any] = {
     'confidence_simple': 80.0       # Confiança do cálculo simplificado
 }
 
+# Configurações do OSRM (cálculo de rota real)
+OSRM_CONFIG: Dict[str, Any] = {
+    'server_url': os.getenv('OSRM_SERVER_URL', 'http://router.project-osrm.org'),
+    'profile': 'driving',               # Perfil de roteamento
+    'timeout_seconds': 5,               # Timeout de cada tentativa
+    'max_retries': 2,                   # Novas tentativas em falhas transitórias (conexão, 429, 5xx)
+    'deadline_seconds': 8,              # Prazo total de uma chamada, com as novas tentativas
+    'backoff_base_seconds': 0.2,        # Espera aleatória até base * 2^tentativa...
+    'backoff_max_seconds': 2.0,         # ...limitada a este valor
+    'pool_maxsize': 20,                 # Conexões keep-alive mantidas com o servidor
+    'async_concurrency': 20,            # Rotas simultâneas no cliente assíncrono
+    'confidence_osrm': 90.0,            # Confiança do OSRM (alta)
+    'confidence_fallback': 60.0,        # Confiança do fallback manual (média)
+    'table_max_coordinates': 100,       # Coordenadas por requisição /table (max-table-size do osrm-routed)
+    'table_timeout_seconds': 10,        # Timeout de cada tentativa /table
+    'table_deadline_seconds': 20,       # Prazo de cada requisição /table
+    'batch_stops_per_bus': 3            # Paradas mais próximas de cada ônibus no ETA em lote
+}
+
+# Cache das rotas do OSRM (api/route_cache.py): leituras seguidas do mesmo ônibus
+# para a mesma parada caem na mesma célula e reaproveitam a rota
+ROUTE_CACHE_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('OSRM_ROUTE_CACHE', 'true').lower() == 'true',
+    'cell_meters': 100.0,                   # Lado da célula em que a origem é quantizada
+    'ttl_seconds': 300,                     # Validade de uma rota guardada
+    'max_entries': 20000,                   # Rotas guardadas por processo (LRU)
+    'interpolate': True,                    # Ajusta a rota guardada à posição exata (e usa células vizinhas)
+    'min_interpolation_meters': 50.0        # Abaixo disso da parada, a rota guardada vale como está
+}
+
+# Disjuntor do OSRM (api/circuit_breaker.py): com o OSRM lento ou fora do ar, as
+# chamadas falham na hora e o ETA usa o cálculo manual
+OSRM_CIRCUIT_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('OSRM_CIRCUIT_BREAKER', 'true').lower() == 'true',
+    'window_seconds': 30,                   # Janela móvel de resultados e latências
+    'min_calls': 10,                        # Chamadas na janela antes de avaliar as taxas
+    'error_rate_threshold': 0.5,            # Taxa de erro que abre o disjuntor
+    'slow_call_ms': 2000,                   # Chamada acima disso conta como lenta...
+    'slow_rate_threshold': 0.8,             # ...e esta taxa de lentas abre o disjuntor
+    'open_seconds': 15,                     # Intervalo entre os testes com o disjuntor aberto
+    'half_open_max_calls': 3                # Chamadas de teste (todas com sucesso fecham)
+}
+
+# Perfil de atraso por linha x dia da semana x hora (ajuste histórico do ETA)
+DELAY_PROFILE_CONFIG: Dict[str, Any] = {
+    'refresh_interval_seconds': 300,    # Intervalo da atualização incremental em background
+    'min_samples': 3                    # Amostras mínimas para aplicar o ajuste
+}
+
 # Coordenadas de destinos/paradas importantes (Recife)
 DESTINATIONS: Dict[str, Dict[str, Any]] = {
     'terminal_central': {
@@ -69,6 +143,60 @@ DESTINATIONS: Dict[str, Dict[str, Any]] = {
     }
 }
 
+# Índice espacial de paradas (api/stop_index.py): DESTINATIONS mais as paradas
+# de um stops.txt (GTFS), quando configurado
+STOP_INDEX_CONFIG: Dict[str, Any] = {
+    'stops_file': os.getenv('STOPS_FILE', ''),  # Caminho do stops.txt (vazio: só DESTINATIONS)
+    'cell_meters': 500.0,                   # Lado das células da grade
+    'reload_check_seconds': 30,             # Intervalo entre verificações de mudança no arquivo
+    'max_results': 100                      # Limite de paradas por consulta em /location/stops/nearby
+}
+
+# GTFS estático (api/gtfs_feed.py): paradas, linhas e traçados de um .zip, com
+# snapshot binário (.npy) mapeado em memória nas próximas inicializações
+GTFS_CONFIG: Dict[str, Any] = {
+    'feed_zip': os.getenv('GTFS_FEED', ''),  # Caminho do .zip do GTFS (vazio: sem GTFS)
+    'snapshot_dir': os.getenv('GTFS_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gtfs_cache')),
+    'mmap': True,                           # Abre o snapshot com mmap (páginas compartilhadas entre workers)
+    'route_lines': True                     # Linhas do GTFS no ETA pelo itinerário (arquivos .json têm prioridade)
+}
+
+# ETA pelo itinerário da linha (api/route_engine.py): traçado e paradas em ordem
+# de <routes_dir>/<linha>.json; linhas sem arquivo seguem com o cálculo simplificado
+ROUTE_ENGINE_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('ROUTE_ENGINE', 'true').lower() == 'true',
+    'routes_dir': os.getenv('ROUTES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'routes')),
+    'default_speed_kmh': ETA_CONFIG['default_speed_kmh'],  # Sem travel_seconds nem speed_kmh no arquivo
+    'dwell_seconds': 20,                    # Tempo parado em cada parada intermediária
+    'max_offset_meters': 150.0,             # Acima disso do traçado, a posição está fora do itinerário
+    'confidence_percent': 85.0,             # Confiança do ETA pelo itinerário
+    'reload_check_seconds': 30,             # Intervalo entre verificações de mudança nos arquivos
+    'direction_min_move_meters': 30.0,      # Avanço que define o sentido quando ida e volta se sobrepõem
+    'direction_memory_seconds': 600         # Sem leitura nesse intervalo, o sentido do ônibus é esquecido
+}
+
+# Feeds GTFS-Realtime (api/gtfs_realtime.py): posições e previsões de chegada em
+# protobuf, codificados uma vez por tick em /gtfs-rt/vehicle_positions e /trip_updates
+GTFS_RT_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('GTFS_RT', 'true').lower() == 'true',
+    'tick_seconds': float(os.getenv('GTFS_RT_TICK_SECONDS', '10')),  # Intervalo entre codificações
+    'max_age_minutes': 5                    # Posições mais antigas que isso ficam fora do feed
+}
+
+# Velocidades aprendidas por trecho do itinerário (ml/segment_speeds.py): média
+# e variância ponderadas por trecho entre paradas, dia da semana e faixa
+# horária, a partir de leituras GPS consecutivas do mesmo ônibus (device_id)
+SEGMENT_SPEED_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('SEGMENT_SPEEDS', 'true').lower() == 'true',
+    'path': os.getenv('SEGMENT_SPEEDS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'segment_speeds.npz')),
+    'bucket_hours': 1,                      # Largura da faixa horária (divisor de 24)
+    'min_samples': 3,                       # Observações mínimas para usar a velocidade do trecho
+    'min_move_meters': 30.0,                # Deslocamento mínimo entre leituras para medir
+    'max_gap_seconds': 300,                 # Intervalo maior que isso não vira observação
+    'max_speed_kmh': 90.0,                  # Acima disso a observação é descartada (GPS ruim)
+    'persist_seconds': 300                  # Intervalo entre gravações do arquivo
+}
+
 # Configurações de intervalos adaptativos
 INTERVAL_CONFIG: Dict[str, Any] = {
     'default_interval_seconds': 30,     # Intervalo padrão
@@ -102,6 +230,83 @@ VALIDATION_CONFIG: Dict[str, Any] = {
     'bus_line_pattern': r'^[A-Z0-9\-]+$'  # Padrão para linha de ônibus
 }
 
+# Exportações em streaming (cursor do lado do servidor)
+EXPORT_CONFIG: Dict[str, Any] = {
+    'batch_size': 2000,                 # Linhas por lote lido do banco / enviado ao cliente
+    'formats': ['ndjson', 'csv']        # Formatos suportados
+}
+
+# Paginação por cursor dos históricos (location/history, location/eta, image/analyses)
+PAGINATION_CONFIG: Dict[str, Any] = {
+    'max_limit': 500                    # Maior 'limit' aceito por página (400 acima disso)
+}
+
+# Spool local de gravações enquanto o banco está indisponível (database/spool.py)
+SPOOL_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('SPOOL_ENABLED', 'true').lower() == 'true',
+    'directory': os.getenv('SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool')),
+    'segment_max_bytes': 8 * 1024 * 1024,   # Tamanho a partir do qual o segmento é fechado
+    'fsync_interval_seconds': 0.2,          # fsync em lote: no máximo esta janela fica só no cache do SO
+    'retry_interval_seconds': 10,           # Intervalo entre tentativas de reconexão/reenvio
+    # Segmento que falha com o banco no ar (registro inválido) vai para quarentena (.failed)
+    # depois desta quantidade de tentativas, sem bloquear os seguintes
+    'max_replay_attempts': int(os.getenv('SPOOL_MAX_REPLAY_ATTEMPTS', 3))
+}
+
+# Compressão de trajetória na ingestão (api/trajectory.py)
+TRAJECTORY_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('TRAJECTORY_COMPRESSION', 'true').lower() == 'true',
+    'deadband_meters': 10.0,                # Deslocamento menor que isso é ruído do GPS (ônibus parado)
+    'tolerance_meters': 25.0,               # Desvio máximo em relação à posição extrapolada
+    'max_interval_seconds': 120,            # Grava ao menos um ponto por ônibus neste intervalo
+    'max_tracked_buses': 10000,             # Ônibus com estado em memória por processo
+    'lines': {                              # Tolerâncias por linha (sobrescrevem as de cima)
+        'BRT-1': {'tolerance_meters': 40.0}
+    }
+}
+
+# Deduplicação de reenvios dos dispositivos (api/idempotency.py)
+IDEMPOTENCY_CONFIG: Dict[str, Any] = {
+    'ttl_seconds': 600,                     # Tempo em que uma resposta fica disponível para repetição
+    'max_entries': 10000,                   # Limite de respostas guardadas por processo (LRU)
+    'max_bytes': 64 * 1024 * 1024,          # Limite de memória das respostas guardadas
+    'inflight_wait_seconds': 15,            # Espera máxima por uma requisição igual ainda em andamento
+    'header': 'Idempotency-Key'             # Cabeçalho opcional com a chave da requisição
+}
+
+# Arquivamento do histórico de GPS antigo (database/archive.py)
+ARCHIVE_CONFIG: Dict[str, Any] = {
+    'directory': os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')),
+    'older_than_days': int(os.getenv('ARCHIVE_OLDER_THAN_DAYS', '30')),  # Idade mínima dos pontos arquivados
+    'bucket_seconds': 60,                   # Histórico reduzido: um ponto por linha neste intervalo
+    'batch_size': 20000,                    # Pontos por lote (um arquivo e uma transação por lote)
+    'format': os.getenv('ARCHIVE_FORMAT', 'auto'),  # 'parquet' (requer pyarrow), 'npz' ou 'auto'
+    'orphan_grace_seconds': 3600,           # Arquivos sem manifesto mais velhos que isso são removidos
+    'max_query_rows': 10000                 # Limite de pontos por consulta ao histórico arquivado
+}
+
+# Exportação incremental para o Power BI (database/bi_export.py)
+BI_EXPORT_CONFIG: Dict[str, Any] = {
+    'directory': os.getenv('BI_EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bi_export')),
+    'format': os.getenv('BI_EXPORT_FORMAT', 'auto'),  # 'parquet' (requer pyarrow), 'csv' ou 'auto'
+    'parquet_compression': 'snappy',        # Codec lido pelo conector Parquet do Power BI
+    'batch_size': 50000,                    # Linhas por lote (um arquivo por data e lote)
+    'arrival_settle_seconds': 300,          # Chegadas registradas há menos que isso ficam para a próxima execução
+    'max_gap_ids': 100000                   # Lacunas (ids ainda invisíveis) guardadas por tabela
+}
+
+# Tempo das consultas e captura de planos lentos (database/query_stats.py)
+QUERY_STATS_CONFIG: Dict[str, Any] = {
+    'enabled': os.getenv('QUERY_STATS', 'true').lower() == 'true',
+    'slow_threshold_ms': float(os.getenv('SLOW_QUERY_MS', '200')),  # Execução lenta a partir disso
+    'explain_sample_rate': 0.1,             # Fração das execuções lentas com plano capturado
+    'explain_cooldown_seconds': 300,        # No máximo um EXPLAIN por consulta neste intervalo
+    'explain_timeout_ms': 5000,             # statement_timeout do EXPLAIN (repete a consulta)
+    'max_queries': 500,                     # Consultas distintas acompanhadas por processo
+    'ring_size': 50,                        # Planos guardados (os mais antigos saem primeiro)
+    'top_n': 10                             # Consultas listadas por padrão em /api/dashboard/queries
+}
+
 # Configurações de logging
 LOGGING_CONFIG: Dict[str, Any] = {
     'level': 'INFO',
@@ -156,6 +361,15 @@ def get_traffic_factor_by_hour(hour: int) -> float:
     """
     return TRAFFIC_FACTORS.get(hour, 1.0)
 
+def per_device_state_enabled() -> bool:
+    """
+    Há estado por ônibus em memória: compressão de trajetória (âncoras e posição
+    mais recente), sentido da linha (DirectionTracker) e âncoras das velocidades
+    por trecho. As leituras de um dispositivo precisam cair sempre no mesmo
+    processo, então o servidor roda com um worker só (gunicorn.conf.py).
+    """
+    return TRAJECTORY_CONFIG['enabled'] or ROUTE_ENGINE_CONFIG['enabled']
+
 # Configurações de desenvolvimento
 DEV_CONFIG: Dict[str, Any] = {
     'enable_fallback_mode': True,       # Habilita modo fallback
@@ -0,0 +1,299 @@
+"""
+Arquivamento do histórico de GPS antigo
+Tira de bus_location os pontos que quase nunca são lidos em resolução total
+
+Pontos mais antigos que ARCHIVE_CONFIG['older_than_days'] são arquivados em
+lotes, um lote por transação:
+
+1. o lote é selecionado em ordem de tempo e travado (FOR UPDATE);
+2. os pontos brutos são gravados em um arquivo colunar comprimido no
+   diretório de arquivo (Parquet com pyarrow instalado, senão .npz do numpy);
+3. na mesma transação, as linhas saem de bus_location, o primeiro ponto de
+   cada ônibus (linha e device_id) a cada bucket_seconds vai para
+   bus_location_archive e o arquivo é registrado em location_archive_manifest.
+
+Se o commit falhar, o arquivo fica sem manifesto e é removido na próxima
+execução (depois de orphan_grace_seconds); as linhas continuam no banco e
+entram em um lote seguinte. Localizações com imagem não são arquivadas.
+
+Consultas: downsampled_history lê o histórico reduzido; read_archived_locations
+localiza pelo manifesto os arquivos do intervalo e devolve os pontos brutos.
+
+Uso:
+    python -m database.maintenance archive-history [--older-than-days 30]
+"""
+
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Adiciona o diretório server ao path para imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_simple import ARCHIVE_CONFIG
+from database import queries
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Colunas dos arquivos de pontos brutos (as de bus_location; device_id '' nas
+# leituras sem identificador)
+ARCHIVE_COLUMNS = ('id', 'bus_line', 'device_id', 'timestamp_location', 'latitude', 'longitude')
+
+FILE_EXTENSIONS = {'parquet': '.parquet', 'npz': '.npz'}
+
+def resolve_format(file_format: str = None) -> str:
+    """Formato dos arquivos: o configurado, ou Parquet quando pyarrow está instalado."""
+    file_format = file_format or ARCHIVE_CONFIG['format']
+    if file_format == 'auto':
+        return 'parquet' if PARQUET_AVAILABLE else 'npz'
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError(f"Formato de arquivo inválido: {file_format}")
+    if file_format == 'parquet' and not PARQUET_AVAILABLE:
+        raise ImportError("pyarrow não instalado: pip install pyarrow")
+    return file_format
+
+# ============================================================
+#                    ARQUIVOS COLUNARES
+# ============================================================
+
+def rows_to_columns(rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Linhas de bus_location em colunas tipadas."""
+    return {
+        'id': np.array([r['id'] for r in rows], dtype=np.int64),
+        'bus_line': np.array([r['bus_line'] for r in rows], dtype=str),
+        'device_id': np.array([r.get('device_id') or '' for r in rows], dtype=str),
+        'timestamp_location': np.array([r['timestamp_location'] for r in rows], dtype='datetime64[us]'),
+        'latitude': np.array([r['latitude'] for r in rows], dtype=np.float64),
+        'longitude': np.array([r['longitude'] for r in rows], dtype=np.float64),
+    }
+
+def write_columnar(path: Path, columns: Dict[str, np.ndarray], file_format: str) -> int:
+    """
+    Grava as colunas em path (temporário + rename, com fsync)
+
+    Returns:
+        Tamanho do arquivo em bytes
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+
+    with open(tmp_path, 'wb') as f:
+        if file_format == 'parquet':
+            table = pa.table({name: pa.array(values) for name, values in columns.items()})
+            pq.write_table(table, f, compression='zstd')
+        else:
+            np.savez_compressed(f, **columns)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    fsync_directory(path.parent)
+    return path.stat().st_size
+
+def read_columnar(path: Path, file_format: str) -> Dict[str, np.ndarray]:
+    """Colunas de um arquivo gravado por write_columnar."""
+    if file_format == 'parquet':
+        if not PARQUET_AVAILABLE:
+            raise ImportError("pyarrow não instalado: pip install pyarrow")
+        table = pq.read_table(path, columns=list(ARCHIVE_COLUMNS))
+        return {name: table.column(name).to_numpy() for name in ARCHIVE_COLUMNS}
+
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in ARCHIVE_COLUMNS}
+
+def fsync_directory(directory: Path):
+    """Persiste criação/renomeação de arquivos (metadados do diretório)."""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# ============================================================
+#                       ARQUIVAMENTO
+# ============================================================
+
+def _relative_path(rows: List[Dict[str, Any]], file_format: str) -> str:
+    """Caminho do arquivo do lote: ano/mês do ponto mais antigo e faixa de ids."""
+    first = rows[0]['timestamp_location']
+    ids = [r['id'] for r in rows]
+    return f"{first:%Y/%m}/locations_{min(ids)}_{max(ids)}{FILE_EXTENSIONS[file_format]}"
+
+def archive_batch(db, directory: Path, cutoff: datetime, after: Tuple[datetime, int],
+                  batch_size: int, bucket_seconds: int,
+                  file_format: str) -> Optional[Dict[str, Any]]:
+    """
+    Arquiva um lote de pontos anteriores a cutoff, depois da posição 'after'
+
+    Args:
+        db: SimpleDatabaseManager conectado
+        after: (timestamp_location, id) do último ponto do lote anterior
+
+    Returns:
+        Resumo do lote (inclui 'last', a posição para o próximo), ou None se
+        não há mais pontos a arquivar
+    """
+    with db.get_cursor() as cursor:
+        cursor.execute(queries.SELECT_ARCHIVE_BATCH, (cutoff, after[0], after[1], batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.connection.rollback()
+            return None
+
+        relative_path = _relative_path(rows, file_format)
+        path = directory / relative_path
+        file_bytes = write_columnar(path, rows_to_columns(rows), file_format)
+
+        try:
+            ids = [r['id'] for r in rows]
+            cursor.execute(queries.ARCHIVE_LOCATIONS, (ids, bucket_seconds, bucket_seconds))
+            result = dict(cursor.fetchone())
+            cursor.execute(queries.INSERT_ARCHIVE_MANIFEST, (
+                relative_path, file_format, file_bytes, len(rows),
+                rows[0]['timestamp_location'], rows[-1]['timestamp_location'],
+                min(ids), max(ids), sorted({r['bus_line'] for r in rows}), bucket_seconds
+            ))
+            cursor.connection.commit()
+        except Exception:
+            # Sem manifesto o arquivo não vale nada: as linhas continuam no banco
+            path.unlink(missing_ok=True)
+            raise
+
+    last = rows[-1]
+    return {
+        'file_path': relative_path,
+        'file_bytes': file_bytes,
+        'rows': result['deleted'],
+        'buckets': result['buckets'],
+        'last': (last['timestamp_location'], last['id'])
+    }
+
+def remove_orphan_files(db, directory: Path, grace_seconds: float) -> int:
+    """
+    Remove arquivos sem entrada no manifesto (lote cujo commit falhou)
+
+    Só remove os mais velhos que grace_seconds, para não apagar o arquivo de
+    um lote de outra execução que ainda não fez commit.
+    """
+    if not directory.exists():
+        return 0
+    rows = db.execute_query(queries.ARCHIVE_MANIFEST_FILES, fetch=True)
+    if rows is None:
+        return 0
+    registered = {r['file_path'] for r in rows}
+    limit = time.time() - grace_seconds
+
+    removed = 0
+    for path in directory.rglob('locations_*'):
+        relative_path = path.relative_to(directory).as_posix()
+        if relative_path in registered or path.stat().st_mtime > limit:
+            continue
+        path.unlink(missing_ok=True)
+        removed += 1
+        logger.warning(f"Arquivo sem manifesto removido: {relative_path}")
+    return removed
+
+def archive_history(db, older_than_days: int = None, bucket_seconds: int = None,
+                    batch_size: int = None, directory: str = None, file_format: str = None,
+                    max_batches: int = None) -> Dict[str, Any]:
+    """
+    Arquiva todos os pontos mais antigos que older_than_days, lote a lote
+
+    Parâmetros omitidos vêm de ARCHIVE_CONFIG.
+
+    Returns:
+        Totais: lotes, pontos arquivados, pontos mantidos no histórico
+        reduzido, bytes gravados e arquivos órfãos removidos
+    """
+    older_than_days = older_than_days if older_than_days is not None else ARCHIVE_CONFIG['older_than_days']
+    bucket_seconds = bucket_seconds or ARCHIVE_CONFIG['bucket_seconds']
+    batch_size = batch_size or ARCHIVE_CONFIG['batch_size']
+    directory = Path(directory or ARCHIVE_CONFIG['directory'])
+    file_format = resolve_format(file_format)
+
+    totals = {
+        'batches': 0, 'rows': 0, 'buckets': 0, 'file_bytes': 0,
+        'orphans_removed': remove_orphan_files(db, directory, ARCHIVE_CONFIG['orphan_grace_seconds'])
+    }
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    after = (datetime.min, 0)
+
+    while max_batches is None or totals['batches'] < max_batches:
+        batch = archive_batch(db, directory, cutoff, after, batch_size, bucket_seconds, file_format)
+        if batch is None:
+            break
+        after = batch['last']
+        totals['batches'] += 1
+        totals['rows'] += batch['rows']
+        totals['buckets'] += batch['buckets']
+        totals['file_bytes'] += batch['file_bytes']
+        logger.info(
+            f"Arquivamento: {batch['file_path']} ({batch['rows']} pontos, "
+            f"{batch['file_bytes']} bytes); total {totals['rows']} pontos"
+        )
+
+    return totals
+
+# ============================================================
+#                 CONSULTA AO HISTÓRICO ARQUIVADO
+# ============================================================
+
+def downsampled_history(db, bus_line: str, start: datetime, end: datetime,
+                        limit: int = 1000) -> List[Dict[str, Any]]:
+    """Histórico reduzido (bus_location_archive) da linha em [start, end)."""
+    query, params = queries.downsampled_history_query(bus_line, start, end, limit)
+    return db.execute_query(query, params, fetch=True) or []
+
+def read_archived_locations(db, bus_line: str, start: datetime, end: datetime,
+                            limit: int = None, directory: str = None) -> List[Dict[str, Any]]:
+    """
+    Pontos brutos arquivados da linha em [start, end), em ordem de tempo
+
+    Lê só os arquivos que o manifesto indica para o intervalo e a linha.
+    """
+    directory = Path(directory or ARCHIVE_CONFIG['directory'])
+    query, params = queries.archived_files_query(bus_line, start, end)
+    files = db.execute_query(query, params, fetch=True) or []
+
+    lo, hi = np.datetime64(start, 'us'), np.datetime64(end, 'us')
+    locations = []
+    for entry in files:
+        path = directory / entry['file_path']
+        try:
+            columns = read_columnar(path, entry['file_format'])
+        except FileNotFoundError:
+            logger.error(f"Arquivo do manifesto não encontrado: {entry['file_path']}")
+            continue
+
+        timestamps = columns['timestamp_location'].astype('datetime64[us]')
+        mask = (columns['bus_line'] == bus_line) & (timestamps >= lo) & (timestamps < hi)
+        for i in np.flatnonzero(mask):
+            locations.append({
+                'id': int(columns['id'][i]),
+                'bus_line': bus_line,
+                'device_id': str(columns['device_id'][i]) or None,
+                'latitude': float(columns['latitude'][i]),
+                'longitude': float(columns['longitude'][i]),
+                'timestamp_location': timestamps[i].item()
+            })
+        if limit and len(locations) >= limit:
+            break
+
+    locations.sort(key=lambda loc: (loc['timestamp_location'], loc['id']))
+    return locations[:limit] if limit else locations
@@ -0,0 +1,337 @@
+"""
+Camada de Banco de Dados Assíncrona (psycopg 3 + pool)
+Contraparte de simple_connection.py para servidores ASGI
+
+Os repositórios expõem os mesmos métodos dos repositórios síncronos, como
+corrotinas, e usam o mesmo SQL (database/queries.py). Enquanto uma consulta
+espera o banco, o event loop atende outras requisições; o número de consultas
+simultâneas é limitado pelo tamanho do pool, não por threads.
+"""
+
+import logging
+import os
+import uuid
+from typing import Dict, List, Optional, Any, Tuple, AsyncIterator
+from datetime import datetime
+
+from config_simple import ASYNC_DB_CONFIG
+from database import queries
+
+try:
+    from psycopg.conninfo import make_conninfo
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+    ASYNC_DB_AVAILABLE = True
+except ImportError:
+    ASYNC_DB_AVAILABLE = False
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#           GERENCIADOR DE BANCO DE DADOS (ASSÍNCRONO)
+# ============================================================
+
+class AsyncDatabaseManager:
+    """
+    Gerenciador de conexões PostgreSQL com pool assíncrono
+
+    Mesma semântica de SimpleDatabaseManager.execute_query: cada chamada é
+    uma transação (commit ao final) e erros são registrados e retornam None.
+    """
+
+    def __init__(self, config: Dict[str, Any], pool_config: Dict[str, Any] = None):
+        if not ASYNC_DB_AVAILABLE:
+            raise ImportError("psycopg[pool] não instalado: pip install 'psycopg[binary,pool]'")
+
+        self.config = config
+        pool_config = pool_config or ASYNC_DB_CONFIG
+        self.pool = AsyncConnectionPool(
+            self._conninfo(),
+            min_size=pool_config['pool_min_size'],
+            max_size=pool_config['pool_max_size'],
+            timeout=pool_config['pool_timeout_seconds'],
+            kwargs={'row_factory': dict_row},
+            open=False,
+        )
+
+    def _conninfo(self) -> str:
+        """String de conexão com o mesmo client_encoding do gerenciador síncrono."""
+        return make_conninfo(
+            host=self.config['host'],
+            dbname=self.config['database'],
+            user=self.config['user'],
+            password=self.config['password'],
+            port=self.config['port'],
+            options=self.config.get('options') or
+                    os.getenv('PG_OPTIONS', '-c client_encoding=LATIN1'),
+        )
+
+    async def open(self):
+        """Abre o pool e aguarda as conexões mínimas."""
+        await self.pool.open(wait=True)
+        logger.info("Pool assíncrono de conexões aberto")
+
+    async def close(self):
+        """Fecha o pool (encerramento do servidor)."""
+        await self.pool.close()
+        logger.info("Pool assíncrono de conexões fechado")
+
+    async def execute_query(self, query: str, params: Tuple = None, fetch: bool = False,
+                            prepare: bool = False):
+        """
+        Executa query com ou sem retorno.
+
+        prepare=True prepara o statement já na primeira execução em cada conexão.
+        O psycopg 3 mantém o cache por conexão e o refaz sozinho em conexões
+        novas; sem o flag, ele só prepara depois de algumas execuções repetidas.
+        """
+        try:
+            # A conexão do pool faz commit ao sair do bloco (rollback em exceção)
+            async with self.pool.connection() as conn:
+                cursor = await conn.execute(query, params, prepare=True if prepare else None)
+                return await cursor.fetchall() if fetch else None
+        except Exception as e:
+            logger.error(f"Erro ao executar query: {e}")
+            logger.error(f"Query: {query}")
+            logger.error(f"Params: {params}")
+            return None
+
+    async def stream_query(self, query: str, params: Tuple = None,
+                           batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Leitura com cursor do lado do servidor, entregue em lotes de até
+        batch_size. A conexão fica reservada até o fim do stream.
+        """
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+                    cursor.itersize = batch_size
+                    await cursor.execute(query, params)
+                    while True:
+                        rows = await cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield rows
+
+    async def test_connection(self) -> bool:
+        """Testa se o banco responde."""
+        result = await self.execute_query("SELECT 1 AS ok", fetch=True)
+        return bool(result)
+
+    async def get_database_info(self):
+        """Retorna lista de tabelas e contagem de registros."""
+        try:
+            tables_result = await self.execute_query(queries.LIST_PUBLIC_TABLES, fetch=True)
+            tables = [t['table_name'] for t in tables_result] if tables_result else []
+
+            table_counts = {}
+            for t in tables:
+                res = await self.execute_query(queries.count_rows_query(t), fetch=True)
+                table_counts[t] = res[0]['count'] if res else 0
+
+            return {
+                'tables': tables,
+                'table_counts': table_counts,
+                'total_records': sum(table_counts.values()),
+                'timestamp': datetime.now().isoformat()
+            }
+        except Exception as e:
+            logger.error(f"Erro ao obter informações do banco: {e}")
+            return {'error': str(e)}
+
+    def get_pool_stats(self) -> Dict[str, int]:
+        """Uso do pool, para health checks."""
+        return self.pool.get_stats()
+
+# ============================================================
+#               REPOSITÓRIO DE LOCALIZAÇÃO
+# ============================================================
+
+class AsyncBusLocationRepository:
+    def __init__(self, db_manager: AsyncDatabaseManager):
+        self.db = db_manager
+
+    async def save_location(self, bus_line: str, latitude: float, longitude: float, device_id: str = None):
+        query, params = queries.save_location_query(bus_line, latitude, longitude, device_id)
+        return queries.first_id(await self.db.execute_query(query, params, fetch=True, prepare=True))
+
+    async def save_location_once(self, bus_line: str, latitude: float, longitude: float,
+                                 ingest_key: str, device_id: str = None) -> Tuple[Optional[int], bool]:
+        query, params = queries.save_location_once_query(bus_line, latitude, longitude, ingest_key, device_id)
+        rows = await self.db.execute_query(query, params, fetch=True, prepare=True)
+        if rows is None:
+            return None, False
+        if rows:
+            return rows[0]['id'], True
+        return await self.find_by_ingest_key(ingest_key), False
+
+    async def find_by_ingest_key(self, ingest_key: str) -> Optional[int]:
+        return queries.first_id(await self.db.execute_query(
+            queries.LOCATION_BY_INGEST_KEY, (ingest_key,), fetch=True
+        ))
+
+    async def get_current_locations(self, bus_line: str = None, minutes: int = 5):
+        query, params = queries.current_locations_query(bus_line, minutes)
+        return await self.db.execute_query(query, params, fetch=True, prepare=True) or []
+
+    async def get_location_history(self, bus_line: str, hours: int = 24, limit: int = 100,
+                                   after: Tuple[datetime, int] = None):
+        query, params = queries.location_history_query(bus_line, hours, limit, after)
+        return await self.db.execute_query(query, params, fetch=True, prepare=True) or []
+
+    def stream_location_history(self, bus_line: str, hours: int = 24, limit: int = None,
+                                batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        query, params = queries.location_export_query(bus_line, hours, limit)
+        return self.db.stream_query(query, params, batch_size)
+
+# ============================================================
+#               REPOSITÓRIO DE OCUPAÇÃO
+# ============================================================
+
+class AsyncOccupancyRepository:
+    def __init__(self, db_manager: AsyncDatabaseManager):
+        self.db = db_manager
+
+    async def save_image_analysis(self, location_id: int, image_data: bytes,
+                                  occupancy_count: int = None, ingest_key: str = None):
+        query, params = queries.save_image_analysis_query(
+            location_id, image_data, occupancy_count, ingest_key
+        )
+        return queries.first_id(await self.db.execute_query(query, params, fetch=True))
+
+    async def find_location_by_ingest_key(self, ingest_key: str) -> Optional[int]:
+        rows = await self.db.execute_query(
+            queries.IMAGE_LOCATION_BY_INGEST_KEY, (ingest_key,), fetch=True
+        )
+        return rows[0]['location_id'] if rows else None
+
+    async def get_occupancy_history(self, bus_line: str, hours: int = 24, limit: int = 50,
+                                    after: Tuple[datetime, int] = None):
+        query, params = queries.occupancy_history_query(bus_line, hours, limit, after)
+        return await self.db.execute_query(query, params, fetch=True) or []
+
+    async def get_occupancy_statistics(self, bus_line: str = None, hours: int = 24):
+        query, params = queries.occupancy_statistics_query(bus_line, hours)
+        results = await self.db.execute_query(query, params, fetch=True) or []
+        return queries.summarize_occupancy(results)
+
+# ============================================================
+#                   REPOSITÓRIO DE ETA
+# ============================================================
+
+class AsyncETARepository:
+    def __init__(self, db_manager: AsyncDatabaseManager):
+        self.db = db_manager
+
+    async def save_eta_prediction(self, location_id: int, predicted_arrival: datetime,
+                                  confidence_percent: float):
+        query, params = queries.save_eta_prediction_query(
+            location_id, predicted_arrival, confidence_percent
+        )
+        return queries.first_id(await self.db.execute_query(query, params, fetch=True, prepare=True))
+
+    async def update_actual_arrival(self, prediction_id: int, actual_arrival: datetime):
+        query, params = queries.update_actual_arrival_query(prediction_id, actual_arrival)
+        await self.db.execute_query(query, params)
+
+    async def get_eta_predictions(self, bus_line: str, hours: int = 24, limit: int = 50,
+                                  after: Tuple[datetime, int] = None):
+        query, params = queries.eta_predictions_query(bus_line, hours, limit, after)
+        return await self.db.execute_query(query, params, fetch=True) or []
+
+    async def get_eta_statistics(self, bus_line: str = None, days: int = 7):
+        query, params = queries.eta_statistics_query(bus_line, days)
+        results = await self.db.execute_query(query, params, fetch=True) or []
+        return queries.summarize_eta(results)
+
+# ============================================================
+#              REPOSITÓRIO DE PERFIL DE ATRASO
+# ============================================================
+
+class AsyncDelayProfileRepository:
+    JOB_NAME = queries.DELAY_PROFILE_JOB
+
+    def __init__(self, db_manager: AsyncDatabaseManager):
+        self.db = db_manager
+
+    async def refresh_incremental(self) -> int:
+        query, params = queries.refresh_delay_profile_query(self.JOB_NAME)
+        res = await self.db.execute_query(query, params, fetch=True)
+        return res[0]['updated'] if res else 0
+
+    async def load_profile(self) -> Dict[Tuple[str, int, int], Dict[str, float]]:
+        rows = await self.db.execute_query(queries.LOAD_DELAY_PROFILE, fetch=True) or []
+        return queries.rows_to_delay_profile(rows)
+
+# ============================================================
+#           REPOSITÓRIO DE INTERVALOS ADAPTATIVOS
+# ============================================================
+
+class AsyncIntervalRepository:
+    def __init__(self, db_manager: AsyncDatabaseManager):
+        self.db = db_manager
+
+    async def save_interval(self, location_id: int, interval_seconds: int):
+        query, params = queries.save_interval_query(location_id, interval_seconds)
+        return queries.first_id(await self.db.execute_query(query, params, fetch=True, prepare=True))
+
+# ============================================================
+#              INSTÂNCIAS GLOBAIS E INICIALIZAÇÃO
+# ============================================================
+
+async_db_manager: Optional[AsyncDatabaseManager] = None
+async_bus_repo = None
+async_occupancy_repo = None
+async_eta_repo = None
+async_interval_repo = None
+async_delay_profile_repo = None
+
+async def initialize_async_database(config: Dict[str, Any]) -> bool:
+    """Abre o pool e cria os repositórios. Chamar no startup do servidor ASGI."""
+    global async_db_manager, async_bus_repo, async_occupancy_repo, async_eta_repo
+    global async_interval_repo, async_delay_profile_repo
+
+    try:
+        async_db_manager = AsyncDatabaseManager(config)
+        await async_db_manager.open()
+
+        if await async_db_manager.test_connection():
+            async_bus_repo = AsyncBusLocationRepository(async_db_manager)
+            async_occupancy_repo = AsyncOccupancyRepository(async_db_manager)
+            async_eta_repo = AsyncETARepository(async_db_manager)
+            async_interval_repo = AsyncIntervalRepository(async_db_manager)
+            async_delay_profile_repo = AsyncDelayProfileRepository(async_db_manager)
+
+            logger.info("Banco de dados assíncrono inicializado")
+            return True
+
+        logger.error("Falha ao conectar com banco de dados (assíncrono)")
+        return False
+
+    except Exception as e:
+        logger.error(f"Erro ao inicializar banco assíncrono: {e}")
+        return False
+
+async def close_async_database():
+    """Fecha o pool. Chamar no shutdown do servidor ASGI."""
+    if async_db_manager:
+        await async_db_manager.close()
+
+def get_async_database_manager():
+    return async_db_manager
+
+def get_async_bus_repository():
+    return async_bus_repo
+
+def get_async_occupancy_repository():
+    return async_occupancy_repo
+
+def get_async_eta_repository():
+    return async_eta_repo
+
+def get_async_interval_repository():
+    return async_interval_repo
+
+def get_async_delay_profile_repository():
+    return async_delay_profile_repo
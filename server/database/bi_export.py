@@ -0,0 +1,338 @@
+"""
+Exportação incremental para o Power BI
+Arquivos colunares em disco local, lidos pelo relatório no lugar das tabelas de produção
+
+Cada execução exporta só o que mudou desde a anterior:
+
+- bus_location, bus_image (metadados, sem os bytes da imagem) e
+  prediction_confidence: linhas com id maior que o último exportado. O id
+  vem da sequência antes do commit, então uma transação mais lenta pode
+  aparecer com id menor que o de linhas já exportadas: ids faltando abaixo
+  do último exportado (lacunas) são guardados e lidos de novo nas execuções
+  seguintes, até aparecerem ou até todas as transações abertas na leitura
+  terminarem (xmin do snapshot além do xmax guardado: insert desfeito);
+- arrivals: chegadas registradas (arrival_recorded_at) desde a execução
+  anterior, já que a chegada é gravada depois, em previsões já exportadas, e
+  com um horário que pode ser antigo; as registradas nos últimos
+  arrival_settle_seconds ficam para a execução seguinte. Uma chegada
+  corrigida sai de novo. O relatório relaciona arrivals.prediction_id com
+  prediction_confidence.id.
+
+As marcas d'água ficam em analytics_watermark (migração 007), uma por
+conjunto, e só avançam depois que os arquivos do lote estão no disco (fsync).
+Os arquivos seguem o particionamento Hive por data, que o conector de pasta
+do Power BI combina:
+
+    <BI_EXPORT_DIR>/bus_location/date=2026-10-18/part-<de>-<até>.parquet
+
+<de>-<até> é a faixa de ids (ou de instantes, em ms, para arrivals) do lote;
+lacunas preenchidas saem em part-<último id>-<último id>-gaps-<crc das lacunas>.
+Arquivos além da marca d'água gravada são de um lote interrompido antes de
+avançá-la: são removidos e exportados de novo, sem linhas duplicadas (um
+arquivo de lacunas interrompido é regravado com o mesmo nome).
+
+Parquet (compressão snappy, lida pelo Power BI) requer pyarrow; sem ele os
+arquivos saem em CSV.
+
+Uso:
+    python -m database.maintenance export-bi [--dataset bus_location]
+"""
+
+import csv
+import logging
+import os
+import re
+import sys
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Adiciona o diretório server ao path para imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_simple import BI_EXPORT_CONFIG
+from database import queries
+from database.archive import PARQUET_AVAILABLE, fsync_directory
+
+if PARQUET_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Prefixo dos jobs em analytics_watermark
+BI_EXPORT_JOB = 'bi_export'
+
+# Colunas e tipos de cada conjunto (esquema fixo: todos os arquivos de um
+# conjunto têm as mesmas colunas, mesmo com valores nulos em um lote)
+DATASETS: Dict[str, Dict[str, Any]] = {
+    'bus_location': {
+        'partition_by': 'timestamp_location',
+        'columns': [('id', 'int64'), ('bus_line', 'string'), ('timestamp_location', 'timestamp'),
+                    ('latitude', 'float64'), ('longitude', 'float64')]
+    },
+    'bus_image': {
+        'partition_by': 'timestamp_image',
+        'columns': [('id', 'int64'), ('location_id', 'int64'), ('bus_line', 'string'),
+                    ('timestamp_image', 'timestamp'), ('timestamp_location', 'timestamp'),
+                    ('occupancy_count', 'int32'), ('image_bytes', 'int64')]
+    },
+    'prediction_confidence': {
+        'partition_by': 'timestamp_prediction',
+        'columns': [('id', 'int64'), ('location_id', 'int64'), ('bus_line', 'string'),
+                    ('timestamp_location', 'timestamp'), ('timestamp_prediction', 'timestamp'),
+                    ('predicted_arrival', 'timestamp'), ('actual_arrival', 'timestamp'),
+                    ('confidence_percent', 'float64')]
+    },
+    'arrivals': {
+        'partition_by': 'actual_arrival',
+        'columns': [('prediction_id', 'int64'), ('bus_line', 'string'),
+                    ('predicted_arrival', 'timestamp'), ('actual_arrival', 'timestamp'),
+                    ('delay_minutes', 'float64')]
+    }
+}
+
+FILE_EXTENSIONS = {'parquet': '.parquet', 'csv': '.csv'}
+
+_PART_NAME = re.compile(r'^part-(\d+)-(\d+)')
+
+def resolve_format(file_format: str = None) -> str:
+    """Formato dos arquivos: o configurado, ou Parquet quando pyarrow está instalado."""
+    file_format = file_format or BI_EXPORT_CONFIG['format']
+    if file_format == 'auto':
+        return 'parquet' if PARQUET_AVAILABLE else 'csv'
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError(f"Formato de arquivo inválido: {file_format}")
+    if file_format == 'parquet' and not PARQUET_AVAILABLE:
+        raise ImportError("pyarrow não instalado: pip install pyarrow")
+    return file_format
+
+# ============================================================
+#                          ARQUIVOS
+# ============================================================
+
+def _arrow_type(type_name: str):
+    return {
+        'int64': pa.int64(), 'int32': pa.int32(), 'float64': pa.float64(),
+        'string': pa.string(), 'timestamp': pa.timestamp('us')
+    }[type_name]
+
+def write_part(path: Path, columns: List[Tuple[str, str]], rows: List[Dict[str, Any]],
+               file_format: str) -> int:
+    """
+    Grava as linhas em path (temporário oculto + rename, com fsync)
+
+    Returns:
+        Tamanho do arquivo em bytes
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Oculto para o conector de pasta enquanto está sendo escrito
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    if file_format == 'parquet':
+        schema = pa.schema([(name, _arrow_type(type_name)) for name, type_name in columns])
+        table = pa.Table.from_pylist(rows, schema=schema)
+        with open(tmp_path, 'wb') as f:
+            pq.write_table(table, f, compression=BI_EXPORT_CONFIG['parquet_compression'])
+            f.flush()
+            os.fsync(f.fileno())
+    else:
+        names = [name for name, _ in columns]
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            for row in rows:
+                writer.writerow([_csv_value(row.get(name)) for name in names])
+            f.flush()
+            os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    fsync_directory(path.parent)
+    return path.stat().st_size
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+def write_partitions(dataset_dir: Path, dataset: str, rows: List[Dict[str, Any]],
+                     part_name: str, file_format: str) -> Dict[str, int]:
+    """Grava um lote dividido por data (date=AAAA-MM-DD); retorna arquivos e bytes."""
+    spec = DATASETS[dataset]
+    partitions: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        partitions.setdefault(f"{row[spec['partition_by']]:%Y-%m-%d}", []).append(row)
+
+    written = {'files': 0, 'bytes': 0}
+    for day, part_rows in sorted(partitions.items()):
+        path = dataset_dir / f"date={day}" / f"{part_name}{FILE_EXTENSIONS[file_format]}"
+        written['bytes'] += write_part(path, spec['columns'], part_rows, file_format)
+        written['files'] += 1
+    return written
+
+def remove_uncommitted_parts(dataset_dir: Path, committed_until: int) -> int:
+    """Remove arquivos de lotes além da marca d'água (execução interrompida)."""
+    if not dataset_dir.exists():
+        return 0
+    removed = 0
+    for path in dataset_dir.rglob('*'):
+        match = _PART_NAME.match(path.name)
+        stale_tmp = path.name.startswith('.part-') and path.name.endswith('.tmp')
+        if stale_tmp or (match and int(match.group(2)) > committed_until):
+            path.unlink(missing_ok=True)
+            removed += 1
+    if removed:
+        logger.warning(f"Exportação BI: {removed} arquivos não confirmados removidos em {dataset_dir.name}")
+    return removed
+
+# ============================================================
+#                   MARCAS D'ÁGUA E EXPORTAÇÃO
+# ============================================================
+
+def load_watermark(db, job_name: str) -> Tuple[Optional[datetime], int, List[int], Optional[int]]:
+    """
+    (instante, último id, lacunas, xmax das lacunas) gravados para o job;
+    (None, 0, [], None) na primeira execução
+    """
+    rows = db.execute_query(queries.LOAD_WATERMARK, (job_name,), fetch=True)
+    if rows is None:
+        raise RuntimeError(f"Falha ao ler a marca d'água de {job_name}")
+    if not rows:
+        return None, 0, [], None
+    row = rows[0]
+    return row['watermark'], row['last_id'] or 0, list(row['gap_ids'] or []), row['gap_xmax']
+
+def save_watermark(db, job_name: str, watermark: datetime, last_id: int = None,
+                   gap_ids: List[int] = None, gap_xmax: int = None):
+    params = (job_name, watermark, last_id, gap_ids or None, gap_xmax if gap_ids else None)
+    if not db.execute_query(queries.SAVE_WATERMARK, params, fetch=True):
+        raise RuntimeError(f"Falha ao gravar a marca d'água de {job_name}")
+
+def _ms(moment: Optional[datetime]) -> int:
+    return int(moment.timestamp() * 1000) if moment else 0
+
+def _gaps_tag(gap_ids: List[int]) -> str:
+    """Identifica um conjunto de lacunas (nome do arquivo das linhas atrasadas)."""
+    return f"{zlib.crc32(','.join(map(str, gap_ids)).encode()):08x}"
+
+def export_table(db, table: str, directory: Path, file_format: str, batch_size: int,
+                 job_prefix: str = BI_EXPORT_JOB) -> Dict[str, int]:
+    """Exporta as linhas novas (por id) de uma tabela, um lote por vez, e as lacunas que apareceram."""
+    job_name = f"{job_prefix}:{table}"
+    dataset_dir = directory / table
+    _, last_id, gap_ids, gap_xmax = load_watermark(db, job_name)
+    totals = {'rows': 0, 'late_rows': 0, 'files': 0, 'bytes': 0,
+              'removed': remove_uncommitted_parts(dataset_dir, last_id)}
+
+    # Linhas inseridas durante a exportação ficam para a próxima execução
+    bounds = db.execute_query(queries.bi_export_bounds_query(table), fetch=True)
+    if not bounds:
+        raise RuntimeError(f"Falha ao consultar {table}")
+    until_id, xmin, xmax = bounds[0]['max_id'], bounds[0]['xmin'], bounds[0]['xmax']
+
+    # Lacunas de execuções anteriores: transações que terminaram depois da leitura
+    if gap_ids:
+        rows = db.execute_query(queries.BI_EXPORT_GAPS[table], (gap_ids,), fetch=True)
+        if rows is None:
+            raise RuntimeError(f"Falha ao ler {table}")
+        if rows:
+            written = write_partitions(dataset_dir, table, rows,
+                                       f"part-{last_id}-{last_id}-gaps-{_gaps_tag(gap_ids)}", file_format)
+            totals['rows'] += len(rows)
+            totals['late_rows'] += len(rows)
+            totals['files'] += written['files']
+            totals['bytes'] += written['bytes']
+
+        found = {row['id'] for row in rows}
+        remaining = [gap_id for gap_id in gap_ids if gap_id not in found]
+        # Todas as transações abertas quando as lacunas foram vistas já terminaram:
+        # as que faltam são inserts desfeitos (ou valores pulados da sequência)
+        if remaining and gap_xmax is not None and xmin >= gap_xmax:
+            logger.info(f"Exportação BI {table}: {len(remaining)} ids nunca confirmados descartados")
+            remaining = []
+        if len(remaining) != len(gap_ids):
+            gap_ids = remaining
+            save_watermark(db, job_name, datetime.now(), last_id, gap_ids, gap_xmax)
+
+    while last_id < until_id:
+        rows = db.execute_query(queries.BI_EXPORT_BATCHES[table], (last_id, until_id, batch_size), fetch=True)
+        if rows is None:
+            raise RuntimeError(f"Falha ao ler {table}")
+        if not rows:
+            break
+
+        # Ids ainda invisíveis no trecho lido: relidos nas próximas execuções
+        present = {row['id'] for row in rows}
+        new_gaps = [gap_id for gap_id in range(last_id + 1, rows[-1]['id']) if gap_id not in present]
+        if new_gaps:
+            gap_ids = gap_ids + new_gaps
+            gap_xmax = xmax
+            if len(gap_ids) > BI_EXPORT_CONFIG['max_gap_ids']:
+                dropped = len(gap_ids) - BI_EXPORT_CONFIG['max_gap_ids']
+                logger.warning(f"Exportação BI {table}: {dropped} lacunas mais antigas descartadas")
+                gap_ids = gap_ids[dropped:]
+
+        first, last_id = rows[0]['id'], rows[-1]['id']
+        written = write_partitions(dataset_dir, table, rows, f"part-{first}-{last_id}", file_format)
+        save_watermark(db, job_name, datetime.now(), last_id, gap_ids, gap_xmax)
+
+        totals['rows'] += len(rows)
+        totals['files'] += written['files']
+        totals['bytes'] += written['bytes']
+        logger.info(f"Exportação BI {table}: até id {last_id} ({totals['rows']} linhas)")
+
+    return totals
+
+def export_arrivals(db, directory: Path, file_format: str, batch_size: int,
+                    job_prefix: str = BI_EXPORT_JOB) -> Dict[str, int]:
+    """Exporta as chegadas registradas desde a execução anterior (por arrival_recorded_at)."""
+    job_name = f"{job_prefix}:arrivals"
+    dataset_dir = directory / 'arrivals'
+    since, _, _, _ = load_watermark(db, job_name)
+    totals = {'rows': 0, 'files': 0, 'bytes': 0,
+              'removed': remove_uncommitted_parts(dataset_dir, _ms(since))}
+
+    # arrival_recorded_at é o início da transação do UPDATE: as registradas há
+    # pouco podem ainda não estar confirmadas
+    until = datetime.now() - timedelta(seconds=BI_EXPORT_CONFIG['arrival_settle_seconds'])
+    if since and since >= until:
+        return totals
+    batches = db.stream_query(queries.BI_EXPORT_ARRIVALS, (since or datetime.min, until), batch_size)
+    for seq, rows in enumerate(batches):
+        written = write_partitions(
+            dataset_dir, 'arrivals', rows, f"part-{_ms(since)}-{_ms(until)}-{seq}", file_format
+        )
+        totals['rows'] += len(rows)
+        totals['files'] += written['files']
+        totals['bytes'] += written['bytes']
+
+    save_watermark(db, job_name, until)
+    logger.info(f"Exportação BI arrivals: {totals['rows']} chegadas registradas até {until}")
+    return totals
+
+def export_for_bi(db, datasets: List[str] = None, directory: str = None, file_format: str = None,
+                  batch_size: int = None, job_prefix: str = BI_EXPORT_JOB) -> Dict[str, Dict[str, int]]:
+    """
+    Exporta os conjuntos pedidos (padrão: todos) de forma incremental
+
+    Parâmetros omitidos vêm de BI_EXPORT_CONFIG.
+
+    Returns:
+        Por conjunto: linhas e arquivos exportados, bytes gravados e arquivos
+        não confirmados removidos
+    """
+    directory = Path(directory or BI_EXPORT_CONFIG['directory'])
+    file_format = resolve_format(file_format)
+    batch_size = batch_size or BI_EXPORT_CONFIG['batch_size']
+
+    totals = {}
+    for dataset in datasets or list(DATASETS):
+        if dataset == 'arrivals':
+            totals[dataset] = export_arrivals(db, directory, file_format, batch_size, job_prefix)
+        else:
+            totals[dataset] = export_table(db, dataset, directory, file_format, batch_size, job_prefix)
+    return totals
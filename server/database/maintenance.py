@@ -0,0 +1,132 @@
+"""
+Jobs de manutenção do banco de dados
+Executados sob demanda pela linha de comando, fora do ciclo das requisições
+
+Uso:
+    python -m database.maintenance backfill-denormalized [--batch-size 5000]
+    python -m database.maintenance archive-history [--older-than-days 30] [--bucket-seconds 60]
+    python -m database.maintenance export-bi [--dataset bus_location] [--format parquet]
+"""
+
+import argparse
+import logging
+import os
+import sys
+from typing import Dict
+
+# Adiciona o diretório server ao path para imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.simple_connection import SimpleDatabaseManager
+from database.archive import archive_history
+from database.bi_export import export_for_bi, DATASETS
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Tabelas que recebem cópia de bus_line / timestamp_location (migração 003)
+DENORMALIZED_TABLES = ['bus_image', 'prediction_confidence']
+
+def backfill_denormalized_columns(db: SimpleDatabaseManager, batch_size: int = 5000) -> Dict[str, int]:
+    """
+    Preenche bus_line e timestamp_location nas linhas antigas
+
+    Atualiza em lotes (um commit por lote) para não manter locks longos
+    sobre tabelas em uso pela ingestão.
+
+    Args:
+        db: Gerenciador de banco conectado
+        batch_size: Linhas por lote
+
+    Returns:
+        Quantidade de linhas atualizadas por tabela
+    """
+    totals = {}
+
+    for table in DENORMALIZED_TABLES:
+        query = f"""
+            UPDATE {table} t
+            SET bus_line = bl.bus_line,
+                timestamp_location = bl.timestamp_location
+            FROM bus_location bl
+            WHERE t.id IN (
+                SELECT id FROM {table}
+                WHERE bus_line IS NULL
+                ORDER BY id
+                LIMIT %s
+            )
+            AND bl.id = t.location_id
+            RETURNING t.id
+        """
+        totals[table] = 0
+
+        while True:
+            updated = db.execute_query(query, (batch_size,), fetch=True)
+            if not updated:
+                break
+            totals[table] += len(updated)
+            logger.info(f"Backfill {table}: {totals[table]} linhas atualizadas")
+
+    return totals
+
+def main():
+    """Ponto de entrada da linha de comando."""
+    from config_simple import DATABASE_CONFIG, LOGGING_CONFIG
+
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format']
+    )
+
+    parser = argparse.ArgumentParser(description='Jobs de manutenção do banco de dados')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill = subparsers.add_parser(
+        'backfill-denormalized',
+        help='Preenche bus_line/timestamp_location em bus_image e prediction_confidence'
+    )
+    backfill.add_argument('--batch-size', type=int, default=5000)
+
+    archive = subparsers.add_parser(
+        'archive-history',
+        help='Arquiva localizações antigas em disco e mantém o histórico reduzido'
+    )
+    archive.add_argument('--older-than-days', type=int)
+    archive.add_argument('--bucket-seconds', type=int)
+    archive.add_argument('--batch-size', type=int)
+    archive.add_argument('--format', choices=['auto', 'parquet', 'npz'])
+    archive.add_argument('--max-batches', type=int)
+
+    bi = subparsers.add_parser(
+        'export-bi',
+        help='Exporta de forma incremental os arquivos lidos pelo relatório do Power BI'
+    )
+    bi.add_argument('--dataset', action='append', choices=list(DATASETS),
+                    help='Conjunto a exportar (repetível; padrão: todos)')
+    bi.add_argument('--format', choices=['auto', 'parquet', 'csv'])
+    bi.add_argument('--batch-size', type=int)
+
+    args = parser.parse_args()
+
+    db = SimpleDatabaseManager(DATABASE_CONFIG)
+    if not db.test_connection():
+        logger.error("Banco de dados indisponível")
+        return 1
+
+    if args.command == 'backfill-denormalized':
+        totals = backfill_denormalized_columns(db, args.batch_size)
+        logger.info(f"Backfill concluído: {totals}")
+    elif args.command == 'archive-history':
+        totals = archive_history(
+            db, args.older_than_days, args.bucket_seconds, args.batch_size,
+            file_format=args.format, max_batches=args.max_batches
+        )
+        logger.info(f"Arquivamento concluído: {totals}")
+    elif args.command == 'export-bi':
+        totals = export_for_bi(db, args.dataset, file_format=args.format, batch_size=args.batch_size)
+        logger.info(f"Exportação BI concluída: {totals}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,821 @@
+"""
+SQL compartilhado entre os repositórios síncronos (psycopg2) e assíncronos (psycopg 3)
+Cada consulta é montada uma única vez aqui; os repositórios só executam
+
+Os dois drivers usam o mesmo estilo de parâmetro (%s), então o texto é idêntico.
+Funções *_query retornam (sql, params); funções summarize_* / rows_to_* fazem o
+pós-processamento das linhas, também idêntico nos dois lados.
+
+As consultas quentes rodam como prepared statements, um por texto SQL. Por
+isso os filtros opcionais só acrescentam trechos fixos: cada combinação gera
+sempre o mesmo texto e é preparada uma vez por conexão.
+"""
+
+import base64
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from config_simple import ML_CONFIG
+from ml.occupancy_levels import determine_occupancy_level, occupancy_level_sql
+
+Query = Tuple[str, Tuple[Any, ...]]
+
+# ============================================================
+#                      INFORMAÇÕES DO BANCO
+# ============================================================
+
+LIST_PUBLIC_TABLES = """
+    SELECT table_name
+    FROM information_schema.tables
+    WHERE table_schema = 'public'
+    ORDER BY table_name
+"""
+
+def count_rows_query(table: str) -> str:
+    # Nome vem de LIST_PUBLIC_TABLES, não da requisição
+    return f"SELECT COUNT(*) as count FROM {table}"
+
+# ============================================================
+#                       LOCALIZAÇÃO
+# ============================================================
+
+INSERT_LOCATION = """
+    INSERT INTO bus_location
+    (bus_line, latitude, longitude, timestamp_location, device_id)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING id
+"""
+
+def save_location_query(bus_line: str, latitude: float, longitude: float,
+                        device_id: str = None) -> Query:
+    return INSERT_LOCATION, (bus_line, latitude, longitude, datetime.now(), device_id)
+
+# Leitura com chave de idempotência do dispositivo: um reenvio da mesma
+# leitura não insere nada (RETURNING vazio) e o id original é buscado à parte.
+INSERT_LOCATION_ONCE = """
+    INSERT INTO bus_location
+    (bus_line, latitude, longitude, timestamp_location, ingest_key, device_id)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (ingest_key) DO NOTHING
+    RETURNING id
+"""
+
+LOCATION_BY_INGEST_KEY = """
+    SELECT id FROM bus_location WHERE ingest_key = %s
+"""
+
+def save_location_once_query(bus_line: str, latitude: float, longitude: float,
+                             ingest_key: str, device_id: str = None) -> Query:
+    return INSERT_LOCATION_ONCE, (bus_line, latitude, longitude, datetime.now(), ingest_key, device_id)
+
+def current_locations_query(bus_line: str = None, minutes: int = 5) -> Query:
+    query = """
+        SELECT * FROM bus_location
+        WHERE timestamp_location > %s
+    """
+    params = [datetime.now() - timedelta(minutes=minutes)]
+
+    if bus_line:
+        query += " AND bus_line = %s"
+        params.append(bus_line)
+
+    query += " ORDER BY timestamp_location DESC LIMIT 50"
+    return query, tuple(params)
+
+def latest_device_locations_query(minutes: int = 5) -> Query:
+    """Leitura mais recente de cada dispositivo nos últimos minutes (feed GTFS-RT)."""
+    query = """
+        SELECT DISTINCT ON (device_id)
+               id, bus_line, device_id, latitude, longitude, timestamp_location
+        FROM bus_location
+        WHERE device_id IS NOT NULL AND timestamp_location > %s
+        ORDER BY device_id, timestamp_location DESC, id DESC
+    """
+    return query, (datetime.now() - timedelta(minutes=minutes),)
+
+def location_history_query(bus_line: str, hours: int = 24, limit: int = 100,
+                           after: Tuple[datetime, int] = None) -> Query:
+    """
+    Histórico de uma linha, do mais recente para o mais antigo.
+
+    after: (timestamp_location, id) da última linha da página anterior;
+    a busca continua a partir dela pelo índice (keyset), sem OFFSET.
+    """
+    query = """
+        SELECT * FROM bus_location
+        WHERE bus_line = %s
+        AND timestamp_location > %s
+    """
+    params = [bus_line, datetime.now() - timedelta(hours=hours)]
+
+    if after:
+        query += " AND (timestamp_location, id) < (%s, %s)"
+        params.extend(after)
+
+    query += " ORDER BY timestamp_location DESC, id DESC LIMIT %s"
+    params.append(limit)
+    return query, tuple(params)
+
+def location_export_query(bus_line: str, hours: int = 24, limit: int = None) -> Query:
+    """Histórico completo para exportação em lotes (cursor do lado do servidor)."""
+    query = """
+        SELECT id, bus_line, latitude, longitude, timestamp_location
+        FROM bus_location
+        WHERE bus_line = %s
+        AND timestamp_location > %s
+        ORDER BY timestamp_location DESC
+    """
+    params = [bus_line, datetime.now() - timedelta(hours=hours)]
+
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    return query, tuple(params)
+
+# ============================================================
+#                        OCUPAÇÃO
+# ============================================================
+
+# Salva a imagem e atualiza o agregado horário na mesma transação.
+# Com ingest_key, um reenvio da mesma imagem não insere nem soma no agregado.
+# Localização inexistente: a chave estrangeira rejeita, como em SAVE_ETA_PREDICTION.
+SAVE_IMAGE_ANALYSIS = """
+    WITH ins AS (
+        INSERT INTO bus_image
+        (location_id, image_data, timestamp_image, occupancy_count,
+         bus_line, timestamp_location, ingest_key)
+        SELECT %s, %s, %s, %s, bl.bus_line, bl.timestamp_location, %s::uuid
+        FROM (VALUES (1)) AS one (n)
+        LEFT JOIN bus_location bl ON bl.id = %s
+        ON CONFLICT (ingest_key) DO NOTHING
+        RETURNING id, bus_line, timestamp_image, occupancy_count
+    ), rollup AS (
+        INSERT INTO occupancy_hourly_rollup AS r
+        (bus_line, hour_bucket, occupancy_level, sample_count,
+         sum_occupancy, min_occupancy, max_occupancy)
+        SELECT ins.bus_line, date_trunc('hour', ins.timestamp_image), %s, 1,
+               ins.occupancy_count, ins.occupancy_count, ins.occupancy_count
+        FROM ins
+        WHERE ins.occupancy_count IS NOT NULL
+        AND ins.bus_line IS NOT NULL
+        ON CONFLICT (bus_line, hour_bucket, occupancy_level) DO UPDATE SET
+            sample_count = r.sample_count + EXCLUDED.sample_count,
+            sum_occupancy = r.sum_occupancy + EXCLUDED.sum_occupancy,
+            min_occupancy = LEAST(r.min_occupancy, EXCLUDED.min_occupancy),
+            max_occupancy = GREATEST(r.max_occupancy, EXCLUDED.max_occupancy)
+    )
+    SELECT id FROM ins
+"""
+
+# Carga do agregado a partir das imagens já gravadas (instalação com dados
+# anteriores à migração 001). Células existentes não são alteradas, então
+# pode rodar a cada inicialização. O nível usa a mesma regra da gravação.
+SEED_OCCUPANCY_ROLLUP = f"""
+    INSERT INTO occupancy_hourly_rollup
+        (bus_line, hour_bucket, occupancy_level, sample_count,
+         sum_occupancy, min_occupancy, max_occupancy)
+    SELECT
+        bl.bus_line,
+        date_trunc('hour', bi.timestamp_image),
+        {occupancy_level_sql('bi.occupancy_count', ML_CONFIG['max_occupancy_count'])},
+        COUNT(*),
+        SUM(bi.occupancy_count),
+        MIN(bi.occupancy_count),
+        MAX(bi.occupancy_count)
+    FROM bus_image bi
+    JOIN bus_location bl ON bi.location_id = bl.id
+    WHERE bi.occupancy_count IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (bus_line, hour_bucket, occupancy_level) DO NOTHING
+"""
+
+IMAGE_LOCATION_BY_INGEST_KEY = """
+    SELECT location_id FROM bus_image WHERE ingest_key = %s
+"""
+
+def save_image_analysis_query(location_id: int, image_data: bytes,
+                              occupancy_count: int = None, ingest_key: str = None) -> Query:
+    occupancy_level = None
+    if occupancy_count is not None:
+        occupancy_level = determine_occupancy_level(
+            occupancy_count, ML_CONFIG['max_occupancy_count']
+        )
+    params = (location_id, image_data, datetime.now(), occupancy_count, ingest_key,
+              location_id, occupancy_level)
+    return SAVE_IMAGE_ANALYSIS, params
+
+def occupancy_history_query(bus_line: str, hours: int = 24, limit: int = 50,
+                            after: Tuple[datetime, int] = None) -> Query:
+    """
+    Análises de ocupação de uma linha (sem os bytes da imagem),
+    paginadas por keyset em (timestamp_image, id).
+    """
+    query = """
+        SELECT id, location_id, bus_line, timestamp_image, occupancy_count
+        FROM bus_image
+        WHERE bus_line = %s
+        AND timestamp_image > %s
+    """
+    params = [bus_line, datetime.now() - timedelta(hours=hours)]
+
+    if after:
+        query += " AND (timestamp_image, id) < (%s, %s)"
+        params.extend(after)
+
+    query += " ORDER BY timestamp_image DESC, id DESC LIMIT %s"
+    params.append(limit)
+    return query, tuple(params)
+
+def occupancy_statistics_query(bus_line: str = None, hours: int = 24) -> Query:
+    """
+    Estatísticas de ocupação lidas do agregado horário.
+
+    O custo depende de linhas x horas, não da quantidade de imagens.
+    A janela é arredondada para o início da hora.
+    """
+    query = """
+        SELECT
+            bus_line,
+            occupancy_level,
+            SUM(sample_count) as count,
+            SUM(sum_occupancy) as sum_occupancy,
+            MIN(min_occupancy) as min_occupancy,
+            MAX(max_occupancy) as max_occupancy
+        FROM occupancy_hourly_rollup
+        WHERE hour_bucket >= date_trunc('hour', %s::timestamp)
+    """
+    params = [datetime.now() - timedelta(hours=hours)]
+
+    if bus_line:
+        query += " AND bus_line = %s"
+        params.append(bus_line)
+
+    query += """
+        GROUP BY bus_line, occupancy_level
+        ORDER BY bus_line, occupancy_level
+    """
+    return query, tuple(params)
+
+def summarize_occupancy(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Agrupa as linhas do agregado por nível e por linha de ônibus."""
+    stats = {
+        'total_analyses': sum(int(r['count']) for r in results),
+        'by_occupancy': {},
+        'by_line': {}
+    }
+
+    for r in results:
+        level = r['occupancy_level']
+        line = r['bus_line']
+        count = int(r['count'])
+        total = int(r['sum_occupancy'])
+
+        occ = stats['by_occupancy'].setdefault(level, {
+            'count': 0, 'sum_occupancy': 0,
+            'min_occupancy': r['min_occupancy'], 'max_occupancy': r['max_occupancy']
+        })
+        occ['count'] += count
+        occ['sum_occupancy'] += total
+        occ['min_occupancy'] = min(occ['min_occupancy'], r['min_occupancy'])
+        occ['max_occupancy'] = max(occ['max_occupancy'], r['max_occupancy'])
+
+        by_line = stats['by_line'].setdefault(line, {
+            'total_analyses': 0, 'sum_occupancy': 0, 'level_sum': 0
+        })
+        by_line['total_analyses'] += count
+        by_line['sum_occupancy'] += total
+        by_line['level_sum'] += level * count
+
+    # Médias calculadas a partir de soma/contagem
+    for occ in stats['by_occupancy'].values():
+        occ['avg_occupancy'] = occ.pop('sum_occupancy') / occ['count']
+
+    for by_line in stats['by_line'].values():
+        by_line['avg_occupancy'] = by_line.pop('sum_occupancy') / by_line['total_analyses']
+        by_line['avg_occupancy_level'] = by_line.pop('level_sum') / by_line['total_analyses']
+
+    return stats
+
+# ============================================================
+#                           ETA
+# ============================================================
+
+# bus_line e timestamp_location copiados da localização. LEFT JOIN: sem a
+# localização, a linha é inserida mesmo assim e a chave estrangeira rejeita
+# (erro registrado pelo execute_query) em vez de não inserir nada em silêncio.
+SAVE_ETA_PREDICTION = """
+    INSERT INTO prediction_confidence
+    (location_id, predicted_arrival, confidence_percent, timestamp_prediction,
+     bus_line, timestamp_location)
+    SELECT %s, %s, %s, %s, bl.bus_line, bl.timestamp_location
+    FROM (VALUES (1)) AS one (n)
+    LEFT JOIN bus_location bl ON bl.id = %s
+    RETURNING id
+"""
+
+# arrival_recorded_at: quando a chegada foi registrada (exportação do Power BI)
+UPDATE_ACTUAL_ARRIVAL = """
+    UPDATE prediction_confidence
+    SET actual_arrival = %s, arrival_recorded_at = %s
+    WHERE id = %s
+"""
+
+def update_actual_arrival_query(prediction_id: int, actual_arrival: datetime) -> Query:
+    return UPDATE_ACTUAL_ARRIVAL, (actual_arrival, datetime.now(), prediction_id)
+
+def save_eta_prediction_query(location_id: int, predicted_arrival: datetime,
+                              confidence_percent: float) -> Query:
+    params = (location_id, predicted_arrival, confidence_percent, datetime.now(), location_id)
+    return SAVE_ETA_PREDICTION, params
+
+def eta_predictions_query(bus_line: str, hours: int = 24, limit: int = 50,
+                          after: Tuple[datetime, int] = None) -> Query:
+    """
+    Previsões de ETA de uma linha, paginadas por keyset
+    em (timestamp_prediction, id).
+    """
+    query = """
+        SELECT id, location_id, bus_line, predicted_arrival, actual_arrival,
+               confidence_percent, timestamp_prediction
+        FROM prediction_confidence
+        WHERE bus_line = %s
+        AND timestamp_prediction > %s
+    """
+    params = [bus_line, datetime.now() - timedelta(hours=hours)]
+
+    if after:
+        query += " AND (timestamp_prediction, id) < (%s, %s)"
+        params.extend(after)
+
+    query += " ORDER BY timestamp_prediction DESC, id DESC LIMIT %s"
+    params.append(limit)
+    return query, tuple(params)
+
+def eta_statistics_query(bus_line: str = None, days: int = 7) -> Query:
+    query = """
+        SELECT
+            pc.confidence_percent,
+            pc.predicted_arrival,
+            pc.actual_arrival,
+            pc.bus_line
+        FROM prediction_confidence pc
+        WHERE pc.timestamp_prediction > %s
+    """
+    params = [datetime.now() - timedelta(days=days)]
+
+    if bus_line:
+        query += " AND pc.bus_line = %s"
+        params.append(bus_line)
+
+    return query, tuple(params)
+
+def summarize_eta(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Confiança média geral e por linha."""
+    if not results:
+        return {'error': 'Nenhum dado de ETA encontrado'}
+
+    conf_values = [r['confidence_percent'] for r in results if r['confidence_percent']]
+
+    stats = {
+        'total_predictions': len(results),
+        'avg_confidence_percent': sum(conf_values) / len(conf_values) if conf_values else 0,
+        'by_line': {}
+    }
+
+    for r in results:
+        line = r['bus_line']
+        stats['by_line'].setdefault(line, {'count': 0, 'avg_confidence': 0})
+        stats['by_line'][line]['count'] += 1
+        if r['confidence_percent']:
+            stats['by_line'][line]['avg_confidence'] += r['confidence_percent']
+
+    for line in stats['by_line']:
+        stats['by_line'][line]['avg_confidence'] /= stats['by_line'][line]['count']
+
+    return stats
+
+# ============================================================
+#                    PERFIL DE ATRASO
+# ============================================================
+
+DELAY_PROFILE_JOB = 'delay_profile'
+
+# Incorpora ao perfil as chegadas ainda não contadas.
+#
+# Cada chegada é contada uma vez: as linhas com actual_arrival e sem
+# profiled_at são travadas, agregadas e marcadas na mesma transação. Não há
+# marca d'água de tempo, então uma chegada gravada depois de uma execução,
+# com horário anterior a ela (ou cuja transação terminou depois), entra na
+# próxima. Linhas travadas por outra transação ficam para a execução seguinte.
+# Os novos lotes são combinados com o perfil existente pela fórmula paralela
+# de Welford (média e M2), sem reler o histórico.
+REFRESH_DELAY_PROFILE = """
+    WITH job AS (
+        -- Uma instância por vez; as outras saem sem esperar
+        SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS locked
+    ), pending AS (
+        SELECT
+            pc.id,
+            pc.bus_line,
+            (EXTRACT(ISODOW FROM pc.timestamp_location) - 1)::smallint AS weekday,
+            EXTRACT(HOUR FROM pc.timestamp_location)::smallint AS hour,
+            EXTRACT(EPOCH FROM (pc.actual_arrival - pc.predicted_arrival)) / 60 AS delay
+        FROM prediction_confidence pc
+        CROSS JOIN job
+        WHERE job.locked
+        AND pc.actual_arrival IS NOT NULL
+        AND pc.profiled_at IS NULL
+        AND pc.bus_line IS NOT NULL
+        FOR UPDATE OF pc SKIP LOCKED
+    ), marked AS (
+        UPDATE prediction_confidence pc
+        SET profiled_at = now()
+        FROM pending
+        WHERE pc.id = pending.id
+    ), agg AS (
+        SELECT
+            bus_line, weekday, hour,
+            COUNT(*) AS n,
+            AVG(delay) AS mean,
+            VAR_POP(delay) * COUNT(*) AS m2
+        FROM pending
+        GROUP BY bus_line, weekday, hour
+    ), merged AS (
+        INSERT INTO delay_profile AS d
+        (bus_line, weekday, hour, sample_count, mean_delay_minutes, m2_delay)
+        SELECT bus_line, weekday, hour, n, mean, m2 FROM agg
+        ON CONFLICT (bus_line, weekday, hour) DO UPDATE SET
+            sample_count = d.sample_count + EXCLUDED.sample_count,
+            mean_delay_minutes = d.mean_delay_minutes
+                + (EXCLUDED.mean_delay_minutes - d.mean_delay_minutes)
+                * EXCLUDED.sample_count / (d.sample_count + EXCLUDED.sample_count),
+            m2_delay = d.m2_delay + EXCLUDED.m2_delay
+                + (EXCLUDED.mean_delay_minutes - d.mean_delay_minutes) ^ 2
+                * d.sample_count * EXCLUDED.sample_count
+                / (d.sample_count + EXCLUDED.sample_count)
+        RETURNING 1
+    )
+    SELECT COUNT(*) AS updated FROM merged
+"""
+
+LOAD_DELAY_PROFILE = """
+    SELECT bus_line, weekday, hour, sample_count, mean_delay_minutes, m2_delay
+    FROM delay_profile
+"""
+
+def refresh_delay_profile_query(job_name: str = DELAY_PROFILE_JOB) -> Query:
+    return REFRESH_DELAY_PROFILE, (job_name,)
+
+def rows_to_delay_profile(rows: List[Dict[str, Any]]) -> Dict[Tuple[str, int, int], Dict[str, float]]:
+    """Indexa o perfil por (linha, dia da semana, hora)."""
+    return {
+        (r['bus_line'], r['weekday'], r['hour']): {
+            'count': r['sample_count'],
+            'mean_delay_minutes': r['mean_delay_minutes'],
+            'variance': r['m2_delay'] / r['sample_count'] if r['sample_count'] else 0.0
+        }
+        for r in rows
+    }
+
+# ============================================================
+#                 INTERVALOS ADAPTATIVOS
+# ============================================================
+
+INSERT_INTERVAL = """
+    INSERT INTO request_interval
+    (location_id, start_time, end_time, interval_seconds)
+    VALUES (%s, %s, %s, %s)
+    RETURNING id
+"""
+
+def save_interval_query(location_id: int, interval_seconds: int) -> Query:
+    start_time = datetime.now()
+    end_time = start_time + timedelta(seconds=interval_seconds)
+    return INSERT_INTERVAL, (location_id, start_time, end_time, interval_seconds)
+
+# ============================================================
+#                  REENVIO DO SPOOL LOCAL
+# ============================================================
+
+# Um registro do spool por linha: localização com ETA, intervalo e imagem
+# opcionais (kind = 'location') ou imagem de uma localização já gravada
+# (kind = 'image'). Tabela temporária, descartada no commit.
+SPOOL_STAGING_COLUMNS = (
+    'kind', 'ingest_key', 'bus_line', 'latitude', 'longitude', 'captured_at',
+    'location_id', 'predicted_arrival', 'confidence_percent', 'interval_seconds',
+    'image_data', 'occupancy_count', 'occupancy_level', 'device_id'
+)
+
+CREATE_SPOOL_STAGING = """
+    CREATE TEMP TABLE spool_staging (
+        kind TEXT NOT NULL,
+        ingest_key UUID NOT NULL,
+        bus_line VARCHAR(30),
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION,
+        captured_at TIMESTAMP NOT NULL,
+        location_id INT,
+        predicted_arrival TIMESTAMP,
+        confidence_percent DECIMAL(5,2),
+        interval_seconds SMALLINT,
+        image_data BYTEA,
+        occupancy_count SMALLINT,
+        occupancy_level SMALLINT,
+        device_id VARCHAR(64)
+    ) ON COMMIT DROP
+"""
+
+COPY_SPOOL_STAGING = f"COPY spool_staging ({', '.join(SPOOL_STAGING_COLUMNS)}) FROM STDIN"
+
+# Grava o lote inteiro em uma transação. Registros repetidos no segmento (o
+# mesmo reenvio do dispositivo gravado duas vezes antes do fechamento) contam
+# uma vez só (staged). Localizações já existentes (mesma ingest_key, de um
+# reenvio anterior) são ignoradas, e ETA, intervalo e imagem só são inseridos
+# para as localizações novas: repetir o lote não duplica nada.
+# O agregado horário recebe as imagens novas, como em SAVE_IMAGE_ANALYSIS.
+REPLAY_SPOOL = """
+    WITH staged AS (
+        SELECT DISTINCT ON (ingest_key) *
+        FROM spool_staging
+        ORDER BY ingest_key
+    ), loc AS (
+        INSERT INTO bus_location
+        (bus_line, latitude, longitude, timestamp_location, ingest_key, device_id)
+        SELECT bus_line, latitude, longitude, captured_at, ingest_key, device_id
+        FROM staged
+        WHERE kind = 'location'
+        ON CONFLICT (ingest_key) DO NOTHING
+        RETURNING id, ingest_key, timestamp_location
+    ), new AS (
+        SELECT s.*, loc.id AS new_location_id, loc.timestamp_location
+        FROM staged s
+        JOIN loc USING (ingest_key)
+    ), eta AS (
+        INSERT INTO prediction_confidence
+        (location_id, predicted_arrival, confidence_percent, timestamp_prediction,
+         bus_line, timestamp_location)
+        SELECT new_location_id, predicted_arrival, confidence_percent, captured_at,
+               bus_line, timestamp_location
+        FROM new
+        WHERE predicted_arrival IS NOT NULL
+        RETURNING 1
+    ), itv AS (
+        INSERT INTO request_interval
+        (location_id, start_time, end_time, interval_seconds)
+        SELECT new_location_id, captured_at,
+               captured_at + make_interval(secs => interval_seconds), interval_seconds
+        FROM new
+        WHERE interval_seconds IS NOT NULL
+        RETURNING 1
+    ), img AS (
+        INSERT INTO bus_image
+        (location_id, image_data, timestamp_image, occupancy_count,
+         bus_line, timestamp_location, ingest_key)
+        SELECT new_location_id, image_data, captured_at, occupancy_count,
+               bus_line, timestamp_location, ingest_key
+        FROM new
+        WHERE image_data IS NOT NULL
+        UNION ALL
+        SELECT bl.id, s.image_data, s.captured_at, s.occupancy_count,
+               bl.bus_line, bl.timestamp_location, s.ingest_key
+        FROM staged s
+        JOIN bus_location bl ON bl.id = s.location_id
+        WHERE s.kind = 'image'
+        ON CONFLICT (ingest_key) DO NOTHING
+        RETURNING ingest_key, bus_line, timestamp_image, occupancy_count
+    ), rollup AS (
+        INSERT INTO occupancy_hourly_rollup AS r
+        (bus_line, hour_bucket, occupancy_level, sample_count,
+         sum_occupancy, min_occupancy, max_occupancy)
+        SELECT img.bus_line, date_trunc('hour', img.timestamp_image), s.occupancy_level,
+               COUNT(*), SUM(img.occupancy_count),
+               MIN(img.occupancy_count), MAX(img.occupancy_count)
+        FROM img
+        JOIN staged s USING (ingest_key)
+        WHERE img.occupancy_count IS NOT NULL
+        GROUP BY img.bus_line, date_trunc('hour', img.timestamp_image), s.occupancy_level
+        ON CONFLICT (bus_line, hour_bucket, occupancy_level) DO UPDATE SET
+            sample_count = r.sample_count + EXCLUDED.sample_count,
+            sum_occupancy = r.sum_occupancy + EXCLUDED.sum_occupancy,
+            min_occupancy = LEAST(r.min_occupancy, EXCLUDED.min_occupancy),
+            max_occupancy = GREATEST(r.max_occupancy, EXCLUDED.max_occupancy)
+    )
+    SELECT
+        (SELECT COUNT(*) FROM loc) AS locations,
+        (SELECT COUNT(*) FROM eta) AS predictions,
+        (SELECT COUNT(*) FROM itv) AS intervals,
+        (SELECT COUNT(*) FROM img) AS images
+"""
+
+def spool_staging_row(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Linha de spool_staging (ordem de SPOOL_STAGING_COLUMNS) para um registro do spool."""
+    eta = record.get('eta') or {}
+    image = record.get('image') or {}
+    occupancy_count = image.get('occupancy_count')
+    occupancy_level = None
+    if occupancy_count is not None:
+        occupancy_level = determine_occupancy_level(
+            occupancy_count, ML_CONFIG['max_occupancy_count']
+        )
+
+    return (
+        record['kind'], record['ingest_key'], record.get('bus_line'),
+        record.get('latitude'), record.get('longitude'), record['captured_at'],
+        record.get('location_id'), eta.get('predicted_arrival'), eta.get('confidence_percent'),
+        record.get('interval_seconds'),
+        base64.b64decode(image['data']) if image.get('data') else None,
+        occupancy_count, occupancy_level, record.get('device_id')
+    )
+
+# ============================================================
+#               ARQUIVAMENTO DO HISTÓRICO
+# ============================================================
+
+# Próximo lote de pontos antigos, em ordem de tempo a partir do último lote
+# (keyset). Localizações com imagem ficam: a imagem é o histórico de ocupação.
+# As linhas ficam travadas até o fim da transação que as arquiva.
+SELECT_ARCHIVE_BATCH = """
+    SELECT bl.id, bl.bus_line, bl.device_id, bl.timestamp_location, bl.latitude, bl.longitude
+    FROM bus_location bl
+    WHERE bl.timestamp_location < %s
+    AND (bl.timestamp_location, bl.id) > (%s, %s)
+    AND NOT EXISTS (SELECT 1 FROM bus_image bi WHERE bi.location_id = bl.id)
+    ORDER BY bl.timestamp_location, bl.id
+    LIMIT %s
+    FOR UPDATE OF bl SKIP LOCKED
+"""
+
+# Remove o lote de bus_location (ETA e intervalo saem em cascata) e mantém o
+# primeiro ponto de cada (linha, device_id, intervalo de bucket_seconds) no
+# histórico reduzido: com vários ônibus na linha, cada um mantém a sua
+# trajetória. Leituras sem device_id ficam juntas sob ''. Um intervalo dividido
+# entre dois lotes soma as contagens e fica com o ponto mais antigo.
+ARCHIVE_LOCATIONS = """
+    WITH moved AS (
+        DELETE FROM bus_location
+        WHERE id = ANY(%s)
+        RETURNING bus_line, COALESCE(device_id, '') AS device_id,
+                  timestamp_location, latitude, longitude,
+                  to_timestamp(floor(extract(epoch FROM timestamp_location) / %s) * %s)
+                      AT TIME ZONE 'UTC' AS bucket_start
+    ), buckets AS (
+        SELECT DISTINCT ON (bus_line, device_id, bucket_start)
+               bus_line, device_id, bucket_start, timestamp_location, latitude, longitude,
+               COUNT(*) OVER (PARTITION BY bus_line, device_id, bucket_start) AS sample_count
+        FROM moved
+        ORDER BY bus_line, device_id, bucket_start, timestamp_location
+    ), kept AS (
+        INSERT INTO bus_location_archive AS a
+        (bus_line, device_id, bucket_start, timestamp_location, latitude, longitude, sample_count)
+        SELECT bus_line, device_id, bucket_start, timestamp_location, latitude, longitude, sample_count
+        FROM buckets
+        ON CONFLICT (bus_line, device_id, bucket_start) DO UPDATE SET
+            sample_count = a.sample_count + EXCLUDED.sample_count,
+            timestamp_location = LEAST(a.timestamp_location, EXCLUDED.timestamp_location),
+            latitude = CASE WHEN EXCLUDED.timestamp_location < a.timestamp_location
+                            THEN EXCLUDED.latitude ELSE a.latitude END,
+            longitude = CASE WHEN EXCLUDED.timestamp_location < a.timestamp_location
+                             THEN EXCLUDED.longitude ELSE a.longitude END
+        RETURNING 1
+    )
+    SELECT
+        (SELECT COUNT(*) FROM moved) AS deleted,
+        (SELECT COUNT(*) FROM kept) AS buckets
+"""
+
+INSERT_ARCHIVE_MANIFEST = """
+    INSERT INTO location_archive_manifest
+    (file_path, file_format, file_bytes, row_count, range_start, range_end,
+     min_location_id, max_location_id, bus_lines, bucket_seconds)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING id
+"""
+
+ARCHIVE_MANIFEST_FILES = """
+    SELECT file_path FROM location_archive_manifest
+"""
+
+def archived_files_query(bus_line: str, start: datetime, end: datetime) -> Query:
+    """Arquivos do manifesto com pontos da linha em [start, end)."""
+    query = """
+        SELECT file_path, file_format, range_start, range_end, row_count
+        FROM location_archive_manifest
+        WHERE range_start < %s
+        AND range_end >= %s
+        AND %s = ANY(bus_lines)
+        ORDER BY range_start, id
+    """
+    return query, (end, start, bus_line)
+
+def downsampled_history_query(bus_line: str, start: datetime, end: datetime,
+                              limit: int = 1000) -> Query:
+    """
+    Histórico reduzido da linha em [start, end), do mais antigo para o mais
+    recente; um ponto por ônibus (device_id, None sem identificador) e intervalo
+    """
+    query = """
+        SELECT bus_line, NULLIF(device_id, '') AS device_id, bucket_start,
+               timestamp_location, latitude, longitude, sample_count
+        FROM bus_location_archive
+        WHERE bus_line = %s
+        AND bucket_start >= %s
+        AND bucket_start < %s
+        ORDER BY bucket_start, device_id
+        LIMIT %s
+    """
+    return query, (bus_line, start, end, limit)
+
+# ============================================================
+#               EXPORTAÇÃO PARA O POWER BI
+# ============================================================
+
+# Conjuntos exportados: tabelas lidas por id crescente (linhas novas desde a
+# última execução, mais as lacunas de execuções anteriores) e as chegadas,
+# lidas por arrival_recorded_at (a chegada é registrada depois, com UPDATE,
+# em previsões que já foram exportadas, e com um horário que pode ser antigo).
+_BI_EXPORT_SELECTS = {
+    'bus_location': ("id", """
+        SELECT id, bus_line, timestamp_location, latitude, longitude
+        FROM bus_location
+    """),
+    # Metadados da imagem, sem os bytes
+    'bus_image': ("bi.id", """
+        SELECT bi.id, bi.location_id,
+               COALESCE(bi.bus_line, bl.bus_line) AS bus_line,
+               bi.timestamp_image,
+               COALESCE(bi.timestamp_location, bl.timestamp_location) AS timestamp_location,
+               bi.occupancy_count,
+               octet_length(bi.image_data) AS image_bytes
+        FROM bus_image bi
+        LEFT JOIN bus_location bl ON bl.id = bi.location_id
+    """),
+    'prediction_confidence': ("pc.id", """
+        SELECT pc.id, pc.location_id,
+               COALESCE(pc.bus_line, bl.bus_line) AS bus_line,
+               COALESCE(pc.timestamp_location, bl.timestamp_location) AS timestamp_location,
+               pc.timestamp_prediction, pc.predicted_arrival, pc.actual_arrival,
+               pc.confidence_percent::double precision AS confidence_percent
+        FROM prediction_confidence pc
+        LEFT JOIN bus_location bl ON bl.id = pc.location_id
+    """)
+}
+
+# Próximo lote: (último id exportado, limite da execução, tamanho do lote)
+BI_EXPORT_BATCHES = {
+    table: f"{select} WHERE {id_column} > %s AND {id_column} <= %s ORDER BY {id_column} LIMIT %s"
+    for table, (id_column, select) in _BI_EXPORT_SELECTS.items()
+}
+
+# Lacunas de execuções anteriores que já ficaram visíveis: (lista de ids,)
+BI_EXPORT_GAPS = {
+    table: f"{select} WHERE {id_column} = ANY(%s) ORDER BY {id_column}"
+    for table, (id_column, select) in _BI_EXPORT_SELECTS.items()
+}
+
+BI_EXPORT_ARRIVALS = """
+    SELECT id AS prediction_id, bus_line, predicted_arrival, actual_arrival,
+           EXTRACT(EPOCH FROM (actual_arrival - predicted_arrival)) / 60 AS delay_minutes
+    FROM prediction_confidence
+    WHERE arrival_recorded_at > %s
+    AND arrival_recorded_at <= %s
+    AND actual_arrival IS NOT NULL
+    ORDER BY arrival_recorded_at, id
+"""
+
+def max_id_query(table: str) -> str:
+    # Nome vem de BI_EXPORT_BATCHES, não da requisição
+    return f"SELECT COALESCE(MAX(id), 0) AS max_id FROM {table}"
+
+def bi_export_bounds_query(table: str) -> str:
+    """
+    Maior id visível e o snapshot da mesma leitura: ids abaixo do máximo que
+    não aparecem são de transações abertas (xid < xmax) ou desfeitas; quando o
+    xmin de uma leitura posterior passa desse xmax, todas elas terminaram.
+    """
+    # Nome vem de BI_EXPORT_BATCHES, não da requisição
+    return f"""
+        SELECT COALESCE(MAX(id), 0) AS max_id,
+               pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin,
+               pg_snapshot_xmax(pg_current_snapshot())::text::bigint AS xmax
+        FROM {table}
+    """
+
+LOAD_WATERMARK = """
+    SELECT watermark, last_id, gap_ids, gap_xmax FROM analytics_watermark WHERE job_name = %s
+"""
+
+SAVE_WATERMARK = """
+    INSERT INTO analytics_watermark (job_name, watermark, last_id, gap_ids, gap_xmax)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (job_name) DO UPDATE SET
+        watermark = EXCLUDED.watermark,
+        last_id = EXCLUDED.last_id,
+        gap_ids = EXCLUDED.gap_ids,
+        gap_xmax = EXCLUDED.gap_xmax
+    RETURNING job_name
+"""
+
+def first_id(rows: Optional[List[Dict[str, Any]]]) -> Optional[int]:
+    """id da primeira linha retornada por um INSERT ... RETURNING."""
+    return rows[0]['id'] if rows else None
@@ -0,0 +1,253 @@
+"""
+Tempo das consultas do SimpleDatabaseManager
+Histograma de latência por consulta normalizada e planos das execuções lentas
+
+Cada chamada de execute_query é cronometrada e somada à consulta
+normalizada (espaços colapsados, literais trocados por '?'), em um
+histograma de buckets fixos, do qual saem p50/p95/p99. Acima de
+slow_threshold_ms, uma amostra das execuções (explain_sample_rate, no máximo
+uma por consulta a cada explain_cooldown_seconds) tem o plano capturado, e o
+plano vai para um buffer circular das últimas ring_size capturas. Leituras
+(SELECT e WITH ... SELECT) são repetidas com EXPLAIN (ANALYZE, BUFFERS) em uma
+transação desfeita em seguida; escritas recebem só EXPLAIN, sem executar de novo
+(repetir um INSERT ou UPDATE lento dentro da requisição dobraria o custo e os
+bloqueios).
+
+Os números são por processo (cada worker do gunicorn tem os seus), como as
+métricas do spool. Consultas: GET /api/dashboard/queries.
+"""
+
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config_simple import QUERY_STATS_CONFIG
+
+# Limites superiores dos buckets do histograma, em ms (o último é "acima de 5 s")
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+# Chave das consultas que chegam depois de max_queries consultas distintas
+OTHER_QUERIES = '(outras consultas)'
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+# EXPLAIN só para comandos que ele aceita; funções administrativas (pg_*) têm
+# efeitos fora da transação (ex.: pg_terminate_backend) e não são repetidas
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+_ADMIN_FUNCTION = re.compile(r'\bpg_\w+\s*\(', re.IGNORECASE)
+
+# Leituras podem ser repetidas com ANALYZE; qualquer escrita (inclusive em CTE
+# ou SELECT ... FOR UPDATE) fica só com EXPLAIN
+_READ = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_WRITE = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+
+def normalize_query(query: str) -> str:
+    """Texto da consulta sem literais e com espaços colapsados."""
+    normalized = _STRING.sub('?', query)
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _IN_LIST.sub('(?)', normalized)
+    return _WHITESPACE.sub(' ', normalized).strip()
+
+def query_fingerprint(normalized: str) -> str:
+    return hashlib.md5(normalized.encode()).hexdigest()[:12]
+
+def is_explainable(query: str) -> bool:
+    return bool(_EXPLAINABLE.match(query)) and not _ADMIN_FUNCTION.search(query)
+
+def is_read_only(query: str) -> bool:
+    """True se a consulta só lê (pode ser repetida com EXPLAIN ANALYZE)."""
+    return bool(_READ.match(query)) and not _WRITE.search(_STRING.sub('?', query))
+
+class _QueryTiming:
+    """Contadores de uma consulta normalizada."""
+    __slots__ = ('query', 'calls', 'errors', 'slow_calls', 'total_ms', 'max_ms',
+                 'buckets', 'last_explain')
+
+    def __init__(self, query: str):
+        self.query = query
+        self.calls = 0
+        self.errors = 0
+        self.slow_calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.last_explain = 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Limite superior do bucket que contém o percentil q (o máximo no último bucket)."""
+        if not self.calls:
+            return None
+        target = q * self.calls
+        cumulative = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max_ms) if bound != float('inf') else self.max_ms
+        return self.max_ms
+
+    def to_dict(self, fingerprint: str) -> Dict[str, Any]:
+        return {
+            'fingerprint': fingerprint,
+            'query': self.query,
+            'calls': self.calls,
+            'errors': self.errors,
+            'slow_calls': self.slow_calls,
+            'total_ms': round(self.total_ms, 2),
+            'mean_ms': round(self.total_ms / self.calls, 2) if self.calls else None,
+            'max_ms': round(self.max_ms, 2),
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'histogram': {
+                ('inf' if bound == float('inf') else str(bound)): count
+                for bound, count in zip(BUCKETS_MS, self.buckets) if count
+            }
+        }
+
+class QueryStats:
+    """
+    Estatísticas de tempo por consulta normalizada e capturas de planos lentos
+
+    Limitada a max_queries consultas distintas (as demais são somadas em
+    OTHER_QUERIES) e a ring_size capturas de plano.
+    """
+
+    ORDERS = ('total_ms', 'mean_ms', 'max_ms', 'p95_ms', 'p99_ms', 'calls', 'slow_calls')
+
+    def __init__(self, slow_threshold_ms: float = 200.0, explain_sample_rate: float = 0.1,
+                 explain_cooldown_seconds: float = 300, max_queries: int = 500, ring_size: int = 50):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_cooldown_seconds = explain_cooldown_seconds
+        self.max_queries = max_queries
+        self._timings: Dict[str, _QueryTiming] = {}
+        self._captures: deque = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+        self.since = datetime.now()
+
+    def record(self, query: str, elapsed_seconds: float, error: bool = False) -> bool:
+        """
+        Soma uma execução à consulta
+
+        Returns:
+            True se a execução deve ter o plano capturado (lenta, sorteada na
+            amostra e fora do intervalo de espera da consulta)
+        """
+        elapsed_ms = elapsed_seconds * 1000
+        normalized = normalize_query(query)
+        fingerprint = query_fingerprint(normalized)
+        slow = elapsed_ms >= self.slow_threshold_ms
+
+        with self._lock:
+            timing = self._timings.get(fingerprint)
+            if timing is None:
+                if len(self._timings) >= self.max_queries:
+                    fingerprint = OTHER_QUERIES
+                    timing = self._timings.setdefault(fingerprint, _QueryTiming(OTHER_QUERIES))
+                else:
+                    timing = self._timings[fingerprint] = _QueryTiming(normalized)
+
+            timing.calls += 1
+            timing.total_ms += elapsed_ms
+            timing.max_ms = max(timing.max_ms, elapsed_ms)
+            for i, bound in enumerate(BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    timing.buckets[i] += 1
+                    break
+            if error:
+                timing.errors += 1
+            if not slow or error:
+                return False
+            timing.slow_calls += 1
+
+            now = time.monotonic()
+            if (fingerprint == OTHER_QUERIES
+                    or now - timing.last_explain < self.explain_cooldown_seconds
+                    or random.random() >= self.explain_sample_rate):
+                return False
+            timing.last_explain = now
+        return is_explainable(query)
+
+    def add_capture(self, query: str, elapsed_seconds: float, plan: str = None, error: str = None,
+                    analyzed: bool = False):
+        """
+        Guarda o plano (ou o erro ao obtê-lo) de uma execução lenta
+
+        analyzed indica se o plano veio de EXPLAIN ANALYZE (tempos reais) ou
+        só de EXPLAIN (estimativas).
+        """
+        normalized = normalize_query(query)
+        with self._lock:
+            self._captures.append({
+                'fingerprint': query_fingerprint(normalized),
+                'query': normalized,
+                'duration_ms': round(elapsed_seconds * 1000, 2),
+                'captured_at': datetime.now().isoformat(),
+                'plan': plan,
+                'analyzed': analyzed,
+                'error': error
+            })
+
+    def top(self, n: int = 10, order_by: str = 'total_ms') -> List[Dict[str, Any]]:
+        """As n consultas com maior valor de order_by."""
+        if order_by not in self.ORDERS:
+            raise ValueError(f"Ordenação inválida: {order_by}")
+        with self._lock:
+            rows = [timing.to_dict(fp) for fp, timing in self._timings.items()]
+        rows.sort(key=lambda r: r[order_by] or 0, reverse=True)
+        return rows[:n]
+
+    def recent_captures(self, n: int = None) -> List[Dict[str, Any]]:
+        """Capturas de plano, da mais recente para a mais antiga."""
+        with self._lock:
+            captures = list(reversed(self._captures))
+        return captures[:n] if n else captures
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._captures.clear()
+            self.since = datetime.now()
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': True,
+                'since': self.since.isoformat(),
+                'distinct_queries': len(self._timings),
+                'statements': sum(t.calls for t in self._timings.values()),
+                'errors': sum(t.errors for t in self._timings.values()),
+                'slow_statements': sum(t.slow_calls for t in self._timings.values()),
+                'plans_captured': len(self._captures),
+                'slow_threshold_ms': self.slow_threshold_ms
+            }
+
+# ============================================================
+#                  INSTÂNCIA GLOBAL (POR PROCESSO)
+# ============================================================
+
+query_stats: Optional[QueryStats] = None
+if QUERY_STATS_CONFIG['enabled']:
+    query_stats = QueryStats(
+        QUERY_STATS_CONFIG['slow_threshold_ms'],
+        QUERY_STATS_CONFIG['explain_sample_rate'],
+        QUERY_STATS_CONFIG['explain_cooldown_seconds'],
+        QUERY_STATS_CONFIG['max_queries'],
+        QUERY_STATS_CONFIG['ring_size']
+    )
+
+def get_query_stats() -> Optional[QueryStats]:
+    return query_stats
+
+def get_query_stats_status() -> Dict[str, Any]:
+    if query_stats is None:
+        return {'enabled': False}
+    return query_stats.get_status()
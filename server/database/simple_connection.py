@@ -5,16 +5,56 @@ Baseado nos requisitos do projeto IoT de monitoramento de ônibus
 """
 
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+import hashlib
 import logging
 import os
+import re
+import threading
+import time
+import uuid
 from contextlib import contextmanager
-from typing import Dict, List, Optional, Any, Tuple
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple, Iterator
+from datetime import datetime
+
+from config_simple import QUERY_STATS_CONFIG
+from database import queries
+from database.query_stats import get_query_stats, is_read_only
 
 # Configuração de logging
 logger = logging.getLogger(__name__)
 
+# ============================================================
+#                  PREPARED STATEMENTS
+# ============================================================
+
+_PLACEHOLDER = re.compile(r'%([s%])')
+
+def prepared_statement_name(query: str) -> str:
+    """Nome estável do statement, derivado do texto SQL."""
+    return f"stmt_{hashlib.md5(query.encode()).hexdigest()[:16]}"
+
+def to_positional(query: str) -> str:
+    """Troca os placeholders %s do psycopg2 por $1, $2... (sintaxe do PREPARE)."""
+    counter = iter(range(1, query.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda m: f"${next(counter)}" if m.group(1) == 's' else '%', query)
+
+class PreparedStatementConnection(psycopg2.extensions.connection):
+    """
+    Conexão que registra os statements já preparados nela (texto SQL -> nome).
+
+    Prepared statements existem por sessão no servidor. Como o registro fica no
+    objeto da conexão, uma conexão nova (ex.: depois de o pool descartar uma
+    conexão derrubada) começa vazia e prepara tudo de novo no primeiro uso.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: Dict[str, str] = {}
+
 # ============================================================
 #                GERENCIADOR DE BANCO DE DADOS
 # ============================================================
@@ -22,15 +62,22 @@ logger = logging.getLogger(__name__)
 class SimpleDatabaseManager:
     """
     Gerenciador simplificado de conexões com banco de dados PostgreSQL
+
+    Mantém um pool de conexões por processo (uma por thread em uso). Deve ser
+    criado depois do fork dos workers: conexões herdadas do processo pai
+    compartilhariam o mesmo socket entre processos.
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], pool_size: int = 1):
         self.config = config
-        self.connection = None
+        self.pool_size = max(1, pool_size)
+        self.pool = None
+        # getconn() do psycopg2 falha com o pool esgotado; o semáforo faz a thread esperar
+        self._slots = threading.BoundedSemaphore(self.pool_size)
         self._connect()
     
-    def _connect(self):
-        """Conecta ao banco de dados.
+    def _connection_kwargs(self) -> Dict[str, Any]:
+        """Parâmetros de conexão com as configurações do gerenciador.
 
         Em alguns ambientes Windows / bancos inicializados com encoding LATIN1,
         o psycopg2 pode falhar ao decodificar mensagens de erro como UTF‑8
@@ -39,56 +86,186 @@ class SimpleDatabaseManager:
         Para evitar o erro `'utf-8' codec can't decode byte 0xe7 ...`,
         ajustamos explicitamente o client_encoding via options.
         """
+        return dict(
+            host=self.config['host'],
+            database=self.config['database'],
+            user=self.config['user'],
+            password=self.config['password'],
+            port=self.config['port'],
+            connection_factory=PreparedStatementConnection,
+            cursor_factory=psycopg2.extras.RealDictCursor,
+            # Permite sobrescrever via variável de ambiente, se necessário.
+            options=self.config.get('options') or
+                    os.getenv('PG_OPTIONS', '-c client_encoding=LATIN1'),
+        )
+    
+    def _open_connection(self):
+        """Abre uma conexão avulsa, fora do pool."""
+        return psycopg2.connect(**self._connection_kwargs())
+    
+    def _connect(self):
+        """Cria o pool de conexões."""
         try:
-            self.connection = psycopg2.connect(
-                host=self.config['host'],
-                database=self.config['database'],
-                user=self.config['user'],
-                password=self.config['password'],
-                port=self.config['port'],
-                cursor_factory=psycopg2.extras.RealDictCursor,
-                # Permite sobrescrever via variável de ambiente, se necessário.
-                options=self.config.get('options') or
-                        os.getenv('PG_OPTIONS', '-c client_encoding=LATIN1'),
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                1, self.pool_size, **self._connection_kwargs()
             )
-            logger.info("Conexão com banco de dados estabelecida")
+            logger.info(f"Conexão com banco de dados estabelecida (pool de {self.pool_size})")
         except Exception as e:
             logger.error(f"Erro ao conectar com banco: {e}")
-            self.connection = None
+            self.pool = None
+    
+    def close(self):
+        """Fecha todas as conexões do pool."""
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
     
     @contextmanager
     def get_cursor(self):
-        """Obtém cursor com rollback automático em caso de erro."""
-        if not self.connection:
+        """Obtém cursor de uma conexão do pool, com rollback automático em caso de erro."""
+        if not self.pool:
             raise Exception("Banco de dados não conectado")
         
-        cursor = None
-        try:
-            cursor = self.connection.cursor()
-            yield cursor
-        except Exception as e:
-            self.connection.rollback()
-            logger.error(f"Erro no cursor: {e}")
-            raise
-        finally:
-            if cursor:
-                cursor.close()
+        with self._slots:
+            connection = self.pool.getconn()
+            cursor = None
+            try:
+                cursor = connection.cursor()
+                yield cursor
+            except Exception as e:
+                if not connection.closed:
+                    connection.rollback()
+                logger.error(f"Erro no cursor: {e}")
+                raise
+            finally:
+                if cursor and not cursor.closed:
+                    cursor.close()
+                # Conexões derrubadas (ex.: banco reiniciado) são descartadas e recriadas
+                self.pool.putconn(connection, close=bool(connection.closed))
     
-    def execute_query(self, query: str, params: Tuple = None, fetch: bool = False):
-        """Executa query com ou sem retorno."""
-        if not self.connection:
+    def _execute_prepared(self, cursor, query: str, params: Tuple = None):
+        """
+        Executa a query como prepared statement da conexão do cursor.
+
+        PREPARE na primeira vez em cada conexão; depois só EXECUTE, sem novo
+        parse/planejamento. Se o servidor não tiver mais o statement (ex.:
+        DISCARD ALL de um pooler), o registro é limpo e a query é preparada de novo.
+        """
+        connection = cursor.connection
+        name = connection.prepared.get(query)
+        if name is None:
+            name = prepared_statement_name(query)
+            cursor.execute(f"PREPARE {name} AS {to_positional(query)}")
+            connection.prepared[query] = name
+
+        args = ', '.join(['%s'] * len(params or ()))
+        try:
+            cursor.execute(f"EXECUTE {name} ({args})" if args else f"EXECUTE {name}", params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            logger.warning(f"Prepared statement {name} perdido no servidor; preparando novamente")
+            connection.rollback()
+            connection.prepared.clear()
+            self._execute_prepared(cursor, query, params)
+
+    def execute_query(self, query: str, params: Tuple = None, fetch: bool = False,
+                      prepare: bool = False):
+        """
+        Executa query com ou sem retorno.
+
+        prepare=True executa como prepared statement (ver _execute_prepared);
+        usado nas consultas de maior volume dos repositórios.
+
+        O tempo de cada execução (sem a espera por conexão do pool) vai para
+        database/query_stats.py.
+        """
+        if not self.pool:
             return None
+        stats = get_query_stats()
+        for attempt in range(2):
+            started = None
+            connection = None
+            committing = False
+            try:
+                with self.get_cursor() as cursor:
+                    connection = cursor.connection
+                    started = time.perf_counter()
+                    if prepare:
+                        self._execute_prepared(cursor, query, params)
+                    else:
+                        cursor.execute(query, params)
+                    rows = [dict(row) for row in cursor.fetchall()] if fetch else None
+                    # Commit também após leituras: INSERT ... RETURNING usa fetch=True
+                    # e precisa ser persistido.
+                    committing = True
+                    cursor.connection.commit()
+                    elapsed = time.perf_counter() - started
+                    if stats and stats.record(query, elapsed):
+                        self._capture_plan(cursor, query, params, elapsed)
+                    return rows
+            except Exception as e:
+                if stats and started is not None:
+                    stats.record(query, time.perf_counter() - started, error=True)
+                # Conexão derrubada antes do commit (banco reiniciado, conexão ociosa
+                # encerrada): a transação não foi gravada e o pool já descartou a
+                # conexão, então repete uma vez em uma conexão nova. Falha no próprio
+                # commit não é repetida: a escrita pode ter sido gravada.
+                if attempt == 0 and not committing and connection is not None and connection.closed \
+                        and isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                    logger.warning(f"Conexão com o banco perdida; repetindo em nova conexão: {e}")
+                    continue
+                logger.error(f"Erro ao executar query: {e}")
+                logger.error(f"Query: {query}")
+                logger.error(f"Params: {params}")
+                return None
+    
+    def _capture_plan(self, cursor, query: str, params: Tuple, elapsed: float):
+        """
+        Guarda o plano de uma execução lenta
+
+        Leituras são repetidas com EXPLAIN (ANALYZE, BUFFERS); escritas recebem
+        só EXPLAIN, para não executar de novo um INSERT/UPDATE lento dentro da
+        requisição. Roda depois do commit, em uma transação própria desfeita
+        ao final.
+        """
+        stats = get_query_stats()
+        analyze = is_read_only(query)
+        explain = "EXPLAIN (ANALYZE, BUFFERS)" if analyze else "EXPLAIN"
         try:
-            with self.get_cursor() as cursor:
-                cursor.execute(query, params)
-                if fetch:
-                    return [dict(row) for row in cursor.fetchall()]
-                self.connection.commit()
+            cursor.execute("SET LOCAL statement_timeout = %s", (QUERY_STATS_CONFIG['explain_timeout_ms'],))
+            cursor.execute(f"{explain} {query}", params)
+            plan = '\n'.join(row['QUERY PLAN'] for row in cursor.fetchall())
+            stats.add_capture(query, elapsed, plan=plan, analyzed=analyze)
         except Exception as e:
-            logger.error(f"Erro ao executar query: {e}")
-            logger.error(f"Query: {query}")
-            logger.error(f"Params: {params}")
-            return None
+            stats.add_capture(query, elapsed, error=str(e), analyzed=analyze)
+        finally:
+            if not cursor.connection.closed:
+                cursor.connection.rollback()
+
+    def stream_query(self, query: str, params: Tuple = None,
+                     batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Executa uma leitura com cursor do lado do servidor (named cursor)
+        e entrega as linhas em lotes de até batch_size.
+
+        Usa uma conexão dedicada, para não manter a transação da conexão
+        compartilhada aberta durante o envio. A memória usada é limitada
+        ao tamanho do lote, independente do total de linhas.
+        """
+        connection = self._open_connection()
+        try:
+            cursor = connection.cursor(name=f"stream_{uuid.uuid4().hex}")
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
+            cursor.close()
+        finally:
+            # Também executado quando o cliente desconecta no meio do stream
+            connection.rollback()
+            connection.close()
     
     def test_connection(self) -> bool:
         """Testa se o banco responde."""
@@ -101,20 +278,13 @@ class SimpleDatabaseManager:
     def get_database_info(self):
         """Retorna lista de tabelas e contagem de registros."""
         try:
-            tables_query = """
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public'
-                ORDER BY table_name
-            """
-            tables_result = self.execute_query(tables_query, fetch=True)
+            tables_result = self.execute_query(queries.LIST_PUBLIC_TABLES, fetch=True)
             tables = [t['table_name'] for t in tables_result] if tables_result else []
 
             table_counts = {}
             for t in tables:
                 try:
-                    count_q = f"SELECT COUNT(*) as count FROM {t}"
-                    res = self.execute_query(count_q, fetch=True)
+                    res = self.execute_query(queries.count_rows_query(t), fetch=True)
                     table_counts[t] = res[0]['count'] if res else 0
                 except:
                     table_counts[t] = 0
@@ -137,41 +307,50 @@ class SimpleBusLocationRepository:
     def __init__(self, db_manager: SimpleDatabaseManager):
         self.db = db_manager
     
-    def save_location(self, bus_line: str, latitude: float, longitude: float):
-        query = """
-            INSERT INTO bus_location 
-            (bus_line, latitude, longitude, timestamp_location)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id
+    def save_location(self, bus_line: str, latitude: float, longitude: float, device_id: str = None):
+        query, params = queries.save_location_query(bus_line, latitude, longitude, device_id)
+        return queries.first_id(self.db.execute_query(query, params, fetch=True, prepare=True))
+    
+    def save_location_once(self, bus_line: str, latitude: float, longitude: float,
+                           ingest_key: str, device_id: str = None) -> Tuple[Optional[int], bool]:
         """
-        params = (bus_line, latitude, longitude, datetime.now())
-        res = self.db.execute_query(query, params, fetch=True)
-        return res[0]['id'] if res else None
+        Grava a leitura uma única vez por ingest_key (chave de idempotência).
+        Retorna (id, criada); um reenvio devolve o id original com criada=False
+        e (None, False) se o banco falhar.
+        """
+        query, params = queries.save_location_once_query(bus_line, latitude, longitude, ingest_key, device_id)
+        rows = self.db.execute_query(query, params, fetch=True, prepare=True)
+        if rows is None:
+            return None, False
+        if rows:
+            return rows[0]['id'], True
+        return self.find_by_ingest_key(ingest_key), False
+    
+    def find_by_ingest_key(self, ingest_key: str) -> Optional[int]:
+        return queries.first_id(self.db.execute_query(
+            queries.LOCATION_BY_INGEST_KEY, (ingest_key,), fetch=True
+        ))
     
     def get_current_locations(self, bus_line: str = None, minutes: int = 5):
-        query = """
-            SELECT * FROM bus_location 
-            WHERE timestamp_location > %s
-        """
-        params = [datetime.now() - timedelta(minutes=minutes)]
-
-        if bus_line:
-            query += " AND bus_line = %s"
-            params.append(bus_line)
-
-        query += " ORDER BY timestamp_location DESC LIMIT 50"
-        return self.db.execute_query(query, tuple(params), fetch=True) or []
+        query, params = queries.current_locations_query(bus_line, minutes)
+        return self.db.execute_query(query, params, fetch=True, prepare=True) or []
     
-    def get_location_history(self, bus_line: str, hours: int = 24, limit: int = 100):
-        query = """
-            SELECT * FROM bus_location 
-            WHERE bus_line = %s
-            AND timestamp_location > %s
-            ORDER BY timestamp_location DESC
-            LIMIT %s
-        """
-        params = (bus_line, datetime.now() - timedelta(hours=hours), limit)
+    def get_latest_device_locations(self, minutes: int = 5):
+        """Leitura mais recente de cada dispositivo identificado (device_id)."""
+        query, params = queries.latest_device_locations_query(minutes)
         return self.db.execute_query(query, params, fetch=True) or []
+    
+    def get_location_history(self, bus_line: str, hours: int = 24, limit: int = 100,
+                             after: Tuple[datetime, int] = None):
+        """Histórico de uma linha, paginado por keyset em (timestamp_location, id)."""
+        query, params = queries.location_history_query(bus_line, hours, limit, after)
+        return self.db.execute_query(query, params, fetch=True, prepare=True) or []
+
+    def stream_location_history(self, bus_line: str, hours: int = 24, limit: int = None,
+                                batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Histórico de localizações em lotes, para exportações grandes."""
+        query, params = queries.location_export_query(bus_line, hours, limit)
+        return self.db.stream_query(query, params, batch_size)
 
 # ============================================================
 #               REPOSITÓRIO DE OCUPAÇÃO
@@ -181,62 +360,30 @@ class SimpleOccupancyRepository:
     def __init__(self, db_manager: SimpleDatabaseManager):
         self.db = db_manager
     
-    def save_image_analysis(self, location_id: int, image_data: bytes, occupancy_count: int = None):
-        query = """
-            INSERT INTO bus_image
-            (location_id, image_data, timestamp_image, occupancy_count)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id
-        """
-        params = (location_id, image_data, datetime.now(), occupancy_count)
-        res = self.db.execute_query(query, params, fetch=True)
-        return res[0]['id'] if res else None
+    def save_image_analysis(self, location_id: int, image_data: bytes, occupancy_count: int = None,
+                            ingest_key: str = None):
+        """Salva a imagem e atualiza o agregado horário na mesma transação."""
+        query, params = queries.save_image_analysis_query(
+            location_id, image_data, occupancy_count, ingest_key
+        )
+        return queries.first_id(self.db.execute_query(query, params, fetch=True))
+    
+    def find_location_by_ingest_key(self, ingest_key: str) -> Optional[int]:
+        """Localização da imagem já gravada com esta chave de idempotência, se houver."""
+        rows = self.db.execute_query(queries.IMAGE_LOCATION_BY_INGEST_KEY, (ingest_key,), fetch=True)
+        return rows[0]['location_id'] if rows else None
+    
+    def get_occupancy_history(self, bus_line: str, hours: int = 24, limit: int = 50,
+                              after: Tuple[datetime, int] = None):
+        """Análises de ocupação de uma linha, paginadas por keyset."""
+        query, params = queries.occupancy_history_query(bus_line, hours, limit, after)
+        return self.db.execute_query(query, params, fetch=True) or []
     
     def get_occupancy_statistics(self, bus_line: str = None, hours: int = 24):
-        query = """
-            SELECT 
-                bi.occupancy_count,
-                COUNT(*) as count,
-                AVG(bi.occupancy_count) as avg_occupancy,
-                bl.bus_line
-            FROM bus_image bi
-            JOIN bus_location bl ON bi.location_id = bl.id
-            WHERE bi.timestamp_image > %s
-            AND bi.occupancy_count IS NOT NULL
-        """
-        params = [datetime.now() - timedelta(hours=hours)]
-
-        if bus_line:
-            query += " AND bl.bus_line = %s"
-            params.append(bus_line)
-
-        query += """
-            GROUP BY bi.occupancy_count, bl.bus_line
-            ORDER BY bl.bus_line, bi.occupancy_count
-        """
-        results = self.db.execute_query(query, tuple(params), fetch=True) or []
-
-        stats = {
-            'total_analyses': sum(r['count'] for r in results),
-            'by_occupancy': {},
-            'by_line': {}
-        }
-
-        for r in results:
-            occ = r['occupancy_count']
-            line = r['bus_line']
-            count = r['count']
-            avg = r['avg_occupancy']
-
-            stats['by_occupancy'].setdefault(occ, {'count': 0, 'avg_occupancy': 0})
-            stats['by_occupancy'][occ]['count'] += count
-            stats['by_occupancy'][occ]['avg_occupancy'] += avg
-
-            stats['by_line'].setdefault(line, {'total_analyses': 0, 'avg_occupancy': 0})
-            stats['by_line'][line]['total_analyses'] += count
-            stats['by_line'][line]['avg_occupancy'] += avg
-
-        return stats
+        """Estatísticas de ocupação lidas do agregado horário."""
+        query, params = queries.occupancy_statistics_query(bus_line, hours)
+        results = self.db.execute_query(query, params, fetch=True) or []
+        return queries.summarize_occupancy(results)
 
 # ============================================================
 #                   REPOSITÓRIO DE ETA
@@ -248,65 +395,57 @@ class SimpleETARepository:
     
     def save_eta_prediction(self, location_id: int, predicted_arrival: datetime,
                             confidence_percent: float):
-        query = """
-            INSERT INTO prediction_confidence
-            (location_id, predicted_arrival, confidence_percent, timestamp_prediction)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id
-        """
-        params = (location_id, predicted_arrival, confidence_percent, datetime.now())
-        res = self.db.execute_query(query, params, fetch=True)
-        return res[0]['id'] if res else None
+        query, params = queries.save_eta_prediction_query(
+            location_id, predicted_arrival, confidence_percent
+        )
+        return queries.first_id(self.db.execute_query(query, params, fetch=True, prepare=True))
     
     def update_actual_arrival(self, prediction_id: int, actual_arrival: datetime):
-        query = """
-            UPDATE prediction_confidence 
-            SET actual_arrival = %s
-            WHERE id = %s
-        """
-        self.db.execute_query(query, (actual_arrival, prediction_id))
+        query, params = queries.update_actual_arrival_query(prediction_id, actual_arrival)
+        self.db.execute_query(query, params)
+    
+    def get_eta_predictions(self, bus_line: str, hours: int = 24, limit: int = 50,
+                            after: Tuple[datetime, int] = None):
+        """Previsões de ETA de uma linha, paginadas por keyset."""
+        query, params = queries.eta_predictions_query(bus_line, hours, limit, after)
+        return self.db.execute_query(query, params, fetch=True) or []
     
     def get_eta_statistics(self, bus_line: str = None, days: int = 7):
-        query = """
-            SELECT 
-                pc.confidence_percent,
-                pc.predicted_arrival,
-                pc.actual_arrival,
-                bl.bus_line
-            FROM prediction_confidence pc
-            JOIN bus_location bl ON pc.location_id = bl.id
-            WHERE pc.timestamp_prediction > %s
-        """
-        params = [datetime.now() - timedelta(days=days)]
-
-        if bus_line:
-            query += " AND bl.bus_line = %s"
-            params.append(bus_line)
+        query, params = queries.eta_statistics_query(bus_line, days)
+        results = self.db.execute_query(query, params, fetch=True) or []
+        return queries.summarize_eta(results)
 
-        results = self.db.execute_query(query, tuple(params), fetch=True) or []
-
-        if not results:
-            return {'error': 'Nenhum dado de ETA encontrado'}
-
-        conf_values = [r['confidence_percent'] for r in results if r['confidence_percent']]
+# ============================================================
+#              REPOSITÓRIO DE PERFIL DE ATRASO
+# ============================================================
 
-        stats = {
-            'total_predictions': len(results),
-            'avg_confidence_percent': sum(conf_values) / len(conf_values) if conf_values else 0,
-            'by_line': {}
-        }
+class SimpleDelayProfileRepository:
+    """
+    Perfil de atraso (linha x dia da semana x hora), atualizado de forma
+    incremental a partir das chegadas reais registradas em prediction_confidence.
+    """
 
-        for r in results:
-            line = r['bus_line']
-            stats['by_line'].setdefault(line, {'count': 0, 'avg_confidence': 0})
-            stats['by_line'][line]['count'] += 1
-            if r['confidence_percent']:
-                stats['by_line'][line]['avg_confidence'] += r['confidence_percent']
+    JOB_NAME = queries.DELAY_PROFILE_JOB
 
-        for line in stats['by_line']:
-            stats['by_line'][line]['avg_confidence'] /= stats['by_line'][line]['count']
+    def __init__(self, db_manager: SimpleDatabaseManager):
+        self.db = db_manager
+    
+    def refresh_incremental(self) -> int:
+        """
+        Incorpora ao perfil as chegadas ainda não contadas
+        (profiled_at + merge de Welford, ver queries.REFRESH_DELAY_PROFILE).
 
-        return stats
+        Returns:
+            Quantidade de células (linha, dia, hora) atualizadas
+        """
+        query, params = queries.refresh_delay_profile_query(self.JOB_NAME)
+        res = self.db.execute_query(query, params, fetch=True)
+        return res[0]['updated'] if res else 0
+    
+    def load_profile(self) -> Dict[Tuple[str, int, int], Dict[str, float]]:
+        """Carrega o perfil completo, indexado por (linha, dia da semana, hora)."""
+        rows = self.db.execute_query(queries.LOAD_DELAY_PROFILE, fetch=True) or []
+        return queries.rows_to_delay_profile(rows)
 
 # ============================================================
 #           REPOSITÓRIO DE INTERVALOS ADAPTATIVOS
@@ -317,17 +456,8 @@ class SimpleIntervalRepository:
         self.db = db_manager
     
     def save_interval(self, location_id: int, interval_seconds: int):
-        query = """
-            INSERT INTO request_interval
-            (location_id, start_time, end_time, interval_seconds)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id
-        """
-        start_time = datetime.now()
-        end_time = start_time + timedelta(seconds=interval_seconds)
-        params = (location_id, start_time, end_time, interval_seconds)
-        res = self.db.execute_query(query, params, fetch=True)
-        return res[0]['id'] if res else None
+        query, params = queries.save_interval_query(location_id, interval_seconds)
+        return queries.first_id(self.db.execute_query(query, params, fetch=True, prepare=True))
 
 # ============================================================
 #              INSTÂNCIAS GLOBAIS E INICIALIZAÇÃO
@@ -338,18 +468,28 @@ simple_bus_repo = None
 simple_occupancy_repo = None
 simple_eta_repo = None
 simple_interval_repo = None
+simple_delay_profile_repo = None
 
-def initialize_simple_database(config: Dict[str, Any]) -> bool:
+def initialize_simple_database(config: Dict[str, Any], pool_size: int = 1) -> bool:
+    """
+    Cria o pool de conexões e os repositórios deste processo.
+    Em servidores prefork, chamar em cada worker (depois do fork).
+    """
     global simple_db_manager, simple_bus_repo, simple_occupancy_repo, simple_eta_repo, simple_interval_repo
+    global simple_delay_profile_repo
     
     try:
-        simple_db_manager = SimpleDatabaseManager(config)
+        # Nova tentativa (ex.: reconexão pelo spool): descarta o pool anterior
+        if simple_db_manager:
+            simple_db_manager.close()
+        simple_db_manager = SimpleDatabaseManager(config, pool_size)
         
         if simple_db_manager.test_connection():
             simple_bus_repo = SimpleBusLocationRepository(simple_db_manager)
             simple_occupancy_repo = SimpleOccupancyRepository(simple_db_manager)
             simple_eta_repo = SimpleETARepository(simple_db_manager)
             simple_interval_repo = SimpleIntervalRepository(simple_db_manager)
+            simple_delay_profile_repo = SimpleDelayProfileRepository(simple_db_manager)
             
             logger.info("Sistema simplificado de banco de dados inicializado")
             return True
@@ -361,6 +501,11 @@ def initialize_simple_database(config: Dict[str, Any]) -> bool:
         logger.error(f"Erro ao inicializar banco simplificado: {e}")
         return False
 
+def close_simple_database():
+    """Fecha o pool de conexões (encerramento do worker)."""
+    if simple_db_manager:
+        simple_db_manager.close()
+
 def get_simple_database_manager():
     return simple_db_manager
 
@@ -375,3 +520,6 @@ def get_simple_eta_repository():
 
 def get_simple_interval_repository():
     return simple_interval_repo
+
+def get_simple_delay_profile_repository():
+    return simple_delay_profile_repo
@@ -0,0 +1,487 @@
+"""
+Spool local de gravações enquanto o PostgreSQL está indisponível
+Log append-only em segmentos, com fsync em lote e reenvio em massa via COPY
+
+Quando o banco não responde, as APIs gravam aqui o que iriam inserir
+(localização com ETA, intervalo e imagem, ou imagem de uma localização já
+gravada), um registro JSON por linha. Uma thread por processo faz o fsync
+periódico e, quando o banco volta, reenvia os segmentos fechados em uma
+transação por segmento (COPY para tabela temporária + REPLAY_SPOOL).
+
+Arquivos no diretório do spool:
+- <ns>-<pid>-<id>.open: segmento ativo de um processo (trava exclusiva enquanto aberto)
+- <ns>-<pid>-<id>.seg:  segmento fechado, pronto para reenvio
+- <ns>-<pid>-<id>.failed: segmento em quarentena (falhou com o banco no ar
+  em max_replay_attempts tentativas); fica no disco para inspeção manual
+
+Cada registro tem uma ingest_key (UUID, derivada da chave de idempotência do
+dispositivo quando houver); o reenvio ignora chaves já gravadas,
+então um segmento reenviado duas vezes (queda entre o commit e a remoção do
+arquivo) não duplica linhas. Segmentos .open de processos encerrados são
+adotados no reenvio seguinte.
+"""
+
+import base64
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sem trava entre processos (servidor de desenvolvimento, processo único)
+    fcntl = None
+
+from config_simple import SPOOL_CONFIG
+from database import queries
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+FAILED_SUFFIX = '.failed'
+
+# Novos nomes tentados quando a trava do segmento recém-criado não é obtida
+OPEN_SEGMENT_ATTEMPTS = 3
+
+# ============================================================
+#                  ARQUIVOS E FORMATO COPY
+# ============================================================
+
+def _try_lock(f) -> bool:
+    """Trava exclusiva sem espera; False se outro processo já tem a trava."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def _fsync_directory(directory: Path):
+    """Persiste criação/renomeação de arquivos (metadados do diretório)."""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def read_segment(f) -> List[Dict[str, Any]]:
+    """
+    Lê os registros de um segmento.
+
+    Uma última linha incompleta (queda no meio da escrita) é descartada:
+    ela nunca chegou a ser confirmada pelo fsync.
+    """
+    records = []
+    for line in f.read().splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            logger.warning("Registro incompleto ignorado no spool")
+    return records
+
+def copy_value(value: Any) -> str:
+    """Valor no formato texto do COPY (NULL = \\N, bytea em hexadecimal)."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def copy_buffer(rows: Iterable[Tuple[Any, ...]]) -> io.StringIO:
+    """Monta o conteúdo do COPY ... FROM STDIN, uma linha por tupla."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(v) for v in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+# ============================================================
+#                         SPOOL
+# ============================================================
+
+class WriteSpool:
+    """
+    Spool de gravações de um processo
+
+    append_* só escreve no arquivo (flush para o SO); o fsync é feito em lote
+    pela thread de background a cada fsync_interval_seconds, que também tenta
+    o reenvio a cada retry_interval_seconds.
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = 8 * 1024 * 1024,
+                 fsync_interval_seconds: float = 0.2, max_replay_attempts: int = 3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_interval_seconds = fsync_interval_seconds
+        self.max_replay_attempts = max_replay_attempts
+
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._file = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._dirty = False
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+        self.records_spooled = 0
+        self.records_replayed = 0
+        self.segments_replayed = 0
+        self.segments_quarantined = 0
+        # Tentativas com erro por segmento (nome do arquivo), com o banco no ar
+        self._replay_failures: Dict[str, int] = {}
+        self.replay_progress: Optional[Dict[str, int]] = None
+        self.last_replay: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    # --------------------------- escrita ---------------------------
+
+    def append_location(self, bus_line: str, latitude: float, longitude: float,
+                        predicted_arrival: str = None, confidence_percent: float = None,
+                        interval_seconds: int = None, image_data: bytes = None,
+                        occupancy_count: int = None, ingest_key: str = None,
+                        device_id: str = None) -> str:
+        """
+        Guarda uma localização e as gravações que dependem dela. Retorna a ingest_key
+        (a informada pelo dispositivo, ou uma nova).
+        """
+        record = {
+            'kind': 'location',
+            'bus_line': bus_line,
+            'device_id': device_id,
+            'latitude': latitude,
+            'longitude': longitude,
+            'interval_seconds': interval_seconds,
+        }
+        if predicted_arrival:
+            record['eta'] = {
+                'predicted_arrival': predicted_arrival,
+                'confidence_percent': confidence_percent
+            }
+        if image_data is not None:
+            record['image'] = {
+                'data': base64.b64encode(image_data).decode('ascii'),
+                'occupancy_count': occupancy_count
+            }
+        return self._append(record, ingest_key)
+
+    def append_image(self, location_id: int, image_data: bytes,
+                     occupancy_count: int = None, ingest_key: str = None) -> str:
+        """Guarda a análise de imagem de uma localização já gravada. Retorna a ingest_key."""
+        return self._append({
+            'kind': 'image',
+            'location_id': location_id,
+            'image': {
+                'data': base64.b64encode(image_data).decode('ascii'),
+                'occupancy_count': occupancy_count
+            }
+        }, ingest_key)
+
+    def _append(self, record: Dict[str, Any], ingest_key: str = None) -> str:
+        record['ingest_key'] = ingest_key or str(uuid.uuid4())
+        record['captured_at'] = datetime.now().isoformat()
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self._dirty = True
+            self.records_spooled += 1
+
+            if self._size >= self.segment_max_bytes:
+                self._seal_segment()
+
+        return record['ingest_key']
+
+    def _open_segment(self):
+        """
+        Cria o segmento ativo, travado enquanto este processo escreve nele.
+
+        Sem a trava, outro processo adotaria o segmento como órfão e o
+        reenviaria (e apagaria) enquanto ele ainda recebe registros.
+        """
+        for _ in range(OPEN_SEGMENT_ATTEMPTS):
+            name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}{OPEN_SUFFIX}"
+            path = self.directory / name
+            f = open(path, 'ab')
+            if _try_lock(f):
+                break
+            f.close()
+            path.unlink(missing_ok=True)
+        else:
+            raise OSError(f"Não foi possível travar um segmento do spool em {self.directory}")
+
+        self._path, self._file = path, f
+        self._size = 0
+        _fsync_directory(self.directory)
+        logger.warning(f"Banco indisponível: gravações indo para o spool ({self._path.name})")
+
+    def _seal_segment(self):
+        """Fecha o segmento ativo e o marca como pronto para reenvio."""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        sealed = self._path.with_suffix(SEALED_SUFFIX)
+        os.replace(self._path, sealed)
+        _fsync_directory(self.directory)
+        self._file.close()  # libera a trava
+        self._file = None
+        self._path = None
+        self._dirty = False
+
+    def sync(self):
+        """fsync do segmento ativo, se houve escrita desde o último."""
+        with self._lock:
+            if self._dirty and self._file is not None:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def seal(self):
+        with self._lock:
+            self._seal_segment()
+
+    # --------------------------- reenvio ---------------------------
+
+    def _adopt_orphans(self):
+        """Fecha segmentos .open cujo processo terminou (trava livre)."""
+        for path in self.directory.glob(f'*{OPEN_SUFFIX}'):
+            if path == self._path:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    if _try_lock(f):
+                        os.replace(path, path.with_suffix(SEALED_SUFFIX))
+                        logger.info(f"Segmento órfão adotado para reenvio: {path.name}")
+            except FileNotFoundError:
+                continue
+
+    def has_pending(self) -> bool:
+        if self._file is not None:
+            return True
+        return any(self.directory.glob(f'*{SEALED_SUFFIX}')) or any(self.directory.glob(f'*{OPEN_SUFFIX}'))
+
+    def replay(self, db_manager) -> int:
+        """
+        Reenvia ao banco todos os segmentos fechados, do mais antigo ao mais novo.
+
+        Erro com o banco fora do ar interrompe o reenvio (os segmentos ficam
+        para a próxima tentativa). Erro com o banco no ar é do próprio segmento
+        (registro inválido): ele é pulado e, depois de max_replay_attempts
+        tentativas, vai para quarentena (.failed), sem bloquear os seguintes.
+
+        Returns:
+            Quantidade de registros reenviados
+        """
+        if not self._replay_lock.acquire(blocking=False):
+            return 0
+        try:
+            self.seal()
+            self._adopt_orphans()
+            segments = sorted(self.directory.glob(f'*{SEALED_SUFFIX}'))
+            if not segments:
+                return 0
+
+            self.replay_progress = {
+                'segments_total': len(segments), 'segments_done': 0, 'records_done': 0
+            }
+            replayed = 0
+            for path in segments:
+                try:
+                    count = self._replay_segment(db_manager, path)
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Erro ao reenviar segmento {path.name} do spool: {e}")
+                    if not db_manager.test_connection():
+                        break
+                    self._record_replay_failure(path)
+                    continue
+                self._replay_failures.pop(path.name, None)
+                replayed += count
+                self.replay_progress['segments_done'] += 1
+                self.replay_progress['records_done'] += count
+            else:
+                if not self._replay_failures:
+                    self.last_error = None
+
+            if replayed:
+                self.last_replay = datetime.now()
+                logger.info(f"Spool reenviado: {replayed} registros, "
+                            f"{self.replay_progress['segments_done']}/{len(segments)} segmentos")
+            return replayed
+        finally:
+            self.replay_progress = None
+            self._replay_lock.release()
+
+    def _record_replay_failure(self, path: Path):
+        """Conta a falha do segmento e o põe em quarentena ao atingir o limite."""
+        failures = self._replay_failures.get(path.name, 0) + 1
+        if failures < self.max_replay_attempts:
+            self._replay_failures[path.name] = failures
+            return
+
+        self._replay_failures.pop(path.name, None)
+        try:
+            os.replace(path, path.with_suffix(FAILED_SUFFIX))
+        except FileNotFoundError:
+            return  # Reenviado por outro processo
+        _fsync_directory(self.directory)
+        self.segments_quarantined += 1
+        logger.error(f"Segmento {path.name} do spool em quarentena após {failures} tentativas: "
+                     f"{path.with_suffix(FAILED_SUFFIX).name}")
+
+    def _replay_segment(self, db_manager, path: Path) -> int:
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return 0  # Já reenviado por outro processo
+
+        with f:
+            if not _try_lock(f):
+                return 0  # Outro processo está reenviando este segmento
+            records = read_segment(f)
+
+            if records:
+                with db_manager.get_cursor() as cursor:
+                    cursor.execute(queries.CREATE_SPOOL_STAGING)
+                    cursor.copy_expert(
+                        queries.COPY_SPOOL_STAGING,
+                        copy_buffer(queries.spool_staging_row(r) for r in records)
+                    )
+                    cursor.execute(queries.REPLAY_SPOOL)
+                    result = dict(cursor.fetchone())
+                    cursor.connection.commit()
+                logger.info(f"Segmento {path.name} reenviado: {result}")
+
+            path.unlink(missing_ok=True)
+            _fsync_directory(self.directory)
+
+        self.records_replayed += len(records)
+        self.segments_replayed += 1
+        return len(records)
+
+    # ------------------------- background --------------------------
+
+    def start_background(self, connect: Callable[[], Any], retry_interval_seconds: int):
+        """
+        Inicia a thread de fsync em lote e reenvio (daemon).
+
+        Args:
+            connect: retorna o SimpleDatabaseManager do processo (reconectando,
+                se necessário) ou None se o banco continua indisponível
+            retry_interval_seconds: intervalo entre tentativas de reenvio
+        """
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _run():
+            next_attempt = 0.0
+            while not self._stop_event.wait(self.fsync_interval_seconds):
+                try:
+                    self.sync()
+                    if time.monotonic() < next_attempt or not self.has_pending():
+                        continue
+                    next_attempt = time.monotonic() + retry_interval_seconds
+                    # Só fecha o segmento ativo quando o banco responde de fato
+                    db_manager = connect()
+                    if db_manager and db_manager.test_connection():
+                        self.replay(db_manager)
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Erro na thread do spool: {e}")
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=_run, name='write-spool', daemon=True)
+        self._thread.start()
+        logger.info(f"Spool de gravações ativo em {self.directory}")
+
+    def close(self):
+        """Interrompe a thread e fecha o segmento ativo (fica pronto para reenvio)."""
+        self._stop_event.set()
+        self.seal()
+
+    def get_status(self) -> Dict[str, Any]:
+        """Tamanho do spool e progresso do reenvio, para health checks."""
+        segments = list(self.directory.glob(f'*{SEALED_SUFFIX}')) + \
+            list(self.directory.glob(f'*{OPEN_SUFFIX}'))
+        pending_bytes = 0
+        for path in segments:
+            try:
+                pending_bytes += path.stat().st_size
+            except FileNotFoundError:
+                pass
+
+        return {
+            'enabled': True,
+            'directory': str(self.directory),
+            'pending_segments': len(segments),
+            'pending_bytes': pending_bytes,
+            'records_spooled': self.records_spooled,
+            'records_replayed': self.records_replayed,
+            'segments_replayed': self.segments_replayed,
+            'failed_segments': len(list(self.directory.glob(f'*{FAILED_SUFFIX}'))),
+            'replay_in_progress': dict(self.replay_progress) if self.replay_progress else None,
+            'last_replay': self.last_replay.isoformat() if self.last_replay else None,
+            'last_error': self.last_error
+        }
+
+# ============================================================
+#              INSTÂNCIA GLOBAL E INICIALIZAÇÃO
+# ============================================================
+
+write_spool: Optional[WriteSpool] = None
+
+def start_write_spool(connect: Callable[[], Any]) -> Optional[WriteSpool]:
+    """
+    Cria o spool deste processo e inicia a thread de fsync/reenvio.
+    Em servidores prefork, chamar em cada worker (depois do fork).
+    """
+    global write_spool
+
+    if not SPOOL_CONFIG['enabled']:
+        return None
+    if write_spool is None:
+        try:
+            write_spool = WriteSpool(
+                SPOOL_CONFIG['directory'],
+                SPOOL_CONFIG['segment_max_bytes'],
+                SPOOL_CONFIG['fsync_interval_seconds'],
+                SPOOL_CONFIG['max_replay_attempts']
+            )
+        except OSError as e:
+            logger.error(f"Erro ao criar spool em {SPOOL_CONFIG['directory']}: {e}")
+            return None
+    write_spool.start_background(connect, SPOOL_CONFIG['retry_interval_seconds'])
+    return write_spool
+
+def stop_write_spool():
+    """Fecha o segmento ativo (encerramento do worker)."""
+    if write_spool:
+        write_spool.close()
+
+def get_write_spool() -> Optional[WriteSpool]:
+    return write_spool
+
+def get_spool_status() -> Dict[str, Any]:
+    if write_spool is None:
+        return {'enabled': False}
+    return write_spool.get_status()
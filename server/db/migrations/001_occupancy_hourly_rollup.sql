@@ -0,0 +1,29 @@
+-- ========================================================
+-- Migração 001: Agregado horário de ocupação
+-- Descrição: Mantém contagem/soma/mínimo/máximo de ocupação por
+-- linha, hora e nível, para que as estatísticas não precisem
+-- varrer bus_image a cada requisição.
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+-- ==============================
+-- Tabela: occupancy_hourly_rollup
+-- Descrição: Agregado incremental atualizado a cada INSERT em bus_image
+-- ==============================
+CREATE TABLE IF NOT EXISTS occupancy_hourly_rollup (
+    bus_line VARCHAR(30) NOT NULL,         		-- Linha do ônibus
+    hour_bucket TIMESTAMP NOT NULL,        		-- Início da hora (date_trunc('hour'))
+    occupancy_level SMALLINT NOT NULL,     		-- Nível de ocupação (0-4)
+    sample_count INT NOT NULL,             		-- Quantidade de análises
+    sum_occupancy BIGINT NOT NULL,         		-- Soma das contagens de passageiros
+    min_occupancy SMALLINT NOT NULL,       		-- Menor contagem observada
+    max_occupancy SMALLINT NOT NULL,       		-- Maior contagem observada
+    PRIMARY KEY (bus_line, hour_bucket, occupancy_level)
+);
+
+CREATE INDEX IF NOT EXISTS idx_occupancy_rollup_hour
+    ON occupancy_hourly_rollup (hour_bucket);
+
+-- A carga inicial a partir das imagens já existentes é feita por
+-- start_simple.py (queries.SEED_OCCUPANCY_ROLLUP), com os níveis de
+-- ml/occupancy_levels.py: a regra fica em um lugar só.
@@ -0,0 +1,43 @@
+-- ========================================================
+-- Migração 002: Perfil de atraso por linha, dia da semana e hora
+-- Descrição: Substitui a agregação sobre 7 dias de prediction_confidence
+-- feita a cada POST de GPS por uma tabela atualizada incrementalmente.
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+-- ==============================
+-- Tabela: delay_profile
+-- Descrição: Média e variância (Welford) do atraso em minutos
+-- (actual_arrival - predicted_arrival)
+-- ==============================
+CREATE TABLE IF NOT EXISTS delay_profile (
+    bus_line VARCHAR(30) NOT NULL,         		-- Linha do ônibus
+    weekday SMALLINT NOT NULL,             		-- Dia da semana (0 = segunda, como datetime.weekday())
+    hour SMALLINT NOT NULL,                		-- Hora do dia (0-23) da localização
+    sample_count INT NOT NULL,             		-- Quantidade de chegadas observadas
+    mean_delay_minutes DOUBLE PRECISION NOT NULL,	-- Atraso médio em minutos
+    m2_delay DOUBLE PRECISION NOT NULL,    		-- Soma dos quadrados dos desvios (variância = m2 / n)
+    PRIMARY KEY (bus_line, weekday, hour)
+);
+
+-- ==============================
+-- Tabela: analytics_watermark
+-- Descrição: Marca d'água dos jobs incrementais
+-- ==============================
+CREATE TABLE IF NOT EXISTS analytics_watermark (
+    job_name VARCHAR(50) PRIMARY KEY,      		-- Nome do job
+    watermark TIMESTAMP NOT NULL           		-- Último instante processado
+);
+
+-- ==============================
+-- Coluna: prediction_confidence.profiled_at
+-- Descrição: Quando a chegada foi contada no perfil (NULL = pendente).
+-- O job conta cada chegada uma vez, na ordem em que as transações
+-- terminam, sem depender do horário informado em actual_arrival.
+-- ==============================
+ALTER TABLE prediction_confidence ADD COLUMN IF NOT EXISTS profiled_at TIMESTAMP;
+
+-- O job do perfil lê só as chegadas pendentes
+CREATE INDEX IF NOT EXISTS idx_prediction_confidence_pending_profile
+    ON prediction_confidence (id)
+    WHERE actual_arrival IS NOT NULL AND profiled_at IS NULL;
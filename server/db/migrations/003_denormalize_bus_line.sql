@@ -0,0 +1,31 @@
+-- ========================================================
+-- Migração 003: bus_line e horário da localização nas tabelas dependentes
+-- Descrição: Copia bus_line e timestamp_location de bus_location para
+-- bus_image e prediction_confidence, permitindo filtrar por linha sem JOIN.
+-- Linhas antigas são preenchidas em lotes por:
+--     python -m database.maintenance backfill-denormalized
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+ALTER TABLE bus_image
+    ADD COLUMN IF NOT EXISTS bus_line VARCHAR(30),          -- Cópia de bus_location.bus_line
+    ADD COLUMN IF NOT EXISTS timestamp_location TIMESTAMP;  -- Cópia de bus_location.timestamp_location
+
+ALTER TABLE prediction_confidence
+    ADD COLUMN IF NOT EXISTS bus_line VARCHAR(30),          -- Cópia de bus_location.bus_line
+    ADD COLUMN IF NOT EXISTS timestamp_location TIMESTAMP;  -- Cópia de bus_location.timestamp_location
+
+-- Índices compostos para as consultas por linha + janela de tempo. Com o id,
+-- também servem à paginação por keyset em (timestamp, id) decrescente.
+CREATE INDEX IF NOT EXISTS idx_bus_image_line_time_id
+    ON bus_image (bus_line, timestamp_image DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_prediction_confidence_line_time_id
+    ON prediction_confidence (bus_line, timestamp_prediction DESC, id DESC);
+
+-- Índices parciais usados apenas pelo backfill (ficam vazios depois dele)
+CREATE INDEX IF NOT EXISTS idx_bus_image_backfill
+    ON bus_image (id) WHERE bus_line IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_prediction_confidence_backfill
+    ON prediction_confidence (id) WHERE bus_line IS NULL;
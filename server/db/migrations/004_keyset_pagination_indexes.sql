@@ -0,0 +1,10 @@
+-- ========================================================
+-- Migração 004: Índices para paginação por keyset
+-- Descrição: As listagens paginam por (timestamp, id) em ordem decrescente;
+-- com o id no índice, qualquer página custa o mesmo que a primeira.
+-- bus_image e prediction_confidence já recebem o índice equivalente na 003.
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+CREATE INDEX IF NOT EXISTS idx_bus_location_line_time_id
+    ON bus_location (bus_line, timestamp_location DESC, id DESC);
@@ -0,0 +1,21 @@
+-- ========================================================
+-- Migração 005: chave de ingestão para gravações reenviadas
+-- Descrição: Identificador único, gerado no servidor quando a leitura é
+-- recebida, gravado junto com a localização e a imagem. O reenvio do spool
+-- local (database/spool.py) usa ON CONFLICT (ingest_key) DO NOTHING, então
+-- repetir um segmento não duplica linhas.
+-- Gravações diretas deixam a coluna NULL (não conflita no índice único).
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+ALTER TABLE bus_location
+    ADD COLUMN IF NOT EXISTS ingest_key UUID;   -- Chave da leitura original (spool)
+
+ALTER TABLE bus_image
+    ADD COLUMN IF NOT EXISTS ingest_key UUID;   -- Chave da leitura original (spool)
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_bus_location_ingest_key
+    ON bus_location (ingest_key);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_bus_image_ingest_key
+    ON bus_image (ingest_key);
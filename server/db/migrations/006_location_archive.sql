@@ -0,0 +1,61 @@
+-- ========================================================
+-- Migração 006: Arquivamento do histórico de GPS antigo
+-- Descrição: Localizações mais antigas que ARCHIVE_CONFIG['older_than_days']
+-- saem de bus_location: os pontos brutos vão para arquivos colunares
+-- comprimidos em disco (registrados no manifesto) e um ponto por ônibus
+-- (linha e device_id) a cada bucket_seconds fica em bus_location_archive
+-- (database/archive.py).
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+-- ==============================
+-- Tabela: bus_location_archive
+-- Descrição: Histórico reduzido, um ponto por ônibus e intervalo de tempo
+-- ==============================
+CREATE TABLE IF NOT EXISTS bus_location_archive (
+    bus_line VARCHAR(30) NOT NULL,         		-- Linha do ônibus
+    device_id VARCHAR(64) NOT NULL DEFAULT '',	-- Dispositivo do ônibus ('' para leituras sem device_id)
+    bucket_start TIMESTAMP NOT NULL,       		-- Início do intervalo (múltiplo de bucket_seconds)
+    timestamp_location TIMESTAMP NOT NULL, 		-- Momento do ponto mantido (o primeiro do intervalo)
+    latitude DOUBLE PRECISION NOT NULL,    		-- Latitude do ponto mantido
+    longitude DOUBLE PRECISION NOT NULL,   		-- Longitude do ponto mantido
+    sample_count INT NOT NULL,             		-- Pontos brutos arquivados no intervalo
+    PRIMARY KEY (bus_line, device_id, bucket_start)
+);
+
+-- ==============================
+-- Tabela: location_archive_manifest
+-- Descrição: Arquivos com os pontos brutos removidos de bus_location
+-- ==============================
+CREATE TABLE IF NOT EXISTS location_archive_manifest (
+    id SERIAL PRIMARY KEY,                 		-- Identificador do lote arquivado
+    file_path TEXT NOT NULL UNIQUE,        		-- Caminho relativo ao diretório de arquivo
+    file_format VARCHAR(10) NOT NULL,      		-- 'parquet' ou 'npz'
+    file_bytes BIGINT NOT NULL,            		-- Tamanho do arquivo
+    row_count INT NOT NULL,                		-- Pontos no arquivo
+    range_start TIMESTAMP NOT NULL,        		-- timestamp_location do ponto mais antigo
+    range_end TIMESTAMP NOT NULL,          		-- timestamp_location do ponto mais recente
+    min_location_id INT NOT NULL,          		-- Menor id arquivado
+    max_location_id INT NOT NULL,          		-- Maior id arquivado
+    bus_lines TEXT[] NOT NULL,             		-- Linhas presentes no arquivo
+    bucket_seconds INT NOT NULL,           		-- Intervalo usado na redução
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP	-- Momento do arquivamento
+);
+
+CREATE INDEX IF NOT EXISTS idx_location_archive_manifest_range
+    ON location_archive_manifest (range_start, range_end);
+
+-- Seleção dos lotes por idade
+CREATE INDEX IF NOT EXISTS idx_bus_location_time
+    ON bus_location (timestamp_location DESC);
+
+-- Chaves estrangeiras: a verificação de imagem e o DELETE em cascata de cada
+-- lote não varrem as tabelas dependentes inteiras
+CREATE INDEX IF NOT EXISTS idx_bus_image_location
+    ON bus_image (location_id);
+
+CREATE INDEX IF NOT EXISTS idx_prediction_confidence_location
+    ON prediction_confidence (location_id);
+
+CREATE INDEX IF NOT EXISTS idx_request_interval_location
+    ON request_interval (location_id);
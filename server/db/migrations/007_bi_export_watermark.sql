@@ -0,0 +1,31 @@
+-- ========================================================
+-- Migração 007: Marcas d'água da exportação do Power BI
+-- Descrição: A exportação incremental (database/bi_export.py) guarda em
+-- analytics_watermark, por tabela, o último id exportado e as lacunas abaixo
+-- dele: ids que ainda não eram visíveis (transação aberta quando o lote foi
+-- lido) e são lidos de novo nas execuções seguintes. A coluna watermark
+-- continua sendo o instante: da última execução, ou o limite de
+-- arrival_recorded_at já exportado.
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+ALTER TABLE analytics_watermark
+    ADD COLUMN IF NOT EXISTS last_id BIGINT,    -- Último id processado (jobs por id)
+    ADD COLUMN IF NOT EXISTS gap_ids BIGINT[],  -- Ids abaixo de last_id ainda não vistos
+    ADD COLUMN IF NOT EXISTS gap_xmax BIGINT;   -- xmax do snapshot em que as lacunas foram vistas
+
+-- Quando a chegada foi registrada (UPDATE_ACTUAL_ARRIVAL), independente do
+-- horário informado em actual_arrival, que pode ser bem anterior
+ALTER TABLE prediction_confidence
+    ADD COLUMN IF NOT EXISTS arrival_recorded_at TIMESTAMP;
+
+-- Chegadas registradas antes desta coluna: o registro mais antigo possível
+-- é o próprio horário da chegada (mesmo limite da marca d'água anterior)
+UPDATE prediction_confidence
+SET arrival_recorded_at = actual_arrival
+WHERE actual_arrival IS NOT NULL
+AND arrival_recorded_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_prediction_confidence_arrival_recorded
+    ON prediction_confidence (arrival_recorded_at)
+    WHERE arrival_recorded_at IS NOT NULL;
@@ -0,0 +1,16 @@
+-- ========================================================
+-- Migração 008: dispositivo de origem de cada localização
+-- Descrição: device_id enviado pelo ESP32, gravado junto com a leitura. O
+-- feed GTFS-Realtime (api/gtfs_realtime.py) publica um veículo por
+-- dispositivo, a partir da leitura mais recente de cada um; leituras sem
+-- device_id (NULL) não identificam o ônibus e ficam fora do feed.
+-- Idempotente: pode ser executada mais de uma vez.
+-- ========================================================
+
+ALTER TABLE bus_location
+    ADD COLUMN IF NOT EXISTS device_id VARCHAR(64);   -- Identificador do dispositivo (ESP32)
+
+-- Leitura mais recente de cada dispositivo (DISTINCT ON device_id)
+CREATE INDEX IF NOT EXISTS idx_bus_location_device_time
+    ON bus_location (device_id, timestamp_location DESC)
+    WHERE device_id IS NOT NULL;
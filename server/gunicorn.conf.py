@@ -0,0 +1,79 @@
+"""
+Configuração do Gunicorn para produção
+Valores vêm de API_CONFIG (config_simple.py), ajustáveis por variáveis de ambiente
+
+Para executar:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Modelo de processos:
+- preload_app: o master importa o app (e os pesos do YOLO) uma vez; os workers
+  herdam essa memória por copy-on-write em vez de carregar uma cópia cada.
+- post_fork: cada worker cria o próprio pool de conexões e a thread do perfil
+  de atraso. Nada disso existe no master.
+- gthread: API_CONFIG['threads'] requisições simultâneas por worker; o pool de
+  conexões tem o mesmo tamanho.
+- Um worker só enquanto houver estado por ônibus em memória
+  (per_device_state_enabled): com vários, leituras consecutivas de um
+  dispositivo caem em processos diferentes, cada um compara com a sua própria
+  âncora e a posição mais recente muda conforme o worker que responde. Para
+  escalar, rode várias instâncias de um worker atrás de um balanceador que
+  distribua pelo device_id.
+
+Reload sem derrubar uploads em andamento:
+- kill -HUP <master>: sobe workers novos e encerra os antigos com graceful_timeout
+  para concluírem as requisições em andamento (recarrega configuração e
+  recria pools; o código continua o do master, por causa do preload).
+- Para publicar código novo: kill -USR2 <master> (novo master com o código
+  atualizado), depois kill -TERM <master antigo>, que também espera graceful_timeout.
+"""
+
+import gc
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config_simple import API_CONFIG, per_device_state_enabled
+
+bind = f"{API_CONFIG['host']}:{API_CONFIG['port']}"
+workers = API_CONFIG['workers']
+if workers > 1 and per_device_state_enabled():
+    print(f"API_WORKERS={workers} ignorado: estado por ônibus em memória exige um worker "
+          f"(desative TRAJECTORY_COMPRESSION e ROUTE_ENGINE para usar mais)", file=sys.stderr)
+    workers = 1
+worker_class = 'gthread'
+threads = API_CONFIG['threads']
+timeout = API_CONFIG['timeout']
+graceful_timeout = API_CONFIG['graceful_timeout']
+keepalive = API_CONFIG['keepalive']
+max_requests = API_CONFIG['max_requests']
+max_requests_jitter = API_CONFIG['max_requests_jitter']
+
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+def when_ready(server):
+    """Master pronto, app já carregado: congela os objetos atuais no GC.
+
+    Sem isso, a coleta de lixo nos workers toca os cabeçalhos dos objetos
+    herdados e força a cópia das páginas de memória compartilhadas.
+    """
+    gc.freeze()
+    server.log.info("App pré-carregado; objetos congelados para copy-on-write")
+
+def post_fork(server, worker):
+    """Recursos por processo, criados depois do fork."""
+    from main import initialize_services
+    from ml.occupancy_predictor import configure_inference_threads
+
+    configure_inference_threads(API_CONFIG['inference_threads'])
+    mode = initialize_services()
+    server.log.info(f"Worker {worker.pid} inicializado (modo: {mode})")
+
+def worker_exit(server, worker):
+    """Fecha pool e thread de background ao encerrar o worker."""
+    from main import shutdown_services
+
+    shutdown_services()
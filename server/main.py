@@ -6,7 +6,8 @@ Este é o ponto de entrada principal do backend.
 Inicia o servidor Flask e registra todas as APIs.
 
 Para executar:
-    python main.py
+    python main.py                              # desenvolvimento
+    gunicorn -c gunicorn.conf.py wsgi:app       # produção
 
 O servidor estará disponível em: http://localhost:3000
 """
@@ -35,25 +36,105 @@ from api.simple_location_api import simple_location_bp
 from api.simple_image_api import simple_image_bp
 from api.simple_integrated_api import simple_integrated_bp
 from api.dashboard_api import dashboard_bp
+from api.gtfs_rt_api import gtfs_rt_bp
+from api.osrm_client import get_osrm_circuit_status
 
-# Tenta inicializar banco de dados simplificado
-try:
-    from database.simple_connection import initialize_simple_database
-    from config_simple import DATABASE_CONFIG
+# Modo do banco neste processo (definido por initialize_services)
+DATABASE_MODE = "fallback"
+
+def _initialize_database() -> str:
+    """
+    Conecta ao banco e inicia a thread do perfil de atraso.
+    Também usada pelo spool para reconectar um processo que iniciou em fallback.
+    """
+    global DATABASE_MODE
     
-    if initialize_simple_database(DATABASE_CONFIG):
-        logger.info("Banco de dados simplificado inicializado")
-        DATABASE_MODE = "simple_database"
-    else:
-        logger.warning("Falha ao conectar com banco - usando modo fallback")
-        DATABASE_MODE = "fallback"
+    try:
+        from database.simple_connection import initialize_simple_database
+        from config_simple import DATABASE_CONFIG
         
-except ImportError as e:
-    logger.warning("Erro ao inicializar banco simplificado: %s", e)
-    logger.info("Usando modo fallback (sem banco de dados)")
-    DATABASE_MODE = "fallback"
+        # Uma conexão por thread de atendimento
+        if initialize_simple_database(DATABASE_CONFIG, pool_size=API_CONFIG['threads']):
+            logger.info("Banco de dados simplificado inicializado")
+            DATABASE_MODE = "simple_database"
+            
+            # Perfil de atraso usado no ajuste histórico do ETA (atualização em background)
+            from database.simple_connection import get_simple_delay_profile_repository
+            from ml.delay_profile import get_delay_profile_cache
+            from config_simple import DELAY_PROFILE_CONFIG
+            get_delay_profile_cache().start_background_refresh(
+                get_simple_delay_profile_repository(),
+                DELAY_PROFILE_CONFIG['refresh_interval_seconds']
+            )
+        else:
+            logger.warning("Falha ao conectar com banco - usando modo fallback")
+            DATABASE_MODE = "fallback"
+            
+    except ImportError as e:
+        logger.warning("Erro ao inicializar banco simplificado: %s", e)
+        logger.info("Usando modo fallback (sem banco de dados)")
+        DATABASE_MODE = "fallback"
+    
+    return DATABASE_MODE
 
-def create_app():
+def _spool_database():
+    """Banco para o reenvio do spool; reconecta se o processo está em fallback."""
+    from database.simple_connection import get_simple_database_manager, get_simple_bus_repository
+    
+    if get_simple_bus_repository() is None:
+        _initialize_database()
+    if DATABASE_MODE != "simple_database":
+        return None
+    return get_simple_database_manager()
+
+def initialize_services() -> str:
+    """
+    Inicializa os recursos de cada processo: pool de conexões com o banco,
+    thread de atualização do perfil de atraso, spool local de gravações e
+    thread de ticks dos feeds GTFS-RT.
+    
+    Não roda na importação do módulo: em produção (gunicorn.conf.py) o app é
+    pré-carregado no master e esta função é chamada em cada worker, depois do
+    fork. Conexões e threads não sobrevivem ao fork de forma segura.
+    
+    Returns:
+        "simple_database" ou "fallback"
+    """
+    mode = _initialize_database()
+    
+    # Sem banco (ou se ele cair depois), as gravações vão para o spool
+    from database.spool import start_write_spool
+    start_write_spool(_spool_database)
+    
+    # Feeds GTFS-RT codificados uma vez por tick
+    from config_simple import GTFS_RT_CONFIG
+    if GTFS_RT_CONFIG['enabled']:
+        from api.gtfs_realtime import get_gtfs_realtime_publisher
+        get_gtfs_realtime_publisher().start()
+    
+    # Velocidades aprendidas por trecho: gravadas periodicamente no arquivo
+    from config_simple import SEGMENT_SPEED_CONFIG
+    if SEGMENT_SPEED_CONFIG['enabled']:
+        from ml.segment_speeds import get_segment_speed_estimator
+        get_segment_speed_estimator().start_background_persist(SEGMENT_SPEED_CONFIG['persist_seconds'])
+    
+    return mode
+
+def shutdown_services():
+    """Libera os recursos criados por initialize_services (saída do worker)."""
+    from database.simple_connection import close_simple_database
+    from database.spool import stop_write_spool
+    from ml.delay_profile import get_delay_profile_cache
+    from api.gtfs_realtime import get_gtfs_realtime_publisher
+    from ml.segment_speeds import get_segment_speed_estimator
+    
+    get_gtfs_realtime_publisher().stop()
+    get_segment_speed_estimator().stop()
+    stop_write_spool()
+    get_delay_profile_cache().stop()
+    close_simple_database()
+
+def create_app(enable_cors: bool = True):
     """
     Cria e configura a aplicação Flask
     
@@ -63,6 +144,10 @@ def create_app():
     3. Registra todos os blueprints (APIs)
     4. Define endpoints globais (health check, info)
     
+    Args:
+        enable_cors: False quando o app é montado dentro do servidor ASGI,
+            que já aplica CORS em todas as respostas
+    
     Returns:
         Flask app configurado e pronto para uso
     """
@@ -70,10 +155,11 @@ def create_app():
     
     # Habilita CORS para permitir requisições do frontend
     # Isso permite que o Next.js (localhost:3001) faça requisições para a API
-    CORS(app, 
-         origins=CORS_CONFIG['origins'],
-         methods=CORS_CONFIG['methods'],
-         allow_headers=CORS_CONFIG['allow_headers'])
+    if enable_cors:
+        CORS(app, 
+             origins=CORS_CONFIG['origins'],
+             methods=CORS_CONFIG['methods'],
+             allow_headers=CORS_CONFIG['allow_headers'])
     
     # Registra blueprints das APIs
     # Cada blueprint agrupa endpoints relacionados
@@ -81,6 +167,7 @@ def create_app():
     app.register_blueprint(simple_image_bp, url_prefix='/api')         # API de análise de imagens
     app.register_blueprint(simple_integrated_bp, url_prefix='/api')    # API integrada (GPS + Imagem)
     app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')  # API do dashboard (frontend)
+    app.register_blueprint(gtfs_rt_bp, url_prefix='/gtfs-rt')          # Feeds GTFS-Realtime (protobuf)
     
     # ============================================
     # Endpoints Globais
@@ -101,7 +188,8 @@ def create_app():
             'status': 'healthy',
             'service': 'bus-monitoring-api',
             'version': '1.0.0',
-            'description': 'API de monitoramento IoT para ônibus'
+            'description': 'API de monitoramento IoT para ônibus',
+            'osrm_circuit': get_osrm_circuit_status()
         }, 200
     
     @app.route('/')
@@ -132,7 +220,9 @@ def create_app():
             'occupancy_statistics': '/api/image/statistics',
             'integrated': '/api/location-image',
             'integrated_status': '/api/integrated/status/<bus_line>',
-            'health': '/api/health'
+            'health': '/api/health',
+            'gtfs_rt_vehicle_positions': '/gtfs-rt/vehicle_positions',
+            'gtfs_rt_trip_updates': '/gtfs-rt/trip_updates'
         }
         }, 200
     
@@ -144,9 +234,10 @@ if __name__ == '__main__':
     logger.info("Iniciando servidor de monitoramento de ônibus IoT...")
     logger.info("Projeto Integrador - 4º Semestre ADS")
     
+    initialize_services()
     app = create_app()
     
-    # Inicia o servidor Flask usando a configuração definida em API_CONFIG
+    # Inicia o servidor Flask (desenvolvimento; em produção use gunicorn.conf.py) usando a configuração definida em API_CONFIG
     app.run(
         host=API_CONFIG['host'],  # por exemplo: "127.0.0.1"
         port=API_CONFIG['port'],  # por exemplo: 3000
@@ -0,0 +1,122 @@
+"""
+Cache em memória do perfil de atraso por linha, dia da semana e hora
+Atualizado em background a partir da tabela delay_profile
+Baseado nos requisitos do projeto IoT de monitoramento de ônibus
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from config_simple import DELAY_PROFILE_CONFIG
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+def delay_to_adjustment(avg_delay: float) -> float:
+    """
+    Converte atraso médio (minutos) em fator de ajuste do ETA
+
+    Args:
+        avg_delay: Atraso médio em minutos (negativo = adiantado)
+
+    Returns:
+        Fator multiplicativo do ETA
+    """
+    if avg_delay > 0:
+        # Atraso médio de 5 minutos = fator 1.1 (10% mais tempo)
+        return max(0.8, 1.0 + (avg_delay / 50))
+    # Adiantamento médio = fator < 1.0 (menos tempo)
+    return min(1.2, 1.0 + (avg_delay / 50))
+
+class DelayProfileCache:
+    """
+    Perfil de atraso mantido em memória
+
+    A consulta por requisição é apenas um acesso a dicionário; a
+    atualização incremental roda em uma thread separada.
+    """
+
+    def __init__(self, min_samples: int = 3):
+        self.min_samples = min_samples
+        self._profile: Dict[Tuple[str, int, int], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self.last_refresh: Optional[datetime] = None
+
+    def refresh(self, repository) -> bool:
+        """
+        Incorpora novas chegadas no banco e recarrega o perfil
+
+        Args:
+            repository: SimpleDelayProfileRepository
+
+        Returns:
+            True se o perfil foi recarregado
+        """
+        try:
+            updated = repository.refresh_incremental()
+            profile = repository.load_profile()
+        except Exception as e:
+            logger.error(f"Erro ao atualizar perfil de atraso: {e}")
+            return False
+
+        # Troca a referência inteira: leitores nunca veem um perfil parcial
+        with self._lock:
+            self._profile = profile
+            self.last_refresh = datetime.now()
+
+        logger.info(f"Perfil de atraso atualizado: {updated} células novas, {len(profile)} no total")
+        return True
+
+    def get_profile(self, bus_line: str, weekday: int, hour: int) -> Optional[Dict[str, float]]:
+        """Retorna média, variância e contagem da célula, se houver."""
+        return self._profile.get((bus_line, weekday, hour))
+
+    def get_adjustment(self, bus_line: str, weekday: int, hour: int) -> float:
+        """
+        Fator de ajuste histórico para a linha no dia/hora informados
+
+        Returns:
+            Fator de ajuste (1.0 quando não há amostras suficientes)
+        """
+        cell = self.get_profile(bus_line, weekday, hour)
+        if not cell or cell['count'] < self.min_samples:
+            return 1.0
+        return delay_to_adjustment(cell['mean_delay_minutes'])
+
+    def start_background_refresh(self, repository, interval_seconds: int):
+        """Inicia a thread de atualização periódica (daemon)."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _run():
+            while True:
+                self.refresh(repository)
+                if self._stop_event.wait(interval_seconds):
+                    break
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=_run, name='delay-profile-refresh', daemon=True)
+        self._thread.start()
+        logger.info(f"Atualização do perfil de atraso iniciada (a cada {interval_seconds}s)")
+
+    def stop(self):
+        """Interrompe a thread de atualização."""
+        self._stop_event.set()
+
+    def get_status(self) -> Dict:
+        """Resumo para health checks."""
+        return {
+            'cells': len(self._profile),
+            'last_refresh': self.last_refresh.isoformat() if self.last_refresh else None
+        }
+
+# Instância global do cache
+delay_profile_cache = DelayProfileCache(DELAY_PROFILE_CONFIG['min_samples'])
+
+def get_delay_profile_cache() -> DelayProfileCache:
+    """Retorna a instância global do cache de perfil de atraso."""
+    return delay_profile_cache
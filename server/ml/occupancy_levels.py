@@ -0,0 +1,41 @@
+"""
+Níveis de ocupação (0-4) a partir da contagem de passageiros
+Regra única usada pelas APIs, pelos repositórios e pelo SQL do agregado horário
+
+Fica fora de api/ e database/ para que as duas camadas importem daqui sem
+depender uma da outra.
+"""
+
+from config_simple import ML_CONFIG
+
+# Frações da capacidade que fecham os níveis 1 (Baixa), 2 (Média) e 3 (Alta);
+# acima da última é 4 (Lotado) e zero passageiros é 0 (Vazio)
+OCCUPANCY_LEVEL_FRACTIONS = (0.25, 0.5, 0.75)
+
+def determine_occupancy_level(passenger_count: int, max_capacity: int = None) -> int:
+    """
+    Determina nível de ocupação (0-4) baseado na contagem de passageiros
+    """
+    if max_capacity is None:
+        max_capacity = ML_CONFIG['max_occupancy_count']
+    if passenger_count == 0:
+        return 0
+    for level, fraction in enumerate(OCCUPANCY_LEVEL_FRACTIONS, start=1):
+        if passenger_count <= max_capacity * fraction:
+            return level
+    return len(OCCUPANCY_LEVEL_FRACTIONS) + 1
+
+def occupancy_level_sql(column: str, max_capacity: int = None) -> str:
+    """
+    Expressão CASE equivalente a determine_occupancy_level
+
+    Args:
+        column: coluna (ou expressão) com a contagem de passageiros
+        max_capacity: capacidade do ônibus (padrão: ML_CONFIG['max_occupancy_count'])
+    """
+    if max_capacity is None:
+        max_capacity = ML_CONFIG['max_occupancy_count']
+    branches = [f"WHEN {column} = 0 THEN 0"]
+    for level, fraction in enumerate(OCCUPANCY_LEVEL_FRACTIONS, start=1):
+        branches.append(f"WHEN {column} <= {max_capacity * fraction} THEN {level}")
+    return f"CASE {' '.join(branches)} ELSE {len(OCCUPANCY_LEVEL_FRACTIONS) + 1} END"
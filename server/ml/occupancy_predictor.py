@@ -427,8 +427,27 @@ class OccupancyPredictor:
         return recommendations
 
 # Instância global do preditor
+# Criada na importação: com o app pré-carregado (gunicorn.conf.py), os pesos
+# ficam na memória do master e são compartilhados copy-on-write pelos workers
 occupancy_predictor = OccupancyPredictor()
 
+def configure_inference_threads(num_threads: int):
+    """
+    Limita as threads internas de torch/OpenCV deste processo
+    
+    Com vários workers, cada um usando todos os núcleos, a inferência
+    disputa CPU entre processos. Chamar em cada worker, depois do fork.
+    
+    Args:
+        num_threads: Threads de inferência por processo
+    """
+    cv2.setNumThreads(num_threads)
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
 def predict_bus_occupancy(image_base64: str) -> Dict:
     """
     Função wrapper para predição de ocupação
@@ -0,0 +1,330 @@
+"""
+Velocidades aprendidas por trecho do itinerário, dia da semana e faixa horária
+Estimador incremental a partir de leituras GPS consecutivas do mesmo ônibus
+
+O ETA usava ETA_CONFIG['default_speed_kmh'] (ou o tempo tabelado do
+itinerário) vezes o fator fixo da hora. Para linhas com itinerário
+(api/route_engine.py), cada par de leituras consecutivas do mesmo ônibus
+vira uma observação: a distância percorrida ao longo do traçado entre as
+duas leituras, dividida pelo tempo entre elas. O tempo é atribuído aos
+trechos entre paradas atravessados, na proporção da distância em cada um.
+
+Por linha (e sentido, para as do GTFS: LineRoute.key), arrays [trecho, dia
+da semana, faixa horária] guardam totais ponderados: soma dos pesos, soma das
+velocidades e soma dos quadrados, mais a contagem de observações. Cada
+observação tem peso 1, dividido entre os trechos atravessados. Média e
+variância saem dos totais na consulta.
+
+Ônibus parado: a leitura âncora é mantida até ele andar min_move_meters, então
+o tempo parado (congestionamento, semáforo) entra na velocidade do trecho.
+Intervalos maiores que max_gap_seconds, ré ou velocidade acima de
+max_speed_kmh descartam a observação e recomeçam a partir da leitura nova.
+
+Os arrays são gravados em SEGMENT_SPEED_CONFIG['path'] (.npz) a cada
+persist_seconds e no encerramento do worker. Vários workers gravam no mesmo
+arquivo: cada um soma aos totais do disco só o que acumulou desde a sua última
+gravação, com o arquivo travado. Como são somas, a junção é exata, inclusive
+quando dois workers atualizam a mesma célula.
+
+Só ônibus identificados (device_id, bus_key_for) alimentam o estimador: sem
+identificador, leituras de ônibus diferentes da mesma linha virariam uma
+observação só. As leituras de referência ficam na memória do processo, então
+as de um dispositivo precisam cair sempre no mesmo worker
+(per_device_state_enabled em config_simple.py).
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from config_simple import SEGMENT_SPEED_CONFIG
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = 7
+
+def hour_buckets() -> int:
+    return 24 // SEGMENT_SPEED_CONFIG['bucket_hours']
+
+# Arrays de LineSpeeds (também as chaves no .npz)
+SPEED_ARRAYS = ('weight', 'total', 'total_sq', 'count')
+
+class LineSpeeds:
+    """Totais ponderados da velocidade (km/h) de cada trecho de uma linha."""
+
+    __slots__ = ('stop_ids',) + SPEED_ARRAYS
+
+    def __init__(self, stop_ids: Tuple[str, ...], weight: np.ndarray = None, total: np.ndarray = None,
+                 total_sq: np.ndarray = None, count: np.ndarray = None):
+        shape = (len(stop_ids) - 1, WEEKDAYS, hour_buckets())
+        self.stop_ids = tuple(stop_ids)
+        self.weight = weight if weight is not None else np.zeros(shape, dtype=np.float64)
+        self.total = total if total is not None else np.zeros(shape, dtype=np.float64)
+        self.total_sq = total_sq if total_sq is not None else np.zeros(shape, dtype=np.float64)
+        self.count = count if count is not None else np.zeros(shape, dtype=np.uint32)
+
+    def copy(self) -> 'LineSpeeds':
+        return LineSpeeds(self.stop_ids, *(getattr(self, name).copy() for name in SPEED_ARRAYS))
+
+    def update(self, segment: int, weekday: int, bucket: int, speed_kmh: float, weight: float):
+        """Uma observação com o peso dado (fração da distância no trecho)."""
+        cell = (segment, weekday, bucket)
+        self.weight[cell] += weight
+        self.total[cell] += weight * speed_kmh
+        self.total_sq[cell] += weight * speed_kmh * speed_kmh
+        self.count[cell] += 1
+
+    def mean_var(self, cell) -> Tuple[np.ndarray, np.ndarray]:
+        """Média e variância (km/h) de uma célula ou fatia; 0 onde não há peso."""
+        weight = self.weight[cell]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(weight > 0, self.total[cell] / weight, 0.0)
+            var = np.where(weight > 0, self.total_sq[cell] / weight - mean * mean, 0.0)
+        return mean, np.maximum(var, 0.0)
+
+class SegmentSpeedEstimator:
+    """Velocidades por trecho de todas as linhas, alimentadas pelas leituras GPS."""
+
+    def __init__(self, path: str = None):
+        self.path = path if path is not None else SEGMENT_SPEED_CONFIG['path']
+        self._lines: Dict[str, LineSpeeds] = {}
+        # Estado na última gravação/leitura do arquivo (base da junção com o disco)
+        self._base: Dict[str, LineSpeeds] = {}
+        # bus_key -> (linha e sentido, distância ao longo do traçado, instante epoch)
+        self._anchors: Dict[str, Tuple[str, float, float]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self.observations = 0
+        self.discarded = 0
+        self.last_persist: Optional[datetime] = None
+
+    def _line(self, line: str, stop_ids: Tuple[str, ...]) -> LineSpeeds:
+        speeds = self._lines.get(line)
+        if speeds is None or speeds.stop_ids != stop_ids:
+            # Linha nova ou itinerário com outras paradas: recomeça
+            speeds = self._lines[line] = LineSpeeds(stop_ids)
+        return speeds
+
+    def observe(self, bus_key: Optional[str], route, along_m: float, timestamp: datetime) -> bool:
+        """
+        Leitura de um ônibus projetada no itinerário
+
+        Args:
+            bus_key: identificador do ônibus (bus_key_for); None não gera observação
+            route: LineRoute da linha (api/route_engine.py)
+            along_m: distância ao longo do traçado
+            timestamp: instante da leitura
+
+        Returns:
+            True se a leitura gerou uma observação de velocidade
+        """
+        if bus_key is None:
+            return False
+        config = SEGMENT_SPEED_CONFIG
+        t = timestamp.timestamp()
+        with self._lock:
+            anchor = self._anchors.get(bus_key)
+            if anchor is None or anchor[0] != route.key or t <= anchor[2] or \
+                    t - anchor[2] > config['max_gap_seconds'] or along_m < anchor[1]:
+                self._anchors[bus_key] = (route.key, along_m, t)
+                return False
+            moved = along_m - anchor[1]
+            if moved < config['min_move_meters']:
+                return False
+            seconds = t - anchor[2]
+            speed_kmh = moved / seconds * 3.6
+            self._anchors[bus_key] = (route.key, along_m, t)
+            if speed_kmh > config['max_speed_kmh']:
+                self.discarded += 1
+                return False
+
+            # Trechos entre paradas atravessados, com a fração da distância em cada um
+            stop_along = route.stop_along
+            start = max(anchor[1], float(stop_along[0]))
+            end = min(along_m, float(stop_along[-1]))
+            if end <= start:
+                return False
+            first = int(np.searchsorted(stop_along, start, side='right')) - 1
+            last = min(int(np.searchsorted(stop_along, end, side='left')) - 1, len(stop_along) - 2)
+            when = datetime.fromtimestamp((anchor[2] + t) / 2)
+            weekday, bucket = when.weekday(), when.hour // config['bucket_hours']
+            speeds = self._line(route.key, route.stop_ids)
+            for segment in range(max(first, 0), last + 1):
+                overlap = min(end, stop_along[segment + 1]) - max(start, stop_along[segment])
+                if overlap > 0:
+                    speeds.update(segment, weekday, bucket, speed_kmh, overlap / moved)
+            self.observations += 1
+            return True
+
+    def segment_speed(self, line: str, segment: int, weekday: int, hour: int) -> Optional[Dict[str, float]]:
+        """Média, desvio padrão e contagem de um trecho; None sem observações."""
+        speeds = self._lines.get(line)
+        if speeds is None or not 0 <= segment < len(speeds.stop_ids) - 1:
+            return None
+        cell = (segment, weekday, hour // SEGMENT_SPEED_CONFIG['bucket_hours'])
+        count = int(speeds.count[cell])
+        if not count:
+            return None
+        mean, var = speeds.mean_var(cell)
+        return {'mean_kmh': float(mean), 'std_kmh': float(np.sqrt(var)), 'count': count}
+
+    def line_speeds(self, line: str, stop_ids: Tuple[str, ...], weekday: int, hour: int) -> Optional[np.ndarray]:
+        """
+        Velocidade (km/h) de cada trecho da linha no dia e hora
+
+        Returns:
+            Array com NaN nos trechos com menos de min_samples observações;
+            None se a linha não tem observações para estas paradas
+        """
+        speeds = self._lines.get(line)
+        if speeds is None or speeds.stop_ids != stop_ids:
+            return None
+        bucket = hour // SEGMENT_SPEED_CONFIG['bucket_hours']
+        mean, _ = speeds.mean_var((slice(None), weekday, bucket))
+        return np.where(speeds.count[:, weekday, bucket] >= SEGMENT_SPEED_CONFIG['min_samples'], mean, np.nan)
+
+    # ============================================================
+    #                      PERSISTÊNCIA
+    # ============================================================
+
+    def load(self) -> int:
+        """Lê o arquivo (se existe); devolve o número de linhas carregadas."""
+        with self._lock:
+            lines = read_speeds_file(self.path)
+            self._lines = {line: speeds.copy() for line, speeds in lines.items()}
+            self._base = lines
+            return len(lines)
+
+    def persist(self) -> bool:
+        """Junta ao arquivo o que mudou desde a última gravação e grava de uma vez."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path + '.lock', 'w') as lock_file:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                with self._lock:
+                    merged = merge_speeds(read_speeds_file(self.path), self._lines, self._base)
+                    write_speeds_file(self.path, merged)
+                    self._lines = {line: speeds.copy() for line, speeds in merged.items()}
+                    self._base = merged
+                    self.last_persist = datetime.now()
+        except OSError as e:
+            logger.warning(f"Velocidades por trecho não gravadas em {self.path}: {e}")
+            return False
+        return True
+
+    def start_background_persist(self, interval_seconds: float):
+        """Inicia a thread de gravação periódica (daemon)."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _run():
+            while not self._stop_event.wait(interval_seconds):
+                self.persist()
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=_run, name='segment-speeds-persist', daemon=True)
+        self._thread.start()
+        logger.info(f"Gravação das velocidades por trecho iniciada (a cada {interval_seconds}s)")
+
+    def stop(self):
+        """Interrompe a thread e grava o estado atual."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self.persist()
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': SEGMENT_SPEED_CONFIG['enabled'],
+                'path': self.path,
+                'observations': self.observations,
+                'discarded': self.discarded,
+                'tracked_buses': len(self._anchors),
+                'lines': {line: {'segments': len(s.stop_ids) - 1, 'cells_with_data': int(np.count_nonzero(s.count))}
+                          for line, s in self._lines.items()},
+                'last_persist': self.last_persist.isoformat() if self.last_persist else None
+            }
+
+def read_speeds_file(path: str) -> Dict[str, LineSpeeds]:
+    """
+    Linhas gravadas no .npz (chaves <linha>/stops, /weight, /total, /total_sq,
+    /count); arquivo em outro formato é ignorado e regravado no próximo persist
+    """
+    if not os.path.exists(path):
+        return {}
+    lines = {}
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            for key in data.files:
+                if not key.endswith('/stops'):
+                    continue
+                line = key[:-len('/stops')]
+                speeds = LineSpeeds(tuple(data[key].tolist()),
+                                    *(data[f"{line}/{name}"] for name in SPEED_ARRAYS))
+                if speeds.weight.shape[2] == hour_buckets():
+                    lines[line] = speeds
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Arquivo de velocidades por trecho ignorado ({path}): {e}")
+        return {}
+    return lines
+
+def write_speeds_file(path: str, lines: Dict[str, LineSpeeds]):
+    arrays = {}
+    for line, speeds in lines.items():
+        arrays[f"{line}/stops"] = np.array(speeds.stop_ids)
+        for name in SPEED_ARRAYS:
+            arrays[f"{line}/{name}"] = getattr(speeds, name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def merge_speeds(disk: Dict[str, LineSpeeds], mine: Dict[str, LineSpeeds],
+                 base: Dict[str, LineSpeeds]) -> Dict[str, LineSpeeds]:
+    """Disco + (meu estado - base): totais somados, mudanças de outros workers não se perdem."""
+    merged = {line: speeds.copy() for line, speeds in disk.items()}
+    for line, speeds in mine.items():
+        on_disk = merged.get(line)
+        previous = base.get(line)
+        if on_disk is None or on_disk.stop_ids != speeds.stop_ids:
+            merged[line] = speeds.copy()
+            continue
+        if previous is None or previous.stop_ids != speeds.stop_ids:
+            previous = LineSpeeds(speeds.stop_ids)
+        for name in SPEED_ARRAYS:
+            getattr(on_disk, name)[:] += getattr(speeds, name) - getattr(previous, name)
+    return merged
+
+# Instância global do estimador
+segment_speed_estimator = SegmentSpeedEstimator()
+_loaded = False
+_load_lock = threading.Lock()
+
+def get_segment_speed_estimator() -> SegmentSpeedEstimator:
+    """Retorna a instância global, lendo o arquivo na primeira chamada."""
+    global _loaded
+    if not _loaded:
+        with _load_lock:
+            if not _loaded:
+                lines = segment_speed_estimator.load()
+                if lines:
+                    logger.info(f"Velocidades por trecho carregadas: {lines} linha(s)")
+                _loaded = True
+    return segment_speed_estimator
+
+def get_segment_speeds_status() -> Dict[str, Any]:
+    return segment_speed_estimator.get_status()
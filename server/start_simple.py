@@ -89,6 +89,10 @@ def create_database_schema():
         else:
             logger.info("Schema do banco já existe")
         
+        apply_migrations(cursor)
+        seed_occupancy_rollup(cursor)
+        conn.commit()
+        
         cursor.close()
         conn.close()
         return True
@@ -97,6 +101,25 @@ def create_database_schema():
         logger.error("Erro ao criar schema: %s", e)
         return False
 
+def apply_migrations(cursor):
+    """
+    Aplica os scripts de db/migrations em ordem alfabética
+
+    As migrações são idempotentes (IF NOT EXISTS / ON CONFLICT),
+    então podem ser executadas a cada inicialização.
+    """
+    migrations_dir = Path(__file__).parent / 'db' / 'migrations'
+    for migration_path in sorted(migrations_dir.glob('*.sql')):
+        with open(migration_path, 'r', encoding='utf-8') as f:
+            cursor.execute(f.read())
+        logger.info("Migração aplicada: %s", migration_path.name)
+
+def seed_occupancy_rollup(cursor):
+    """Carrega o agregado horário de ocupação a partir das imagens já gravadas."""
+    from database.queries import SEED_OCCUPANCY_ROLLUP
+    cursor.execute(SEED_OCCUPANCY_ROLLUP)
+    logger.info("Agregado de ocupação: %s células carregadas", cursor.rowcount)
+
 def start_server():
     """Inicia o servidor Flask"""
     try:
@@ -106,8 +129,9 @@ def start_server():
         logger.info("=" * 50)
         
         # Importa e executa o main
-        from main import create_app
+        from main import create_app, initialize_services
         
+        initialize_services()
         app = create_app()
         app.run(
             host='0.0.0.0',
@@ -0,0 +1,192 @@
+"""
+Testes do arquivamento do histórico de GPS (database/archive.py)
+
+Uso:
+    python -m pytest test_archive.py -v
+
+Os testes de arquivamento usam o PostgreSQL local com as migrações aplicadas
+(ignorados sem banco). Os pontos do teste ficam no ano 2001, e o corte de
+idade só alcança pontos anteriores a 2006: o restante do banco não é tocado.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from flask import Flask
+
+from config_simple import DATABASE_CONFIG
+from database import archive
+from database import simple_connection as sync_db
+from api import simple_location_api
+from test_database_repositories import _database_available
+
+requires_db = pytest.mark.skipif(not _database_available(), reason="PostgreSQL local indisponível")
+
+T0 = datetime(2001, 3, 5, 8, 0, 0)
+OLDER_THAN_DAYS = (datetime.now() - datetime(2006, 1, 1)).days
+
+# ============================================================
+#                       FIXTURES
+# ============================================================
+
+@pytest.fixture
+def db():
+    manager = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def bus_line(db):
+    """Linha exclusiva do teste; registros, histórico reduzido e manifesto são removidos ao final."""
+    line = f"A{uuid.uuid4().hex[:8].upper()}"
+    yield line
+    db.execute_query("DELETE FROM bus_location WHERE bus_line = %s", (line,))
+    db.execute_query("DELETE FROM bus_location_archive WHERE bus_line = %s", (line,))
+    db.execute_query("DELETE FROM location_archive_manifest WHERE %s = ANY(bus_lines)", (line,))
+
+def _insert_fixes(db, bus_line, count, step_seconds=10, device_id=None, offset_seconds=0):
+    """Pontos a cada step_seconds a partir de T0 (+ offset_seconds); retorna os ids."""
+    ids = []
+    for i in range(count):
+        rows = db.execute_query(
+            "INSERT INTO bus_location (bus_line, device_id, latitude, longitude, timestamp_location) "
+            "VALUES (%s, %s, %s, %s, %s) RETURNING id",
+            (bus_line, device_id, -8.06 + i * 1e-4, -34.87,
+             T0 + timedelta(seconds=offset_seconds + i * step_seconds)),
+            fetch=True
+        )
+        ids.append(rows[0]['id'])
+    return ids
+
+# ============================================================
+#                    ARQUIVOS COLUNARES
+# ============================================================
+
+def _columns():
+    rows = [{'id': i, 'bus_line': 'L1', 'device_id': 'esp-1' if i % 2 else None,
+             'timestamp_location': T0 + timedelta(seconds=i),
+             'latitude': -8.06, 'longitude': -34.87} for i in range(5)]
+    return archive.rows_to_columns(rows)
+
+@pytest.mark.parametrize('file_format', ['npz', 'parquet'])
+def test_columnar_roundtrip(tmp_path, file_format):
+    if file_format == 'parquet' and not archive.PARQUET_AVAILABLE:
+        pytest.skip("pyarrow não instalado")
+    columns = _columns()
+    path = tmp_path / '2001' / f"locations_0_4{archive.FILE_EXTENSIONS[file_format]}"
+
+    assert archive.write_columnar(path, columns, file_format) > 0
+    assert not list(tmp_path.rglob('*.tmp'))
+
+    loaded = archive.read_columnar(path, file_format)
+    assert loaded['id'].tolist() == columns['id'].tolist()
+    assert list(loaded['bus_line']) == ['L1'] * 5
+    assert list(loaded['device_id']) == ['', 'esp-1', '', 'esp-1', '']
+    assert np.array_equal(loaded['timestamp_location'].astype('datetime64[us]'),
+                          columns['timestamp_location'])
+
+def test_resolve_format():
+    assert archive.resolve_format('npz') == 'npz'
+    assert archive.resolve_format('auto') in ('npz', 'parquet')
+    with pytest.raises(ValueError):
+        archive.resolve_format('csv')
+
+def test_archive_route_without_database():
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    client = app.test_client()
+
+    assert client.get('/api/location/history/L1/archive').status_code == 400
+    response = client.get('/api/location/history/L1/archive?start=2001-03-05&end=2001-03-06')
+    assert response.status_code == 503
+
+# ============================================================
+#                       ARQUIVAMENTO
+# ============================================================
+
+@requires_db
+def test_archive_history_downsamples_and_deletes(db, bus_line, tmp_path):
+    ids = _insert_fixes(db, bus_line, 30)          # 5 minutos, um ponto a cada 10 s
+    with_image = ids[7]
+    db.execute_query(
+        "INSERT INTO bus_image (location_id, image_data, timestamp_image) VALUES (%s, %s, %s)",
+        (with_image, b'\xff\xd8fake', T0)
+    )
+
+    totals = archive.archive_history(
+        db, OLDER_THAN_DAYS, bucket_seconds=60, batch_size=8,
+        directory=str(tmp_path), file_format='npz'
+    )
+    assert totals['rows'] == 29
+    assert totals['batches'] == 4
+
+    # Só a localização com imagem continua em bus_location
+    remaining = db.execute_query("SELECT id FROM bus_location WHERE bus_line = %s", (bus_line,), fetch=True)
+    assert [r['id'] for r in remaining] == [with_image]
+
+    # Um ponto por minuto, o primeiro de cada intervalo; buckets divididos entre lotes somam
+    kept = archive.downsampled_history(db, bus_line, T0, T0 + timedelta(hours=1))
+    assert [r['bucket_start'] for r in kept] == [T0 + timedelta(minutes=m) for m in range(5)]
+    assert [r['timestamp_location'] for r in kept] == [T0 + timedelta(minutes=m) for m in range(5)]
+    assert [r['sample_count'] for r in kept] == [6, 5, 6, 6, 6]   # 70 s tem imagem
+
+    manifest = db.execute_query(
+        "SELECT * FROM location_archive_manifest WHERE %s = ANY(bus_lines) ORDER BY range_start",
+        (bus_line,), fetch=True
+    )
+    assert sum(r['row_count'] for r in manifest) == 29
+    assert all((tmp_path / r['file_path']).exists() for r in manifest)
+
+    # Nada mais a arquivar: uma segunda execução não faz nada
+    assert archive.archive_history(db, OLDER_THAN_DAYS, directory=str(tmp_path), file_format='npz')['rows'] == 0
+
+@requires_db
+def test_archive_keeps_each_bus_on_the_line(db, bus_line, tmp_path):
+    first = _insert_fixes(db, bus_line, 12, device_id='esp-1')                     # 2 minutos
+    second = _insert_fixes(db, bus_line, 12, device_id='esp-2', offset_seconds=5)  # intercalado
+    archive.archive_history(db, OLDER_THAN_DAYS, bucket_seconds=60, batch_size=7,
+                            directory=str(tmp_path), file_format='npz')
+
+    # Um ponto por ônibus e minuto: nenhum dos dois perde a trajetória
+    kept = archive.downsampled_history(db, bus_line, T0, T0 + timedelta(hours=1))
+    assert [(r['bucket_start'], r['device_id']) for r in kept] == [
+        (T0 + timedelta(minutes=m), device) for m in range(2) for device in ('esp-1', 'esp-2')
+    ]
+    assert [r['sample_count'] for r in kept] == [6, 6, 6, 6]
+    assert kept[1]['timestamp_location'] == T0 + timedelta(seconds=5)
+
+    # Os pontos brutos guardam o dispositivo
+    raw = archive.read_archived_locations(db, bus_line, T0, T0 + timedelta(hours=1), directory=str(tmp_path))
+    assert {r['id']: r['device_id'] for r in raw} == {
+        **{i: 'esp-1' for i in first}, **{i: 'esp-2' for i in second}
+    }
+
+@requires_db
+def test_read_archived_locations(db, bus_line, tmp_path):
+    ids = _insert_fixes(db, bus_line, 12)
+    archive.archive_history(db, OLDER_THAN_DAYS, batch_size=5, directory=str(tmp_path), file_format='npz')
+
+    raw = archive.read_archived_locations(db, bus_line, T0, T0 + timedelta(hours=1), directory=str(tmp_path))
+    assert [r['id'] for r in raw] == ids
+    assert raw[3]['timestamp_location'] == T0 + timedelta(seconds=30)
+    assert raw[3]['device_id'] is None
+
+    window = archive.read_archived_locations(
+        db, bus_line, T0 + timedelta(seconds=20), T0 + timedelta(seconds=60), directory=str(tmp_path)
+    )
+    assert [r['id'] for r in window] == ids[2:6]
+
+    limited = archive.read_archived_locations(db, bus_line, T0, T0 + timedelta(hours=1), limit=3,
+                                              directory=str(tmp_path))
+    assert [r['id'] for r in limited] == ids[:3]
+
+@requires_db
+def test_orphan_files_removed(db, tmp_path):
+    orphan = tmp_path / '2001' / '03' / 'locations_1_2.npz'
+    archive.write_columnar(orphan, _columns(), 'npz')
+
+    assert archive.remove_orphan_files(db, tmp_path, grace_seconds=3600) == 0
+    assert archive.remove_orphan_files(db, tmp_path, grace_seconds=-1) == 1
+    assert not orphan.exists()
@@ -0,0 +1,130 @@
+"""
+Testes das rotas assíncronas do servidor ASGI (api/async_api.py, asgi_app.py)
+
+Uso:
+    python -m pytest test_asgi_api.py -v
+
+As respostas são comparadas com as das rotas Flask equivalentes. Sem o
+lifespan (TestClient fora de "with") os pools não são criados: as rotas
+rodam em modo fallback ou sobre repositórios falsos.
+"""
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('starlette')
+from starlette.testclient import TestClient
+
+from api import async_api, trajectory
+from asgi_app import create_asgi_app
+from main import create_app
+
+LOCATION = {'bus_line': 'L1', 'latitude': -8.0630, 'longitude': -34.8710}
+
+class FakeAsyncManager:
+    async def test_connection(self):
+        return True
+
+    async def get_database_info(self):
+        return {'tables': ['bus_location', 'bus_image'], 'total_records': 42}
+
+    def get_pool_stats(self):
+        return {'pool_size': 4}
+
+class FakeAsyncBusRepository:
+    def __init__(self, locations):
+        self.locations = locations
+
+    async def get_current_locations(self, bus_line=None, minutes=5):
+        return [loc for loc in self.locations if bus_line in (None, loc['bus_line'])]
+
+@pytest.fixture
+def asgi_client():
+    return TestClient(create_asgi_app())
+
+@pytest.fixture
+def flask_client():
+    return create_app(enable_cors=False).test_client()
+
+@pytest.fixture(autouse=True)
+def no_compressor(monkeypatch):
+    monkeypatch.setattr(trajectory, 'trajectory_compressor', None)
+
+@pytest.fixture
+def database(monkeypatch):
+    locations = [
+        {'id': 1, 'bus_line': 'L1', 'latitude': -8.0630, 'longitude': -34.8710,
+         'timestamp_location': datetime(2026, 10, 19, 8, 0)},
+        {'id': 2, 'bus_line': 'L1', 'latitude': -8.0631, 'longitude': -34.8711,
+         'timestamp_location': datetime(2026, 10, 19, 8, 1)},
+        {'id': 3, 'bus_line': 'L2', 'latitude': -8.1196, 'longitude': -34.9010,
+         'timestamp_location': datetime(2026, 10, 19, 8, 0)},
+    ]
+    monkeypatch.setattr(async_api, 'get_async_database_manager', lambda: FakeAsyncManager())
+    monkeypatch.setattr(async_api, 'get_async_bus_repository', lambda: FakeAsyncBusRepository(locations))
+    return locations
+
+# ============================================================
+#                        DASHBOARD
+# ============================================================
+
+@pytest.mark.parametrize('path', ['/api/dashboard/health', '/api/dashboard/data',
+                                  '/api/dashboard/buses?line=L1', '/api/dashboard/occupancy',
+                                  '/api/dashboard/metrics'])
+def test_dashboard_same_contract_as_flask(asgi_client, flask_client, path):
+    asgi_body = asgi_client.get(path).json()
+    flask_body = flask_client.get(path).get_json()
+    assert asgi_body.keys() == flask_body.keys()
+
+def test_metrics_include_every_component(asgi_client):
+    body = asgi_client.get('/api/dashboard/metrics').json()
+    for key in ['spool_metrics', 'idempotency_metrics', 'trajectory_metrics', 'query_metrics',
+                'route_cache_metrics', 'osrm_client_metrics', 'segment_speed_metrics']:
+        assert key in body
+    assert body['database_metrics']['connection_status'] == 'disconnected'
+
+def test_buses_from_database_with_fleet_eta(asgi_client, database):
+    body = asgi_client.get('/api/dashboard/buses?minutes=10').json()
+    assert body['count'] == 2 and body['filters'] == {'line_code': None, 'minutes': 10}
+
+    by_line = {bus['line_code']: bus for bus in body['buses']}
+    assert by_line['L1']['id'] == '2'  # mais recente da linha
+    for bus in by_line.values():
+        assert bus['eta']['destination'] and bus['eta']['minutes'] >= 0
+
+def test_buses_invalid_minutes_uses_default(asgi_client, database):
+    body = asgi_client.get('/api/dashboard/buses?line=L2&minutes=abc').json()
+    assert body['count'] == 1 and body['filters'] == {'line_code': 'L2', 'minutes': 5}
+
+def test_metrics_and_data_from_database(asgi_client, database):
+    metrics = asgi_client.get('/api/dashboard/metrics').json()
+    assert metrics['database_metrics'] == {'tables_count': 2, 'total_records': 42,
+                                           'connection_status': 'connected'}
+
+    data = asgi_client.get('/api/dashboard/data').json()
+    assert data['system_status']['mode'] == 'database'
+    assert data['database_info']['connection_pool_size'] == 4
+
+# ============================================================
+#                  INGESTÃO E ROTAS MONTADAS
+# ============================================================
+
+def test_location_same_response_as_flask(asgi_client, flask_client):
+    asgi_body = asgi_client.post('/api/location', json=LOCATION).json()
+    flask_body = flask_client.post('/api/location', json=LOCATION).get_json()
+    assert asgi_body.keys() == flask_body.keys()
+    for key in ['status', 'bus_line', 'destination', 'adaptive_interval_seconds', 'compressed']:
+        assert asgi_body[key] == flask_body[key]
+
+def test_location_validation(asgi_client):
+    assert asgi_client.post('/api/location', content='x',
+                            headers={'Content-Type': 'text/plain'}).status_code == 400
+    response = asgi_client.post('/api/location', json={'bus_line': 'L1', 'latitude': -8.06})
+    assert response.status_code == 400 and 'longitude' in response.json()['error']
+    response = asgi_client.post('/api/location', json={**LOCATION, 'latitude': 95})
+    assert response.status_code == 400
+
+def test_other_routes_served_by_flask(asgi_client):
+    response = asgi_client.get('/api/dashboard/spool')
+    assert response.status_code == 200 and 'spool' in response.json()
@@ -0,0 +1,210 @@
+"""
+Testes da exportação incremental para o Power BI (database/bi_export.py)
+
+Uso:
+    python -m pytest test_bi_export.py -v
+
+Usam o PostgreSQL local com as migrações aplicadas (ignorados sem banco).
+Cada teste usa um prefixo de job próprio em analytics_watermark, começando
+do id máximo atual: só as linhas criadas pelo teste são exportadas.
+"""
+
+import csv
+import uuid
+from datetime import datetime, timedelta
+
+import psycopg2
+import pytest
+
+from config_simple import DATABASE_CONFIG
+from database import bi_export
+from database import simple_connection as sync_db
+from test_database_repositories import _database_available
+
+pytestmark = pytest.mark.skipif(not _database_available(), reason="PostgreSQL local indisponível")
+
+TABLES = ['bus_location', 'bus_image', 'prediction_confidence']
+
+# ============================================================
+#                       FIXTURES
+# ============================================================
+
+@pytest.fixture
+def db():
+    manager = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def bus_line(db):
+    line = f"B{uuid.uuid4().hex[:8].upper()}"
+    yield line
+    db.execute_query("DELETE FROM bus_location WHERE bus_line = %s", (line,))
+
+@pytest.fixture
+def job_prefix(db):
+    """Marcas d'água do teste, a partir do estado atual do banco."""
+    prefix = f"test_bi_{uuid.uuid4().hex[:8]}"
+    for table in TABLES:
+        max_id = db.execute_query(bi_export.queries.max_id_query(table), fetch=True)[0]['max_id']
+        bi_export.save_watermark(db, f"{prefix}:{table}", datetime.now(), max_id)
+    bi_export.save_watermark(db, f"{prefix}:arrivals", datetime.now() - timedelta(hours=1))
+    yield prefix
+    db.execute_query("DELETE FROM analytics_watermark WHERE job_name LIKE %s", (f"{prefix}:%",))
+
+def _insert_location(db, bus_line, moment):
+    return db.execute_query(
+        "INSERT INTO bus_location (bus_line, latitude, longitude, timestamp_location) "
+        "VALUES (%s, -8.06, -34.87, %s) RETURNING id",
+        (bus_line, moment), fetch=True
+    )[0]['id']
+
+def _read_rows(directory, dataset):
+    rows = []
+    for path in sorted((directory / dataset).rglob('part-*.csv')):
+        with open(path, newline='', encoding='utf-8') as f:
+            rows += list(csv.DictReader(f))
+    return rows
+
+def _export(db, tmp_path, job_prefix, **kwargs):
+    return bi_export.export_for_bi(db, directory=str(tmp_path), file_format='csv',
+                                   job_prefix=job_prefix, **kwargs)
+
+# ============================================================
+#                         TESTES
+# ============================================================
+
+def test_incremental_export_partitioned_by_date(db, bus_line, job_prefix, tmp_path):
+    yesterday = datetime.now() - timedelta(days=1)
+    ids = [_insert_location(db, bus_line, yesterday), _insert_location(db, bus_line, datetime.now())]
+    db.execute_query(
+        "INSERT INTO bus_image (location_id, image_data, timestamp_image, occupancy_count, bus_line) "
+        "VALUES (%s, %s, %s, 12, %s)",
+        (ids[1], b'\xff\xd8fake', datetime.now(), bus_line)
+    )
+
+    totals = _export(db, tmp_path, job_prefix, batch_size=1)
+    assert totals['bus_location']['rows'] == 2
+    assert totals['bus_location']['files'] == 2
+    assert totals['bus_image']['rows'] == 1
+
+    partitions = sorted(p.name for p in (tmp_path / 'bus_location').iterdir())
+    assert partitions == [f"date={yesterday:%Y-%m-%d}", f"date={datetime.now():%Y-%m-%d}"]
+    assert [int(r['id']) for r in _read_rows(tmp_path, 'bus_location')] == ids
+
+    image = _read_rows(tmp_path, 'bus_image')[0]
+    assert image['bus_line'] == bus_line and image['image_bytes'] == '6'
+    assert 'image_data' not in image
+
+    # Nada novo: a segunda execução não grava arquivos
+    again = _export(db, tmp_path, job_prefix)
+    assert all(t['rows'] == 0 for t in again.values())
+
+    ids.append(_insert_location(db, bus_line, datetime.now()))
+    assert _export(db, tmp_path, job_prefix, datasets=['bus_location'])['bus_location']['rows'] == 1
+    assert [int(r['id']) for r in _read_rows(tmp_path, 'bus_location')] == ids
+
+def test_arrivals_exported_after_update(db, bus_line, job_prefix, tmp_path, monkeypatch):
+    monkeypatch.setitem(bi_export.BI_EXPORT_CONFIG, 'arrival_settle_seconds', 0)
+    location_id = _insert_location(db, bus_line, datetime.now())
+    predicted = datetime.now() - timedelta(minutes=3)
+    prediction_id = db.execute_query(
+        "INSERT INTO prediction_confidence (location_id, predicted_arrival, confidence_percent, "
+        "timestamp_prediction, bus_line) VALUES (%s, %s, 80, %s, %s) RETURNING id",
+        (location_id, predicted, datetime.now(), bus_line), fetch=True
+    )[0]['id']
+
+    first = _export(db, tmp_path, job_prefix)
+    assert first['prediction_confidence']['rows'] == 1
+    assert _read_rows(tmp_path, 'prediction_confidence')[0]['actual_arrival'] == ''
+
+    sync_db.SimpleETARepository(db).update_actual_arrival(prediction_id, datetime.now())
+    second = _export(db, tmp_path, job_prefix)
+    assert second['prediction_confidence']['rows'] == 0
+
+    # Chegadas de outras linhas na última hora também entram; só as do teste interessam
+    arrivals = [a for a in _read_rows(tmp_path, 'arrivals') if a['bus_line'] == bus_line]
+    assert [int(a['prediction_id']) for a in arrivals] == [prediction_id]
+    assert float(arrivals[0]['delay_minutes']) == pytest.approx(3.0, abs=0.05)
+
+def test_interrupted_batch_is_rewritten(db, bus_line, job_prefix, tmp_path):
+    location_id = _insert_location(db, bus_line, datetime.now())
+    # Arquivo de um lote cujo avanço da marca d'água não aconteceu
+    leftover = tmp_path / 'bus_location' / f"date={datetime.now():%Y-%m-%d}" / f"part-{location_id}-{location_id}.csv"
+    leftover.parent.mkdir(parents=True)
+    leftover.write_text('id\n999\n')
+
+    totals = _export(db, tmp_path, job_prefix, datasets=['bus_location'])
+    assert totals['bus_location']['removed'] == 1
+    assert [int(r['id']) for r in _read_rows(tmp_path, 'bus_location')] == [location_id]
+
+def _insert_prediction(db, location_id, bus_line, predicted):
+    return db.execute_query(
+        "INSERT INTO prediction_confidence (location_id, predicted_arrival, confidence_percent, "
+        "timestamp_prediction, bus_line) VALUES (%s, %s, 80, %s, %s) RETURNING id",
+        (location_id, predicted, datetime.now(), bus_line), fetch=True
+    )[0]['id']
+
+def test_late_arrival_with_past_time_is_exported(db, bus_line, job_prefix, tmp_path, monkeypatch):
+    # Chegada registrada agora com horário anterior à marca d'água (uma hora atrás)
+    monkeypatch.setitem(bi_export.BI_EXPORT_CONFIG, 'arrival_settle_seconds', 0)
+    location_id = _insert_location(db, bus_line, datetime.now())
+    predicted = datetime.now() - timedelta(hours=2)
+    prediction_id = _insert_prediction(db, location_id, bus_line, predicted)
+    sync_db.SimpleETARepository(db).update_actual_arrival(prediction_id, predicted + timedelta(minutes=4))
+
+    _export(db, tmp_path, job_prefix, datasets=['arrivals'])
+    arrivals = [a for a in _read_rows(tmp_path, 'arrivals') if a['bus_line'] == bus_line]
+    assert [int(a['prediction_id']) for a in arrivals] == [prediction_id]
+
+def _job_gaps(db, job_name):
+    return bi_export.load_watermark(db, job_name)[2]
+
+def test_row_committed_after_export_is_not_skipped(db, bus_line, job_prefix, tmp_path):
+    # Transação aberta com id menor que o de uma linha já confirmada
+    slow = psycopg2.connect(**DATABASE_CONFIG)
+    try:
+        with slow.cursor() as cursor:
+            cursor.execute("INSERT INTO bus_location (bus_line, latitude, longitude, timestamp_location) "
+                           "VALUES (%s, -8.06, -34.87, %s) RETURNING id", (bus_line, datetime.now()))
+            late_id = cursor.fetchone()[0]
+        fast_id = _insert_location(db, bus_line, datetime.now())
+        assert late_id < fast_id
+
+        first = _export(db, tmp_path, job_prefix, datasets=['bus_location'])
+        assert first['bus_location']['rows'] == 1
+        assert late_id in _job_gaps(db, f"{job_prefix}:bus_location")
+
+        slow.commit()
+    finally:
+        slow.close()
+
+    second = _export(db, tmp_path, job_prefix, datasets=['bus_location'])
+    assert second['bus_location']['late_rows'] == 1
+    assert sorted(int(r['id']) for r in _read_rows(tmp_path, 'bus_location')) == [late_id, fast_id]
+    assert late_id not in _job_gaps(db, f"{job_prefix}:bus_location")
+
+    # Nada novo: a lacuna preenchida não sai de novo
+    assert _export(db, tmp_path, job_prefix, datasets=['bus_location'])['bus_location']['rows'] == 0
+
+def test_rolled_back_gap_is_dropped(db, bus_line, job_prefix, tmp_path):
+    aborted = psycopg2.connect(**DATABASE_CONFIG)
+    try:
+        with aborted.cursor() as cursor:
+            cursor.execute("INSERT INTO bus_location (bus_line, latitude, longitude, timestamp_location) "
+                           "VALUES (%s, -8.06, -34.87, %s) RETURNING id", (bus_line, datetime.now()))
+            aborted_id = cursor.fetchone()[0]
+        _insert_location(db, bus_line, datetime.now())
+        _export(db, tmp_path, job_prefix, datasets=['bus_location'])
+        assert aborted_id in _job_gaps(db, f"{job_prefix}:bus_location")
+
+        # Ainda aberta: a lacuna continua guardada
+        _export(db, tmp_path, job_prefix, datasets=['bus_location'])
+        assert aborted_id in _job_gaps(db, f"{job_prefix}:bus_location")
+        aborted.rollback()
+    finally:
+        aborted.close()
+
+    # Todas as transações da primeira leitura terminaram: o id nunca vai aparecer
+    _export(db, tmp_path, job_prefix, datasets=['bus_location'])
+    assert _job_gaps(db, f"{job_prefix}:bus_location") == []
@@ -0,0 +1,193 @@
+"""
+Testes do disjuntor do OSRM (api/circuit_breaker.py e api/osrm_client.py)
+
+Uso:
+    python -m pytest test_circuit_breaker.py -v
+
+Usam o OSRM de teste (tools/osrm_stub.py) em uma porta local; não usam
+banco.
+"""
+
+import asyncio
+import time
+
+import pytest
+from flask import Flask
+
+from api import osrm_client, simple_location_api
+from api.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from api.eta_osrm import OSRMETA
+from api.osrm_client import OSRMClient
+from api.route_cache import RouteCache
+from tools.osrm_stub import start_in_thread
+
+START = (-8.0630, -34.8710)
+END = (-8.1264, -34.9176)
+
+def _wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+# ============================================================
+#                        DISJUNTOR
+# ============================================================
+
+def test_error_rate_opens_and_half_open_closes():
+    breaker = CircuitBreaker('teste', min_calls=4, error_rate_threshold=0.5, open_seconds=0.05,
+                             half_open_max_calls=2)
+    for success in (True, False, True):
+        assert breaker.allow()
+        breaker.record(success, 0.01)
+    assert breaker.state == CLOSED  # 3 chamadas: abaixo de min_calls
+
+    breaker.record(False, 0.01)
+    assert breaker.state == OPEN
+    assert not breaker.allow() and breaker.get_status()['rejected'] == 1
+
+    # Sem probe: meio-aberto depois de open_seconds, com 2 chamadas de teste
+    assert _wait_for(lambda: breaker.state == HALF_OPEN)
+    assert breaker.allow() and breaker.allow() and not breaker.allow()
+    breaker.record(True, 0.01)
+    breaker.record(True, 0.01)
+    assert breaker.state == CLOSED and breaker.get_status()['window_calls'] == 0
+
+def test_half_open_failure_reopens():
+    breaker = CircuitBreaker('teste', min_calls=1, open_seconds=0.05)
+    breaker.record(False, 0.01)
+    assert _wait_for(lambda: breaker.state == HALF_OPEN)
+    assert breaker.allow()
+    breaker.record(False, 0.01)
+    assert breaker.state == OPEN and breaker.get_status()['times_opened'] == 2
+
+def test_slow_calls_and_window():
+    breaker = CircuitBreaker('teste', min_calls=3, slow_call_ms=100, slow_rate_threshold=0.6)
+    breaker.record(True, 0.5)
+    breaker.record(True, 0.01)
+    breaker.record(True, 0.5)
+    assert breaker.state == OPEN
+    assert breaker.get_status()['slow_rate'] == pytest.approx(0.667, abs=1e-3)
+
+    # Falhas fora da janela não contam
+    breaker = CircuitBreaker('teste', window_seconds=0.05, min_calls=2)
+    breaker.record(False, 0.01)
+    time.sleep(0.08)
+    breaker.record(False, 0.01)
+    assert breaker.state == CLOSED and breaker.get_status()['window_calls'] == 1
+
+def test_background_probe_moves_to_half_open():
+    healthy = []
+    breaker = CircuitBreaker('teste', min_calls=1, open_seconds=0.05, probe=lambda: bool(healthy))
+    breaker.record(False, 0.01)
+    # Probe falhando: continua aberto (sem meio-aberto só pelo tempo)
+    assert _wait_for(lambda: breaker.get_status()['probe_failures'] >= 2)
+    assert breaker.state == OPEN and not breaker.allow()
+
+    healthy.append(True)
+    assert _wait_for(lambda: breaker.state == HALF_OPEN)
+
+# ============================================================
+#                     CLIENTE DO OSRM
+# ============================================================
+
+@pytest.fixture
+def circuit_config(monkeypatch):
+    monkeypatch.setitem(osrm_client.OSRM_CIRCUIT_CONFIG, 'enabled', True)
+    monkeypatch.setitem(osrm_client.OSRM_CIRCUIT_CONFIG, 'min_calls', 3)
+    monkeypatch.setitem(osrm_client.OSRM_CIRCUIT_CONFIG, 'open_seconds', 0.1)
+    monkeypatch.setitem(osrm_client.OSRM_CIRCUIT_CONFIG, 'half_open_max_calls', 2)
+
+def test_client_fast_fails_and_recovers(circuit_config):
+    # 3 chamadas e 1 teste falham; depois o servidor volta
+    server, url = start_in_thread(fail_requests=4)
+    try:
+        client = OSRMClient(url, max_retries=0)
+        for _ in range(3):
+            with pytest.raises(osrm_client.OSRMError):
+                client.route([START, END])
+        assert client.breaker.state == OPEN
+
+        started = time.monotonic()
+        with pytest.raises(osrm_client.OSRMError) as error:
+            client.route([START, END])
+        assert error.value.circuit_open and time.monotonic() - started < 0.01
+        assert client.get_status()['short_circuited'] == 1
+
+        assert _wait_for(lambda: client.breaker.state == HALF_OPEN)
+        assert client.breaker.get_status()['probe_failures'] == 1
+        client.route([START, END])
+        client.route([START, END])
+        assert client.breaker.state == CLOSED
+    finally:
+        server.shutdown()
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker('teste', min_calls=1, open_seconds=0.05, half_open_max_calls=1)
+    breaker.record(False, 0.01)
+    assert _wait_for(lambda: breaker.state == HALF_OPEN)
+    return breaker
+
+def test_unexpected_error_releases_half_open_slot(monkeypatch):
+    breaker = _half_open_breaker()
+    client = OSRMClient('http://127.0.0.1:9', max_retries=0, circuit=False)
+    client.breaker = breaker
+
+    def broken_get(*args, **kwargs):
+        raise RuntimeError('falha inesperada')
+
+    monkeypatch.setattr(client.session, 'get', broken_get)
+    with pytest.raises(RuntimeError):
+        client.route([START, END])
+    # A vaga de teste conta como falha: volta a abrir em vez de ficar presa
+    assert breaker.state == OPEN
+    assert _wait_for(lambda: breaker.state == HALF_OPEN) and breaker.allow()
+
+@pytest.mark.skipif(not osrm_client.HTTPX_AVAILABLE, reason="httpx não instalado")
+def test_cancelled_async_call_releases_half_open_slot():
+    server, url = start_in_thread(latency_ms=300)
+    try:
+        breaker = _half_open_breaker()
+
+        async def run():
+            client = osrm_client.AsyncOSRMClient(url, max_retries=0, breaker=breaker)
+            task = asyncio.ensure_future(client.route([START, END]))
+            await asyncio.sleep(0.05)
+            task.cancel()  # cliente desconectou no meio da chamada
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await client.client.aclose()
+
+        asyncio.run(run())
+        assert breaker.state == OPEN
+        assert _wait_for(lambda: breaker.state == HALF_OPEN) and breaker.allow()
+    finally:
+        server.shutdown()
+
+def test_eta_skips_osrm_while_open(circuit_config):
+    server, url = start_in_thread(latency_ms=300)
+    try:
+        osrm = OSRMETA(osrm_server=url, cache=RouteCache(max_entries=0),
+                       client=OSRMClient(url, timeout_seconds=0.05, max_retries=0))
+        for _ in range(3):
+            assert osrm.get_route_info(*START, *END)['status'] == 'error'
+
+        started = time.monotonic()
+        route = osrm.get_route_info(*START, *END)
+        assert route['status'] == 'error' and route['circuit_open']
+        assert time.monotonic() - started < 0.01
+
+        # /table também cai no cálculo manual sem esperar
+        table = osrm.get_duration_table([START], [END])
+        assert table['status'] == 'error' and table['durations'] == [[None]]
+    finally:
+        server.shutdown()
+
+def test_health_reports_circuit():
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    body = app.test_client().get('/api/health').get_json()
+    assert body['osrm_circuit'] == osrm_client.get_osrm_circuit_status()
+    assert body['osrm_circuit'].get('state', CLOSED) == CLOSED
@@ -0,0 +1,398 @@
+"""
+Testes dos repositórios de banco de dados (síncronos e assíncronos)
+Os mesmos testes rodam contra as duas implementações, usando um PostgreSQL local
+com o schema de db/create_tables.sql e as migrações aplicadas.
+
+Uso:
+    python -m pytest test_database_repositories.py -v
+
+Variáveis DB_HOST / DB_NAME / DB_USER / DB_PASSWORD / DB_PORT apontam o banco.
+Sem banco disponível, os testes são ignorados.
+"""
+
+import asyncio
+import inspect
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from config_simple import DATABASE_CONFIG
+from database import simple_connection as sync_db
+from ml.occupancy_levels import determine_occupancy_level
+
+try:
+    from database import async_connection as async_db
+except ImportError:
+    async_db = None
+
+def _database_available() -> bool:
+    try:
+        import psycopg2
+        conn = psycopg2.connect(
+            host=DATABASE_CONFIG['host'], database=DATABASE_CONFIG['database'],
+            user=DATABASE_CONFIG['user'], password=DATABASE_CONFIG['password'],
+            port=DATABASE_CONFIG['port'], connect_timeout=2
+        )
+        conn.close()
+        return True
+    except Exception:
+        return False
+
+pytestmark = pytest.mark.skipif(not _database_available(), reason="PostgreSQL local indisponível")
+
+# ============================================================
+#                       FIXTURES
+# ============================================================
+
+class _SyncAdapter:
+    """Executa as corrotinas de um repositório assíncrono em um loop dedicado."""
+
+    def __init__(self, repo, loop):
+        self._repo = repo
+        self._loop = loop
+
+    def __getattr__(self, name):
+        attr = getattr(self._repo, name)
+        if inspect.iscoroutinefunction(attr):
+            return lambda *a, **kw: self._loop.run_until_complete(attr(*a, **kw))
+        if name.startswith('stream_'):
+            return lambda *a, **kw: self._loop.run_until_complete(_collect(attr(*a, **kw)))
+        return attr
+
+async def _collect(stream):
+    return [batch async for batch in stream]
+
+@pytest.fixture(params=['sync', 'async'])
+def repos(request):
+    """Dicionário de repositórios da implementação parametrizada."""
+    if request.param == 'sync':
+        db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+        yield {
+            'bus': sync_db.SimpleBusLocationRepository(db),
+            'occupancy': sync_db.SimpleOccupancyRepository(db),
+            'eta': sync_db.SimpleETARepository(db),
+            'interval': sync_db.SimpleIntervalRepository(db),
+            'delay_profile': sync_db.SimpleDelayProfileRepository(db),
+            'stream': lambda it: list(it),
+        }
+        db.close()
+        return
+
+    if async_db is None or not async_db.ASYNC_DB_AVAILABLE:
+        pytest.skip("psycopg[pool] não instalado")
+
+    loop = asyncio.new_event_loop()
+    db = async_db.AsyncDatabaseManager(DATABASE_CONFIG, {
+        'pool_min_size': 1, 'pool_max_size': 4, 'pool_timeout_seconds': 5.0
+    })
+    loop.run_until_complete(db.open())
+    yield {
+        'bus': _SyncAdapter(async_db.AsyncBusLocationRepository(db), loop),
+        'occupancy': _SyncAdapter(async_db.AsyncOccupancyRepository(db), loop),
+        'eta': _SyncAdapter(async_db.AsyncETARepository(db), loop),
+        'interval': _SyncAdapter(async_db.AsyncIntervalRepository(db), loop),
+        'delay_profile': _SyncAdapter(async_db.AsyncDelayProfileRepository(db), loop),
+        'stream': lambda batches: batches,
+    }
+    loop.run_until_complete(db.close())
+    loop.close()
+
+@pytest.fixture
+def bus_line():
+    """Linha exclusiva do teste; os registros são removidos ao final."""
+    line = f"T{uuid.uuid4().hex[:8].upper()}"
+    yield line
+
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    location_ids = "(SELECT id FROM bus_location WHERE bus_line = %s)"
+    for table in ('bus_image', 'prediction_confidence', 'request_interval'):
+        db.execute_query(f"DELETE FROM {table} WHERE location_id IN {location_ids}", (line,))
+    db.execute_query("DELETE FROM occupancy_hourly_rollup WHERE bus_line = %s", (line,))
+    db.execute_query("DELETE FROM delay_profile WHERE bus_line = %s", (line,))
+    db.execute_query("DELETE FROM bus_location WHERE bus_line = %s", (line,))
+    db.close()
+
+# ============================================================
+#                         TESTES
+# ============================================================
+
+def test_save_location_and_history(repos, bus_line):
+    ids = [repos['bus'].save_location(bus_line, -8.06, -34.87 + i * 0.001) for i in range(5)]
+    assert all(ids)
+
+    history = repos['bus'].get_location_history(bus_line, hours=1, limit=10)
+    assert [r['id'] for r in history] == sorted(ids, reverse=True)
+
+    current = repos['bus'].get_current_locations(bus_line, minutes=5)
+    assert {r['id'] for r in current} == set(ids)
+
+def test_location_history_keyset_pages(repos, bus_line):
+    ids = [repos['bus'].save_location(bus_line, -8.06, -34.87) for _ in range(5)]
+
+    seen, after = [], None
+    while True:
+        page = repos['bus'].get_location_history(bus_line, hours=1, limit=2, after=after)
+        if not page:
+            break
+        seen += [r['id'] for r in page]
+        after = (page[-1]['timestamp_location'], page[-1]['id'])
+
+    assert seen == sorted(ids, reverse=True)
+
+def test_device_id_and_latest_per_device(repos, bus_line):
+    repos['bus'].save_location(bus_line, -8.06, -34.87, 'esp32-a')
+    latest_a = repos['bus'].save_location(bus_line, -8.07, -34.87, 'esp32-a')
+    latest_b, _ = repos['bus'].save_location_once(bus_line, -8.08, -34.87, str(uuid.uuid4()), 'esp32-b')
+    repos['bus'].save_location(bus_line, -8.09, -34.87)
+
+    # Só o repositório síncrono alimenta o GTFS-RT
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    latest = sync_db.SimpleBusLocationRepository(db).get_latest_device_locations(minutes=5)
+    db.close()
+    mine = {r['device_id']: r['id'] for r in latest if r['bus_line'] == bus_line}
+    assert mine == {'esp32-a': latest_a, 'esp32-b': latest_b}
+
+def test_stream_location_history(repos, bus_line):
+    for _ in range(5):
+        repos['bus'].save_location(bus_line, -8.06, -34.87)
+
+    batches = repos['stream'](repos['bus'].stream_location_history(bus_line, hours=1, batch_size=2))
+    assert [len(b) for b in batches] == [2, 2, 1]
+
+def test_image_analysis_updates_rollup(repos, bus_line):
+    location_id = repos['bus'].save_location(bus_line, -8.06, -34.87)
+    image_id = repos['occupancy'].save_image_analysis(location_id, b'\xff\xd8fake', 30)
+    repos['occupancy'].save_image_analysis(location_id, b'\xff\xd8fake', 40)
+    repos['occupancy'].save_image_analysis(location_id, b'\xff\xd8fake', None)
+    assert image_id
+
+    history = repos['occupancy'].get_occupancy_history(bus_line, hours=1)
+    assert len(history) == 3
+    assert all(r['bus_line'] == bus_line for r in history)
+
+    stats = repos['occupancy'].get_occupancy_statistics(bus_line, hours=1)
+    assert stats['total_analyses'] == 2
+    assert stats['by_occupancy'][3]['count'] == 1
+    assert stats['by_occupancy'][4]['max_occupancy'] == 40
+    assert stats['by_line'][bus_line]['avg_occupancy'] == 35
+
+def _rollup_rows(bus_line):
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    rows = db.execute_query(
+        "SELECT occupancy_level, sample_count, sum_occupancy, min_occupancy, max_occupancy "
+        "FROM occupancy_hourly_rollup WHERE bus_line = %s ORDER BY occupancy_level",
+        (bus_line,), fetch=True
+    ) or []
+    db.close()
+    return {r['occupancy_level']: (r['sample_count'], r['sum_occupancy'],
+                                   r['min_occupancy'], r['max_occupancy']) for r in rows}
+
+def test_rollup_upsert_per_level(repos, bus_line):
+    location_id = repos['bus'].save_location(bus_line, -8.06, -34.87)
+    for count in (5, 10, 45, 0):
+        assert repos['occupancy'].save_image_analysis(location_id, b'\xff\xd8fake', count)
+
+    # Mesma hora e nível: soma no agregado; níveis de determine_occupancy_level
+    assert _rollup_rows(bus_line) == {0: (1, 0, 0, 0), 1: (2, 15, 5, 10), 4: (1, 45, 45, 45)}
+
+def test_seed_rollup_matches_python_levels(bus_line):
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    location_id = sync_db.SimpleBusLocationRepository(db).save_location(bus_line, -8.06, -34.87)
+    counts = list(range(0, 51))
+    for count in counts:
+        db.execute_query(
+            "INSERT INTO bus_image (location_id, image_data, timestamp_image, occupancy_count) "
+            "VALUES (%s, %s, date_trunc('hour', now()), %s)",
+            (location_id, b'\xff\xd8fake', count)
+        )
+    db.execute_query(sync_db.queries.SEED_OCCUPANCY_ROLLUP)
+    seeded = _rollup_rows(bus_line)
+
+    expected = {}
+    for count in counts:
+        level = determine_occupancy_level(count)
+        samples, total, low, high = expected.get(level, (0, 0, count, count))
+        expected[level] = (samples + 1, total + count, min(low, count), max(high, count))
+    assert seeded == expected
+
+    # Células já existentes não mudam: a carga pode rodar a cada inicialização
+    db.execute_query(sync_db.queries.SEED_OCCUPANCY_ROLLUP)
+    assert _rollup_rows(bus_line) == seeded
+    db.close()
+
+def test_eta_prediction_roundtrip(repos, bus_line):
+    location_id = repos['bus'].save_location(bus_line, -8.06, -34.87)
+    predicted = datetime.now() + timedelta(minutes=10)
+    prediction_id = repos['eta'].save_eta_prediction(location_id, predicted, 90.0)
+    assert prediction_id
+
+    repos['eta'].update_actual_arrival(prediction_id, predicted + timedelta(minutes=2))
+
+    predictions = repos['eta'].get_eta_predictions(bus_line, hours=1)
+    assert len(predictions) == 1
+    assert predictions[0]['bus_line'] == bus_line
+    assert predictions[0]['actual_arrival'] is not None
+
+    stats = repos['eta'].get_eta_statistics(bus_line, days=1)
+    assert stats['total_predictions'] == 1
+    assert stats['by_line'][bus_line]['avg_confidence'] == 90.0
+
+def test_inserts_copy_location_columns(repos, bus_line):
+    location_id = repos['bus'].save_location(bus_line, -8.06, -34.87)
+    prediction_id = repos['eta'].save_eta_prediction(location_id, datetime.now(), 75.0)
+    image_id = repos['occupancy'].save_image_analysis(location_id, b'\xff\xd8fake', 12)
+
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    location = db.execute_query("SELECT bus_line, timestamp_location FROM bus_location WHERE id = %s",
+                                (location_id,), fetch=True)[0]
+    for table, row_id in (('prediction_confidence', prediction_id), ('bus_image', image_id)):
+        row = db.execute_query(f"SELECT bus_line, timestamp_location FROM {table} WHERE id = %s",
+                               (row_id,), fetch=True)[0]
+        assert row == location
+    db.close()
+
+def test_inserts_for_missing_location_fail_loudly(repos, caplog):
+    missing_id = 2 ** 31 - 1
+    assert repos['eta'].save_eta_prediction(missing_id, datetime.now(), 75.0) is None
+    assert repos['occupancy'].save_image_analysis(missing_id, b'\xff\xd8fake', 12) is None
+    # A chave estrangeira rejeita e o erro é registrado (antes não inseria nada, em silêncio)
+    errors = [r.getMessage() for r in caplog.records if 'Erro ao executar query' in r.getMessage()]
+    assert len(errors) == 2 and all('foreign key' in e or 'chave estrangeira' in e for e in errors)
+
+def test_save_interval(repos, bus_line):
+    location_id = repos['bus'].save_location(bus_line, -8.06, -34.87)
+    assert repos['interval'].save_interval(location_id, 30)
+
+def test_save_location_once_by_ingest_key(repos, bus_line):
+    ingest_key = str(uuid.uuid4())
+    location_id, created = repos['bus'].save_location_once(bus_line, -8.06, -34.87, ingest_key)
+    assert location_id and created
+    assert repos['bus'].save_location_once(bus_line, -8.06, -34.87, ingest_key) == (location_id, False)
+
+    image_id = repos['occupancy'].save_image_analysis(location_id, b'\xff\xd8fake', 30, ingest_key)
+    assert image_id
+    assert repos['occupancy'].save_image_analysis(location_id, b'\xff\xd8fake', 30, ingest_key) is None
+    assert repos['occupancy'].find_location_by_ingest_key(ingest_key) == location_id
+
+    assert len(repos['occupancy'].get_occupancy_history(bus_line, hours=1)) == 1
+    assert repos['occupancy'].get_occupancy_statistics(bus_line, hours=1)['total_analyses'] == 1
+
+def _record_arrivals(repos, bus_line, delays, arrived_at):
+    for delay in delays:
+        location_id = repos['bus'].save_location(bus_line, -8.06, -34.87)
+        predicted = arrived_at - timedelta(minutes=delay)
+        prediction_id = repos['eta'].save_eta_prediction(location_id, predicted, 80.0)
+        repos['eta'].update_actual_arrival(prediction_id, arrived_at)
+
+def _line_cell(repos, bus_line):
+    cells = {key: cell for key, cell in repos['delay_profile'].load_profile().items()
+             if key[0] == bus_line}
+    assert len(cells) == 1
+    return next(iter(cells.values()))
+
+def test_delay_profile_incremental_refresh(repos, bus_line):
+    now = datetime.now()
+    _record_arrivals(repos, bus_line, [2, 4], now)
+    assert repos['delay_profile'].refresh_incremental() >= 1
+    cell = _line_cell(repos, bus_line)
+    assert cell['count'] == 2 and cell['mean_delay_minutes'] == pytest.approx(3.0)
+
+    # Chegadas gravadas depois da execução, com horário anterior a ela
+    _record_arrivals(repos, bus_line, [6, 10], now - timedelta(hours=2))
+    repos['delay_profile'].refresh_incremental()
+    cell = _line_cell(repos, bus_line)
+    # Merge de Welford = média e variância populacional de [2, 4, 6, 10]
+    assert cell['count'] == 4
+    assert cell['mean_delay_minutes'] == pytest.approx(5.5)
+    assert cell['variance'] == pytest.approx(8.75)
+
+    # Nada pendente: a próxima execução não conta de novo
+    repos['delay_profile'].refresh_incremental()
+    assert _line_cell(repos, bus_line)['count'] == 4
+
+def test_load_delay_profile(repos):
+    profile = repos['delay_profile'].load_profile()
+    assert isinstance(profile, dict)
+    for (line, weekday, hour), cell in profile.items():
+        assert 0 <= weekday <= 6 and 0 <= hour <= 23
+        assert cell['count'] > 0
+
+# ============================================================
+#                  PREPARED STATEMENTS
+# ============================================================
+
+def _prepared_names(db):
+    rows = db.execute_query("SELECT name FROM pg_prepared_statements", fetch=True) or []
+    return {r['name'] for r in rows}
+
+def test_to_positional_placeholders():
+    assert sync_db.to_positional("a = %s AND b LIKE 'x%%' AND c < %s") == \
+        "a = $1 AND b LIKE 'x%' AND c < $2"
+
+def test_prepared_statement_reused_per_connection(bus_line):
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    repo = sync_db.SimpleBusLocationRepository(db)
+    name = sync_db.prepared_statement_name(sync_db.queries.INSERT_LOCATION)
+
+    assert repo.save_location(bus_line, -8.06, -34.87)
+    assert repo.save_location(bus_line, -8.06, -34.87)
+    assert name in _prepared_names(db)
+    db.close()
+
+def test_prepared_statement_recreated(bus_line):
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    repo = sync_db.SimpleBusLocationRepository(db)
+    assert repo.save_location(bus_line, -8.06, -34.87)
+
+    # Servidor perdeu os statements (ex.: DISCARD ALL de um pooler)
+    db.execute_query("DEALLOCATE ALL")
+    assert repo.save_location(bus_line, -8.06, -34.87)
+
+    # Reconexão: o pool descarta a conexão derrubada e a nova prepara de novo
+    pid = db.execute_query("SELECT pg_backend_pid() AS pid", fetch=True)[0]['pid']
+    other = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    other.execute_query("SELECT pg_terminate_backend(%s)", (pid,), fetch=True)
+    other.close()
+
+    # A conexão derrubada é descartada e a gravação é repetida em uma nova
+    assert repo.save_location(bus_line, -8.06, -34.87)
+    new_pid = db.execute_query("SELECT pg_backend_pid() AS pid", fetch=True)[0]['pid']
+    assert new_pid != pid
+    assert repo.save_location(bus_line, -8.06, -34.87)
+    db.close()
+
+# ============================================================
+#                       MANUTENÇÃO
+# ============================================================
+
+def test_backfill_denormalized_columns(bus_line):
+    from database.maintenance import backfill_denormalized_columns
+
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    location_id = sync_db.SimpleBusLocationRepository(db).save_location(bus_line, -8.06, -34.87)
+    # Linhas gravadas antes da migração 003, sem as colunas copiadas
+    db.execute_query(
+        "INSERT INTO bus_image (location_id, image_data, timestamp_image, occupancy_count) "
+        "VALUES (%s, %s, now(), 10), (%s, %s, now(), 20)",
+        (location_id, b'\xff\xd8fake', location_id, b'\xff\xd8fake')
+    )
+    db.execute_query(
+        "INSERT INTO prediction_confidence "
+        "(location_id, predicted_arrival, confidence_percent, timestamp_prediction) "
+        "VALUES (%s, now(), 80, now())", (location_id,)
+    )
+
+    totals = backfill_denormalized_columns(db, batch_size=1)
+    assert totals['bus_image'] >= 2 and totals['prediction_confidence'] >= 1
+
+    location = db.execute_query("SELECT bus_line, timestamp_location FROM bus_location WHERE id = %s",
+                                (location_id,), fetch=True)[0]
+    for table in ('bus_image', 'prediction_confidence'):
+        rows = db.execute_query(f"SELECT bus_line, timestamp_location FROM {table} WHERE location_id = %s",
+                                (location_id,), fetch=True)
+        assert rows and all(row == location for row in rows)
+
+    # Nada mais a preencher
+    assert backfill_denormalized_columns(db) == {'bus_image': 0, 'prediction_confidence': 0}
+    db.close()
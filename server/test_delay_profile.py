@@ -0,0 +1,78 @@
+"""
+Testes do perfil de atraso em memória (ml/delay_profile.py)
+
+Uso:
+    python -m pytest test_delay_profile.py -v
+
+O repositório é substituído por um objeto fixo; a atualização incremental
+no banco é testada em test_database_repositories.py.
+"""
+
+import pytest
+
+from database.queries import rows_to_delay_profile
+from ml.delay_profile import DelayProfileCache, delay_to_adjustment
+
+class FakeRepository:
+    def __init__(self, rows):
+        self.rows = rows
+        self.refreshes = 0
+        self.fail = False
+
+    def refresh_incremental(self):
+        if self.fail:
+            raise RuntimeError('banco fora do ar')
+        self.refreshes += 1
+        return len(self.rows)
+
+    def load_profile(self):
+        return rows_to_delay_profile(self.rows)
+
+def _row(line, weekday, hour, count, mean, m2=0.0):
+    return {'bus_line': line, 'weekday': weekday, 'hour': hour, 'sample_count': count,
+            'mean_delay_minutes': mean, 'm2_delay': m2}
+
+def test_delay_to_adjustment():
+    assert delay_to_adjustment(0) == 1.0
+    assert delay_to_adjustment(5) == pytest.approx(1.1)
+    assert delay_to_adjustment(-5) == pytest.approx(0.9)
+    # Linear nos dois sentidos (mesma regra do cálculo anterior por requisição)
+    assert delay_to_adjustment(-30) == pytest.approx(0.4)
+    assert delay_to_adjustment(50) == pytest.approx(2.0)
+
+def test_rows_to_delay_profile_variance():
+    profile = rows_to_delay_profile([_row('L1', 0, 8, 4, 5.5, 35.0), _row('L2', 1, 9, 0, 0.0)])
+    assert profile[('L1', 0, 8)] == {'count': 4, 'mean_delay_minutes': 5.5, 'variance': 8.75}
+    assert profile[('L2', 1, 9)]['variance'] == 0.0
+
+def test_cache_adjustment_and_min_samples():
+    repository = FakeRepository([_row('L1', 0, 8, 5, 5.0), _row('L1', 0, 9, 2, 5.0)])
+    cache = DelayProfileCache(min_samples=3)
+    assert cache.get_adjustment('L1', 0, 8) == 1.0
+    assert cache.refresh(repository)
+
+    assert cache.get_adjustment('L1', 0, 8) == pytest.approx(1.1)
+    # Poucas amostras ou célula inexistente: sem ajuste
+    assert cache.get_adjustment('L1', 0, 9) == 1.0
+    assert cache.get_adjustment('L9', 3, 12) == 1.0
+    assert cache.get_status()['cells'] == 2 and cache.get_status()['last_refresh']
+
+def test_cache_keeps_profile_on_error():
+    repository = FakeRepository([_row('L1', 0, 8, 5, 5.0)])
+    cache = DelayProfileCache(min_samples=3)
+    cache.refresh(repository)
+
+    repository.fail = True
+    assert not cache.refresh(repository)
+    assert cache.get_adjustment('L1', 0, 8) == pytest.approx(1.1)
+
+def test_background_refresh_stops():
+    repository = FakeRepository([_row('L1', 0, 8, 5, 5.0)])
+    cache = DelayProfileCache()
+    cache.start_background_refresh(repository, interval_seconds=60)
+    cache._thread.join(0.5)
+    assert repository.refreshes == 1
+
+    cache.stop()
+    cache._thread.join(2)
+    assert not cache._thread.is_alive()
@@ -0,0 +1,98 @@
+"""
+Testes das distâncias vetorizadas (api/geo.py) e do ETA da frota no dashboard
+
+Uso:
+    python -m pytest test_geo.py -v
+
+Comparam o resultado vetorizado com calculate_distance_km; não usam banco.
+"""
+
+import random
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from api import dashboard_api
+from api.geo import FixedPoints, distance_matrix_km, haversine_km, path_length_km
+from api.stop_index import StopIndex, rebuild_stop_index
+from api.utils import calculate_distance_km
+from config_simple import DESTINATIONS
+
+LAT, LON = -8.0630, -34.8710
+
+def _points(n: int, seed: int, spread: float = 0.15):
+    rng = random.Random(seed)
+    return ([LAT + rng.uniform(-spread, spread) for _ in range(n)],
+            [LON + rng.uniform(-spread, spread) for _ in range(n)])
+
+# ============================================================
+#                        DISTÂNCIAS
+# ============================================================
+
+def test_haversine_matches_scalar():
+    lats, lons = _points(500, 1)
+    lats2, lons2 = _points(500, 2)
+    expected = [calculate_distance_km(*p) for p in zip(lats, lons, lats2, lons2)]
+    assert haversine_km(lats, lons, lats2, lons2) == pytest.approx(expected, rel=1e-12)
+    # Broadcasting: um ponto contra vários, e pontos antípodas sem NaN
+    assert haversine_km(LAT, LON, lats2, lons2).shape == (500,)
+    assert haversine_km(0, 0, 0, 180) == pytest.approx(np.pi * 6371.0)
+
+def test_distance_matrix_and_nearest():
+    lats, lons = _points(50, 3)
+    stop_lats, stop_lons = _points(30, 4)
+    matrix = distance_matrix_km(lats, lons, stop_lats, stop_lons)
+    assert matrix.shape == (50, 30)
+    assert matrix[7, 11] == pytest.approx(calculate_distance_km(lats[7], lons[7], stop_lats[11], stop_lons[11]))
+
+    indices, distances = FixedPoints(stop_lats, stop_lons).nearest(lats, lons)
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        brute = [calculate_distance_km(lat, lon, a, b) for a, b in zip(stop_lats, stop_lons)]
+        assert indices[i] == int(np.argmin(brute))
+        assert distances[i] == pytest.approx(min(brute))
+
+def test_nearest_in_chunks(monkeypatch):
+    from api import geo
+    monkeypatch.setattr(geo, 'NEAREST_CHUNK_CELLS', 7)
+    lats, lons = _points(25, 5)
+    stop_lats, stop_lons = _points(3, 6)
+    chunked = FixedPoints(stop_lats, stop_lons).nearest(lats, lons)
+    whole = distance_matrix_km(lats, lons, stop_lats, stop_lons)
+    assert chunked[0].tolist() == whole.argmin(axis=1).tolist()
+
+def test_path_length():
+    lats, lons = _points(20, 7)
+    expected = sum(calculate_distance_km(lats[i], lons[i], lats[i + 1], lons[i + 1]) for i in range(19))
+    assert path_length_km(lats, lons) == pytest.approx(expected)
+    assert path_length_km([LAT], [LON]) == 0.0
+    assert path_length_km([], []) == 0.0
+
+# ============================================================
+#                      ETA DA FROTA
+# ============================================================
+
+def test_nearest_many_matches_grid():
+    stops = {f"s{i}": {'name': f"Parada {i}", 'latitude': lat, 'longitude': lon, 'type': 'parada'}
+             for i, (lat, lon) in enumerate(zip(*_points(300, 8)))}
+    index = StopIndex(stops)
+    lats, lons = _points(40, 9)
+    assert [s['id'] for s in index.nearest_many(lats, lons)] == \
+        [index.nearest(lat, lon)[0]['id'] for lat, lon in zip(lats, lons)]
+    assert StopIndex({}).nearest_many([LAT], [LON]) == [None]
+
+def test_fleet_etas_on_dashboard_buses():
+    rebuild_stop_index(dict(DESTINATIONS))
+    now = datetime.now()
+    locations = [
+        {'id': 1, 'bus_line': 'L1', 'latitude': -8.0630, 'longitude': -34.8710, 'timestamp_location': now},
+        {'id': 2, 'bus_line': 'L2', 'latitude': -8.05, 'longitude': -34.88, 'timestamp_location': now},
+    ]
+    buses = {b['line_code']: b for b in dashboard_api.latest_buses_by_line(locations)}
+
+    assert buses['L1']['eta']['destination'] == 'terminal_central'
+    assert buses['L1']['eta']['minutes'] == 0.0
+    eta = buses['L2']['eta']
+    assert eta['destination'] == 'shopping_recife' and eta['distance_km'] == 0.42
+    assert 50.0 <= eta['confidence'] <= 95.0
+    assert eta['minutes'] > 0
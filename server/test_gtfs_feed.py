@@ -0,0 +1,141 @@
+"""
+Testes da importação do GTFS estático (api/gtfs_feed.py)
+
+Uso:
+    python -m pytest test_gtfs_feed.py -v
+
+Um GTFS pequeno é montado em um .zip temporário; não usam banco nem rede.
+"""
+
+import os
+import zipfile
+
+import numpy as np
+import pytest
+
+from api import gtfs_feed, route_engine
+from api.gtfs_feed import get_gtfs_feed, load_gtfs, parse_gtfs_zip, parse_gtfs_time, snapshot_path
+from api.route_engine import rebuild_route_engine
+from api.stop_index import rebuild_stop_index
+
+FEED = {
+    'stops.txt': """stop_id,stop_name,stop_lat,stop_lon,location_type
+A,Terminal Derby,-8.0571,-34.8990,1
+B,Parada Boa Vista,-8.0600,-34.8900,0
+C,Parada Santo Amaro,-8.0500,-34.8800,0
+E,Entrada Derby,-8.0572,-34.8991,2
+X,Sem coordenada,,,0
+""",
+    'routes.txt': """route_id,route_short_name,route_long_name,route_type
+R1,L7,Derby - Santo Amaro,3
+R2,,Circular,3
+""",
+    'trips.txt': """route_id,service_id,trip_id,direction_id,shape_id
+R1,U,t1,0,S1
+R1,U,t2,0,S1
+R1,U,t3,1,S1
+R2,U,t4,0,
+""",
+    'shapes.txt': """shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence
+S1,-8.0600,-34.8900,2
+S1,-8.0571,-34.8990,1
+S1,-8.0500,-34.8800,3
+""",
+    'stop_times.txt': """trip_id,arrival_time,departure_time,stop_id,stop_sequence
+t1,23:58:00,23:59:00,A,1
+t1,,,B,2
+t1,24:09:00,24:10:00,C,3
+t2,08:00:00,08:00:00,A,1
+t2,08:10:00,08:10:00,B,2
+t3,09:00:00,09:00:00,C,1
+t3,09:10:00,09:10:00,A,2
+t4,10:00:00,10:00:00,B,1
+t4,10:05:00,10:05:00,C,2
+t4,10:06:00,10:06:00,NADA,3
+"""
+}
+
+def _write_feed(path, files=FEED):
+    with zipfile.ZipFile(path, 'w') as feed:
+        for name, content in files.items():
+            feed.writestr(name, content)
+    return str(path)
+
+@pytest.fixture
+def feed_zip(tmp_path, monkeypatch):
+    path = _write_feed(tmp_path / 'recife.zip')
+    monkeypatch.setitem(gtfs_feed.GTFS_CONFIG, 'snapshot_dir', str(tmp_path / 'cache'))
+    return path
+
+def test_parse_feed(feed_zip):
+    assert parse_gtfs_time('25:01:02') == 90062 and parse_gtfs_time('') == -1
+    feed = parse_gtfs_zip(feed_zip)
+    assert feed.counts() == {'stops': 4, 'routes': 2, 'shapes': 1, 'shape_points': 3, 'patterns': 3}
+    # Pontos do traçado na ordem de shape_pt_sequence
+    assert feed.shape(0)[:, 1].tolist() == [-34.8990, -34.8900, -34.8800]
+
+    catalogue = feed.stops_catalogue()
+    assert set(catalogue) == {'A', 'B', 'C'}  # entrada (location_type 2) fica de fora
+    assert catalogue['A']['type'] == 'terminal' and catalogue['B']['type'] == 'parada'
+
+    patterns = {(p['line'], p['direction']): p for p in feed.patterns()}
+    assert set(patterns) == {('L7', 0), ('L7', 1), ('R2', 0)}
+    # Sentido 0: t1 (3 paradas) em vez de t2; horário vazio sem travel_seconds
+    l7 = patterns[('L7', 0)]
+    assert l7['trip_id'] == 't1' and [s['id'] for s in l7['stops']] == ['A', 'B', 'C']
+    assert 'travel_seconds' not in l7['stops'][1] and 'travel_seconds' not in l7['stops'][2]
+    assert feed.pattern_arrivals[:3].tolist() == [-60, -1, 600]
+    # Parada desconhecida ignorada; sem shape
+    assert [s['id'] for s in patterns[('R2', 0)]['stops']] == ['B', 'C']
+    assert patterns[('R2', 0)]['stops'][1]['travel_seconds'] == 300
+    assert patterns[('R2', 0)]['shape'] is None and patterns[('R2', 0)]['name'] == 'Circular'
+
+def test_snapshot_is_mapped_and_refreshed(feed_zip):
+    first = load_gtfs(feed_zip)
+    assert first.loaded_from == 'feed'
+    directory = snapshot_path(feed_zip)
+    assert os.path.exists(os.path.join(directory, 'manifest.json'))
+
+    second = load_gtfs(feed_zip)
+    assert second.loaded_from == 'snapshot'
+    assert isinstance(second.stop_coords, np.memmap)
+    for name, array in first.arrays().items():
+        assert np.array_equal(array, getattr(second, name)), name
+    assert [p['stops'] for p in first.patterns()] == [p['stops'] for p in second.patterns()]
+
+    # Zip novo: os CSVs são lidos de novo e o snapshot é trocado
+    files = dict(FEED, **{'stops.txt': FEED['stops.txt'] + "D,Parada Nova,-8.0400,-34.8700,0\n"})
+    _write_feed(feed_zip, files)
+    third = load_gtfs(feed_zip)
+    assert third.loaded_from == 'feed' and third.counts()['stops'] == 5
+    assert load_gtfs(feed_zip).counts()['stops'] == 5
+    assert not [name for name in os.listdir(os.path.dirname(directory)) if '.tmp-' in name or '.old-' in name]
+
+def test_catalogue_for_stops_and_route_eta(feed_zip, monkeypatch):
+    monkeypatch.setitem(gtfs_feed.GTFS_CONFIG, 'feed_zip', feed_zip)
+    monkeypatch.setattr(gtfs_feed, '_gtfs_feed', None)
+    try:
+        assert rebuild_stop_index().nearest(-8.0599, -34.8901)[0]['id'] == 'B'
+        feed = get_gtfs_feed()
+        assert get_gtfs_feed() is feed
+
+        engine = rebuild_route_engine()
+        l7 = engine.get('L7')
+        assert [s['id'] for s in l7.stops] == ['A', 'B', 'C']
+        # Os dois sentidos da linha são carregados
+        assert [route.direction for route in engine.directions['L7']] == [0, 1]
+        assert [s['id'] for s in engine.get('L7', 1).stops] == ['C', 'A']
+        # Sem horários: distância a speed_kmh mais o tempo parado padrão
+        assert l7.dwell_seconds == route_engine.ROUTE_ENGINE_CONFIG['dwell_seconds']
+        assert 'L1' in engine.lines  # arquivos .json continuam valendo
+        # R2 sem shape: poligonal das paradas, 5 min de B a C
+        assert engine.get('R2').dwell_seconds == 0
+        r2 = engine.etas('R2', -8.0600, -34.8900)
+        assert r2['stops'][0]['id'] == 'C' and r2['stops'][0]['eta_minutes'] == pytest.approx(5.0, abs=0.05)
+
+        status = gtfs_feed.get_gtfs_feed_status()
+        assert status['stops'] == 4 and status['loaded_from'] in ('feed', 'snapshot')
+    finally:
+        monkeypatch.undo()
+        rebuild_stop_index()
+        rebuild_route_engine()
@@ -0,0 +1,190 @@
+"""
+Testes dos feeds GTFS-Realtime (api/gtfs_realtime.py e api/gtfs_rt_api.py)
+
+Uso:
+    python -m pytest test_gtfs_realtime.py -v
+
+As posições vêm de uma fonte fixa (sem banco); o protobuf é lido por um
+decodificador mínimo do formato binário e, se instalados, pelos bindings
+oficiais (gtfs-realtime-bindings).
+"""
+
+import struct
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from api import gtfs_realtime
+from api.gtfs_realtime import GTFSRealtimePublisher, TRIP_UPDATES, VEHICLE_POSITIONS, pb_varint
+from api.gtfs_rt_api import gtfs_rt_bp
+from api.route_engine import LineRoute, RouteEngine, rebuild_route_engine
+from api.stop_index import rebuild_stop_index
+from api.trajectory import METERS_PER_DEGREE
+from api.utils import get_traffic_factor_by_hour
+from config_simple import DESTINATIONS
+
+FIX_TIME = datetime(2026, 10, 19, 8, 0, 0)
+LAT, LON = -8.0300, -34.9500
+
+def _point(east_m: float, north_m: float = 0.0):
+    return (LAT + north_m / METERS_PER_DEGREE, LON + east_m / (METERS_PER_DEGREE * 0.99))
+
+def _stop(stop_id: str, east_m: float, north_m: float = 0.0):
+    lat, lon = _point(east_m, north_m)
+    return {'id': stop_id, 'latitude': lat, 'longitude': lon}
+
+def _read_varint(data: bytes, i: int):
+    value = shift = 0
+    while True:
+        byte = data[i]
+        value |= (byte & 0x7F) << shift
+        i += 1
+        if byte < 0x80:
+            return value, i
+        shift += 7
+
+def decode(data: bytes):
+    """Campo -> lista de valores (int, float ou bytes das mensagens aninhadas)."""
+    fields = {}
+    i = 0
+    while i < len(data):
+        key, i = _read_varint(data, i)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, i = _read_varint(data, i)
+        elif wire_type == 5:
+            value = struct.unpack('<f', data[i:i + 4])[0]
+            i += 4
+        elif wire_type == 2:
+            size, i = _read_varint(data, i)
+            value = data[i:i + size]
+            i += size
+        else:
+            raise ValueError(f"Tipo {wire_type} inesperado")
+        fields.setdefault(field, []).append(value)
+    return fields
+
+def _fix(device_id, line, latitude, longitude, timestamp=FIX_TIME):
+    return {'device_id': device_id, 'bus_line': line, 'latitude': latitude, 'longitude': longitude,
+            'timestamp_location': timestamp}
+
+def _locations():
+    return [
+        # T9 do GTFS: ida pela rua y=0, volta pela paralela y=500
+        _fix('bus-3', 'T9', *_point(1000)),
+        _fix('bus-4', 'T9', *_point(1000, 500)),
+        # L1 (arquivo .json, sem sentido do GTFS) entre o Terminal Central e o Shopping Recife
+        _fix('bus-1', 'L1', -8.0561, -34.8731),
+        _fix('bus-1', 'L1', -8.0630, -34.8710, datetime(2026, 10, 19, 7, 59, 0)),
+        # L2 sem itinerário: parada mais próxima
+        _fix('bus-2', 'L2', -8.1190, -34.9000),
+        # Sem device_id: não identifica o ônibus, fica fora do feed
+        _fix(None, 'L1', -8.0500, -34.8790)
+    ]
+
+@pytest.fixture(autouse=True)
+def catalogue(monkeypatch):
+    rebuild_stop_index(dict(DESTINATIONS))
+    outbound = LineRoute('T9', [_point(0), _point(3000)], [_stop('a', 0), _stop('b', 1500), _stop('c', 3000)],
+                         speed_kmh=36.0, dwell_seconds=0, direction=0)
+    inbound = LineRoute('T9', [_point(3000, 500), _point(0, 500)], [_stop('d', 3000, 500), _stop('e', 0, 500)],
+                        speed_kmh=36.0, dwell_seconds=0, direction=1)
+    engine = RouteEngine({'L1': rebuild_route_engine().get('L1'), 'T9': [outbound, inbound]})
+    monkeypatch.setattr(gtfs_realtime, 'get_route_engine', lambda: engine)
+    monkeypatch.setattr(gtfs_realtime, '_route_ids', lambda: {'T9': 'R9'})
+    yield
+
+def test_wire_format():
+    # Exemplo da documentação do protobuf: campo 1 = 150
+    assert pb_varint(1, 150) == b'\x08\x96\x01'
+    # int64 negativo ocupa 10 bytes
+    assert len(pb_varint(1, -1)) == 11
+
+def test_feeds_from_fleet_state():
+    locations = _locations()
+    publisher = GTFSRealtimePublisher(60, 5, source=lambda minutes: locations)
+    publisher.refresh()
+
+    feed = decode(publisher.get(VEHICLE_POSITIONS).payload)
+    header = decode(feed[1][0])
+    assert header[1] == [b'2.0'] and header[2] == [0]
+    # Um veículo por dispositivo; a leitura sem device_id fica de fora
+    vehicles = {decode(v[8][0])[1][0]: v for v in (decode(decode(entity)[4][0]) for entity in feed[2])}
+    assert sorted(vehicles) == [b'bus-1', b'bus-2', b'bus-3', b'bus-4']
+    bus1 = vehicles[b'bus-1']
+    assert decode(bus1[8][0])[2] == [b'L1']
+    assert decode(bus1[2][0])[1][0] == pytest.approx(-8.0561, abs=1e-5)
+    assert bus1[5] == [int(FIX_TIME.timestamp())]  # leitura mais recente do ônibus
+    assert bus1[7] == [b'shopping_recife'] and bus1[4] == [2]
+    # L1 não tem sentido do GTFS: posição sem viagem
+    assert 1 not in bus1 and 1 not in vehicles[b'bus-2']
+
+    # T9: route_id, direction_id e início estimado pelos horários do padrão
+    trip = decode(vehicles[b'bus-3'][1][0])
+    assert trip[5] == [b'R9'] and trip[6] == [0] and 1 not in trip
+    elapsed = 100 * get_traffic_factor_by_hour(datetime.now().hour)  # 1000 m a 10 m/s
+    start = datetime.strptime(f"{trip[3][0].decode()} {trip[2][0].decode()}", '%Y%m%d %H:%M:%S')
+    assert abs((FIX_TIME - timedelta(seconds=elapsed) - start).total_seconds()) <= 1
+    assert decode(vehicles[b'bus-4'][1][0])[6] == [1]
+
+    # TripUpdate só para as viagens identificadas
+    updates = {decode(u[3][0])[1][0]: u for u in
+               (decode(decode(entity)[3][0]) for entity in decode(publisher.get(TRIP_UPDATES).payload)[2])}
+    assert sorted(updates) == [b'bus-3', b'bus-4']
+    assert updates[b'bus-3'][1] == vehicles[b'bus-3'][1]
+    stops = [decode(update) for update in updates[b'bus-3'][2]]
+    assert [s[4][0] for s in stops] == [b'b', b'c']
+    arrivals = [decode(s[2][0])[2][0] for s in stops]
+    assert FIX_TIME.timestamp() < arrivals[0] < arrivals[1]
+
+def test_one_encode_per_tick_and_etag(monkeypatch):
+    locations = _locations()
+    publisher = GTFSRealtimePublisher(60, 5, source=lambda minutes: locations)
+    monkeypatch.setattr(gtfs_realtime, 'gtfs_realtime_publisher', publisher)
+    app = Flask(__name__)
+    app.register_blueprint(gtfs_rt_bp, url_prefix='/gtfs-rt')
+    client = app.test_client()
+
+    first = client.get('/gtfs-rt/vehicle_positions')
+    assert first.status_code == 200 and first.mimetype == 'application/x-protobuf'
+    etag = first.headers['ETag']
+    for _ in range(50):
+        assert client.get('/gtfs-rt/vehicle_positions').data == first.data
+        client.get('/gtfs-rt/trip_updates')
+    assert publisher.ticks == 1 and publisher.encodes == 2
+    assert client.get('/gtfs-rt/vehicle_positions', headers={'If-None-Match': etag}).status_code == 304
+
+    # Tick sem leitura nova: mesmo buffer e mesma ETag
+    publisher.refresh()
+    assert publisher.encodes == 2 and client.get('/gtfs-rt/vehicle_positions').headers['ETag'] == etag
+
+    # Leitura nova sem device_id: não muda o feed
+    locations.append(_fix(None, 'L1', -8.0500, -34.8790, datetime(2026, 10, 19, 8, 0, 30)))
+    publisher.refresh()
+    assert publisher.encodes == 2
+
+    # Leitura nova de um ônibus: feed recodificado
+    locations.append(_fix('bus-1', 'L1', -8.0500, -34.8790, datetime(2026, 10, 19, 8, 0, 30)))
+    publisher.refresh()
+    assert client.get('/gtfs-rt/vehicle_positions', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/gtfs-rt/status').get_json()['gtfs_realtime']['feeds'][VEHICLE_POSITIONS]['entities'] == 4
+
+def test_source_error_serves_empty_feed():
+    def broken(minutes):
+        raise RuntimeError('banco fora do ar')
+
+    publisher = GTFSRealtimePublisher(60, 5, source=broken)
+    feed = decode(publisher.get(VEHICLE_POSITIONS).payload)
+    assert 2 not in feed and publisher.errors == 1
+
+def test_official_bindings_parse_feed():
+    gtfs_realtime_pb2 = pytest.importorskip('google.transit.gtfs_realtime_pb2')
+    publisher = GTFSRealtimePublisher(60, 5, source=lambda minutes: _locations())
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(publisher.get(TRIP_UPDATES).payload)
+    assert message.header.gtfs_realtime_version == '2.0'
+    trip_update = message.entity[0].trip_update
+    assert trip_update.trip.route_id == 'R9' and trip_update.trip.direction_id == 0
+    assert trip_update.trip.start_date == FIX_TIME.strftime('%Y%m%d')
+    assert [u.stop_id for u in trip_update.stop_time_update] == ['b', 'c']
@@ -0,0 +1,137 @@
+"""
+Testes da deduplicação de requisições dos dispositivos (api/idempotency.py)
+
+Uso:
+    python -m pytest test_idempotency.py -v
+
+Os testes das rotas rodam sem banco (modo fallback); a gravação única por
+ingest_key no banco é testada em test_database_repositories.py.
+"""
+
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from api import idempotency
+from api import simple_location_api
+from api.idempotency import ResponseCache, ingest_key_for, REPLAY_HEADER
+
+# ============================================================
+#                       FIXTURES
+# ============================================================
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Cache novo no lugar do global do processo."""
+    fresh = ResponseCache(max_entries=100, ttl_seconds=60)
+    monkeypatch.setattr(idempotency, 'response_cache', fresh)
+    return fresh
+
+@pytest.fixture
+def client(cache):
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    return app.test_client()
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Conta quantas vezes a rota de localização foi de fato processada."""
+    counter = {'n': 0}
+    original = simple_location_api.get_nearest_destination
+
+    def counting(*args, **kwargs):
+        counter['n'] += 1
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(simple_location_api, 'get_nearest_destination', counting)
+    # L1 tem itinerário (data/routes): sem ele, toda leitura passa por get_nearest_destination
+    monkeypatch.setattr(simple_location_api, 'estimate_route_eta', lambda *args, **kwargs: None)
+    return counter
+
+LOCATION = {'bus_line': 'L1', 'latitude': -8.0630, 'longitude': -34.8710}
+
+# ============================================================
+#                       CHAVES E CACHE
+# ============================================================
+
+def test_ingest_key_sources():
+    by_header = ingest_key_for('/api/location', {}, {'Idempotency-Key': 'abc'})
+    by_field = ingest_key_for('/api/location', {'idempotency_key': 'abc'}, {})
+    assert by_header == by_field
+
+    seq = ingest_key_for('/api/location', {'device_id': 'esp-7', 'seq': 41}, {})
+    assert seq == ingest_key_for('/api/location', {'device_id': 'esp-7', 'seq': 41}, {})
+    assert seq != ingest_key_for('/api/location', {'device_id': 'esp-7', 'seq': 42}, {})
+    assert seq != ingest_key_for('/api/location-image', {'device_id': 'esp-7', 'seq': 41}, {})
+
+    assert ingest_key_for('/api/location', {'device_id': 'esp-7'}, {}) is None
+
+def test_cache_ttl_and_lru():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.put('a', 200, b'1')
+    cache.put('b', 200, b'2')
+    assert cache.get('a') == (200, b'1')
+    cache.put('c', 200, b'3')          # 'b' é a menos usada
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+
+    expiring = ResponseCache(ttl_seconds=0.01)
+    expiring.put('a', 200, b'1')
+    time.sleep(0.02)
+    assert expiring.get('a') is None
+    assert expiring.get_status()['bytes'] == 0
+
+def test_cache_bounded_by_bytes():
+    cache = ResponseCache(max_entries=100, max_bytes=10)
+    for key in 'abc':
+        cache.put(key, 200, b'x' * 4)
+    assert cache.get_status()['bytes'] <= 10
+    assert cache.get('a') is None
+
+def test_acquire_waits_for_inflight_request(cache):
+    assert cache.acquire('k') == (None, True)
+
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(r=cache.acquire('k', 5)))
+    waiter.start()
+    time.sleep(0.05)
+    cache.release('k', 200, b'{}')
+    waiter.join(1)
+
+    assert result['r'] == ((200, b'{}'), False)
+    assert cache.get_status()['in_flight'] == 0
+
+# ============================================================
+#                         ROTAS
+# ============================================================
+
+def test_repeated_location_returns_cached_response(client, calls, cache):
+    headers = {'Idempotency-Key': 'esp-7-0001'}
+    first = client.post('/api/location', json=LOCATION, headers=headers)
+    second = client.post('/api/location', json=LOCATION, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert calls['n'] == 1
+    assert second.get_data() == first.get_data()
+    assert second.headers[REPLAY_HEADER] == 'true'
+    assert REPLAY_HEADER not in first.headers
+    assert cache.get_status()['hits'] == 1
+
+def test_sequence_number_deduplicates(client, calls):
+    for seq in (1, 1, 2):
+        client.post('/api/location', json=dict(LOCATION, device_id='esp-7', seq=seq))
+    assert calls['n'] == 2
+
+def test_requests_without_key_are_not_cached(client, calls, cache):
+    for _ in range(2):
+        assert client.post('/api/location', json=LOCATION).status_code == 200
+    assert calls['n'] == 2
+    assert cache.get_status()['entries'] == 0
+
+def test_errors_are_not_cached(client, cache):
+    headers = {'Idempotency-Key': 'bad-1'}
+    assert client.post('/api/location', json={'bus_line': 'L1'}, headers=headers).status_code == 400
+    assert cache.get_status()['entries'] == 0
+    assert cache.get_status()['in_flight'] == 0
@@ -0,0 +1,110 @@
+"""
+Testes da exportação do histórico em streaming (NDJSON e CSV) e dos
+limites da paginação por cursor
+
+Uso:
+    python -m pytest test_location_export.py -v
+
+O repositório é substituído por um gerador de lotes; não usa banco.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from api import simple_location_api
+
+ROWS = [
+    {'id': i, 'bus_line': 'L1', 'latitude': -8.06 - i / 1000, 'longitude': -34.87,
+     'timestamp_location': datetime(2026, 10, 19, 8, i)}
+    for i in range(5)
+]
+
+class FakeRepository:
+    def __init__(self, rows, fail_on_open=False):
+        self.rows = rows
+        self.fail_on_open = fail_on_open
+        self.calls = []
+
+    def stream_location_history(self, bus_line, hours=24, limit=None, batch_size=1000):
+        self.calls.append((bus_line, hours, limit))
+        if self.fail_on_open:
+            raise RuntimeError('conexão recusada')
+        for start in range(0, len(self.rows), 2):
+            yield self.rows[start:start + 2]
+
+@pytest.fixture
+def client_with(monkeypatch):
+    def make(repository):
+        monkeypatch.setattr(simple_location_api, 'get_simple_database_manager', lambda: object())
+        monkeypatch.setattr(simple_location_api, 'get_simple_bus_repository', lambda: repository)
+        app = Flask(__name__)
+        app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+        return app.test_client()
+    return make
+
+def test_export_ndjson(client_with):
+    repository = FakeRepository(ROWS)
+    response = client_with(repository).get('/api/location/history/L1/export?hours=6&limit=5')
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    assert 'history_L1.ndjson' in response.headers['Content-Disposition']
+
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['id'] for line in lines] == [0, 1, 2, 3, 4]
+    assert lines[1]['timestamp_location'] == '2026-10-19T08:01:00'
+    assert repository.calls == [('L1', 6, 5)]
+
+def test_export_csv(client_with):
+    response = client_with(FakeRepository(ROWS)).get('/api/location/history/L1/export?format=csv')
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+
+    rows = list(csv.reader(io.StringIO(response.data.decode())))
+    assert rows[0] == ['id', 'bus_line', 'latitude', 'longitude', 'timestamp_location']
+    assert len(rows) == 6 and rows[3][0] == '2' and rows[3][4] == '2026-10-19T08:02:00'
+
+def test_export_empty_csv_has_header(client_with):
+    response = client_with(FakeRepository([])).get('/api/location/history/L1/export?format=csv')
+    assert response.status_code == 200
+    assert response.data.decode().splitlines() == ['id,bus_line,latitude,longitude,timestamp_location']
+
+def test_export_database_error_before_streaming(client_with):
+    # Erro ao abrir o cursor: 500 com JSON, não um 200 truncado
+    response = client_with(FakeRepository(ROWS, fail_on_open=True)).get('/api/location/history/L1/export')
+    assert response.status_code == 500 and response.get_json()['error']
+
+def test_export_invalid_format(client_with):
+    response = client_with(FakeRepository(ROWS)).get('/api/location/history/L1/export?format=xml')
+    assert response.status_code == 400
+
+# ============================================================
+#                  PAGINAÇÃO DOS HISTÓRICOS
+# ============================================================
+
+@pytest.mark.parametrize('path', ['/api/location/history/L1', '/api/location/eta/L1',
+                                  '/api/image/occupancy/L1/history'])
+@pytest.mark.parametrize('limit', [0, -1, 501])
+def test_history_limit_out_of_range(path, limit):
+    from api import simple_image_api
+
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    app.register_blueprint(simple_image_api.simple_image_bp, url_prefix='/api')
+    response = app.test_client().get(f"{path}?limit={limit}")
+    assert response.status_code == 400 and 'limit' in response.get_json()['error']
+
+def test_history_limit_one_pages(monkeypatch):
+    class Repository:
+        def get_location_history(self, bus_line, hours, limit, after):
+            assert limit == 2  # uma linha a mais para saber se há próxima página
+            return ROWS[:limit]
+
+    monkeypatch.setattr(simple_location_api, 'get_simple_database_manager', lambda: object())
+    monkeypatch.setattr(simple_location_api, 'get_simple_bus_repository', lambda: Repository())
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    body = app.test_client().get('/api/location/history/L1?limit=1').get_json()
+    assert body['count'] == 1 and body['next_cursor']
@@ -0,0 +1,123 @@
+"""
+Testes do cliente HTTP do OSRM (api/osrm_client.py)
+
+Uso:
+    python -m pytest test_osrm_client.py -v
+
+Usam o OSRM de teste (tools/osrm_stub.py) em uma porta local; não usam
+banco. Os testes assíncronos são pulados sem httpx.
+"""
+
+import asyncio
+import socket
+import time
+
+import pytest
+
+from api import osrm_client
+from api.osrm_client import HTTPX_AVAILABLE, OSRMClient, OSRMError
+from tools.osrm_stub import start_in_thread
+
+START = (-8.0630, -34.8710)
+END = (-8.1264, -34.9176)
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_in_thread(**kwargs)
+        servers.append(server)
+        return url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setitem(osrm_client.OSRM_CONFIG, 'backoff_base_seconds', 0.01)
+    monkeypatch.setitem(osrm_client.OSRM_CONFIG, 'backoff_max_seconds', 0.02)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# ============================================================
+#                    CLIENTE (SÍNCRONO)
+# ============================================================
+
+def test_connections_are_reused(stub):
+    client = OSRMClient(stub())
+    for _ in range(20):
+        assert client.route([START, END])['routes'][0]['distance'] > 0
+
+    status = client.get_status()
+    assert status['calls'] == 20 and status['attempts'] == 20
+    assert status['connections_opened'] == 1
+    assert status['connection_reuse_ratio'] == 0.95
+    assert status['attempt_latency_ms']['p50'] is not None
+
+def test_transient_failures_are_retried(stub):
+    client = OSRMClient(stub(fail_requests=2), max_retries=2)
+    assert client.route([START, END])['code'] == 'Ok'
+    status = client.get_status()
+    assert status['attempts'] == 3 and status['retries'] == 2 and status['failures'] == 0
+    assert set(status['by_attempt']) == {'1', '2', '3'}
+
+    # Tentativas esgotadas
+    client = OSRMClient(stub(fail_requests=5), max_retries=1)
+    with pytest.raises(OSRMError, match='503'):
+        client.route([START, END])
+    assert client.get_status()['attempts'] == 2 and client.get_status()['failures'] == 1
+
+def test_osrm_errors_are_not_retried(stub):
+    client = OSRMClient(stub(max_table_size=4), max_retries=3)
+    with pytest.raises(OSRMError, match='Too many'):
+        client.get('/table/v1/driving/' + ';'.join(['-34.87,-8.06'] * 5))
+    assert client.get_status()['attempts'] == 1
+
+    # Servidor fora do ar: falha de conexão é repetida
+    client = OSRMClient(f"http://127.0.0.1:{_free_port()}", max_retries=2)
+    with pytest.raises(OSRMError):
+        client.route([START, END])
+    assert client.get_status()['attempts'] == 3
+
+def test_deadline_limits_retries(stub):
+    client = OSRMClient(stub(latency_ms=300), timeout_seconds=0.1, deadline_seconds=0.25, max_retries=10)
+    started = time.monotonic()
+    with pytest.raises(OSRMError):
+        client.route([START, END])
+    assert time.monotonic() - started < 0.6
+    status = client.get_status()
+    assert status['failures'] == 1 and status['attempts'] < 11
+
+# ============================================================
+#                   CLIENTE (ASSÍNCRONO)
+# ============================================================
+
+@pytest.mark.skipif(not HTTPX_AVAILABLE, reason='httpx não instalado')
+def test_async_fan_out(stub):
+    from api.osrm_client import AsyncOSRMClient
+    url = stub(latency_ms=20, fail_requests=1)
+
+    async def run():
+        client = AsyncOSRMClient(url)
+        try:
+            pairs = [(START, (END[0] + i * 0.001, END[1])) for i in range(50)]
+            started = time.monotonic()
+            results = await client.routes(pairs, concurrency=10)
+            return results, time.monotonic() - started, client.get_status()
+        finally:
+            await client.aclose()
+
+    results, elapsed, status = asyncio.run(run())
+    assert [r['status'] for r in results] == ['success'] * 50
+    # Distâncias na ordem dos pares
+    assert results[0]['distance_meters'] > results[-1]['distance_meters']
+    # 50 x 20 ms em sequência levariam 1 s
+    assert elapsed < 0.6
+    assert status['retries'] == 1
+    assert 1 <= status['connections_opened'] <= 10
+    assert status['connection_reuse_ratio'] >= 0.8
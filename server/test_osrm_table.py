@@ -0,0 +1,157 @@
+"""
+Testes do ETA em lote pelo /table do OSRM (api/eta_osrm.py)
+
+Uso:
+    python -m pytest test_osrm_table.py -v
+
+Usam o OSRM de teste (tools/osrm_stub.py) em uma porta local; não usam
+banco.
+"""
+
+import random
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from api import eta_osrm, simple_location_api, trajectory
+from api.eta_osrm import OSRMETA, calculate_batch_etas
+from api.geo import haversine_km
+from api.route_cache import RouteCache
+from api.stop_index import rebuild_stop_index
+from config_simple import DESTINATIONS
+from tools.osrm_stub import start_in_thread
+
+LAT, LON = -8.0630, -34.8710
+DETOUR, SPEED_KMH = 1.3, 25.0
+
+@pytest.fixture(scope='module')
+def stub_url():
+    server, url = start_in_thread(detour=DETOUR, speed_kmh=SPEED_KMH, max_table_size=100)
+    yield url
+    server.shutdown()
+
+def _points(n: int, seed: int):
+    rng = random.Random(seed)
+    return [(LAT + rng.uniform(-0.1, 0.1), LON + rng.uniform(-0.1, 0.1)) for _ in range(n)]
+
+def _expected_seconds(source, destination) -> float:
+    return float(haversine_km(*source, *destination)) * DETOUR / SPEED_KMH * 3600
+
+def _stops(points):
+    return [{'id': f"s{i}", 'name': f"Parada {i}", 'latitude': lat, 'longitude': lon}
+            for i, (lat, lon) in enumerate(points)]
+
+# ============================================================
+#                          MATRIZ
+# ============================================================
+
+def test_table_matches_route_estimate(stub_url):
+    osrm = OSRMETA(osrm_server=stub_url, cache=RouteCache(max_entries=0))
+    sources, destinations = _points(5, 1), _points(4, 2)
+    table = osrm.get_duration_table(sources, destinations)
+
+    assert table['status'] == 'success' and table['requests'] == 1
+    for i, source in enumerate(sources):
+        for j, destination in enumerate(destinations):
+            assert table['durations'][i][j] == pytest.approx(_expected_seconds(source, destination), abs=0.1)
+            assert table['distances'][i][j] == pytest.approx(
+                float(haversine_km(*source, *destination)) * DETOUR * 1000, abs=0.1)
+
+def test_large_fleet_is_chunked_and_merged(stub_url, monkeypatch):
+    osrm = OSRMETA(osrm_server=stub_url, cache=RouteCache(max_entries=0))
+    sources, destinations = _points(23, 3), _points(12, 4)
+    whole = osrm.get_duration_table(sources, destinations)
+
+    # 10 coordenadas por requisição: 5 paradas x 5 ônibus por bloco
+    monkeypatch.setitem(eta_osrm.OSRM_CONFIG, 'table_max_coordinates', 10)
+    chunked = osrm.get_duration_table(sources, destinations)
+    assert chunked['status'] == 'success'
+    assert chunked['requests'] == 5 * 3
+    assert chunked['durations'] == whole['durations']
+    assert chunked['distances'] == whole['distances']
+
+def test_failed_chunks_fall_back_to_manual(monkeypatch):
+    server, url = start_in_thread(max_table_size=8)
+    try:
+        osrm = OSRMETA(osrm_server=url, cache=RouteCache(max_entries=0))
+        monkeypatch.setattr(eta_osrm, 'osrm_eta', osrm)
+        monkeypatch.setitem(eta_osrm.OSRM_CONFIG, 'table_max_coordinates', 10)
+
+        # Primeiro bloco (6 ônibus + 4 paradas) é recusado; o segundo (2 + 4) passa
+        sources, stops = _points(8, 5), _stops(_points(4, 6))
+        table = osrm.get_duration_table(sources, [(s['latitude'], s['longitude']) for s in stops])
+        assert table['status'] == 'partial' and table['failed_requests'] == 1
+        assert table['durations'][0] == [None] * 4 and None not in table['durations'][7]
+
+        buses = [{'latitude': lat, 'longitude': lon} for lat, lon in sources]
+        etas = calculate_batch_etas(buses, [stops] * len(buses))
+        assert {e['source'] for e in etas[0]} == {'manual_fallback'}
+        assert {e['source'] for e in etas[7]} == {'OSRM'}
+        assert etas[0][0]['confidence_percent'] == eta_osrm.OSRM_CONFIG['confidence_fallback']
+    finally:
+        server.shutdown()
+
+def test_batch_etas_dedupe_stops_and_sort(stub_url, monkeypatch):
+    osrm = OSRMETA(osrm_server=stub_url, cache=RouteCache(max_entries=0))
+    monkeypatch.setattr(eta_osrm, 'osrm_eta', osrm)
+    requested = []
+    original = osrm._table_request
+    monkeypatch.setattr(osrm, '_table_request',
+                        lambda s, d: requested.append(len(d)) or original(s, d))
+
+    stops = _stops(_points(6, 7))
+    buses = [{'latitude': lat, 'longitude': lon} for lat, lon in _points(3, 8)]
+    # Paradas repetidas entre os ônibus viram uma coluna só
+    etas = calculate_batch_etas(buses, [stops[:4], stops[2:], stops[::2]], traffic_factor=1.5)
+
+    assert requested == [6]
+    assert [len(e) for e in etas] == [4, 4, 3]
+    for bus, bus_etas in zip(buses, etas):
+        assert [e['eta_minutes'] for e in bus_etas] == sorted(e['eta_minutes'] for e in bus_etas)
+        first = bus_etas[0]
+        stop = next(s for s in stops if s['id'] == first['stop_id'])
+        seconds = _expected_seconds((bus['latitude'], bus['longitude']), (stop['latitude'], stop['longitude']))
+        assert first['eta_minutes'] == pytest.approx(seconds * 1.5 / 60, abs=0.1)
+        assert first['source'] == 'OSRM'
+
+# ============================================================
+#                        ENDPOINT
+# ============================================================
+
+class _FakeRepository:
+    def __init__(self, locations):
+        self.locations = locations
+
+    def get_current_locations(self, bus_line=None, minutes=5):
+        return [l for l in self.locations if bus_line in (None, l['bus_line'])]
+
+def test_fleet_eta_endpoint(stub_url, monkeypatch):
+    rebuild_stop_index(dict(DESTINATIONS))
+    monkeypatch.setattr(eta_osrm, 'osrm_eta', OSRMETA(osrm_server=stub_url, cache=RouteCache(max_entries=0)))
+    # Só as posições do repositório (sem as recentes de outros testes)
+    monkeypatch.setattr(trajectory, 'trajectory_compressor', None)
+    now = datetime.now()
+    monkeypatch.setattr(simple_location_api, 'get_simple_bus_repository', lambda: _FakeRepository([
+        {'id': 3, 'bus_line': 'L1', 'latitude': -8.0630, 'longitude': -34.8710, 'timestamp_location': now},
+        {'id': 2, 'bus_line': 'L2', 'latitude': -8.05, 'longitude': -34.88, 'timestamp_location': now},
+        # Posição antiga da L1: ignorada
+        {'id': 1, 'bus_line': 'L1', 'latitude': -8.10, 'longitude': -34.90, 'timestamp_location': now},
+    ]))
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    client = app.test_client()
+
+    body = client.get('/api/location/fleet/eta?stops=2').get_json()
+    assert body['count'] == 2
+    buses = {b['bus_line']: b for b in body['buses']}
+    assert buses['L1']['latitude'] == -8.0630
+    assert buses['L1']['etas'][0]['stop_id'] == 'terminal_central'
+    assert buses['L1']['etas'][0]['eta_minutes'] == 0.0
+    assert all(len(b['etas']) == 2 and b['etas'][0]['source'] == 'OSRM' for b in body['buses'])
+
+    body = client.get('/api/location/fleet/eta?line=L2').get_json()
+    assert [b['bus_line'] for b in body['buses']] == ['L2']
+
+    assert client.get('/api/location/fleet/eta?stops=0').status_code == 400
+    assert client.get('/api/location/fleet/eta?minutes=0').status_code == 400
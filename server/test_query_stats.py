@@ -0,0 +1,148 @@
+"""
+Testes do tempo das consultas e da captura de planos (database/query_stats.py)
+
+Uso:
+    python -m pytest test_query_stats.py -v
+
+Os testes de QueryStats não usam banco; os de execute_query usam o PostgreSQL
+local (ignorados sem banco).
+"""
+
+import uuid
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from api import dashboard_api
+from config_simple import DATABASE_CONFIG
+from database import query_stats as query_stats_module
+from database import simple_connection as sync_db
+from database.query_stats import QueryStats, OTHER_QUERIES, is_explainable, is_read_only, normalize_query
+from test_database_repositories import _database_available
+
+requires_db = pytest.mark.skipif(not _database_available(), reason="PostgreSQL local indisponível")
+
+@pytest.fixture
+def stats(monkeypatch):
+    """QueryStats que captura o plano de toda execução (limite 0, amostra 100%)."""
+    instance = QueryStats(slow_threshold_ms=0, explain_sample_rate=1.0, explain_cooldown_seconds=0)
+    monkeypatch.setattr(query_stats_module, 'query_stats', instance)
+    return instance
+
+# ============================================================
+#                       QUERYSTATS
+# ============================================================
+
+def test_normalize_query_replaces_literals():
+    assert normalize_query("SELECT *\n  FROM bus_location WHERE bus_line = 'L1' AND id IN (1, 2, 3)") == \
+        "SELECT * FROM bus_location WHERE bus_line = ? AND id IN (?)"
+    assert normalize_query("SELECT * FROM t WHERE a = %s LIMIT 10") == "SELECT * FROM t WHERE a = %s LIMIT ?"
+    assert is_explainable("  with x AS (SELECT 1) SELECT * FROM x")
+    assert not is_explainable("SELECT pg_sleep(1)")
+    assert not is_explainable("VACUUM bus_location")
+
+    assert is_read_only("SELECT * FROM bus_location WHERE bus_line = 'UPDATE'")
+    assert is_read_only("WITH x AS (SELECT 1) SELECT * FROM x")
+    assert not is_read_only("WITH moved AS (DELETE FROM t RETURNING *) SELECT * FROM moved")
+    assert not is_read_only("SELECT * FROM t FOR UPDATE")
+    assert not is_read_only("INSERT INTO t VALUES (1)")
+
+def test_histogram_and_top():
+    stats = QueryStats(slow_threshold_ms=100, explain_sample_rate=0)
+    for _ in range(98):
+        stats.record("SELECT 1", 0.003)
+    stats.record("SELECT 1", 0.150)
+    stats.record("SELECT 1", 0.800)
+    stats.record("SELECT * FROM t WHERE id = 7", 0.040)
+
+    select_1 = stats.top(1, 'calls')[0]
+    assert stats.top(1, 'max_ms')[0]['fingerprint'] == select_1['fingerprint']
+    assert select_1['calls'] == 100 and select_1['slow_calls'] == 2
+    assert select_1['p50_ms'] == 5 and select_1['p99_ms'] == 200 and select_1['max_ms'] == 800
+    assert select_1['histogram'] == {'5': 98, '200': 1, '1000': 1}
+
+    assert [q['query'] for q in stats.top(1, 'mean_ms')] == ["SELECT * FROM t WHERE id = ?"]
+    with pytest.raises(ValueError):
+        stats.top(5, 'nome')
+
+def test_distinct_queries_are_bounded():
+    stats = QueryStats(max_queries=2)
+    for table in ('a', 'b', 'c', 'd'):
+        stats.record(f"SELECT * FROM {table}", 0.001)
+    assert stats.get_status()['distinct_queries'] == 3
+    assert {q['query'] for q in stats.top(5)} >= {OTHER_QUERIES}
+
+def test_explain_sampling_and_cooldown():
+    stats = QueryStats(slow_threshold_ms=50, explain_sample_rate=1.0, explain_cooldown_seconds=300)
+    assert not stats.record("SELECT * FROM t", 0.010)
+    assert stats.record("SELECT * FROM t", 0.100)
+    # Mesma consulta dentro do intervalo de espera
+    assert not stats.record("SELECT * FROM t", 0.100)
+    assert not stats.record("SELECT * FROM t", 0.100, error=True)
+    assert stats.record("SELECT * FROM u", 0.100)
+
+    never = QueryStats(slow_threshold_ms=50, explain_sample_rate=0.0)
+    assert not never.record("SELECT * FROM t", 1.0)
+
+def test_capture_ring_buffer():
+    stats = QueryStats(ring_size=3)
+    for i in range(5):
+        stats.add_capture(f"SELECT {i}", 0.5, plan=f"plano {i}")
+    assert [c['plan'] for c in stats.recent_captures()] == ['plano 4', 'plano 3', 'plano 2']
+    assert len(stats.recent_captures(1)) == 1
+
+# ============================================================
+#                   EXECUTE_QUERY E ENDPOINT
+# ============================================================
+
+@requires_db
+def test_execute_query_captures_plan_and_rolls_back(stats):
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    line = f"Q{uuid.uuid4().hex[:8].upper()}"
+    try:
+        rows = db.execute_query(
+            "INSERT INTO bus_location (bus_line, latitude, longitude, timestamp_location) "
+            "VALUES (%s, -8.06, -34.87, %s) RETURNING id",
+            (line, datetime.now()), fetch=True
+        )
+        assert rows and rows[0]['id']
+
+        # Escrita: só EXPLAIN, o INSERT não é executado de novo
+        capture = stats.recent_captures(1)[0]
+        assert capture['error'] is None and not capture['analyzed']
+        assert 'Insert on bus_location' in capture['plan'] and 'actual time' not in capture['plan']
+
+        count = db.execute_query("SELECT COUNT(*) AS n FROM bus_location WHERE bus_line = %s", (line,), fetch=True)
+        assert count[0]['n'] == 1
+
+        # Leitura: EXPLAIN ANALYZE com buffers
+        capture = stats.recent_captures(1)[0]
+        assert capture['analyzed'] and 'actual time' in capture['plan'] and 'Buffers' in capture['plan']
+
+        assert db.execute_query("SELECT * FROM tabela_inexistente", fetch=True) is None
+        failed = [q for q in stats.top(10) if 'tabela_inexistente' in q['query']]
+        assert failed[0]['errors'] == 1
+    finally:
+        db.execute_query("DELETE FROM bus_location WHERE bus_line = %s", (line,))
+        db.close()
+
+def test_queries_endpoint(stats):
+    stats.record("SELECT * FROM bus_location WHERE id = 1", 0.3)
+    stats.add_capture("SELECT * FROM bus_location WHERE id = 1", 0.3, plan="Seq Scan on bus_location")
+    app = Flask(__name__)
+    app.register_blueprint(dashboard_api.dashboard_bp, url_prefix='/api/dashboard')
+    client = app.test_client()
+
+    body = client.get('/api/dashboard/queries?top=5&order=p95_ms').get_json()
+    assert body['queries'][0]['query'] == "SELECT * FROM bus_location WHERE id = ?"
+    assert body['slow_captures'][0]['plan'] == "Seq Scan on bus_location"
+    assert body['status']['statements'] == 1
+
+    for i in range(3):
+        stats.add_capture(f"SELECT {i}", 0.3, plan="Result")
+    body = client.get('/api/dashboard/queries?top=0').get_json()
+    assert len(body['queries']) == 1 and len(body['slow_captures']) == 1
+
+    assert client.get('/api/dashboard/queries?order=nome').status_code == 400
+    assert client.get('/api/dashboard/queries?top=x').status_code == 400
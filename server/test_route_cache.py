@@ -0,0 +1,115 @@
+"""
+Testes do cache de rotas do OSRM (api/route_cache.py)
+
+Uso:
+    python -m pytest test_route_cache.py -v
+
+O OSRM é substituído por uma resposta fixa (Session.get); não usam rede
+nem banco.
+"""
+
+import pytest
+import requests
+
+from api.eta_osrm import OSRMETA
+from api.route_cache import RouteCache
+from api.trajectory import METERS_PER_DEGREE
+from api.utils import calculate_distance_km
+
+# Terminal Central -> Aeroporto
+START = (-8.0630, -34.8710)
+END = (-8.1264, -34.9176)
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+@pytest.fixture
+def osrm_calls(monkeypatch):
+    """Conta as requisições ao OSRM; cada rota tem 12 km e 20 minutos."""
+    calls = []
+
+    def fake_get(session, url, params=None, timeout=None):
+        calls.append(url)
+        if 'erro' in url:
+            return _FakeResponse({'code': 'NoRoute', 'message': 'sem rota'})
+        return _FakeResponse({'code': 'Ok', 'routes': [{'distance': 12000.0, 'duration': 1200.0}]})
+
+    monkeypatch.setattr(requests.Session, 'get', fake_get)
+    return calls
+
+def _north(meters: float) -> float:
+    return meters / METERS_PER_DEGREE
+
+# ============================================================
+#                          CACHE
+# ============================================================
+
+def test_same_cell_hits_and_saves_requests(osrm_calls):
+    osrm = OSRMETA(osrm_server='http://osrm', cache=RouteCache(cell_meters=100, interpolate=False))
+    first = osrm.get_route_info(*START, *END, destination_id='aeroporto')
+    assert first['status'] == 'success' and 'cache' not in first
+
+    # Poucos metros depois, mesma célula: sem requisição nova
+    second = osrm.get_route_info(START[0] + _north(3), START[1], *END, destination_id='aeroporto')
+    assert second['cache'] == 'hit'
+    assert second['duration_seconds'] == 1200.0
+    assert len(osrm_calls) == 1
+
+    # Outro destino é outra rota
+    osrm.get_route_info(*START, -8.0476, -34.8770, destination_id='shopping_recife')
+    assert len(osrm_calls) == 2
+
+    status = osrm.cache.get_status()
+    assert status['hits'] == 1 and status['misses'] == 2
+    assert status['hit_ratio'] == pytest.approx(1 / 3, abs=1e-3)
+    assert status['saved_seconds'] >= 0 and status['avg_request_ms'] is not None
+
+def test_interpolation_scales_by_remaining_distance(osrm_calls):
+    cache = RouteCache(cell_meters=100, interpolate=True)
+    osrm = OSRMETA(osrm_server='http://osrm', cache=cache)
+    osrm.get_route_info(*START, *END, destination_id='aeroporto')
+
+    # 100 m mais perto da parada: célula vizinha, rota guardada ajustada
+    lat, lon = START[0] + (END[0] - START[0]) * 0.0125, START[1] + (END[1] - START[1]) * 0.0125
+    assert cache.cell(lat, lon) != cache.cell(*START)
+    route = osrm.get_route_info(lat, lon, *END, destination_id='aeroporto')
+    assert route['cache'] == 'interpolated'
+    ratio = calculate_distance_km(lat, lon, *END) / calculate_distance_km(*START, *END)
+    assert route['distance_meters'] == pytest.approx(12000.0 * ratio)
+    assert route['duration_seconds'] == pytest.approx(1200.0 * ratio)
+    assert len(osrm_calls) == 1
+
+    # Longe (várias células): requisição nova
+    osrm.get_route_info(START[0] + _north(500), START[1], *END, destination_id='aeroporto')
+    assert len(osrm_calls) == 2
+
+def test_ttl_eviction_and_errors(osrm_calls):
+    expired = OSRMETA(osrm_server='http://osrm', cache=RouteCache(ttl_seconds=0))
+    expired.get_route_info(*START, *END)
+    expired.get_route_info(*START, *END)
+    assert len(osrm_calls) == 2
+
+    cache = RouteCache(max_entries=2, interpolate=False)
+    for i in range(3):
+        cache.put(START[0] + _north(1000 * i), START[1], END, 'aeroporto', 'driving', 1000.0, 60.0, 0.05)
+    assert cache.get_status()['entries'] == 2 and cache.get_status()['evictions'] == 1
+    assert cache.get(*START, 'aeroporto', 'driving') is None
+
+    # Erros do OSRM não são guardados
+    failing = OSRMETA(osrm_server='http://erro', cache=RouteCache())
+    assert failing.get_route_info(*START, *END)['status'] == 'error'
+    assert failing.get_route_info(*START, *END)['status'] == 'error'
+    assert failing.cache.get_status()['entries'] == 0
+
+def test_eta_reports_cache_use(osrm_calls):
+    osrm = OSRMETA(osrm_server='http://osrm', cache=RouteCache())
+    assert osrm.get_eta_with_traffic_factor(*START, *END, 1.2, 'aeroporto')['route_cache'] == 'miss'
+    eta = osrm.get_eta_with_traffic_factor(*START, *END, 1.2, 'aeroporto')
+    assert eta['route_cache'] == 'hit'
+    assert eta['eta_minutes'] == 24.0 and eta['distance_km'] == 12.0
@@ -0,0 +1,204 @@
+"""
+Testes do ETA pelo itinerário da linha (api/route_engine.py)
+
+Uso:
+    python -m pytest test_route_engine.py -v
+
+Traçados sintéticos (em metros a partir de um ponto de Recife) e o
+itinerário da L1 em data/routes; não usam banco nem rede.
+"""
+
+import json
+import os
+
+import pytest
+from flask import Flask
+
+from api import route_engine, simple_location_api
+from api.route_engine import (DirectionTracker, LineRoute, RouteEngine, estimate_route_eta, get_route_engine,
+                              rebuild_route_engine)
+from api.trajectory import METERS_PER_DEGREE
+from api.utils import calculate_distance_km
+
+LAT, LON = -8.0630, -34.8710
+X_SCALE = METERS_PER_DEGREE * 0.99
+SPEED_KMH = 36.0  # 10 m/s
+
+def _point(east_m: float, north_m: float):
+    return (LAT + north_m / METERS_PER_DEGREE, LON + east_m / X_SCALE)
+
+def _stop(stop_id: str, east_m: float, north_m: float = 0.0, **extra):
+    lat, lon = _point(east_m, north_m)
+    return {'id': stop_id, 'name': stop_id.upper(), 'latitude': lat, 'longitude': lon, **extra}
+
+@pytest.fixture(autouse=True)
+def restore_engine():
+    yield
+    rebuild_route_engine()
+
+# ============================================================
+#                    PROJEÇÃO E TEMPOS
+# ============================================================
+
+def test_straight_route_etas():
+    route = LineRoute('T1', [_point(0, 0), _point(3000, 0)],
+                      [_stop('a', 0), _stop('b', 1000), _stop('c', 3000)],
+                      speed_kmh=SPEED_KMH, dwell_seconds=0)
+    result = route.etas(*_point(500, 30))
+    assert result['along_m'] == pytest.approx(500, abs=5)
+    assert result['offset_m'] == pytest.approx(30, abs=1)
+    assert [s['id'] for s in result['stops']] == ['b', 'c']
+    assert result['stops'][0]['eta_minutes'] == pytest.approx(50 / 60, abs=0.05)
+    assert result['stops'][1]['eta_minutes'] == pytest.approx(250 / 60, abs=0.05)
+    assert result['stops'][1]['distance_km'] == pytest.approx(2.5, abs=0.01)
+
+def test_timetable_and_dwell():
+    # 600 s até b (em vez de 100 s a 10 m/s), 30 s parado em b
+    route = LineRoute('T1', [_point(0, 0), _point(3000, 0)],
+                      [_stop('a', 0), _stop('b', 1000, travel_seconds=600), _stop('c', 3000)],
+                      speed_kmh=SPEED_KMH, dwell_seconds=30)
+    assert route.arrival.tolist() == pytest.approx([0, 600, 830], abs=1)
+    # Metade do caminho até b: metade do tempo tabelado
+    assert route.etas(*_point(500, 0))['stops'][0]['eta_minutes'] == pytest.approx(5.0, abs=0.05)
+    # Logo depois de b: sem a parada em b
+    assert route.etas(*_point(1100, 0))['stops'][0]['eta_minutes'] == pytest.approx(190 / 60, abs=0.05)
+
+def test_winding_route_beats_straight_line():
+    # Zigue-zague: 6 idas e voltas de 1 km entre a e b, a 600 m em linha reta
+    shape = [_point(0, 0)]
+    for i in range(6):
+        shape.append(_point(1000 if i % 2 == 0 else 0, 100 * i))
+        shape.append(_point(1000 if i % 2 == 0 else 0, 100 * (i + 1)))
+    end = shape[-1]
+    route = LineRoute('T2', shape, [_stop('a', 0), {'id': 'b', 'latitude': end[0], 'longitude': end[1]}],
+                      speed_kmh=SPEED_KMH, dwell_seconds=0)
+
+    eta = route.etas(*_point(0, 0))['stops'][0]
+    assert eta['distance_km'] == pytest.approx(6.6, abs=0.01)
+    assert eta['eta_minutes'] == pytest.approx(660 / 60, abs=0.05)
+    straight_km = calculate_distance_km(LAT, LON, *end)
+    assert straight_km < 0.7  # a linha reta veria ~1/10 do trajeto
+
+def test_off_route_end_and_loops():
+    route = LineRoute('T1', [_point(0, 0), _point(3000, 0)],
+                      [_stop('a', 0), _stop('b', 3000)], speed_kmh=SPEED_KMH)
+    assert route.etas(*_point(1000, 500)) is None
+    assert route.etas(*_point(3000, 0))['stops'] == []
+    # Antes da primeira parada: tempo até ela somado
+    before = LineRoute('T1', [_point(-500, 0), _point(3000, 0)],
+                       [_stop('a', 0), _stop('b', 3000)], speed_kmh=SPEED_KMH, dwell_seconds=0)
+    assert [s['eta_minutes'] for s in before.etas(*_point(-500, 0))['stops']] == \
+        pytest.approx([50 / 60, 350 / 60], abs=0.05)
+
+    # Circular: a última parada é ao lado da primeira, mas fica no fim do traçado
+    loop = LineRoute('C1', [_point(0, 0), _point(1000, 0), _point(1000, 1000), _point(0, 1000), _point(0, 20)],
+                     [_stop('ini', 0), _stop('meio', 1000, 1000), _stop('fim', 0, 20)],
+                     speed_kmh=SPEED_KMH)
+    assert loop.stop_along.tolist() == pytest.approx([0, 2000, 3980], abs=1)
+
+# ============================================================
+#                   IDA E VOLTA (SENTIDOS)
+# ============================================================
+
+def _two_way_engine():
+    """Ida pela rua y=0; a volta usa a mesma rua até x=2000 e depois a paralela y=500."""
+    outbound = LineRoute('T9', [_point(0, 0), _point(3000, 0)],
+                         [_stop('a', 0), _stop('b', 1500), _stop('c', 3000)],
+                         speed_kmh=SPEED_KMH, dwell_seconds=0, direction=0)
+    inbound = LineRoute('T9', [_point(3000, 0), _point(2000, 0), _point(2000, 500), _point(0, 500)],
+                        [_stop('c', 3000), _stop('d', 2000, 500), _stop('e', 0, 500)],
+                        speed_kmh=SPEED_KMH, dwell_seconds=0, direction=1)
+    return RouteEngine({'T9': [outbound, inbound]}, tracker=DirectionTracker(min_move_meters=30))
+
+def test_direction_by_nearby_shape():
+    engine = _two_way_engine()
+    assert engine.get('T9').direction == 0 and engine.get('T9', 1).key == 'T9:1'
+    assert engine.etas('T9', *_point(1000, 0))['direction'] == 0
+    assert engine.etas('T9', *_point(1000, 500))['direction'] == 1
+    # Trecho comum sem leitura anterior do ônibus: ambíguo
+    assert engine.etas('T9', *_point(2500, 0)) is None
+    assert engine.etas('T9', *_point(2500, 0), bus_key='device:1') is None
+
+def test_direction_by_progress_on_shared_street():
+    engine = _two_way_engine()
+    # Indo para oeste no trecho comum: volta (along cresce no sentido 1)
+    engine.etas('T9', *_point(2600, 0), bus_key='device:1')
+    result = engine.etas('T9', *_point(2500, 0), bus_key='device:1')
+    assert result['direction'] == 1 and [s['id'] for s in result['stops']] == ['d', 'e']
+    # Parado: mantém o sentido
+    assert engine.etas('T9', *_point(2495, 0), bus_key='device:1')['direction'] == 1
+
+    # Outro ônibus, vindo da ida fora do trecho comum, segue na ida
+    engine.etas('T9', *_point(1900, 0), bus_key='device:2')
+    result = engine.etas('T9', *_point(2100, 0), bus_key='device:2')
+    assert result['direction'] == 0 and [s['id'] for s in result['stops']] == ['c']
+
+def test_direction_tracker_forgets_idle_buses():
+    tracker = DirectionTracker(min_move_meters=30, memory_seconds=60)
+    assert tracker.choose('device:1', 'T9', {0: 100.0, 1: 900.0}, now=0) is None
+    assert tracker.choose('device:1', 'T9', {0: 150.0, 1: 850.0}, now=10) == 0
+    # Avanço menor que min_move_meters: referência mantida, avanços pequenos se somam
+    assert tracker.choose('device:1', 'T9', {0: 170.0, 1: 830.0}, now=20) == 0
+    assert tracker.choose('device:1', 'T9', {0: 140.0, 1: 860.0}, now=30) == 0
+    assert tracker.choose('device:1', 'T9', {0: 120.0, 1: 880.0}, now=40) == 1
+    assert tracker.choose('device:2', 'T9', {0: 100.0, 1: 900.0}, now=200) is None
+    assert len(tracker) == 1
+
+# ============================================================
+#                  ARQUIVOS E RECEPÇÃO
+# ============================================================
+
+def test_loads_directory_and_reloads(tmp_path, monkeypatch):
+    monkeypatch.setitem(route_engine.ROUTE_ENGINE_CONFIG, 'routes_dir', str(tmp_path))
+    monkeypatch.setitem(route_engine.ROUTE_ENGINE_CONFIG, 'reload_check_seconds', 0)
+    line = {'line': 'T1', 'speed_kmh': SPEED_KMH, 'shape': [_point(0, 0), _point(3000, 0)],
+            'stops': [_stop('a', 0), _stop('b', 3000)]}
+    (tmp_path / 'T1.json').write_text(json.dumps(line))
+    (tmp_path / 'quebrado.json').write_text('{"shape": []}')
+
+    engine = rebuild_route_engine()
+    assert list(engine.lines) == ['T1']
+    assert engine.etas('T9', *_point(0, 0)) is None
+
+    line['stops'].insert(1, _stop('novo', 1500))
+    (tmp_path / 'T1.json').write_text(json.dumps(line))
+    os.utime(tmp_path / 'T1.json', (1, 1))
+    reloaded = get_route_engine()
+    assert reloaded is not engine
+    assert [s['id'] for s in reloaded.etas('T1', *_point(0, 0))['stops']] == ['novo', 'b']
+
+def test_location_endpoints_use_itinerary():
+    rebuild_route_engine()
+    route = get_route_engine().get('L1')
+    assert route is not None and [s['id'] for s in route.stops][-1] == 'aeroporto'
+
+    # Entre o Terminal Central e o Shopping Recife, sobre o traçado
+    estimate = estimate_route_eta('L1', -8.0561, -34.8731)
+    assert estimate['destination']['id'] == 'shopping_recife'
+    assert estimate['eta']['source'] == 'route_engine'
+    assert [s['id'] for s in estimate['downstream_stops']] == ['shopping_recife', 'boa_viagem', 'aeroporto']
+    assert estimate_route_eta('L2', -8.0561, -34.8731) is None
+
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    client = app.test_client()
+    body = client.get('/api/location/route/L1/eta?latitude=-8.0561&longitude=-34.8731').get_json()
+    assert body['on_route'] and len(body['stops']) == 3
+    assert body['stops'][0]['eta_minutes'] < body['stops'][1]['eta_minutes'] < body['stops'][2]['eta_minutes']
+    assert not client.get('/api/location/route/L1/eta?latitude=-8.0&longitude=-34.0').get_json()['on_route']
+    assert client.get('/api/location/route/L9/eta?latitude=-8.05&longitude=-34.87').status_code == 404
+    assert client.get('/api/location/route/L1/eta?latitude=-8.05').status_code == 400
+
+def test_route_eta_endpoint_direction(monkeypatch):
+    engine = _two_way_engine()
+    monkeypatch.setattr(simple_location_api, 'get_route_engine', lambda: engine)
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    client = app.test_client()
+
+    lat, lon = _point(2500, 0)
+    body = client.get(f'/api/location/route/T9/eta?latitude={lat}&longitude={lon}').get_json()
+    assert not body['on_route'] and body['stops'] == []
+    body = client.get(f'/api/location/route/T9/eta?latitude={lat}&longitude={lon}&direction=1').get_json()
+    assert body['on_route'] and body['direction_id'] == 1 and body['stops'][0]['id'] == 'd'
+    assert client.get(f'/api/location/route/T9/eta?latitude={lat}&longitude={lon}&direction=5').status_code == 404
@@ -0,0 +1,153 @@
+"""
+Testes das velocidades aprendidas por trecho (ml/segment_speeds.py)
+
+Uso:
+    python -m pytest test_segment_speeds.py -v
+
+Traçado sintético em linha reta (paradas a 0, 1000 e 3000 m); o arquivo
+.npz fica em tmp_path.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from api import route_engine
+from api.route_engine import LineRoute, RouteEngine
+from api.trajectory import METERS_PER_DEGREE
+from config_simple import SEGMENT_SPEED_CONFIG
+from ml import segment_speeds
+from ml.segment_speeds import SegmentSpeedEstimator
+
+LAT, LON = -8.0630, -34.8710
+MONDAY_8H = datetime(2026, 10, 19, 8, 0, 0)
+
+def _point(east_m: float):
+    return (LAT, LON + east_m / (METERS_PER_DEGREE * 0.99))
+
+def _route():
+    stops = [{'id': stop_id, 'latitude': _point(east)[0], 'longitude': _point(east)[1]}
+             for stop_id, east in [('a', 0), ('b', 1000), ('c', 3000)]]
+    return LineRoute('T1', [_point(0), _point(3000)], stops, speed_kmh=36.0, dwell_seconds=0)
+
+def _drive(estimator, route, bus_key, start, points):
+    """points: [(segundos desde start, distância ao longo do traçado)]."""
+    return [estimator.observe(bus_key, route, along, start + timedelta(seconds=seconds))
+            for seconds, along in points]
+
+@pytest.fixture
+def estimator(tmp_path, monkeypatch):
+    fresh = SegmentSpeedEstimator(str(tmp_path / 'segment_speeds.npz'))
+    monkeypatch.setattr(segment_speeds, 'segment_speed_estimator', fresh)
+    monkeypatch.setattr(segment_speeds, '_loaded', True)
+    return fresh
+
+def test_weighted_mean_per_segment_and_bucket(estimator):
+    route = _route()
+    # 100 m a cada 20 s = 18 km/h no trecho a-b
+    observed = _drive(estimator, route, 'bus1', MONDAY_8H, [(0, 100), (20, 200), (40, 300)])
+    assert observed == [False, True, True]
+    cell = estimator.segment_speed('T1', 0, 0, 8)
+    assert cell['mean_kmh'] == pytest.approx(18.0) and cell['std_kmh'] == pytest.approx(0.0)
+    assert cell['count'] == 2
+    assert estimator.segment_speed('T1', 0, 0, 9) is None
+
+    # Mais rápido: média ponderada das três observações (18, 18, 36)
+    _drive(estimator, route, 'bus1', MONDAY_8H, [(50, 400)])  # 36 km/h
+    cell = estimator.segment_speed('T1', 0, 0, 8)
+    assert cell['mean_kmh'] == pytest.approx(24.0)
+    assert cell['std_kmh'] == pytest.approx(np.sqrt(72.0))
+
+    # Observação que cruza a parada b conta nos dois trechos
+    _drive(estimator, route, 'bus1', MONDAY_8H, [(80, 700), (120, 1300)])
+    assert estimator.segment_speed('T1', 1, 0, 8)['mean_kmh'] == pytest.approx(54.0)
+
+def test_stationary_gaps_backtracking_and_outliers(estimator):
+    route = _route()
+    # Parado 60 s e depois 200 m em 20 s: 200 m em 80 s = 9 km/h
+    observed = _drive(estimator, route, 'bus1', MONDAY_8H,
+                      [(0, 100), (30, 105), (60, 110), (80, 300)])
+    assert observed == [False, False, False, True]
+    assert estimator.segment_speed('T1', 0, 0, 8)['mean_kmh'] == pytest.approx(9.0)
+
+    # Intervalo longo, ré e salto de GPS não viram observação
+    assert not _drive(estimator, route, 'bus1', MONDAY_8H, [(1000, 500)])[0]
+    assert not _drive(estimator, route, 'bus1', MONDAY_8H, [(1020, 400)])[0]
+    assert not _drive(estimator, route, 'bus1', MONDAY_8H, [(1030, 900)])[0]  # 180 km/h
+    assert estimator.discarded == 1
+    assert estimator.segment_speed('T1', 0, 0, 8)['count'] == 1
+
+    # Sem identificador do ônibus não há observação
+    assert not _drive(estimator, route, None, MONDAY_8H, [(2000, 100), (2020, 300)])[1]
+    assert not route_engine.observe_route_fix(None, 'T1', 300, MONDAY_8H)
+    assert None not in estimator._anchors
+
+def test_learned_speeds_change_route_etas(estimator, monkeypatch):
+    route = _route()
+    engine = RouteEngine({'T1': route})
+    monkeypatch.setattr(route_engine, 'get_route_engine', lambda: engine)
+    baseline = engine.etas('T1', *_point(0), traffic_factor=1.5)
+    # Sem velocidades aprendidas: tabela vezes o fator (100 s e 300 s a 10 m/s)
+    assert [s['eta_minutes'] for s in baseline['stops']] == pytest.approx([150 / 60, 450 / 60], abs=0.05)
+    assert baseline['learned_segments'] == 0
+
+    # Trecho a-b a 18 km/h (min_samples observações na hora atual)
+    start = datetime.now().replace(minute=30, second=0, microsecond=0)
+    points = [(20 * i, 100 * (i + 1)) for i in range(SEGMENT_SPEED_CONFIG['min_samples'] + 1)]
+    for seconds, along in points:
+        route_engine.observe_route_fix('bus1', 'T1', along, start + timedelta(seconds=seconds))
+    result = engine.etas('T1', *_point(0), traffic_factor=1.5)
+    assert result['learned_segments'] == 1
+    # a-b: 1000 m a 5 m/s; b-c segue a tabela com o fator
+    assert [s['eta_minutes'] for s in result['stops']] == pytest.approx([200 / 60, 500 / 60], abs=0.05)
+
+    # Itinerário com outras paradas: velocidades da versão anterior não valem
+    assert estimator.line_speeds('T1', ('a', 'c'), start.weekday(), start.hour) is None
+
+def test_persist_merges_workers(tmp_path):
+    path = str(tmp_path / 'segment_speeds.npz')
+    route = _route()
+    first, second = SegmentSpeedEstimator(path), SegmentSpeedEstimator(path)
+    _drive(first, route, 'bus1', MONDAY_8H, [(0, 100), (20, 200)])
+    _drive(second, route, 'bus2', MONDAY_8H, [(0, 1100), (20, 1300)])
+    assert first.persist() and second.persist()
+
+    # A segunda gravação soma ao disco; gravar de novo não duplica
+    assert first.persist()
+    reloaded = SegmentSpeedEstimator(path)
+    assert reloaded.load() == 1
+    assert reloaded.segment_speed('T1', 0, 0, 8)['count'] == 1
+    assert reloaded.segment_speed('T1', 1, 0, 8)['mean_kmh'] == pytest.approx(36.0)
+
+    # Nova observação de um worker que já gravou entra como diferença
+    _drive(second, route, 'bus2', MONDAY_8H, [(40, 1500)])
+    assert second.persist()
+    reloaded.load()
+    assert reloaded.segment_speed('T1', 1, 0, 8)['count'] == 2
+    assert np.isnan(reloaded.line_speeds('T1', route.stop_ids, 0, 8)).all()
+
+def test_persist_merges_workers_on_same_cell(tmp_path):
+    path = str(tmp_path / 'segment_speeds.npz')
+    route = _route()
+    first, second = SegmentSpeedEstimator(path), SegmentSpeedEstimator(path)
+    # Mesmo trecho, dia e hora: 18 km/h no primeiro worker, 36 km/h no segundo
+    _drive(first, route, 'bus1', MONDAY_8H, [(0, 100), (20, 200)])
+    _drive(second, route, 'bus2', MONDAY_8H, [(0, 100), (10, 200)])
+    assert first.persist() and second.persist() and first.persist()
+
+    reloaded = SegmentSpeedEstimator(path)
+    reloaded.load()
+    cell = reloaded.segment_speed('T1', 0, 0, 8)
+    assert cell['count'] == 2
+    assert cell['mean_kmh'] == pytest.approx(27.0) and cell['std_kmh'] == pytest.approx(9.0)
+
+    # Mais uma rodada nos dois: cada observação entra uma vez só
+    _drive(first, route, 'bus1', MONDAY_8H, [(40, 300)])    # 18 km/h
+    _drive(second, route, 'bus2', MONDAY_8H, [(20, 300)])   # 36 km/h
+    assert second.persist() and first.persist() and second.persist()
+    reloaded.load()
+    cell = reloaded.segment_speed('T1', 0, 0, 8)
+    assert cell['count'] == 4
+    assert cell['mean_kmh'] == pytest.approx(27.0) and cell['std_kmh'] == pytest.approx(9.0)
+    assert first.segment_speed('T1', 0, 0, 8) == second.segment_speed('T1', 0, 0, 8)
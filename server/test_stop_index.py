@@ -0,0 +1,135 @@
+"""
+Testes do índice espacial de paradas (api/stop_index.py)
+
+Uso:
+    python -m pytest test_stop_index.py -v
+
+Catálogos sintéticos em volta de Recife, comparados com a busca linear por
+Haversine; não usam banco.
+"""
+
+import os
+import random
+import time
+
+import pytest
+from flask import Flask
+
+from api import simple_location_api, stop_index
+from api.stop_index import StopIndex, get_stop_index, rebuild_stop_index
+from api.utils import calculate_distance_km, get_nearest_destination
+from config_simple import DESTINATIONS
+
+LAT, LON = -8.0630, -34.8710
+
+def _catalogue(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    return {
+        f"s{i}": {'name': f"Parada {i}", 'latitude': LAT + rng.uniform(-0.15, 0.15),
+                  'longitude': LON + rng.uniform(-0.15, 0.15), 'type': 'parada'}
+        for i in range(n)
+    }
+
+def _brute_force(stops, latitude, longitude):
+    return sorted(stops, key=lambda s: calculate_distance_km(
+        latitude, longitude, stops[s]['latitude'], stops[s]['longitude']))
+
+def _queries(n: int, seed: int = 11):
+    rng = random.Random(seed)
+    return [(LAT + rng.uniform(-0.2, 0.2), LON + rng.uniform(-0.2, 0.2)) for _ in range(n)]
+
+@pytest.fixture(scope='module')
+def stops():
+    return _catalogue(5000)
+
+@pytest.fixture(scope='module')
+def index(stops):
+    return StopIndex(stops, cell_meters=500)
+
+# ============================================================
+#                         CONSULTAS
+# ============================================================
+
+def test_nearest_matches_brute_force(stops, index):
+    for latitude, longitude in _queries(200):
+        expected = _brute_force(stops, latitude, longitude)[:5]
+        assert [s['id'] for s in index.nearest(latitude, longitude, k=5)] == expected
+
+def test_within_radius_matches_brute_force(stops, index):
+    for latitude, longitude in _queries(50):
+        expected = {s for s in stops if calculate_distance_km(
+            latitude, longitude, stops[s]['latitude'], stops[s]['longitude']) <= 0.8}
+        found = index.within(latitude, longitude, 800)
+        # Projeção equiretangular: diferença de centímetros na borda do raio
+        assert len({s['id'] for s in found} ^ expected) <= 1
+        assert [s['distance_km'] for s in found] == sorted(s['distance_km'] for s in found)
+
+def test_far_point_and_limits(index):
+    # Ponto a centenas de km do catálogo: cai na varredura das células restantes
+    far = index.nearest(-3.7, -38.5, k=2)
+    assert len(far) == 2 and far[0]['distance_km'] > 500
+    assert index.nearest(-3.7, -38.5, k=2, max_distance_m=1000) == []
+    assert StopIndex({}).nearest(LAT, LON) == []
+    assert index.within(LAT, LON, 300, limit=3) == index.within(LAT, LON, 300)[:3]
+
+def test_queries_are_sub_millisecond(index):
+    queries = _queries(2000)
+    started = time.perf_counter()
+    for latitude, longitude in queries:
+        index.nearest(latitude, longitude, k=3)
+        index.within(latitude, longitude, 500)
+    per_query_ms = (time.perf_counter() - started) * 1000 / (2 * len(queries))
+    assert per_query_ms < 1.0
+
+# ============================================================
+#                  CATÁLOGO E RECONSTRUÇÃO
+# ============================================================
+
+def test_nearest_destination_uses_catalogue():
+    rebuild_stop_index(dict(DESTINATIONS))
+    nearest = get_nearest_destination(-8.05, -34.88)
+    assert nearest['id'] == 'shopping_recife' and nearest['distance_km'] == 0.42
+    # Dicionário próprio: índice só para ele
+    assert get_nearest_destination(-8.05, -34.88, {'x': DESTINATIONS['aeroporto']})['id'] == 'x'
+
+def test_index_rebuilt_when_stops_file_changes(tmp_path, monkeypatch):
+    stops_file = tmp_path / 'stops.txt'
+    stops_file.write_text("stop_id,stop_name,stop_lat,stop_lon,location_type\n"
+                          "P1,Parada Derby,-8.0571,-34.8990,0\n")
+    monkeypatch.setitem(stop_index.STOP_INDEX_CONFIG, 'stops_file', str(stops_file))
+    monkeypatch.setitem(stop_index.STOP_INDEX_CONFIG, 'reload_check_seconds', 0)
+
+    first = get_stop_index()
+    assert len(first) == len(DESTINATIONS) + 1
+    assert first.nearest(-8.0571, -34.8990)[0]['id'] == 'P1'
+
+    stops_file.write_text("stop_id,stop_name,stop_lat,stop_lon,location_type\n"
+                          "P2,Estação Joana Bezerra,-8.0883,-34.8919,1\n")
+    mtime = os.path.getmtime(stops_file) + 10
+    os.utime(stops_file, (mtime, mtime))
+
+    second = get_stop_index()
+    assert second is not first
+    assert second.nearest(-8.0571, -34.8990)[0]['id'] != 'P1'
+    assert second.nearest(-8.0883, -34.8919)[0] == pytest.approx({
+        'id': 'P2', 'name': 'Estação Joana Bezerra', 'latitude': -8.0883,
+        'longitude': -34.8919, 'type': 'terminal', 'distance_km': 0.0
+    })
+    # O índice antigo continua respondendo com o catálogo dele
+    assert first.nearest(-8.0571, -34.8990)[0]['id'] == 'P1'
+    rebuild_stop_index(dict(DESTINATIONS))
+
+def test_nearby_stops_endpoint():
+    rebuild_stop_index(dict(DESTINATIONS))
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    client = app.test_client()
+
+    body = client.get('/api/location/stops/nearby?latitude=-8.05&longitude=-34.88&k=2').get_json()
+    assert [s['id'] for s in body['stops']] == ['shopping_recife', 'terminal_central']
+
+    body = client.get('/api/location/stops/nearby?latitude=-8.05&longitude=-34.88&radius_m=1000').get_json()
+    assert [s['id'] for s in body['stops']] == ['shopping_recife']
+
+    assert client.get('/api/location/stops/nearby?latitude=-8.05').status_code == 400
+    assert client.get('/api/location/stops/nearby?latitude=-8.05&longitude=-34.88&k=0').status_code == 400
@@ -0,0 +1,165 @@
+"""
+Testes da compressão de trajetória na ingestão (api/trajectory.py)
+
+Uso:
+    python -m pytest test_trajectory.py -v
+
+Trajetórias sintéticas em Recife, uma leitura a cada 10 s; não usam banco.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from api import simple_location_api, trajectory
+from api.trajectory import (TrajectoryCompressor, METERS_PER_DEGREE, bus_key_for, device_id_from_key,
+                            merge_latest_positions)
+
+LAT, LON = -8.0630, -34.8710
+T0 = 1_700_000_000.0
+
+def _east(meters: float) -> float:
+    """Graus de longitude equivalentes a 'meters' para leste em LAT."""
+    return meters / (METERS_PER_DEGREE * math.cos(math.radians(LAT)))
+
+def _north(meters: float) -> float:
+    return meters / METERS_PER_DEGREE
+
+def _feed(compressor, points, bus_key='bus-1', bus_line='L1'):
+    """Envia (lat, lon, t) e retorna os índices dos pontos gravados."""
+    return [i for i, (lat, lon, t) in enumerate(points)
+            if compressor.offer(bus_key, bus_line, lat, lon, now=t)]
+
+@pytest.fixture
+def compressor():
+    return TrajectoryCompressor(deadband_meters=10, tolerance_meters=25, max_interval_seconds=120)
+
+# ============================================================
+#                       COMPRESSÃO
+# ============================================================
+
+def test_parked_bus_keeps_one_point_per_interval(compressor):
+    # 5 minutos parado, com ruído de GPS de até 4 m
+    jitter = [(0, 0), (3, 1), (-2, 2), (1, -4), (2, 2)]
+    points = [(LAT + _north(jitter[i % 5][1]), LON + _east(jitter[i % 5][0]), T0 + i * 10)
+              for i in range(31)]
+    assert _feed(compressor, points) == [0, 12, 24]
+
+def test_constant_speed_straight_line_is_dropped(compressor):
+    # 10 m/s para leste: depois de dois pontos, a extrapolação prevê os demais
+    points = [(LAT, LON + _east(100 * i), T0 + i * 10) for i in range(12)]
+    assert _feed(compressor, points) == [0, 1]
+
+def test_turn_is_persisted(compressor):
+    straight = [(LAT, LON + _east(100 * i), T0 + i * 10) for i in range(5)]
+    corner_lon = straight[-1][1]
+    turned = [(LAT + _north(100 * i), corner_lon, T0 + (4 + i) * 10) for i in range(1, 4)]
+    persisted = _feed(compressor, straight + turned)
+    assert 5 in persisted                   # primeiro ponto depois da curva
+    assert len(persisted) < len(straight + turned)
+
+def test_tolerance_per_line():
+    compressor = TrajectoryCompressor(tolerance_meters=5, lines={'BRT-1': {'tolerance_meters': 100}})
+    # Desvio lateral de 30 m a cada ponto, avançando 100 m
+    points = [(LAT + _north(30 * (i % 2)), LON + _east(100 * i), T0 + i * 10) for i in range(10)]
+    strict = _feed(compressor, points, 'a', 'L1')
+    loose = _feed(compressor, points, 'b', 'BRT-1')
+    assert len(loose) < len(strict)
+
+    status = compressor.get_status()
+    assert status['by_line']['L1']['received'] == 10
+    assert status['by_line']['BRT-1']['compression_ratio'] > status['by_line']['L1']['compression_ratio']
+    assert status['points_dropped'] == 20 - len(strict) - len(loose)
+
+def test_forced_point_becomes_anchor(compressor):
+    compressor.offer('bus-1', 'L1', LAT, LON, now=T0)
+    assert compressor.offer('bus-1', 'L1', LAT, LON, force=True, now=T0 + 10)
+    assert not compressor.offer('bus-1', 'L1', LAT, LON, now=T0 + 20)
+
+def test_state_is_bounded():
+    compressor = TrajectoryCompressor(max_tracked_buses=2)
+    for key in ('a', 'b', 'c'):
+        compressor.offer(key, 'L1', LAT, LON)
+    assert compressor.get_status()['tracked_buses'] == 2
+    # 'a' saiu: volta a ser o primeiro ponto e é gravado
+    assert compressor.offer('a', 'L1', LAT, LON)
+
+# ============================================================
+#                  POSIÇÃO MAIS RECENTE
+# ============================================================
+
+def test_dropped_point_updates_latest_position(compressor, monkeypatch):
+    compressor.offer('bus-1', 'L1', LAT, LON)
+    compressor.set_location_id('bus-1', 42)
+    compressor.offer('bus-1', 'L1', LAT + _north(3), LON)
+
+    latest = compressor.latest_positions('L1')
+    assert len(latest) == 1
+    assert latest[0]['id'] == 42 and latest[0]['compressed']
+    assert latest[0]['latitude'] == pytest.approx(LAT + _north(3))
+
+    monkeypatch.setattr(trajectory, 'trajectory_compressor', compressor)
+    stored = [{'id': 42, 'bus_line': 'L1', 'latitude': LAT, 'longitude': LON,
+               'timestamp_location': datetime.now() - timedelta(seconds=30)}]
+    merged = merge_latest_positions(stored, 'L1')
+    assert [loc.get('compressed', False) for loc in merged] == [True, False]
+
+def test_location_route_reports_compressed_points(compressor, monkeypatch):
+    monkeypatch.setattr(trajectory, 'trajectory_compressor', compressor)
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    client = app.test_client()
+
+    fix = {'bus_line': 'L1', 'latitude': LAT, 'longitude': LON, 'device_id': 'esp-9'}
+    first = client.post('/api/location', json=fix).get_json()
+    second = client.post('/api/location', json=fix).get_json()
+
+    assert first['compressed'] is False
+    assert second['compressed'] is True
+    assert second['spooled'] is False
+    assert second['eta']['eta_minutes'] == first['eta']['eta_minutes']
+    assert compressor.get_status()['points_dropped'] == 1
+
+def test_location_route_without_device_id_is_not_compressed(compressor, monkeypatch):
+    # Sem device_id, os ônibus da linha não se distinguem: todos os pontos são gravados
+    monkeypatch.setattr(trajectory, 'trajectory_compressor', compressor)
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    client = app.test_client()
+
+    fix = {'bus_line': 'L1', 'latitude': LAT, 'longitude': LON}
+    responses = [client.post('/api/location', json=fix).get_json() for _ in range(2)]
+    assert [r['compressed'] for r in responses] == [False, False]
+    assert compressor.get_status()['points_received'] == 0
+
+def test_bus_key_requires_device_id():
+    assert bus_key_for({'device_id': 'esp-9'}) == 'device:esp-9'
+    assert bus_key_for({'device_id': 7}) == 'device:7'
+    assert bus_key_for({}) is None
+    assert bus_key_for({'device_id': '  '}) is None
+    assert device_id_from_key(bus_key_for({'device_id': ' esp-9 '})) == 'esp-9'
+
+def test_location_route_rejects_long_device_id():
+    app = Flask(__name__)
+    app.register_blueprint(simple_location_api.simple_location_bp, url_prefix='/api')
+    fix = {'bus_line': 'L1', 'latitude': LAT, 'longitude': LON, 'device_id': 'x' * 65}
+    response = app.test_client().post('/api/location', json=fix)
+    assert response.status_code == 400 and 'device_id' in response.get_json()['error']
+
+def test_gunicorn_single_worker_with_per_device_state(monkeypatch):
+    import os
+    import runpy
+    import config_simple
+
+    conf = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+    monkeypatch.setitem(config_simple.API_CONFIG, 'workers', 4)
+    assert config_simple.per_device_state_enabled()
+    assert runpy.run_path(conf)['workers'] == 1
+
+    # Sem estado por ônibus em memória, o número de workers configurado vale
+    monkeypatch.setitem(config_simple.TRAJECTORY_CONFIG, 'enabled', False)
+    monkeypatch.setitem(config_simple.ROUTE_ENGINE_CONFIG, 'enabled', False)
+    assert runpy.run_path(conf)['workers'] == 4
@@ -0,0 +1,260 @@
+"""
+Testes do spool local de gravações (database/spool.py)
+
+Uso:
+    python -m pytest test_write_spool.py -v
+
+Os testes de reenvio usam um PostgreSQL local com as migrações aplicadas
+(incluindo 005_ingest_key.sql) e são ignorados sem banco disponível.
+"""
+
+import shutil
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from config_simple import DATABASE_CONFIG
+from database import simple_connection as sync_db
+from database import spool as spool_module
+from database.spool import (
+    WriteSpool, read_segment, copy_value, SEALED_SUFFIX, OPEN_SUFFIX, FAILED_SUFFIX
+)
+
+def _database_available() -> bool:
+    try:
+        db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+        ok = db.test_connection()
+        db.close()
+        return ok
+    except Exception:
+        return False
+
+requires_db = pytest.mark.skipif(not _database_available(), reason="PostgreSQL local indisponível")
+
+# ============================================================
+#                       FIXTURES
+# ============================================================
+
+@pytest.fixture
+def spool(tmp_path):
+    s = WriteSpool(tmp_path / 'spool', fsync_interval_seconds=0.05)
+    yield s
+    s.close()
+
+@pytest.fixture
+def db():
+    manager = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def bus_line():
+    """Linha exclusiva do teste; os registros são removidos ao final."""
+    line = f"S{uuid.uuid4().hex[:8].upper()}"
+    yield line
+
+    db = sync_db.SimpleDatabaseManager(DATABASE_CONFIG)
+    location_ids = "(SELECT id FROM bus_location WHERE bus_line = %s)"
+    for table in ('bus_image', 'prediction_confidence', 'request_interval'):
+        db.execute_query(f"DELETE FROM {table} WHERE location_id IN {location_ids}", (line,))
+    db.execute_query("DELETE FROM occupancy_hourly_rollup WHERE bus_line = %s", (line,))
+    db.execute_query("DELETE FROM bus_location WHERE bus_line = %s", (line,))
+    db.close()
+
+def _count(db, table: str, bus_line: str) -> int:
+    rows = db.execute_query(f"SELECT COUNT(*) AS n FROM {table} WHERE bus_line = %s", (bus_line,), fetch=True)
+    return rows[0]['n']
+
+# ============================================================
+#                    SEGMENTOS (SEM BANCO)
+# ============================================================
+
+def test_append_and_seal(spool):
+    keys = [spool.append_location('L1', -8.06, -34.87, interval_seconds=30) for _ in range(3)]
+    assert len(set(keys)) == 3
+    assert len(list(spool.directory.glob(f'*{OPEN_SUFFIX}'))) == 1
+
+    spool.seal()
+    segments = list(spool.directory.glob(f'*{SEALED_SUFFIX}'))
+    assert len(segments) == 1
+    with open(segments[0], 'rb') as f:
+        records = read_segment(f)
+    assert [r['ingest_key'] for r in records] == keys
+
+    status = spool.get_status()
+    assert status['pending_segments'] == 1
+    assert status['records_spooled'] == 3
+
+def test_segment_rolls_at_max_bytes(tmp_path):
+    spool = WriteSpool(tmp_path, segment_max_bytes=300)
+    for _ in range(10):
+        spool.append_location('L1', -8.06, -34.87)
+    spool.close()
+    assert len(list(tmp_path.glob(f'*{SEALED_SUFFIX}'))) > 1
+
+def test_truncated_tail_is_ignored(spool):
+    spool.append_location('L1', -8.06, -34.87)
+    spool.seal()
+    path = next(spool.directory.glob(f'*{SEALED_SUFFIX}'))
+    with open(path, 'ab') as f:
+        f.write(b'{"kind":"location","ingest')
+
+    with open(path, 'rb') as f:
+        assert len(read_segment(f)) == 1
+
+def test_open_segment_requires_lock(spool, monkeypatch):
+    # Segmento sem trava seria adotado como órfão por outro processo
+    monkeypatch.setattr(spool_module, '_try_lock', lambda f: False)
+    with pytest.raises(OSError):
+        spool.append_location('L1', -8.06, -34.87)
+    assert not list(spool.directory.iterdir())
+
+def test_replay_keeps_segments_while_database_down(spool):
+    class DatabaseDown:
+        def get_cursor(self):
+            raise ConnectionError('conexão recusada')
+
+        def test_connection(self):
+            return False
+
+    spool.append_location('L1', -8.06, -34.87)
+    for _ in range(spool.max_replay_attempts + 1):
+        assert spool.replay(DatabaseDown()) == 0
+    # Queda do banco não conta como falha do segmento
+    assert len(list(spool.directory.glob(f'*{SEALED_SUFFIX}'))) == 1
+    assert not list(spool.directory.glob(f'*{FAILED_SUFFIX}'))
+    assert spool.get_status()['last_error'] == 'conexão recusada'
+
+def test_copy_value_escaping():
+    assert copy_value(None) == '\\N'
+    assert copy_value(b'\x01\xff') == '\\\\x01ff'
+    assert copy_value('a\tb\\c\n') == 'a\\tb\\\\c\\n'
+
+# ============================================================
+#                     REENVIO (COM BANCO)
+# ============================================================
+
+@requires_db
+def test_replay_inserts_bundle_and_is_idempotent(spool, db, bus_line, tmp_path):
+    arrival = (datetime.now() + timedelta(minutes=10)).isoformat()
+    spool.append_location(bus_line, -8.06, -34.87, predicted_arrival=arrival,
+                          confidence_percent=85.0, interval_seconds=30)
+    spool.append_location(bus_line, -8.07, -34.88, interval_seconds=45,
+                          image_data=b'\xff\xd8fake', occupancy_count=30, device_id='esp32-7')
+    spool.seal()
+
+    # Cópia do segmento: simula queda entre o commit e a remoção do arquivo
+    segment = next(spool.directory.glob(f'*{SEALED_SUFFIX}'))
+    backup = tmp_path / 'backup.seg'
+    shutil.copy(segment, backup)
+
+    assert spool.replay(db) == 2
+    assert not list(spool.directory.glob(f'*{SEALED_SUFFIX}'))
+    assert _count(db, 'bus_location', bus_line) == 2
+    assert _count(db, 'prediction_confidence', bus_line) == 1
+    assert _count(db, 'bus_image', bus_line) == 1
+
+    intervals = db.execute_query(
+        "SELECT ri.interval_seconds FROM request_interval ri "
+        "JOIN bus_location bl ON bl.id = ri.location_id WHERE bl.bus_line = %s "
+        "ORDER BY ri.interval_seconds", (bus_line,), fetch=True
+    )
+    assert [r['interval_seconds'] for r in intervals] == [30, 45]
+
+    devices = db.execute_query("SELECT device_id FROM bus_location WHERE bus_line = %s ORDER BY latitude",
+                               (bus_line,), fetch=True)
+    assert [r['device_id'] for r in devices] == ['esp32-7', None]
+
+    rollup = db.execute_query(
+        "SELECT SUM(sample_count) AS n FROM occupancy_hourly_rollup WHERE bus_line = %s",
+        (bus_line,), fetch=True
+    )
+    assert rollup[0]['n'] == 1
+
+    shutil.copy(backup, segment)
+    spool.replay(db)
+    assert _count(db, 'bus_location', bus_line) == 2
+    assert _count(db, 'prediction_confidence', bus_line) == 1
+    assert _count(db, 'bus_image', bus_line) == 1
+    assert spool.get_status()['records_replayed'] == 4
+
+@requires_db
+def test_replay_counts_repeated_record_once(spool, db, bus_line):
+    # Reenvio do dispositivo gravado duas vezes no mesmo segmento
+    arrival = (datetime.now() + timedelta(minutes=10)).isoformat()
+    key = str(uuid.uuid4())
+    for _ in range(2):
+        spool.append_location(bus_line, -8.06, -34.87, predicted_arrival=arrival,
+                              confidence_percent=85.0, interval_seconds=30,
+                              image_data=b'\xff\xd8fake', occupancy_count=30, ingest_key=key)
+    location_id = sync_db.SimpleBusLocationRepository(db).save_location(bus_line, -8.07, -34.88)
+    image_key = str(uuid.uuid4())
+    for _ in range(2):
+        spool.append_image(location_id, b'\xff\xd8fake', 12, ingest_key=image_key)
+    spool.seal()
+
+    spool.replay(db)
+    assert _count(db, 'bus_location', bus_line) == 2
+    assert _count(db, 'prediction_confidence', bus_line) == 1
+    assert _count(db, 'bus_image', bus_line) == 2
+
+    intervals = db.execute_query(
+        "SELECT COUNT(*) AS n FROM request_interval ri "
+        "JOIN bus_location bl ON bl.id = ri.location_id WHERE bl.bus_line = %s", (bus_line,), fetch=True
+    )
+    assert intervals[0]['n'] == 1
+    rollup = db.execute_query(
+        "SELECT SUM(sample_count) AS n, SUM(sum_occupancy) AS total "
+        "FROM occupancy_hourly_rollup WHERE bus_line = %s", (bus_line,), fetch=True
+    )
+    assert rollup[0]['n'] == 2 and rollup[0]['total'] == 42
+
+@requires_db
+def test_replay_image_for_existing_location(spool, db, bus_line):
+    location_id = sync_db.SimpleBusLocationRepository(db).save_location(bus_line, -8.06, -34.87)
+    spool.append_image(location_id, b'\xff\xd8fake', 12)
+    assert spool.replay(db) == 1
+
+    images = db.execute_query(
+        "SELECT location_id, bus_line, occupancy_count FROM bus_image WHERE location_id = %s",
+        (location_id,), fetch=True
+    )
+    assert images == [{'location_id': location_id, 'bus_line': bus_line, 'occupancy_count': 12}]
+
+    data = db.execute_query("SELECT image_data FROM bus_image WHERE location_id = %s",
+                            (location_id,), fetch=True)
+    assert bytes(data[0]['image_data']) == b'\xff\xd8fake'
+
+@requires_db
+def test_replay_adopts_orphan_segment(tmp_path, db, bus_line):
+    # Segmento ativo de um processo que terminou sem fechá-lo
+    crashed = WriteSpool(tmp_path)
+    crashed.append_location(bus_line, -8.06, -34.87)
+    crashed._file.close()
+    crashed._file = None
+
+    spool = WriteSpool(tmp_path)
+    assert spool.replay(db) == 1
+    assert _count(db, 'bus_location', bus_line) == 1
+    assert not list(tmp_path.iterdir())
+
+@requires_db
+def test_replay_quarantines_poison_segment(tmp_path, db, bus_line):
+    spool = WriteSpool(tmp_path, max_replay_attempts=2)
+    spool.append_location('X' * 40, -8.06, -34.87)  # maior que VARCHAR(30): COPY falha
+    spool.seal()
+    spool.append_location(bus_line, -8.06, -34.87)
+
+    # O segmento inválido não bloqueia o seguinte
+    assert spool.replay(db) == 1
+    assert _count(db, 'bus_location', bus_line) == 1
+    assert len(list(tmp_path.glob(f'*{SEALED_SUFFIX}'))) == 1
+
+    # Segunda falha com o banco no ar: quarentena
+    assert spool.replay(db) == 0
+    assert not list(tmp_path.glob(f'*{SEALED_SUFFIX}'))
+    assert len(list(tmp_path.glob(f'*{FAILED_SUFFIX}'))) == 1
+    assert not spool.has_pending()
+    status = spool.get_status()
+    assert status['failed_segments'] == 1 and status['pending_segments'] == 0
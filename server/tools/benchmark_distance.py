@@ -0,0 +1,84 @@
+"""
+Microbenchmark: distância Haversine escalar (api/utils.py) x vetorizada (api/geo.py)
+
+Para 1, 100 e 100 mil pontos em volta de Recife mede:
+- pares: distância de cada ponto até um segundo ponto (calculate_distance_km
+  em laço x haversine_km sobre arrays)
+- paradas: parada mais próxima de cada ponto entre --stops paradas fixas
+  (laço escalar x FixedPoints.nearest, com os termos das paradas pré-calculados)
+
+Não usa banco.
+
+Uso:
+    python tools/benchmark_distance.py --stops 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.geo import FixedPoints, haversine_km
+from api.utils import calculate_distance_km
+
+LAT, LON = -8.0630, -34.8710
+
+def random_points(n: int, rng: np.random.Generator):
+    return LAT + rng.uniform(-0.15, 0.15, n), LON + rng.uniform(-0.15, 0.15, n)
+
+def best_of(func, repeat: int) -> float:
+    """Menor tempo de 'repeat' execuções, em segundos."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def scalar_pairs(lats, lons, lats2, lons2):
+    return [calculate_distance_km(a, b, c, d) for a, b, c, d in zip(lats, lons, lats2, lons2)]
+
+def scalar_nearest(lats, lons, stop_lats, stop_lons):
+    stops = list(zip(stop_lats, stop_lons))
+    return [min(range(len(stops)), key=lambda j: calculate_distance_km(lat, lon, *stops[j]))
+            for lat, lon in zip(lats, lons)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Haversine escalar x vetorizada')
+    parser.add_argument('--stops', type=int, default=200)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 100_000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    stop_lats, stop_lons = random_points(args.stops, rng)
+    fixed = FixedPoints(stop_lats, stop_lons)
+
+    print(f"{'pontos':>8} {'pares escalar ms':>17} {'pares numpy ms':>15} "
+          f"{'paradas escalar ms':>19} {'paradas numpy ms':>17}")
+    for n in args.sizes:
+        lats, lons = random_points(n, rng)
+        lats2, lons2 = random_points(n, rng)
+        # Laço escalar sobre listas do Python, como no código das rotas
+        py = [arr.tolist() for arr in (lats, lons, lats2, lons2)]
+        repeat = 5 if n <= 1000 else 1
+
+        pairs_scalar = best_of(lambda: scalar_pairs(*py), repeat)
+        pairs_numpy = best_of(lambda: haversine_km(lats, lons, lats2, lons2), repeat)
+        # O laço escalar das paradas é O(pontos x paradas): limitado a 10 mil pontos
+        if n <= 10_000:
+            nearest_scalar = best_of(lambda: scalar_nearest(py[0], py[1], stop_lats.tolist(),
+                                                            stop_lons.tolist()), repeat)
+            nearest_scalar_text = f"{nearest_scalar * 1000:19.3f}"
+        else:
+            nearest_scalar_text = f"{'-':>19}"
+        nearest_numpy = best_of(lambda: fixed.nearest(lats, lons), repeat)
+
+        print(f"{n:8d} {pairs_scalar * 1000:17.3f} {pairs_numpy * 1000:15.3f} "
+              f"{nearest_scalar_text} {nearest_numpy * 1000:17.3f}", flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Microbenchmark: importação do GTFS lendo os CSVs x snapshot mapeado (mmap)
+
+Gera um GTFS sintético em volta de Recife (--stops paradas, --routes linhas
+com --trips viagens por sentido e --stops-per-trip paradas cada) ou usa o
+.zip de --feed, e mede:
+- parse_gtfs_zip: leitura dos CSVs (o que cada worker fazia na inicialização)
+- load_snapshot: abertura dos .npy com mmap (inicializações seguintes)
+
+Uso:
+    python tools/benchmark_gtfs.py --stops 20000 --routes 300 --trips 40
+    python tools/benchmark_gtfs.py --feed gtfs_recife.zip
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.gtfs_feed import _source_stat, load_snapshot, parse_gtfs_zip, save_snapshot
+
+LAT, LON = -8.0630, -34.8710
+
+def _format_time(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def write_synthetic_feed(path: str, stops: int, routes: int, trips: int, stops_per_trip: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    coords = np.column_stack((LAT + rng.uniform(-0.2, 0.2, stops), LON + rng.uniform(-0.2, 0.2, stops)))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as feed:
+        out = io.StringIO()
+        out.write("stop_id,stop_name,stop_lat,stop_lon,location_type\n")
+        for i, (lat, lon) in enumerate(coords.tolist()):
+            out.write(f"s{i},Parada {i},{lat:.6f},{lon:.6f},0\n")
+        feed.writestr('stops.txt', out.getvalue())
+
+        feed.writestr('routes.txt', "route_id,route_short_name,route_long_name,route_type\n" +
+                      ''.join(f"r{r},L{r},Linha {r},3\n" for r in range(routes)))
+
+        trips_out, shapes_out, times_out = io.StringIO(), io.StringIO(), io.StringIO()
+        trips_out.write("route_id,service_id,trip_id,direction_id,shape_id\n")
+        shapes_out.write("shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence\n")
+        times_out.write("trip_id,arrival_time,departure_time,stop_id,stop_sequence\n")
+        for r in range(routes):
+            sequence = rng.choice(stops, stops_per_trip, replace=False)
+            for direction in (0, 1):
+                order = sequence if direction == 0 else sequence[::-1]
+                shape_id = f"sh{r}_{direction}"
+                # Traçado: 5 pontos entre paradas consecutivas
+                points = coords[order]
+                steps = np.linspace(0, 1, 5, endpoint=False)
+                shape = (points[:-1, None, :] + steps[None, :, None] * np.diff(points, axis=0)[:, None, :]).reshape(-1, 2)
+                for k, (lat, lon) in enumerate(shape.tolist()):
+                    shapes_out.write(f"{shape_id},{lat:.6f},{lon:.6f},{k}\n")
+                for t in range(trips):
+                    trip_id = f"t{r}_{direction}_{t}"
+                    trips_out.write(f"r{r},U,{trip_id},{direction},{shape_id}\n")
+                    clock = 5 * 3600 + t * 900
+                    for k, stop in enumerate(order.tolist()):
+                        times_out.write(f"{trip_id},{_format_time(clock)},{_format_time(clock)},s{stop},{k + 1}\n")
+                        clock += 90
+        feed.writestr('trips.txt', trips_out.getvalue())
+        feed.writestr('shapes.txt', shapes_out.getvalue())
+        feed.writestr('stop_times.txt', times_out.getvalue())
+
+def main():
+    parser = argparse.ArgumentParser(description='GTFS: leitura dos CSVs x snapshot mapeado')
+    parser.add_argument('--feed', help='.zip do GTFS (padrão: GTFS sintético)')
+    parser.add_argument('--stops', type=int, default=20000)
+    parser.add_argument('--routes', type=int, default=300)
+    parser.add_argument('--trips', type=int, default=40, help='Viagens por linha e sentido')
+    parser.add_argument('--stops-per-trip', type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        feed_zip = args.feed
+        if not feed_zip:
+            feed_zip = os.path.join(tmp, 'sintetico.zip')
+            started = time.perf_counter()
+            write_synthetic_feed(feed_zip, args.stops, args.routes, args.trips, args.stops_per_trip)
+            print(f"GTFS sintético: {os.path.getsize(feed_zip) / 1e6:.1f} MB "
+                  f"({time.perf_counter() - started:.1f} s para gerar)")
+
+        started = time.perf_counter()
+        feed = parse_gtfs_zip(feed_zip)
+        parse_s = time.perf_counter() - started
+        print(f"{feed.counts()}")
+
+        directory = os.path.join(tmp, 'snapshot')
+        started = time.perf_counter()
+        save_snapshot(feed, directory, _source_stat(feed_zip))
+        save_s = time.perf_counter() - started
+
+        runs = 20
+        started = time.perf_counter()
+        for _ in range(runs):
+            mapped = load_snapshot(directory, _source_stat(feed_zip))
+        mapped_ms = (time.perf_counter() - started) / runs * 1000
+        started = time.perf_counter()
+        for _ in range(runs):
+            loaded = load_snapshot(directory, _source_stat(feed_zip), mmap=False)
+        loaded_ms = (time.perf_counter() - started) / runs * 1000
+        assert mapped.counts() == loaded.counts() == feed.counts()
+
+        print(f"{'etapa':<28} {'ms':>10}")
+        print(f"{'parse_gtfs_zip (CSVs)':<28} {parse_s * 1000:10.1f}")
+        print(f"{'save_snapshot':<28} {save_s * 1000:10.1f}")
+        print(f"{'load_snapshot (mmap)':<28} {mapped_ms:10.2f}")
+        print(f"{'load_snapshot (leitura)':<28} {loaded_ms:10.2f}")
+
+if __name__ == '__main__':
+    main()
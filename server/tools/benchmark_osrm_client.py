@@ -0,0 +1,87 @@
+"""
+Microbenchmark: rotas do OSRM com requests.get x cliente com pool x assíncrono
+
+Para N rotas, mede o tempo total e as conexões abertas de:
+- requests.get: uma conexão TCP nova por rota (como era o ETA por OSRM)
+- OSRMClient: Session com keep-alive, em sequência
+- AsyncOSRMClient.routes: httpx, --concurrency rotas ao mesmo tempo
+
+Por padrão usa o OSRM de teste (tools/osrm_stub.py) com --latency-ms de
+latência por requisição; --server aponta para um osrm-routed de verdade.
+
+Uso:
+    python tools/benchmark_osrm_client.py --routes 200 --latency-ms 5 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.osrm_client import HTTPX_AVAILABLE, ROUTE_PARAMS, OSRMClient, route_path
+from tools.osrm_stub import start_in_thread
+
+LAT, LON = -8.0630, -34.8710
+
+def main():
+    parser = argparse.ArgumentParser(description='Rotas do OSRM: requests.get x pool x assíncrono')
+    parser.add_argument('--routes', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--server', help='URL de um osrm-routed (padrão: servidor de teste local)')
+    args = parser.parse_args()
+
+    stub = None
+    server_url = args.server
+    if not server_url:
+        stub, server_url = start_in_thread(latency_ms=args.latency_ms)
+
+    rng = np.random.default_rng(7)
+    pairs = [((LAT, LON), (LAT + dlat, LON + dlon))
+             for dlat, dlon in rng.uniform(-0.1, 0.1, (args.routes, 2)).tolist()]
+
+    print(f"{'cliente':<22} {'s':>8} {'ms/rota':>8} {'conexões':>9}")
+    try:
+        start = time.perf_counter()
+        for origin, destination in pairs:
+            requests.get(server_url + route_path('driving', [origin, destination]), params=ROUTE_PARAMS, timeout=5)
+        elapsed = time.perf_counter() - start
+        print(f"{'requests.get':<22} {elapsed:8.3f} {elapsed / args.routes * 1000:8.2f} {args.routes:9d}")
+
+        client = OSRMClient(server_url)
+        start = time.perf_counter()
+        for origin, destination in pairs:
+            client.route([origin, destination])
+        elapsed = time.perf_counter() - start
+        opened = client.get_status()['connections_opened']
+        print(f"{'OSRMClient (pool)':<22} {elapsed:8.3f} {elapsed / args.routes * 1000:8.2f} {opened:9d}")
+
+        if HTTPX_AVAILABLE:
+            from api.osrm_client import AsyncOSRMClient
+
+            async def fan_out():
+                async_client = AsyncOSRMClient(server_url, max_connections=args.concurrency)
+                try:
+                    started = time.perf_counter()
+                    await async_client.routes(pairs, concurrency=args.concurrency)
+                    return time.perf_counter() - started, async_client.get_status()['connections_opened']
+                finally:
+                    await async_client.aclose()
+
+            elapsed, opened = asyncio.run(fan_out())
+            label = f"AsyncOSRMClient ({args.concurrency})"
+            print(f"{label:<22} {elapsed:8.3f} {elapsed / args.routes * 1000:8.2f} {opened:9d}")
+        else:
+            print("httpx não instalado: cliente assíncrono não medido")
+    finally:
+        if stub:
+            stub.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Microbenchmark: ETA da frota com uma rota por par (/route) x matriz (/table)
+
+Para N ônibus e as paradas do catálogo, mede o tempo total e o número de
+requisições de:
+- /route: uma requisição por par ônibus-parada (OSRMETA.get_route_info, sem cache)
+- /table: OSRMETA.get_duration_table (blocos de table_max_coordinates)
+
+Por padrão usa o OSRM de teste (tools/osrm_stub.py) com --latency-ms de
+latência por requisição; --server aponta para um osrm-routed de verdade.
+
+Uso:
+    python tools/benchmark_osrm_table.py --buses 10 100 500 --stops 20 --latency-ms 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.eta_osrm import OSRMETA
+from api.route_cache import RouteCache
+from tools.osrm_stub import start_in_thread
+
+LAT, LON = -8.0630, -34.8710
+
+def random_points(n: int, rng: np.random.Generator):
+    return list(zip((LAT + rng.uniform(-0.1, 0.1, n)).tolist(), (LON + rng.uniform(-0.1, 0.1, n)).tolist()))
+
+def main():
+    parser = argparse.ArgumentParser(description='ETA da frota: /route por par x /table')
+    parser.add_argument('--buses', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--stops', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    parser.add_argument('--server', help='URL de um osrm-routed (padrão: servidor de teste local)')
+    parser.add_argument('--max-route-pairs', type=int, default=2000,
+                        help='Acima disso a medição /route é pulada')
+    args = parser.parse_args()
+
+    stub = None
+    server_url = args.server
+    if not server_url:
+        stub, server_url = start_in_thread(latency_ms=args.latency_ms)
+
+    # Cache desativado: cada par vai ao servidor (capacidade 0)
+    osrm = OSRMETA(osrm_server=server_url, cache=RouteCache(max_entries=0, interpolate=False))
+    rng = np.random.default_rng(7)
+    stops = random_points(args.stops, rng)
+
+    print(f"{'ônibus':>7} {'pares':>7} {'/route s':>9} {'req':>6} {'/table s':>9} {'req':>4}")
+    try:
+        for n in args.buses:
+            buses = random_points(n, rng)
+            pairs = n * len(stops)
+
+            if pairs <= args.max_route_pairs:
+                start = time.perf_counter()
+                for bus in buses:
+                    for stop in stops:
+                        osrm.get_route_info(*bus, *stop)
+                route_text = f"{time.perf_counter() - start:9.3f} {pairs:6d}"
+            else:
+                route_text = f"{'-':>9} {'-':>6}"
+
+            start = time.perf_counter()
+            table = osrm.get_duration_table(buses, stops)
+            table_seconds = time.perf_counter() - start
+
+            print(f"{n:7d} {pairs:7d} {route_text} {table_seconds:9.3f} {table['requests']:4d}", flush=True)
+    finally:
+        if stub:
+            stub.shutdown()
+
+if __name__ == '__main__':
+    main()
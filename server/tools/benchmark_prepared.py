@@ -0,0 +1,107 @@
+"""
+Microbenchmark: consultas quentes dos repositórios com e sem prepared statement
+
+Para cada consulta (insert de localização, ETA e intervalo; seleção de
+localizações atuais e de histórico) mede:
+- tempo por chamada de SimpleDatabaseManager.execute_query, com prepare=False e True
+- tempo de planejamento no servidor (Planning Time do EXPLAIN ANALYZE),
+  para o texto SQL e para o EXECUTE do statement já preparado
+
+Os inserts usam a linha BENCH_PREP e são removidos ao final.
+
+Uso:
+    python tools/benchmark_prepared.py --iterations 2000
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_simple import DATABASE_CONFIG
+from database import queries
+from database.simple_connection import SimpleDatabaseManager, prepared_statement_name, to_positional
+
+BUS_LINE = 'BENCH_PREP'
+
+PLANNING_TIME = re.compile(r'Planning Time: ([\d.]+) ms')
+
+def hot_queries(location_id: int):
+    """(nome, sql, params) das consultas preparadas pelos repositórios."""
+    now = datetime.now()
+    return [
+        ('insert localização', *queries.save_location_query(BUS_LINE, -8.063, -34.871)),
+        ('insert ETA', *queries.save_eta_prediction_query(location_id, now + timedelta(minutes=5), 80.0)),
+        ('insert intervalo', *queries.save_interval_query(location_id, 30)),
+        ('localizações atuais', *queries.current_locations_query(BUS_LINE, 5)),
+        ('histórico', *queries.location_history_query(BUS_LINE, 24, 100)),
+    ]
+
+def time_calls(db: SimpleDatabaseManager, query, params, iterations: int, prepare: bool) -> float:
+    """Tempo médio por chamada, em microssegundos."""
+    db.execute_query(query, params, fetch=True, prepare=prepare)  # aquecimento
+    start = time.perf_counter()
+    for _ in range(iterations):
+        db.execute_query(query, params, fetch=True, prepare=prepare)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def planning_ms(db: SimpleDatabaseManager, query, params, samples: int, prepared: bool) -> float:
+    """Mediana do Planning Time do EXPLAIN ANALYZE (executado e desfeito com rollback)."""
+    times = []
+    with db.get_cursor() as cursor:
+        connection = cursor.connection
+        if prepared:
+            name = prepared_statement_name(query) + '_bench'
+            cursor.execute(f"PREPARE {name} AS {to_positional(query)}")
+            args = ', '.join(['%s'] * len(params))
+            statement = f"EXECUTE {name} ({args})"
+        else:
+            statement = query
+
+        for _ in range(samples):
+            cursor.execute(f"EXPLAIN (ANALYZE, SUMMARY) {statement}", params)
+            plan = '\n'.join(row['QUERY PLAN'] for row in cursor.fetchall())
+            times.append(float(PLANNING_TIME.search(plan).group(1)))
+            connection.rollback()
+
+        if prepared:
+            cursor.execute(f"DEALLOCATE {name}")
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Consultas com e sem prepared statement')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=50)
+    args = parser.parse_args()
+
+    db = SimpleDatabaseManager(DATABASE_CONFIG)
+    if not db.test_connection():
+        print("Banco de dados indisponível")
+        sys.exit(1)
+
+    query, params = queries.save_location_query(BUS_LINE, -8.063, -34.871)
+    location_id = queries.first_id(db.execute_query(query, params, fetch=True))
+
+    try:
+        print(f"{'consulta':22} {'texto µs':>10} {'prep µs':>10} {'plan texto ms':>14} {'plan prep ms':>13}")
+        for label, query, params in hot_queries(location_id):
+            plain = time_calls(db, query, params, args.iterations, prepare=False)
+            prepared = time_calls(db, query, params, args.iterations, prepare=True)
+            plan_plain = planning_ms(db, query, params, args.samples, prepared=False)
+            plan_prepared = planning_ms(db, query, params, args.samples, prepared=True)
+            print(f"{label:22} {plain:10.1f} {prepared:10.1f} {plan_plain:14.3f} {plan_prepared:13.3f}",
+                  flush=True)
+    finally:
+        location_ids = "(SELECT id FROM bus_location WHERE bus_line = %s)"
+        for table in ('prediction_confidence', 'request_interval'):
+            db.execute_query(f"DELETE FROM {table} WHERE location_id IN {location_ids}", (BUS_LINE,))
+        db.execute_query("DELETE FROM bus_location WHERE bus_line = %s", (BUS_LINE,))
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Comparação de throughput: servidor Flask (main.py) x servidor ASGI (asgi_app.py)
+
+Sobe os dois servidores em portas separadas e dispara POST /api/location
+(payload do ESP32) com N conexões simultâneas por um tempo fixo, medindo
+requisições/s e latências. O gerador de carga usa apenas asyncio (sem
+dependências), para não ser ele o gargalo com milhares de conexões.
+
+Uso:
+    python tools/benchmark_servers.py --connections 50 200 1000 --duration 15
+    python tools/benchmark_servers.py --only asgi --path /api/dashboard/buses --method GET
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'flask': [sys.executable, 'main.py'],
+    'asgi': [sys.executable, 'asgi_app.py'],
+}
+
+PAYLOAD = {
+    'bus_line': 'BENCH',
+    'latitude': -8.0630,
+    'longitude': -34.8710,
+}
+
+# ============================================================
+#                     GERADOR DE CARGA
+# ============================================================
+
+def build_request(method: str, path: str, host: str, body: bytes) -> bytes:
+    headers = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}",
+        "Connection: keep-alive",
+    ]
+    if body:
+        headers += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + body
+
+async def read_response(reader: asyncio.StreamReader):
+    """Lê uma resposta HTTP/1.x; retorna (status, manter_conexão)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("conexão encerrada")
+    version, status = status_line.split(b' ', 2)[:2]
+
+    length, keep_alive, chunked = 0, version == b'HTTP/1.1', False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            keep_alive = value == 'keep-alive' or (keep_alive and value != 'close')
+        elif name == 'transfer-encoding' and 'chunked' in value:
+            chunked = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    elif not keep_alive:
+        await reader.read()
+
+    return int(status), keep_alive
+
+async def worker(host: str, port: int, request: bytes, deadline: float,
+                 latencies: List[float], errors: Dict[str, int]):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            if writer:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.05)
+    if writer:
+        writer.close()
+
+async def run_load(host: str, port: int, method: str, path: str,
+                   connections: int, duration: float) -> Dict:
+    body = json.dumps(PAYLOAD).encode() if method == 'POST' else b''
+    request = build_request(method, path, f"{host}:{port}", body)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        worker(host, port, request, deadline, latencies, errors)
+        for _ in range(connections)
+    ])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': pct(0.50),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0,
+        'errors': errors,
+    }
+
+# ============================================================
+#                        SERVIDORES
+# ============================================================
+
+def start_server(name: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, API_PORT=str(port), API_DEBUG='false', API_HOST='127.0.0.1')
+    process = subprocess.Popen(
+        SERVERS[name], cwd=SERVER_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process
+        except Exception:
+            if process.poll() is not None:
+                raise RuntimeError(f"Servidor {name} encerrou ao iniciar")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Servidor {name} não respondeu em /health")
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput Flask x ASGI')
+    parser.add_argument('--connections', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--path', default='/api/location')
+    parser.add_argument('--method', default='POST', choices=['GET', 'POST'])
+    parser.add_argument('--only', choices=list(SERVERS))
+    parser.add_argument('--base-port', type=int, default=3100)
+    args = parser.parse_args()
+
+    names = [args.only] if args.only else list(SERVERS)
+    results = []
+
+    for offset, name in enumerate(names):
+        port = args.base_port + offset
+        process = start_server(name, port)
+        try:
+            for connections in args.connections:
+                result = asyncio.run(run_load(
+                    '127.0.0.1', port, args.method, args.path, connections, args.duration
+                ))
+                results.append((name, connections, result))
+                print(f"{name:6} {connections:5} conexões: {result['rps']:8.1f} req/s  "
+                      f"p50 {result['p50_ms']:7.1f}ms  p99 {result['p99_ms']:7.1f}ms  "
+                      f"erros {result['errors'] or 0}", flush=True)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    print(f"\n{args.method} {args.path} ({args.duration:.0f}s por rodada)")
+    print(f"{'servidor':8} {'conexões':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>7}")
+    for name, connections, r in results:
+        print(f"{name:8} {connections:9} {r['rps']:9.1f} {r['p50_ms']:8.1f} "
+              f"{r['p95_ms']:8.1f} {r['p99_ms']:8.1f} {sum(r['errors'].values()):7}")
+
+if __name__ == '__main__':
+    main()
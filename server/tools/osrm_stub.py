@@ -0,0 +1,159 @@
+"""
+Servidor OSRM de teste (sem mapa)
+Responde /route e /table no formato do OSRM, com distâncias estimadas
+
+A distância de rota é a Haversine multiplicada por --detour (ruas não são
+linha reta) e a duração supõe --speed-kmh constante. Serve para os testes e
+benchmarks do ETA em lote sem depender do router.project-osrm.org. Recusa
+/table com mais de --max-table-size coordenadas, como o osrm-routed, e
+responde HTTP 503 às primeiras --fail-requests requisições (novas
+tentativas do cliente). Mantém a conexão aberta entre requisições (HTTP/1.1).
+
+Uso:
+    python tools/osrm_stub.py --port 5000 --latency-ms 20
+    OSRM_SERVER_URL=http://localhost:5000 python main.py
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.geo import FixedPoints, haversine_km
+
+_counter_lock = threading.Lock()
+
+class StubOSRMHandler(BaseHTTPRequestHandler):
+    """Handler de /route/v1/<perfil>/<coords> e /table/v1/<perfil>/<coords>."""
+
+    # Keep-alive, como o osrm-routed; sem Nagle, para cabeçalho e corpo
+    # escritos separadamente não esperarem o ACK atrasado do cliente
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    # Ajustados por make_server
+    detour = 1.3
+    speed_kmh = 25.0
+    latency_seconds = 0.0
+    max_table_size = 100
+    fail_requests = 0
+    requests_served = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with _counter_lock:
+            type(self).requests_served += 1
+            served = self.requests_served
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if served <= self.fail_requests:
+            return self._reply(503, {'code': 'Unavailable', 'message': 'Falha simulada'})
+
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 4 or parts[1] != 'v1' or parts[0] not in ('route', 'table'):
+            return self._reply(400, {'code': 'InvalidUrl', 'message': f'URL inválida: {url.path}'})
+        try:
+            coordinates = [tuple(float(v) for v in pair.split(',')) for pair in parts[3].split(';')]
+        except ValueError:
+            return self._reply(400, {'code': 'InvalidQuery', 'message': 'Coordenadas inválidas'})
+        # OSRM recebe longitude,latitude
+        points = [(lat, lon) for lon, lat in coordinates]
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if parts[0] == 'route':
+            return self._route(points)
+        return self._table(points, query)
+
+    def _route(self, points: List[Tuple[float, float]]):
+        if len(points) < 2:
+            return self._reply(400, {'code': 'InvalidQuery', 'message': 'Ao menos duas coordenadas'})
+        lats, lons = zip(*points)
+        legs_km = haversine_km(lats[:-1], lons[:-1], lats[1:], lons[1:]) * self.detour
+        distance = float(legs_km.sum()) * 1000
+        return self._reply(200, {
+            'code': 'Ok',
+            'routes': [{'distance': distance, 'duration': distance / 1000 / self.speed_kmh * 3600}],
+            'waypoints': [{'location': [lon, lat]} for lat, lon in points]
+        })
+
+    def _table(self, points: List[Tuple[float, float]], query: dict):
+        if len(points) > self.max_table_size:
+            return self._reply(400, {'code': 'TooBig', 'message': 'Too many table coordinates'})
+        all_indices = list(range(len(points)))
+        sources = [int(i) for i in query['sources'].split(';')] if 'sources' in query else all_indices
+        destinations = [int(i) for i in query['destinations'].split(';')] if 'destinations' in query else all_indices
+
+        targets = FixedPoints([points[j][0] for j in destinations], [points[j][1] for j in destinations])
+        km = targets.distances_km([points[i][0] for i in sources], [points[i][1] for i in sources]) * self.detour
+        payload = {'code': 'Ok', 'durations': (km / self.speed_kmh * 3600).round(1).tolist()}
+        if 'distance' in query.get('annotations', 'duration'):
+            payload['distances'] = (km * 1000).round(1).tolist()
+        return self._reply(200, payload)
+
+class StubOSRMServer(ThreadingHTTPServer):
+    # Fila de conexões do listen() maior que a padrão (5): muitos clientes
+    # conectando juntos não perdem o SYN (nova tentativa só após 1 s)
+    request_queue_size = 128
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Cliente que desistiu (timeout) antes da resposta: não é erro do servidor
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+def make_server(port: int = 0, detour: float = 1.3, speed_kmh: float = 25.0,
+                latency_ms: float = 0.0, max_table_size: int = 100,
+                fail_requests: int = 0) -> StubOSRMServer:
+    """Servidor ainda não iniciado (port=0 escolhe uma porta livre: server.server_port)."""
+    handler = type('ConfiguredStubOSRMHandler', (StubOSRMHandler,), {
+        'detour': detour, 'speed_kmh': speed_kmh,
+        'latency_seconds': latency_ms / 1000, 'max_table_size': max_table_size,
+        'fail_requests': fail_requests, 'requests_served': 0
+    })
+    return StubOSRMServer(('127.0.0.1', port), handler)
+
+def start_in_thread(**kwargs) -> Tuple[StubOSRMServer, str]:
+    """Sobe o servidor em uma thread daemon; retorna (servidor, URL base)."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor OSRM de teste')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--detour', type=float, default=1.3)
+    parser.add_argument('--speed-kmh', type=float, default=25.0)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--max-table-size', type=int, default=100)
+    parser.add_argument('--fail-requests', type=int, default=0)
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.detour, args.speed_kmh, args.latency_ms, args.max_table_size,
+                         args.fail_requests)
+    print(f"OSRM de teste em http://127.0.0.1:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""
+Entry point WSGI para produção
+Usado pelo Gunicorn com o app pré-carregado (ver gunicorn.conf.py)
+
+Para executar:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+A importação carrega o app Flask, o modelo de ocupação (ml/occupancy_predictor.py)
+e o catálogo de paradas e itinerários (GTFS mapeado do snapshot, api/gtfs_feed.py)
+no processo master, antes do fork. Banco de dados e threads de background NÃO são
+criados aqui: cada worker os inicializa em post_fork (main.initialize_services).
+"""
+
+import os
+import sys
+
+# Adiciona o diretório server ao path para imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import create_app
+from api.route_engine import get_route_engine
+from api.stop_index import get_stop_index
+
+app = create_app()
+
+# Índice de paradas e itinerários prontos antes do fork (páginas compartilhadas)
+get_stop_index()
+get_route_engine()